@@ -0,0 +1,339 @@
+"""
+分散式負載代理的協調
+Flask應用程式把測試計畫分配給數個負載代理（load_agent.py），依各代理的時鐘差排定同一個開始時間，
+定期取得各代理的累計計數、延遲直方圖與吞吐量時間桶並合併成一份結果
+"""
+
+import os
+import time
+import uuid
+from typing import Dict, List, Optional
+
+import requests
+
+from endpoint_balancer import endpoint_summary
+from latency_histogram import LatencyHistogram
+from result_log import aggregates_from_totals, endpoint_statistics_from_totals, throughput_from_totals
+from throughput_series import ThroughputSeries
+
+PLAN_BASIC = 'basic'
+PLAN_MULTI_USER = 'multi_user'
+
+# 送出計畫到開始執行之間的秒數，讓所有代理都在開始前收到計畫
+AGENT_START_DELAY = 3.0
+
+# 主控端取得各代理累計數據的間隔（秒）
+AGENT_POLL_INTERVAL = 1.0
+
+# 對代理的HTTP請求逾時（秒）
+AGENT_REQUEST_TIMEOUT = 5
+
+# 連續多少次無法取得代理狀態時視為該代理失敗
+MAX_POLL_FAILURES = 10
+
+FINISHED_STATUSES = ('completed', 'error')
+
+# 代理的共用權杖：代理啟動時以 --token 或此環境變數設定，主控端從同一個環境變數讀取並放在請求標頭
+AGENT_TOKEN_ENV = 'LOAD_AGENT_TOKEN'
+AGENT_TOKEN_HEADER = 'X-Agent-Token'
+
+
+def split_evenly(total: int, parts: int) -> List[int]:
+    """把總數盡量平均地分成parts份，例如 10 分成 3 份為 [4, 3, 3]"""
+    base, extra = divmod(int(total), parts)
+    return [base + (1 if i < extra else 0) for i in range(parts)]
+
+
+def _scale_arrival(plan: Dict, agent_count: int):
+    """開放迴路的到達率由各代理平分（多個Poisson過程疊加仍是Poisson過程）"""
+    if plan.get('arrival_rate'):
+        plan['arrival_rate'] = float(plan['arrival_rate']) / agent_count
+    if plan.get('rate_curve'):
+        plan['rate_curve'] = [[second, rate / agent_count] for second, rate in plan['rate_curve']]
+
+
+def split_basic_plan(config: Dict, agent_count: int) -> List[Dict]:
+    """
+    把基礎壓力測試的配置分給各代理：並發數與總請求數平分，到達率平分，
+    分不到請求或並發數的代理不參與
+
+    Returns:
+        每個參與代理一份配置（不含agents）
+    """
+    if config.get('load_profile'):
+        raise ValueError("load_profile cannot be combined with distributed agents")
+
+    concurrency_shares = split_evenly(config['concurrent_requests'], agent_count)
+    if config.get('test_duration_minutes'):
+        request_shares = [None] * agent_count
+    else:
+        request_shares = split_evenly(config['total_requests'], agent_count)
+
+    plans = []
+    for concurrency, total_requests in zip(concurrency_shares, request_shares):
+        if concurrency == 0 or total_requests == 0:
+            continue
+        plan = {key: value for key, value in config.items() if key != 'agents'}
+        plan['concurrent_requests'] = concurrency
+        if total_requests is not None:
+            plan['total_requests'] = total_requests
+        plans.append(plan)
+
+    for plan in plans:
+        _scale_arrival(plan, len(plans))
+    return plans
+
+
+def split_multi_user_plan(config: Dict, agent_count: int) -> List[Dict]:
+    """把多用戶測試的用戶分給各代理，並發上限與到達率依用戶數比例分配"""
+    user_shares = [count for count in split_evenly(config['user_count'], agent_count) if count]
+    plans = []
+    for user_count in user_shares:
+        plan = {key: value for key, value in config.items() if key != 'agents'}
+        plan['user_count'] = user_count
+        plan['concurrent_limit'] = max(1, round(int(config.get('concurrent_limit', 10)) * user_count
+                                                / int(config['user_count'])))
+        plans.append(plan)
+
+    for plan in plans:
+        _scale_arrival(plan, len(plans))
+    return plans
+
+
+class AgentClient:
+    """單一負載代理的HTTP客戶端"""
+
+    def __init__(self, url: str, token: Optional[str] = None):
+        self.url = url.rstrip('/')
+        self.session = requests.Session()
+        token = token or os.environ.get(AGENT_TOKEN_ENV)
+        if token:
+            self.session.headers[AGENT_TOKEN_HEADER] = token
+        self.hostname = None
+        self.clock_offset = 0.0  # 代理時鐘減去主控端時鐘（秒）
+
+    def connect(self):
+        """確認代理可用並估計時鐘差（以請求來回時間的中點為準）"""
+        sent = time.time()
+        response = self.session.get(f"{self.url}/api/agent/health", timeout=AGENT_REQUEST_TIMEOUT)
+        received = time.time()
+        response.raise_for_status()
+        data = response.json()
+        self.hostname = data.get('hostname')
+        self.clock_offset = data['time'] - (sent + received) / 2
+
+    def submit(self, plan_id: str, kind: str, config: Dict, start_at: float):
+        """送出計畫；start_at為主控端時鐘的開始時間"""
+        response = self.session.post(f"{self.url}/api/agent/plans", json={
+            'plan_id': plan_id,
+            'kind': kind,
+            'config': config,
+            'start_at': start_at + self.clock_offset
+        }, timeout=AGENT_REQUEST_TIMEOUT)
+        response.raise_for_status()
+
+    def status(self, plan_id: str) -> Dict:
+        response = self.session.get(f"{self.url}/api/agent/plans/{plan_id}", timeout=AGENT_REQUEST_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
+
+    def stop(self, plan_id: str):
+        try:
+            self.session.post(f"{self.url}/api/agent/plans/{plan_id}/stop", timeout=AGENT_REQUEST_TIMEOUT)
+        except requests.RequestException as e:
+            print(f"Failed to stop agent plan on {self.url}: {e}")
+
+
+class AgentRun:
+    """一次分散式測試：每個代理執行一份計畫"""
+
+    def __init__(self, agent_urls: List[str], kind: str, configs: List[Dict]):
+        """
+        Args:
+            agent_urls: 代理URL，與configs一一對應
+            kind: PLAN_BASIC 或 PLAN_MULTI_USER
+            configs: 各代理的測試配置
+        """
+        self.plan_id = str(uuid.uuid4())
+        self.kind = kind
+        self.agents = [AgentClient(url) for url in agent_urls[:len(configs)]]
+        self.configs = configs
+        self.start_at: Optional[float] = None
+        self._snapshots: List[Dict] = [{'status': 'scheduled'} for _ in self.agents]
+        self._failures = [0] * len(self.agents)
+
+    def start(self) -> float:
+        """連線所有代理並送出計畫，回傳主控端時鐘的開始時間"""
+        for agent in self.agents:
+            try:
+                agent.connect()
+            except requests.RequestException as e:
+                raise Exception(f"Load agent {agent.url} is not available: {e}")
+
+        self.start_at = time.time() + AGENT_START_DELAY
+        for agent, config in zip(self.agents, self.configs):
+            try:
+                agent.submit(self.plan_id, self.kind, config, self.start_at)
+            except requests.RequestException as e:
+                self.stop()
+                raise Exception(f"Failed to submit plan to load agent {agent.url}: {e}")
+        return self.start_at
+
+    def poll(self) -> List[Dict]:
+        """
+        取得各代理目前的累計數據
+
+        Returns:
+            每個代理一筆，另加上 agent、hostname 與 clock_offset；
+            暫時無法連線時沿用上次的數據，連續失敗過多則標記為錯誤
+        """
+        for index, agent in enumerate(self.agents):
+            if self._snapshots[index].get('status') in FINISHED_STATUSES:
+                continue
+            try:
+                snapshot = agent.status(self.plan_id)
+                self._failures[index] = 0
+            except requests.RequestException as e:
+                self._failures[index] += 1
+                if self._failures[index] < MAX_POLL_FAILURES:
+                    continue
+                snapshot = {**self._snapshots[index], 'status': 'error', 'error': f"Agent unreachable: {e}"}
+            self._snapshots[index] = {
+                **snapshot,
+                'agent': agent.url,
+                'hostname': agent.hostname,
+                'clock_offset': agent.clock_offset
+            }
+        return list(self._snapshots)
+
+    def stop(self):
+        for agent in self.agents:
+            agent.stop(self.plan_id)
+
+    @staticmethod
+    def finished(snapshots: List[Dict]) -> bool:
+        return all(snapshot.get('status') in FINISHED_STATUSES for snapshot in snapshots)
+
+    @staticmethod
+    def first_error(snapshots: List[Dict]) -> Optional[str]:
+        """所有代理都失敗時回傳第一個錯誤"""
+        if snapshots and all(snapshot.get('status') == 'error' for snapshot in snapshots):
+            return snapshots[0].get('error') or "All load agents failed"
+        return None
+
+
+def _agent_summary(snapshot: Dict, histogram: LatencyHistogram, requests_count: int, failed: int) -> Dict:
+    return {
+        'agent': snapshot.get('agent'),
+        'hostname': snapshot.get('hostname'),
+        'status': snapshot.get('status'),
+        'error': snapshot.get('error'),
+        'clock_offset': snapshot.get('clock_offset'),
+        'requests': requests_count,
+        'failed': failed,
+        'latency_percentiles': histogram.summary()
+    }
+
+
+def merge_basic_snapshots(snapshots: List[Dict], latency_slo: Optional[float] = None) -> Dict:
+    """
+    合併基礎壓力測試各代理的累計數據
+
+    Returns:
+        aggregates（格式同 ResultLog.aggregates）、throughput（以最早開始到最晚結束的實際時間計算）、
+        agents（各代理摘要）、endpoints（各Ollama端點合計所有代理的統計）與合併後的 latency_histogram
+    """
+    totals: Dict[str, float] = {}
+    histogram = LatencyHistogram()
+    endpoint_histograms: Dict[str, LatencyHistogram] = {}
+    starts, ends, agents = [], [], []
+    for snapshot in snapshots:
+        counters = snapshot.get('counters') or {}
+        for name, value in counters.items():
+            totals[name] = totals.get(name, 0) + value
+        agent_histogram = LatencyHistogram.from_dict(snapshot.get('latency_histogram'))
+        histogram.merge(agent_histogram)
+        for endpoint, data in (snapshot.get('endpoint_histograms') or {}).items():
+            endpoint_histograms.setdefault(endpoint, LatencyHistogram()).merge(LatencyHistogram.from_dict(data))
+
+        # 代理回報的時間換算為主控端時鐘
+        offset = snapshot.get('clock_offset', 0.0)
+        if snapshot.get('measurement_start') is not None:
+            starts.append(snapshot['measurement_start'] - offset)
+        if snapshot.get('measurement_end') is not None:
+            ends.append(snapshot['measurement_end'] - offset)
+        agents.append(_agent_summary(
+            snapshot, agent_histogram,
+            int(counters.get('successful', 0) + counters.get('failed', 0)), int(counters.get('failed', 0))
+        ))
+
+    end = max(ends) if ends and AgentRun.finished(snapshots) else time.time()
+    wall_clock_seconds = end - min(starts) if starts else 0.0
+    return {
+        'aggregates': aggregates_from_totals(totals, histogram),
+        'throughput': throughput_from_totals(totals, wall_clock_seconds, latency_slo),
+        'agents': agents,
+        'endpoints': endpoint_statistics_from_totals(totals, endpoint_histograms, wall_clock_seconds),
+        'latency_histogram': histogram
+    }
+
+
+def merge_multi_user_snapshots(snapshots: List[Dict], wall_clock_seconds: float = 0.0) -> Dict:
+    """
+    合併多用戶測試各代理的累計數據
+
+    Args:
+        wall_clock_seconds: 測試開始至今的秒數（計算各端點的吞吐量）
+
+    Returns:
+        counters（查詢數、Token數與回應時間總和）、合併後的 latency_histogram、
+        throughput_series（時間桶已依時鐘差對齊；沒有資料時為None）、agents
+        與 endpoints（各Ollama端點合計所有代理的統計）
+    """
+    counters: Dict[str, float] = {}
+    histogram = LatencyHistogram()
+    series: Optional[ThroughputSeries] = None
+    agents = []
+    endpoint_counters: Dict[str, Dict[str, float]] = {}
+    endpoint_histograms: Dict[str, LatencyHistogram] = {}
+    for snapshot in snapshots:
+        agent_counters = snapshot.get('counters') or {}
+        for name, value in agent_counters.items():
+            counters[name] = counters.get(name, 0) + value
+        agent_histogram = LatencyHistogram.from_dict(snapshot.get('latency_histogram'))
+        histogram.merge(agent_histogram)
+
+        if snapshot.get('throughput'):
+            agent_series = ThroughputSeries.from_dict(snapshot['throughput'])
+            index_offset = -round(snapshot.get('clock_offset', 0.0) / agent_series.bucket_seconds)
+            if series is None:
+                series = ThroughputSeries(agent_series.bucket_seconds, agent_series.window_seconds)
+            series.merge(agent_series, index_offset)
+        for endpoint, data in (snapshot.get('endpoints') or {}).items():
+            totals = endpoint_counters.setdefault(endpoint, {})
+            for name, value in data['counters'].items():
+                totals[name] = totals.get(name, 0) + value
+            endpoint_histograms.setdefault(endpoint, LatencyHistogram()).merge(
+                LatencyHistogram.from_dict(data['latency_histogram'])
+            )
+        agents.append(_agent_summary(
+            snapshot, agent_histogram,
+            int(agent_counters.get('total_queries', 0)), int(agent_counters.get('failed_queries', 0))
+        ))
+
+    total_queries = sum(int(totals.get('total_queries', 0)) for totals in endpoint_counters.values())
+    endpoints = [
+        endpoint_summary(
+            endpoint, int(totals.get('successful_queries', 0)), int(totals.get('failed_queries', 0)),
+            totals.get('response_time_sum', 0.0), int(totals.get('total_tokens', 0)),
+            endpoint_histograms[endpoint], wall_clock_seconds, total_queries
+        )
+        for endpoint, totals in sorted(endpoint_counters.items())
+    ]
+    return {
+        'counters': counters,
+        'latency_histogram': histogram,
+        'throughput_series': series,
+        'agents': agents,
+        'endpoints': endpoints
+    }
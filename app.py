@@ -2,15 +2,24 @@ from flask import Flask, render_template, request, jsonify
 import threading
 import time
 import json
+import math
 import plotly
 import plotly.graph_objs as go
 import plotly.utils
 from datetime import datetime
+from types import SimpleNamespace
 from hardware_info import get_hardware_info
 from ollama_client import OllamaClient
 from stress_test_simple import StressTestManager
 from multi_user_stress_test import MultiUserStressTestManager
+from saturation_search import SaturationSearchManager
 from database import db
+from server_metrics import LATENCY_COMPONENTS
+from latency_histogram import LatencyHistogram
+from record_store import RecordStore, as_record_store
+from result_analysis import (
+    ResultAnalysis, box_statistics, group_by, histogram, sample_step, summarize, to_list
+)
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'ollama-stress-test-secret-key'
@@ -18,6 +27,7 @@ app.config['SECRET_KEY'] = 'ollama-stress-test-secret-key'
 # 全局變量
 stress_test_manager = StressTestManager()
 multi_user_test_manager = MultiUserStressTestManager()
+saturation_search_manager = SaturationSearchManager(stress_test_manager)
 ollama_client = OllamaClient()
 
 @app.route('/')
@@ -81,8 +91,9 @@ def stop_test():
 
 @app.route('/api/test_status/<test_id>')
 def test_status(test_id):
-    """獲取測試狀態"""
-    status = stress_test_manager.get_test_status(test_id)
+    """獲取測試狀態；可用 ?cursor= 只取得上次之後新增的結果"""
+    cursor = request.args.get('cursor', type=int)
+    status = stress_test_manager.get_test_status(test_id, cursor)
     if status:
         return jsonify(status)
     else:
@@ -95,8 +106,8 @@ def test_charts(test_id):
     if not status:
         return jsonify({'error': 'Test not found'}), 404
 
-    # 獲取測試結果數據 - 優先使用完整結果，否則使用當前結果
-    results = status.get('final_results', status.get('current_results', []))
+    # 獲取測試結果數據 - 完成後為完整結果，否則為目前已記錄的結果
+    results = stress_test_manager.get_test_results(test_id)
     if not results:
         return jsonify({'error': 'No test results available'}), 404
 
@@ -158,22 +169,84 @@ def multi_user_test_charts(test_id):
     # 從多用戶測試管理器獲取測試結果
     test_info = multi_user_test_manager.active_tests.get(test_id)
     if not test_info:
-        # 檢查是否在已完成的測試中
+        # 檢查是否在已完成的測試中；已從記憶體移除的測試由歷史記錄重建
         test_result = multi_user_test_manager.test_results.get(test_id)
         if not test_result:
-            return jsonify({'error': 'Test not found'}), 404
+            record = db.get_test_detail(test_id)
+            if not record or record['test_type'] != 2:
+                return jsonify({'error': 'Test not found'}), 404
+            test_result = multi_user_result_from_record(record)
 
         # 生成多用戶測試圖表
         charts = generate_multi_user_test_charts(test_result)
         return jsonify(charts)
 
-    # 如果測試還在進行中，檢查是否有結果數據
-    if 'result' in test_info and test_info['result'].query_results:
-        charts = generate_multi_user_test_charts(test_info['result'])
+    # 如果測試還在進行中，以鎖內取得的副本繪製（工作線程仍在附加結果）
+    test_result = (multi_user_test_manager.get_result_snapshot(test_id)
+                   or multi_user_test_manager.test_results.get(test_id))
+    if test_result is not None and (test_result.query_results or test_result.tpm_samples):
+        charts = generate_multi_user_test_charts(test_result)
         return jsonify(charts)
 
     return jsonify({'error': 'No test results available'}), 404
 
+# ===== 容量搜尋 API =====
+
+@app.route('/api/start_saturation_search', methods=['POST'])
+def start_saturation_search():
+    """開始容量搜尋"""
+    try:
+        search_id = saturation_search_manager.start_search(request.json)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({
+        'success': True,
+        'test_id': search_id,
+        'message': 'Saturation search started successfully'
+    })
+
+@app.route('/api/stop_saturation_search', methods=['POST'])
+def stop_saturation_search():
+    """停止容量搜尋"""
+    test_id = request.json.get('test_id')
+    if not test_id:
+        return jsonify({'error': 'Missing test_id'}), 400
+
+    success = saturation_search_manager.stop_search(test_id)
+
+    return jsonify({
+        'success': success,
+        'message': 'Saturation search stopped' if success else 'Search not found or already stopped'
+    })
+
+@app.route('/api/saturation_search_status/<test_id>')
+def saturation_search_status(test_id):
+    """獲取容量搜尋狀態（含各步驟摘要）"""
+    status = saturation_search_manager.get_search_status(test_id)
+    if status:
+        return jsonify(status)
+    else:
+        return jsonify({'error': 'Search not found'}), 404
+
+@app.route('/api/saturation_search_charts/<test_id>')
+def saturation_search_charts(test_id):
+    """獲取容量搜尋圖表數據"""
+    status = saturation_search_manager.get_search_status(test_id)
+    if not status:
+        return jsonify({'error': 'Search not found'}), 404
+    if not status['steps']:
+        return jsonify({'error': 'No search steps available'}), 404
+
+    return jsonify(generate_saturation_search_charts(status['steps'], status.get('statistics', {})))
+
+# 點圖（趨勢圖、散點圖）最多繪製的點數；超過時等距取樣，直方圖與箱線圖改用預先計算的統計
+MAX_CHART_POINTS = 5000
+
+def sampled_title(title, step):
+    """點圖經過等距取樣時在標題註明取樣間隔"""
+    return f'{title} (每{step}筆取1筆)' if step > 1 else title
+
 def generate_test_charts(results, statistics):
     """生成測試結果圖表"""
     charts = {}
@@ -181,24 +254,25 @@ def generate_test_charts(results, statistics):
     if not results:
         return charts
 
-    # 分離成功和失敗的結果
-    successful_results = [r for r in results if r.get('success', False)]
-    failed_results = [r for r in results if not r.get('success', False)]
+    # 分離成功和失敗的結果；數值直接由欄位陣列讀取，不還原每筆結果
+    results = as_record_store(results)
+    analysis = ResultAnalysis(results)
+    success = analysis.mask('success')
+    success_count = analysis.count(success)
+    failed_count = len(results) - success_count
+    response_times = analysis.values('response_time', where=success)
+    task_ids = [task_id if task_id is not None else i
+                for i, task_id in enumerate(results.column('task_id', where=success))]
+    # 點圖超過MAX_CHART_POINTS時等距取樣
+    step = sample_step(success_count, MAX_CHART_POINTS)
 
-    print(f"Debug: Total results: {len(results)}, Successful: {len(successful_results)}, Failed: {len(failed_results)}")
+    print(f"Debug: Total results: {len(results)}, Successful: {success_count}, Failed: {failed_count}")
 
-    # 1. 回應時間分布直方圖
-    if successful_results:
-        response_times = [r['response_time'] for r in successful_results]
+    # 1. 回應時間分布直方圖（在伺服器端分箱，不把每個回應時間送到瀏覽器）
+    if success_count:
 
         fig_histogram = go.Figure(data=[
-            go.Histogram(
-                x=response_times,
-                nbinsx=20,
-                name='回應時間分布',
-                marker_color='rgba(55, 128, 191, 0.7)',
-                marker_line=dict(color='rgba(55, 128, 191, 1.0)', width=1)
-            )
+            binned_histogram_trace(response_times, '回應時間分布', '55, 128, 191')
         ])
 
         fig_histogram.update_layout(
@@ -231,15 +305,12 @@ def generate_test_charts(results, statistics):
         charts['response_time_histogram'] = plotly.utils.PlotlyJSONEncoder().encode(fig_histogram)
 
     # 2. 回應時間時間序列圖
-    if successful_results:
-        task_ids = [r.get('task_id', i) for i, r in enumerate(successful_results)]
-        response_times = [r['response_time'] for r in successful_results]
-
+    if success_count:
         fig_timeline = go.Figure()
 
         fig_timeline.add_trace(go.Scatter(
-            x=task_ids,
-            y=response_times,
+            x=task_ids[::step],
+            y=to_list(response_times[::step]),
             mode='lines+markers',
             name='回應時間',
             line=dict(color='rgb(55, 128, 191)', width=2),
@@ -257,7 +328,7 @@ def generate_test_charts(results, statistics):
             )
 
         fig_timeline.update_layout(
-            title='回應時間趨勢',
+            title=sampled_title('回應時間趨勢', step),
             xaxis_title='請求序號',
             yaxis_title='回應時間 (秒)',
             template='plotly_white'
@@ -286,8 +357,6 @@ def generate_test_charts(results, statistics):
 
     # 3. 成功率餅圖
     if results:
-        success_count = len(successful_results)
-        failed_count = len(failed_results)
 
         fig_pie = go.Figure(data=[
             go.Pie(
@@ -306,17 +375,23 @@ def generate_test_charts(results, statistics):
         charts['success_rate_pie'] = plotly.utils.PlotlyJSONEncoder().encode(fig_pie)
 
     # 4. 回應時間統計箱線圖
-    if successful_results:
-        response_times = [r['response_time'] for r in successful_results]
-
+    if success_count:
         fig_box = go.Figure()
 
-        fig_box.add_trace(go.Box(
-            y=response_times,
-            name='回應時間',
-            marker_color='rgba(55, 128, 191, 0.7)',
-            boxpoints='outliers'
-        ))
+        if step == 1:
+            fig_box.add_trace(go.Box(
+                y=to_list(response_times),
+                name='回應時間',
+                marker_color='rgba(55, 128, 191, 0.7)',
+                boxpoints='outliers'
+            ))
+        else:
+            # 大型測試以預先計算的四分位數與圍欄繪製（不顯示個別離群點）
+            fig_box.add_trace(go.Box(
+                name='回應時間',
+                marker_color='rgba(55, 128, 191, 0.7)',
+                **{key: [value] for key, value in box_statistics(response_times).items()}
+            ))
 
         fig_box.update_layout(
             title='回應時間統計分析',
@@ -344,40 +419,301 @@ def generate_test_charts(results, statistics):
         )
         charts['response_time_box'] = plotly.utils.PlotlyJSONEncoder().encode(fig_box)
 
+    # 5. 延遲分解堆疊圖
+    breakdown_chart = generate_latency_breakdown_chart(
+        task_ids[::step],
+        results.iter_fields(LATENCY_COMPONENTS, where=analysis.sample(success, MAX_CHART_POINTS)),
+        '請求序號'
+    )
+    if breakdown_chart:
+        charts['latency_breakdown'] = breakdown_chart
+
+    # 6. 流式測量圖表 (TTFT / Token間延遲 / 解碼速度)
+    streamed = analysis.present('ttft', where=success)
+    if analysis.any(streamed):
+        sampled_streamed = analysis.sample(streamed, MAX_CHART_POINTS)
+        charts.update(generate_streaming_charts(
+            analysis.values('ttft', where=streamed),
+            inter_token_latency_stats(statistics, results, sampled_streamed),
+            [task_id if task_id is not None else i
+             for i, task_id in enumerate(results.column('task_id', where=sampled_streamed))],
+            results.column('decode_tokens_per_second', where=sampled_streamed),
+            '請求序號',
+            sample_step(analysis.count(streamed), MAX_CHART_POINTS)
+        ))
+
+    # 7. 長時間測試快照趨勢
+    soak_chart = generate_soak_chart(statistics.get('soak'))
+    if soak_chart:
+        charts['soak_trends'] = soak_chart
+
+    # 延遲百分位數分布（由延遲直方圖計算，涵蓋全部成功請求）
+    percentile_chart = generate_latency_percentile_chart(
+        LatencyHistogram.from_dict(statistics.get('latency_histogram'))
+    )
+    if percentile_chart:
+        charts['latency_percentiles'] = percentile_chart
+
+    # 各Ollama端點的吞吐量與延遲（多端點測試）
+    endpoint_chart = generate_endpoint_chart(statistics.get('endpoints'))
+    if endpoint_chart:
+        charts['endpoint_comparison'] = endpoint_chart
+
+    # 8. 負載曲線：目標並發數與各請求的回應時間（超過MAX_CHART_POINTS時等距取樣）
+    profiled = analysis.present('target_concurrency')
+    profile_step = sample_step(analysis.count(profiled), MAX_CHART_POINTS)
+    profiled_results = sorted(
+        results.iter_fields(('target_concurrency', 'elapsed', 'response_time', 'success'),
+                            where=analysis.sample(profiled, MAX_CHART_POINTS)),
+        key=lambda r: r['elapsed']
+    )
+    if profiled_results:
+        fig_profile = go.Figure()
+        fig_profile.add_trace(go.Scatter(
+            x=[r['elapsed'] for r in profiled_results],
+            y=[r['response_time'] for r in profiled_results],
+            mode='markers',
+            marker=dict(
+                size=6,
+                color=['#007bff' if r['success'] else '#dc3545' for r in profiled_results]
+            ),
+            name='回應時間'
+        ))
+        fig_profile.add_trace(go.Scatter(
+            x=[r['elapsed'] for r in profiled_results],
+            y=[r['target_concurrency'] for r in profiled_results],
+            mode='lines',
+            line=dict(color='#ffc107', width=2, shape='hv'),
+            name='目標並發數',
+            yaxis='y2'
+        ))
+        fig_profile.update_layout(
+            title=sampled_title('負載曲線 (目標並發數與回應時間)', profile_step),
+            xaxis_title='測試經過時間 (秒)',
+            yaxis=dict(title='回應時間 (秒)'),
+            yaxis2=dict(title='目標並發數', overlaying='y', side='right', rangemode='tozero'),
+            template='plotly_white',
+            hovermode='closest'
+        )
+        charts['load_profile'] = plotly.utils.PlotlyJSONEncoder().encode(fig_profile)
+
+    return charts
+
+# 延遲分解各組成的顯示名稱與顏色
+LATENCY_COMPONENT_STYLES = {
+    'client_queue_time': ('客戶端佇列', '#6c757d'),
+    'network_time': ('網路/傳輸', '#17a2b8'),
+    'server_queue_time': ('伺服器佇列', '#dc3545'),
+    'load_time': ('模型載入', '#ffc107'),
+    'prefill_time': ('預填充', '#28a745'),
+    'decode_time': ('解碼', '#007bff')
+}
+
+def generate_latency_breakdown_chart(x_values, breakdowns, x_title, max_bars=300):
+    """
+    生成每個請求的延遲分解堆疊柱狀圖
+
+    Args:
+        x_values: 每個請求的X軸標籤
+        breakdowns: 每個請求含有LATENCY_COMPONENTS鍵的字典
+        x_title: X軸標題
+        max_bars: 最多顯示的請求數，超過時等距取樣
+    """
+    rows = [(x, b) for x, b in zip(x_values, breakdowns) if b.get('decode_time') is not None]
+    if not rows:
+        return None
+
+    if len(rows) > max_bars:
+        step = len(rows) / max_bars
+        rows = [rows[int(i * step)] for i in range(max_bars)]
+
+    fig = go.Figure()
+    for component in LATENCY_COMPONENTS:
+        name, color = LATENCY_COMPONENT_STYLES[component]
+        fig.add_trace(go.Bar(
+            x=[str(x) for x, _ in rows],
+            y=[b.get(component) or 0 for _, b in rows],
+            name=name,
+            marker_color=color
+        ))
+
+    fig.update_layout(
+        title='延遲分解 (客戶端佇列 / 網路 / 伺服器佇列 / 載入 / 預填充 / 解碼)',
+        xaxis_title=x_title,
+        yaxis_title='時間 (秒)',
+        barmode='stack',
+        template='plotly_white',
+        hovermode='x unified'
+    )
+
+    return plotly.utils.PlotlyJSONEncoder().encode(fig)
+
+def binned_histogram_trace(values, name, rgb, bins=20):
+    """
+    在伺服器端分箱的直方圖（長條圖）；大型測試不需要把每個數值都序列化到圖表中
+
+    Args:
+        values: 數值（列表或NumPy陣列）
+        name: 圖例名稱
+        rgb: 顏色的 "R, G, B"
+        bins: 等寬區間數
+    """
+    counts, edges = histogram(values, bins)
+    return go.Bar(
+        x=[(low + high) / 2 for low, high in zip(edges, edges[1:])],
+        y=counts,
+        name=name,
+        marker_color=f'rgba({rgb}, 0.7)',
+        marker_line=dict(color=f'rgba({rgb}, 1.0)', width=1)
+    )
+
+def inter_token_latency_stats(statistics, records, sampled):
+    """
+    Token間延遲的百分位數摘要
+
+    優先使用最終統計中已涵蓋全部請求的 inter_token_latency_stats；沒有時（進行中或較舊的測試）
+    只展開取樣請求的Token間延遲，不展開全部請求
+
+    Args:
+        statistics: 測試統計（或多用戶測試的streaming_statistics）；可為None
+        records: 測試結果的RecordStore
+        sampled: 取樣後的流式請求選取條件（ResultAnalysis.sample的結果）
+    """
+    precomputed = (statistics or {}).get('inter_token_latency_stats')
+    if precomputed:
+        return precomputed
+    return summarize([itl for itls in records.column('inter_token_latencies', where=sampled)
+                      for itl in (itls or [])])
+
+def generate_streaming_charts(ttft_values, itl_stats, x_values, decode_rates, x_title, step=1):
+    """
+    生成流式測量模式的圖表
+
+    Args:
+        ttft_values: 全部流式請求的TTFT（伺服器端分箱）
+        itl_stats: Token間延遲的百分位數摘要（見inter_token_latency_stats）
+        x_values, decode_rates: 取樣後請求的X軸標籤與解碼速度
+        step: 解碼速度點圖的取樣間隔
+    """
+    charts = {}
+
+    # TTFT分布直方圖
+    fig_ttft = go.Figure(data=[
+        binned_histogram_trace(ttft_values, 'TTFT分布', '40, 167, 69')
+    ])
+    fig_ttft.update_layout(
+        title='首Token延遲 (TTFT) 分布',
+        xaxis_title='TTFT (秒)',
+        yaxis_title='請求數量',
+        bargap=0.1,
+        template='plotly_white'
+    )
+    charts['ttft_histogram'] = plotly.utils.PlotlyJSONEncoder().encode(fig_ttft)
+
+    # Token間延遲百分位數
+    if itl_stats:
+        labels = ['p50', 'p90', 'p95', 'p99', 'max']
+        values = [itl_stats[label] * 1000 for label in labels]
+
+        fig_itl = go.Figure(data=[
+            go.Bar(
+                x=labels,
+                y=values,
+                marker_color='rgba(255, 153, 51, 0.8)',
+                text=[f'{value:.1f}ms' for value in values],
+                textposition='auto'
+            )
+        ])
+        fig_itl.update_layout(
+            title='Token間延遲 (ITL) 百分位數',
+            xaxis_title='百分位數',
+            yaxis_title='延遲 (毫秒)',
+            template='plotly_white'
+        )
+        charts['inter_token_latency_percentiles'] = plotly.utils.PlotlyJSONEncoder().encode(fig_itl)
+
+    # 每個請求的解碼速度
+    points = [(x, rate) for x, rate in zip(x_values, decode_rates) if rate is not None]
+    if points:
+        fig_decode = go.Figure()
+        fig_decode.add_trace(go.Scatter(
+            x=[x for x, _ in points],
+            y=[rate for _, rate in points],
+            mode='markers',
+            name='解碼速度',
+            marker=dict(size=7, color='rgb(111, 66, 193)')
+        ))
+        fig_decode.update_layout(
+            title=sampled_title('每個請求的解碼速度', step),
+            xaxis_title=x_title,
+            yaxis_title='tokens/秒',
+            template='plotly_white'
+        )
+        charts['decode_tokens_per_second'] = plotly.utils.PlotlyJSONEncoder().encode(fig_decode)
+
     return charts
 
 def generate_multi_user_test_charts(test_result):
     """生成多用戶測試專用圖表"""
     charts = {}
 
-    if not test_result or not test_result.query_results:
+    # 分散式測試的個別結果留在各負載代理，只有合併後的吞吐量序列與直方圖
+    if not test_result or not (test_result.query_results or test_result.tpm_samples):
         return charts
 
-    query_results = test_result.query_results
-    successful_results = [r for r in query_results if r.success]
-    failed_results = [r for r in query_results if not r.success]
-
-    print(f"Debug Multi-user: Total results: {len(query_results)}, Successful: {len(successful_results)}, Failed: {len(failed_results)}")
-
-    # 1. TPM趨勢圖 (測試二專用)
-    if test_result.tpm_samples:
-        timestamps = [sample['timestamp'].strftime('%H:%M:%S') for sample in test_result.tpm_samples]
-        tpm_values = [sample['tokens_per_minute'] for sample in test_result.tpm_samples]
+    # 由欄位陣列分組與取值，不還原每個QueryResult
+    analysis = ResultAnalysis(test_result.query_results or [])
+    query_results = analysis.store
+    success = analysis.mask('success')
+    success_count = analysis.count(success)
+    successful_users = analysis.keys('user_id', where=success)
+    # 點圖超過MAX_CHART_POINTS時等距取樣
+    step = sample_step(success_count, MAX_CHART_POINTS)
+
+    print(f"Debug Multi-user: Total results: {len(query_results)}, Successful: {success_count}, Failed: {len(query_results) - success_count}")
+
+    # 1. TPM趨勢圖 (測試二專用)；測試進行中使用增量統計的吞吐量序列
+    tpm_samples = test_result.tpm_samples
+    running = getattr(test_result, 'running_statistics', None)
+    if not tpm_samples and running is not None:
+        tpm_samples = running.throughput.series()
+    if tpm_samples:
+        timestamps = [sample['timestamp'].strftime('%H:%M:%S') for sample in tpm_samples]
+        tpm_values = [sample['tokens_per_minute'] for sample in tpm_samples]
 
         fig_tpm = go.Figure()
         fig_tpm.add_trace(go.Scatter(
             x=timestamps,
             y=tpm_values,
-            mode='lines+markers',
+            mode='lines',
             name='TPM',
-            line=dict(color='#28a745', width=3),
-            marker=dict(size=6)
+            line=dict(color='#28a745', width=3)
         ))
 
+        # 舊的歷史記錄只有TPM
+        if 'in_flight' in tpm_samples[0]:
+            fig_tpm.add_trace(go.Scatter(
+                x=timestamps,
+                y=[sample['requests_per_second'] for sample in tpm_samples],
+                mode='lines',
+                name='每秒請求數',
+                line=dict(color='#007bff', width=2),
+                yaxis='y2'
+            ))
+            fig_tpm.add_trace(go.Scatter(
+                x=timestamps,
+                y=[sample['in_flight'] for sample in tpm_samples],
+                mode='lines',
+                name='進行中請求數',
+                line=dict(color='#fd7e14', width=2, dash='dot'),
+                yaxis='y2'
+            ))
+
         fig_tpm.update_layout(
             title='TPM (每分鐘Token數) 趨勢',
             xaxis_title='時間',
             yaxis_title='TPM (tokens/分鐘)',
+            yaxis2=dict(title='請求數', overlaying='y', side='right', rangemode='tozero'),
             template='plotly_white',
             hovermode='x unified'
         )
@@ -385,23 +721,12 @@ def generate_multi_user_test_charts(test_result):
         charts['tpm_timeline'] = plotly.utils.PlotlyJSONEncoder().encode(fig_tpm)
 
     # 2. 用戶查詢分布圖
-    if successful_results:
-        user_stats = {}
-        for result in successful_results:
-            user_id = result.user_id
-            if user_id not in user_stats:
-                user_stats[user_id] = {'queries': 0, 'tokens': 0, 'avg_time': 0}
-            user_stats[user_id]['queries'] += 1
-            user_stats[user_id]['tokens'] += result.tokens_count
-
-        # 計算平均響應時間
-        for user_id in user_stats:
-            user_results = [r for r in successful_results if r.user_id == user_id]
-            if user_results:
-                user_stats[user_id]['avg_time'] = sum(r.response_time for r in user_results) / len(user_results)
+    if success_count:
+        # 單次分組：各用戶的成功查詢數與Token數
+        user_stats = group_by(successful_users, tokens=analysis.values('tokens_count', where=success))
 
         users = [f'用戶 {uid}' for uid in user_stats.keys()]
-        queries = [stats['queries'] for stats in user_stats.values()]
+        queries = [stats['count'] for stats in user_stats.values()]
         tokens = [stats['tokens'] for stats in user_stats.values()]
 
         fig_users = go.Figure()
@@ -437,10 +762,10 @@ def generate_multi_user_test_charts(test_result):
         charts['user_distribution'] = plotly.utils.PlotlyJSONEncoder().encode(fig_users)
 
     # 3. 響應時間vs Token數量散點圖
-    if successful_results:
-        response_times = [r.response_time for r in successful_results]
-        token_counts = [r.tokens_count for r in successful_results]
-        user_colors = [r.user_id for r in successful_results]
+    if success_count:
+        response_times = to_list(analysis.values('response_time', where=success)[::step])
+        token_counts = to_list(analysis.values('tokens_count', where=success)[::step])
+        user_colors = to_list(successful_users[::step])
 
         fig_scatter = go.Figure()
         fig_scatter.add_trace(go.Scatter(
@@ -454,12 +779,12 @@ def generate_multi_user_test_charts(test_result):
                 showscale=True,
                 colorbar=dict(title="用戶ID")
             ),
-            text=[f'用戶 {r.user_id}' for r in successful_results],
+            text=[f'用戶 {uid}' for uid in user_colors],
             hovertemplate='<b>%{text}</b><br>響應時間: %{x:.2f}s<br>Token數: %{y}<extra></extra>'
         ))
 
         fig_scatter.update_layout(
-            title='響應時間 vs Token數量',
+            title=sampled_title('響應時間 vs Token數量', step),
             xaxis_title='響應時間 (秒)',
             yaxis_title='Token數量',
             template='plotly_white'
@@ -469,17 +794,10 @@ def generate_multi_user_test_charts(test_result):
 
     # 4. 多用戶成功率比較
     if query_results:
-        user_success_stats = {}
-        for result in query_results:
-            user_id = result.user_id
-            if user_id not in user_success_stats:
-                user_success_stats[user_id] = {'total': 0, 'success': 0}
-            user_success_stats[user_id]['total'] += 1
-            if result.success:
-                user_success_stats[user_id]['success'] += 1
+        user_success_stats = group_by(analysis.keys('user_id'), success=success)
 
         users = [f'用戶 {uid}' for uid in user_success_stats.keys()]
-        success_rates = [(stats['success'] / stats['total']) * 100 for stats in user_success_stats.values()]
+        success_rates = [(stats['success'] / stats['count']) * 100 for stats in user_success_stats.values()]
 
         fig_success = go.Figure()
         fig_success.add_trace(go.Bar(
@@ -500,6 +818,224 @@ def generate_multi_user_test_charts(test_result):
 
         charts['user_success_rate'] = plotly.utils.PlotlyJSONEncoder().encode(fig_success)
 
+    # 5. 延遲分解堆疊圖
+    breakdown_chart = generate_latency_breakdown_chart(
+        [f'{i * step + 1} (用戶 {uid})' for i, uid in enumerate(successful_users[::step])],
+        query_results.iter_fields(LATENCY_COMPONENTS, where=analysis.sample(success, MAX_CHART_POINTS)),
+        '查詢 (完成順序)'
+    )
+    if breakdown_chart:
+        charts['latency_breakdown'] = breakdown_chart
+
+    # 6. 流式測量圖表
+    streamed = analysis.present('ttft', where=success)
+    if analysis.any(streamed):
+        sampled_streamed = analysis.sample(streamed, MAX_CHART_POINTS)
+        charts.update(generate_streaming_charts(
+            analysis.values('ttft', where=streamed),
+            inter_token_latency_stats(getattr(test_result, 'streaming_statistics', None),
+                                      query_results, sampled_streamed),
+            [f'用戶 {uid}' for uid in analysis.keys('user_id', where=sampled_streamed)],
+            query_results.column('decode_tokens_per_second', where=sampled_streamed),
+            '用戶',
+            sample_step(analysis.count(streamed), MAX_CHART_POINTS)
+        ))
+
+    # 7. 長時間測試快照趨勢
+    soak_chart = generate_soak_chart(getattr(test_result, 'soak_statistics', None))
+    if soak_chart:
+        charts['soak_trends'] = soak_chart
+
+    # 8. 延遲百分位數分布
+    percentile_chart = generate_latency_percentile_chart(getattr(test_result, 'latency_histogram', None))
+    if percentile_chart:
+        charts['latency_percentiles'] = percentile_chart
+
+    # 9. 各Ollama端點的吞吐量與延遲
+    endpoint_chart = generate_endpoint_chart(getattr(test_result, 'endpoint_statistics', None))
+    if endpoint_chart:
+        charts['endpoint_comparison'] = endpoint_chart
+
+    return charts
+
+def generate_endpoint_chart(endpoint_statistics):
+    """生成各Ollama端點的比較圖：輸出Token/秒（長條）與p50/p99回應時間，用於觀察負載是否平衡"""
+    if not endpoint_statistics:
+        return None
+
+    endpoints = [e['endpoint'] for e in endpoint_statistics]
+    fig = go.Figure()
+    fig.add_trace(go.Bar(
+        x=endpoints,
+        y=[e['output_tokens_per_second'] for e in endpoint_statistics],
+        name='輸出Token/秒',
+        marker_color='#28a745',
+        text=[f"{e['share']:.1f}% ({e['requests']}個請求)" for e in endpoint_statistics],
+        textposition='auto'
+    ))
+    for key, name, color in (('p50', 'p50 回應時間', '#007bff'), ('p99', 'p99 回應時間', '#dc3545')):
+        fig.add_trace(go.Scatter(
+            x=endpoints,
+            y=[(e.get('latency_percentiles') or {}).get(key) for e in endpoint_statistics],
+            mode='markers',
+            marker=dict(size=12, color=color),
+            name=name,
+            yaxis='y2'
+        ))
+
+    fig.update_layout(
+        title='各端點吞吐量與延遲 (長條標示請求比例)',
+        xaxis_title='Ollama端點',
+        yaxis=dict(title='輸出Token/秒', rangemode='tozero'),
+        yaxis2=dict(title='回應時間 (秒)', overlaying='y', side='right', rangemode='tozero'),
+        template='plotly_white'
+    )
+
+    return plotly.utils.PlotlyJSONEncoder().encode(fig)
+
+def generate_latency_percentile_chart(histogram):
+    """生成延遲百分位數分布圖（x軸依「幾個9」展開，方便觀察p99/p99.9的尾端延遲）"""
+    if histogram is None or histogram.count == 0:
+        return None
+
+    # x = -log10(1 - p/100)：0 對應p0，1 對應p90，2 對應p99，3 對應p99.9
+    max_nines = min(4.0, math.log10(histogram.count)) if histogram.count > 1 else 1.0
+    steps = 80
+    nines = [max_nines * i / steps for i in range(steps + 1)]
+    percentiles = [100 * (1 - 10 ** -x) for x in nines]
+
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(
+        x=nines,
+        y=[histogram.percentile(p) for p in percentiles],
+        mode='lines',
+        line=dict(color='#007bff', width=2, shape='hv'),
+        name='回應時間',
+        customdata=percentiles,
+        hovertemplate='p%{customdata:.3f}: %{y:.3f}s<extra></extra>'
+    ))
+
+    tick_values = [x for x in (0, 1, 2, 3, 4) if x <= max_nines]
+    fig.update_layout(
+        title=f'延遲百分位數分布 (共 {histogram.count} 個成功請求)',
+        xaxis=dict(title='百分位數', tickvals=tick_values,
+                   ticktext=['p0', 'p90', 'p99', 'p99.9', 'p99.99'][:len(tick_values)]),
+        yaxis_title='回應時間 (秒)',
+        template='plotly_white'
+    )
+
+    return plotly.utils.PlotlyJSONEncoder().encode(fig)
+
+def generate_soak_chart(soak_statistics):
+    """生成依時間執行/soak測試的快照趨勢圖（延遲、吞吐量與RSS）"""
+    snapshots = (soak_statistics or {}).get('snapshots') or []
+    if not snapshots:
+        return None
+
+    minutes = [s['elapsed'] / 60 for s in snapshots]
+    fig = go.Figure()
+    for key, name, color in (('p50_latency', 'p50 延遲', '#28a745'),
+                             ('p95_latency', 'p95 延遲', '#ffc107'),
+                             ('p99_latency', 'p99 延遲', '#dc3545')):
+        fig.add_trace(go.Scatter(x=minutes, y=[s.get(key) for s in snapshots],
+                                 mode='lines+markers', name=name, line=dict(color=color)))
+    fig.add_trace(go.Scatter(x=minutes, y=[s['throughput'] for s in snapshots],
+                             mode='lines', name='吞吐量 (請求/秒)',
+                             line=dict(color='#007bff', dash='dot'), yaxis='y2'))
+    for key, name, color in (('server_rss_mb', 'Ollama RSS (MB)', '#6f42c1'),
+                             ('client_rss_mb', '測試程式 RSS (MB)', '#6c757d')):
+        if any(s.get(key) is not None for s in snapshots):
+            fig.add_trace(go.Scatter(x=minutes, y=[s.get(key) for s in snapshots],
+                                     mode='lines', name=name, line=dict(color=color), yaxis='y3'))
+
+    fig.update_layout(
+        title='長時間測試趨勢 (每個快照區間)',
+        xaxis=dict(title='測試經過時間 (分鐘)', domain=[0, 0.88]),
+        yaxis=dict(title='延遲 (秒)'),
+        yaxis2=dict(title='吞吐量', overlaying='y', side='right', rangemode='tozero'),
+        yaxis3=dict(title='RSS (MB)', overlaying='y', side='right', position=0.96, anchor='free'),
+        template='plotly_white',
+        hovermode='x unified'
+    )
+
+    return plotly.utils.PlotlyJSONEncoder().encode(fig)
+
+def generate_saturation_search_charts(steps, statistics):
+    """生成容量搜尋圖表：吞吐量-延遲曲線與各負載下的延遲/錯誤率"""
+    charts = {}
+    steps = sorted(steps, key=lambda s: s['level'])
+    slo = statistics.get('slo', {})
+    level_title = '到達率 (每秒請求數)' if statistics.get('search_dimension') == 'arrival_rate' else '並發數'
+
+    # 吞吐量-延遲曲線，標示拐點與符合/違反SLO的步驟
+    fig_curve = go.Figure()
+    fig_curve.add_trace(go.Scatter(
+        x=[s['p95_latency'] for s in steps],
+        y=[s['throughput'] for s in steps],
+        mode='lines+markers+text',
+        text=[str(s['level']) for s in steps],
+        textposition='top center',
+        marker=dict(
+            size=10,
+            color=['#28a745' if s['passed'] else '#dc3545' for s in steps]
+        ),
+        line=dict(color='#6c757d'),
+        name='步驟'
+    ))
+
+    knee = statistics.get('knee')
+    if knee:
+        fig_curve.add_trace(go.Scatter(
+            x=[knee['p95_latency']],
+            y=[knee['throughput']],
+            mode='markers',
+            marker=dict(size=18, symbol='star', color='#ffc107'),
+            name=f"拐點 ({knee['level']})"
+        ))
+
+    if slo.get('max_p95_latency') is not None:
+        fig_curve.add_vline(x=slo['max_p95_latency'], line_dash='dash', line_color='#dc3545',
+                            annotation_text='p95 SLO')
+
+    fig_curve.update_layout(
+        title='吞吐量-延遲曲線',
+        xaxis_title='p95 延遲 (秒)',
+        yaxis_title='吞吐量 (每秒成功請求數)',
+        template='plotly_white'
+    )
+    charts['throughput_latency_curve'] = plotly.utils.PlotlyJSONEncoder().encode(fig_curve)
+
+    # 各負載下的延遲百分位數與錯誤率
+    levels = [str(s['level']) for s in steps]
+    fig_levels = go.Figure()
+    for key, name, color in (('p50_latency', 'p50', '#28a745'),
+                             ('p95_latency', 'p95', '#ffc107'),
+                             ('p99_latency', 'p99', '#dc3545')):
+        fig_levels.add_trace(go.Scatter(
+            x=levels,
+            y=[s[key] for s in steps],
+            mode='lines+markers',
+            name=name,
+            line=dict(color=color)
+        ))
+    fig_levels.add_trace(go.Bar(
+        x=levels,
+        y=[s['error_rate'] for s in steps],
+        name='錯誤率 (%)',
+        marker_color='rgba(108, 117, 125, 0.4)',
+        yaxis='y2'
+    ))
+
+    fig_levels.update_layout(
+        title='各負載的延遲百分位數與錯誤率',
+        xaxis_title=level_title,
+        yaxis=dict(title='延遲 (秒)'),
+        yaxis2=dict(title='錯誤率 (%)', overlaying='y', side='right', range=[0, 100]),
+        template='plotly_white',
+        hovermode='x unified'
+    )
+    charts['latency_by_load'] = plotly.utils.PlotlyJSONEncoder().encode(fig_levels)
+
     return charts
 
 # ===== 歷史記錄管理 API =====
@@ -581,6 +1117,21 @@ def api_get_test_detail(test_id):
             'error': str(e)
         }), 500
 
+@app.route('/api/history/<test_id>/steps')
+def api_get_test_steps(test_id):
+    """獲取容量搜尋的各步驟測試記錄"""
+    try:
+        return jsonify({
+            'success': True,
+            'records': db.get_child_tests(test_id)
+        })
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @app.route('/api/history/<test_id>', methods=['DELETE'])
 def api_delete_test_record(test_id):
     """刪除測試記錄"""
@@ -604,6 +1155,33 @@ def api_delete_test_record(test_id):
             'error': str(e)
         }), 500
 
+class MockTestResult:
+    """由歷史記錄重構的多用戶測試結果（只有產生圖表需要的屬性）"""
+
+    def __init__(self, data):
+        # 轉換查詢結果；逐筆讀取時還原為具有相同屬性的物件
+        self.query_results = RecordStore.from_records(data.get('query_results', []),
+                                                      row_factory=SimpleNamespace)
+        self.tpm_samples = []
+
+        # 轉換TPM樣本
+        for sample_data in data.get('tpm_samples', []):
+            sample = {
+                **sample_data,
+                'timestamp': datetime.fromisoformat(sample_data['timestamp'])
+            }
+            self.tpm_samples.append(sample)
+
+def multi_user_result_from_record(record):
+    """由多用戶測試的歷史記錄重構可用於generate_multi_user_test_charts的結果"""
+    mock_result = MockTestResult(record['test_results'])
+    mock_result.soak_statistics = record['test_statistics'].get('soak')
+    mock_result.endpoint_statistics = record['test_statistics'].get('endpoints')
+    mock_result.latency_histogram = LatencyHistogram.from_dict(
+        record['test_statistics'].get('latency_histogram')
+    )
+    return mock_result
+
 @app.route('/api/history/<test_id>/charts')
 def api_get_test_charts(test_id):
     """獲取測試的圖表數據"""
@@ -622,34 +1200,13 @@ def api_get_test_charts(test_id):
             results = record['test_results'].get('results', [])
             statistics = record['test_statistics']
             charts = generate_test_charts(results, statistics)
+        elif record['test_type'] == 3:
+            # 容量搜尋
+            steps = record['test_results'].get('steps', [])
+            charts = generate_saturation_search_charts(steps, record['test_statistics'])
         else:
             # 多用戶並發測試
-            # 重構測試結果為MultiUserTestResult格式
-            test_results = record['test_results']
-
-            # 創建模擬的測試結果對象
-            class MockTestResult:
-                def __init__(self, data):
-                    self.query_results = []
-                    self.tpm_samples = []
-
-                    # 轉換查詢結果
-                    for result_data in data.get('query_results', []):
-                        result_obj = type('QueryResult', (), {})()
-                        for key, value in result_data.items():
-                            setattr(result_obj, key, value)
-                        self.query_results.append(result_obj)
-
-                    # 轉換TPM樣本
-                    for sample_data in data.get('tpm_samples', []):
-                        sample = {
-                            'timestamp': datetime.fromisoformat(sample_data['timestamp']),
-                            'tokens_per_minute': sample_data['tokens_per_minute']
-                        }
-                        self.tpm_samples.append(sample)
-
-            mock_result = MockTestResult(test_results)
-            charts = generate_multi_user_test_charts(mock_result)
+            charts = generate_multi_user_test_charts(multi_user_result_from_record(record))
 
         return jsonify({
             'success': True,
@@ -0,0 +1,192 @@
+"""
+開放迴路(open-loop)到達率排程
+依固定速率、Poisson過程或速率曲線產生請求的預定發送時間，與請求何時完成無關。
+延遲從預定發送時間起算，以修正協同遺漏(coordinated omission)。
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Sequence
+
+from latency_histogram import LatencyHistogram
+from streaming_metrics import summarize_values
+
+ARRIVAL_CLOSED = 'closed'      # 封閉迴路：前一個請求完成後才送出下一個（原有行為）
+ARRIVAL_CONSTANT = 'constant'  # 固定每秒請求數
+ARRIVAL_POISSON = 'poisson'    # Poisson到達（指數分布的間隔）
+ARRIVAL_CURVE = 'curve'        # 依 [[秒, 每秒請求數], ...] 線性插值的速率曲線
+SUPPORTED_ARRIVAL_MODES = (ARRIVAL_CLOSED, ARRIVAL_CONSTANT, ARRIVAL_POISSON, ARRIVAL_CURVE)
+
+# 派發延遲摘要的百分位數（與send_lag_stats的欄位相同）
+SCHEDULE_PERCENTILES = (50, 90, 95, 99)
+
+# 等待排程時間時，每次最多睡眠的秒數（以便及時響應停止請求）
+_MAX_SLEEP = 0.2
+
+
+def validate_arrival_config(mode: str, rate: Optional[float], rate_curve: Optional[Sequence]):
+    """檢查到達率設定，不合法時拋出ValueError"""
+    if mode not in SUPPORTED_ARRIVAL_MODES:
+        raise ValueError(f"Unsupported arrival mode: {mode}")
+    if mode in (ARRIVAL_CONSTANT, ARRIVAL_POISSON) and (rate is None or rate <= 0):
+        raise ValueError("arrival_rate must be greater than 0")
+    if mode == ARRIVAL_CURVE:
+        if not rate_curve:
+            raise ValueError("rate_curve is required for curve arrival mode")
+        if any(point[1] < 0 for point in rate_curve) or all(point[1] <= 0 for point in rate_curve):
+            raise ValueError("rate_curve must contain non-negative rates and at least one positive rate")
+        if max(rate_curve)[1] <= 0:
+            # 曲線結束後沿用最後的速率；速率為0時排程永遠不會再產生請求
+            raise ValueError("rate_curve must end with a positive rate")
+
+
+def rate_at(rate_curve: Sequence[Sequence[float]], t: float) -> float:
+    """取得速率曲線在第t秒的每秒請求數（線性插值，超出範圍時沿用端點值）"""
+    points = sorted(rate_curve)
+    if t <= points[0][0]:
+        return float(points[0][1])
+    for (t0, r0), (t1, r1) in zip(points, points[1:]):
+        if t0 <= t <= t1:
+            if t1 == t0:
+                return float(r1)
+            return r0 + (r1 - r0) * (t - t0) / (t1 - t0)
+    return float(points[-1][1])
+
+
+def arrival_offsets(mode: str, rate: Optional[float] = None,
+                    rate_curve: Optional[Sequence] = None,
+                    seed: Optional[int] = None) -> Iterator[float]:
+    """
+    產生相對於測試開始的預定發送時間（秒），為無限序列
+
+    Args:
+        mode: constant / poisson / curve
+        rate: 每秒請求數（constant與poisson使用）
+        rate_curve: [[秒, 每秒請求數], ...]（curve使用）
+        seed: Poisson亂數種子，方便重現
+    """
+    validate_arrival_config(mode, rate, rate_curve)
+    rng = random.Random(seed)
+    t = 0.0
+
+    if mode == ARRIVAL_CONSTANT:
+        i = 0
+        while True:
+            yield i / rate
+            i += 1
+    elif mode == ARRIVAL_POISSON:
+        while True:
+            yield t
+            t += rng.expovariate(rate)
+    elif mode == ARRIVAL_CURVE:
+        curve_end = max(point[0] for point in rate_curve)
+        while True:
+            current_rate = rate_at(rate_curve, t)
+            if current_rate <= 0:
+                if t > curve_end:
+                    # 曲線結束後速率不會再回升，排程結束
+                    return
+                # 速率為0的區段：每次前進0.1秒直到速率回升
+                t += 0.1
+                continue
+            yield t
+            t += 1 / current_rate
+    else:
+        raise ValueError(f"Arrival mode {mode} has no schedule")
+
+
+def wait_until(target: float, should_stop: Callable[[], bool]) -> bool:
+    """睡眠到指定時間；期間收到停止請求時回傳False"""
+    while True:
+        if should_stop():
+            return False
+        remaining = target - time.time()
+        if remaining <= 0:
+            return True
+        time.sleep(min(remaining, _MAX_SLEEP))
+
+
+def run_open_loop_threaded(tasks: Iterable[Any], offsets: Iterable[float], max_workers: int,
+                           execute: Callable[[Any, float], None],
+                           should_stop: Callable[[], bool]) -> Dict:
+    """
+    依排程把任務派發到線程池，不等待前一個請求完成
+
+    Args:
+        tasks: 任務來源
+        offsets: 與任務一一對應的預定發送時間（相對秒數）
+        max_workers: 同時進行中請求的上限；滿載時任務在池中排隊，排隊時間計入延遲
+        execute: 以 (task, intended_start) 呼叫，intended_start 為預定發送的絕對時間
+        should_stop: 回傳True時停止派發
+
+    Returns:
+        派發器統計：開始時間、派發數量與派發延遲（派發器本身落後排程的秒數，記錄於LatencyHistogram）
+    """
+    start = time.time()
+    dispatch_end = start
+    dispatched = 0
+    dispatch_lag = LatencyHistogram()
+    # 尚未完成的請求（完成時移除），停止時取消其中仍在排隊的請求
+    pending = set()
+    pending_lock = threading.Lock()
+
+    def discard(future):
+        with pending_lock:
+            pending.discard(future)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+    try:
+        for task, offset in zip(tasks, offsets):
+            intended_start = start + offset
+            if not wait_until(intended_start, should_stop):
+                with pending_lock:
+                    queued = list(pending)
+                # 進行中的請求無法取消，仍等待完成
+                for future in queued:
+                    future.cancel()
+                break
+            dispatch_end = time.time()
+            dispatch_lag.record(dispatch_end - intended_start)
+            dispatched += 1
+            future = executor.submit(execute, task, intended_start)
+            with pending_lock:
+                pending.add(future)
+            future.add_done_callback(discard)
+    finally:
+        executor.shutdown(wait=True)
+
+    return {
+        'start': start,
+        'dispatched': dispatched,
+        'dispatch_end': dispatch_end,
+        'dispatch_lag': dispatch_lag
+    }
+
+
+def summarize_schedule(mode: str, rate: Optional[float], dispatcher: Dict,
+                       send_lags: Sequence[float]) -> Dict:
+    """
+    彙總開放迴路測試的排程執行情況
+
+    Args:
+        mode: 到達模式
+        rate: 目標每秒請求數（curve模式為None）
+        dispatcher: run_open_loop_* 回傳的派發器統計
+        send_lags: 每個請求實際發送時間與預定時間的差距（含執行器排隊）
+    """
+    dispatch_lag = dispatcher.get('dispatch_lag') or LatencyHistogram()
+    dispatched = dispatcher.get('dispatched', 0)
+    dispatch_span = dispatcher.get('dispatch_end', 0) - dispatcher.get('start', 0)
+
+    return {
+        'arrival_mode': mode,
+        'target_rate': rate,
+        'dispatched_requests': dispatched,
+        # 第一個請求在時間0派發，因此以間隔數除以派發期間
+        'offered_rate': (dispatched - 1) / dispatch_span if dispatch_span > 0 else 0.0,
+        'dispatch_lag_stats': dispatch_lag.summary(SCHEDULE_PERCENTILES),
+        'send_lag_stats': summarize_values(send_lags),
+        'max_send_lag': max(send_lags) if send_lags else 0.0
+    }
@@ -0,0 +1,175 @@
+"""
+非同步負載引擎
+在單一事件迴圈中維持N個進行中的生成請求，取代「每個並發請求一個線程」的模式
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from async_ollama_client import AsyncMultiEndpointOllamaClient
+from latency_histogram import LatencyHistogram
+from endpoint_balancer import BALANCE_ROUND_ROBIN, DEFAULT_ENDPOINT, normalize_endpoints
+from ollama_backends import BACKEND_GENERATE
+
+# 目標並發數低於worker編號時，worker每次暫停的秒數
+_GATE_INTERVAL = 0.05
+
+ENGINE_THREAD = 'thread'
+ENGINE_ASYNC = 'async'
+SUPPORTED_ENGINES = (ENGINE_THREAD, ENGINE_ASYNC)
+
+
+class AsyncLoadEngine:
+    """以asyncio驅動固定數量的並行請求"""
+
+    def __init__(self, concurrency: int, base_url: str = DEFAULT_ENDPOINT,
+                 dispatch_delay: float = 0.0, endpoints: Optional[List[str]] = None,
+                 balance_strategy: str = BALANCE_ROUND_ROBIN, backend: str = BACKEND_GENERATE,
+                 messages: Optional[List[Dict]] = None):
+        """
+        Args:
+            concurrency: 同時進行中的請求數
+            base_url: Ollama服務器的基礎URL（未設定endpoints時使用）
+            dispatch_delay: 每派發一個任務後的間隔（秒）
+            endpoints: 多個Ollama端點；設定時依balance_strategy分散請求
+            balance_strategy: 多端點的負載平衡策略
+            backend: 生成API（見ollama_backends）
+            messages: 放在每個提示詞之前的對話歷史（僅chat/openai）
+        """
+        self.concurrency = max(1, int(concurrency))
+        self.endpoints = normalize_endpoints(endpoints or [base_url])
+        self.balance_strategy = balance_strategy
+        self.backend = backend
+        self.messages = messages
+        self.dispatch_delay = dispatch_delay
+
+    def _client(self) -> AsyncMultiEndpointOllamaClient:
+        """客戶端的結果帶有endpoint欄位；execute可傳入routing_key供一致性雜湊使用"""
+        return AsyncMultiEndpointOllamaClient(self.endpoints, self.balance_strategy,
+                                              max_connections=self.concurrency,
+                                              backend=self.backend, messages=self.messages)
+
+    def run(self, tasks: Iterable[Any],
+            execute: Callable[[AsyncMultiEndpointOllamaClient, Any], Awaitable[Dict]],
+            on_result: Callable[[Any, Dict], None],
+            should_stop: Callable[[], bool],
+            concurrency_target: Optional[Callable[[float], int]] = None):
+        """
+        在目前線程中執行事件迴圈直到任務耗盡或收到停止請求
+
+        Args:
+            tasks: 任務來源，每個元素交給execute處理
+            execute: 協程函數，負責對單一任務發送請求並回傳結果字典
+            on_result: 每個請求完成時的回呼（在事件迴圈線程中同步呼叫）
+            should_stop: 回傳True時停止派發新任務
+            concurrency_target: 以開始後經過秒數呼叫，回傳當下的目標並發數（不超過concurrency）；
+                編號不小於目標的worker暫停取用新任務
+        """
+        asyncio.run(self._run(tasks, execute, on_result, should_stop, concurrency_target))
+
+    async def _run(self, tasks, execute, on_result, should_stop, concurrency_target=None):
+        async with self._client() as client:
+            if not await client.is_server_available():
+                raise Exception("Ollama server is not available")
+
+            # worker空閒時才從來源取出任務（不預先緩衝），任務取出的時間即為開始等待工作槽位的時間
+            task_iter = iter(tasks)
+            dispatch_lock = asyncio.Lock()
+            start = time.time()
+            last_dispatch = None
+            exhausted = False
+
+            async def next_task():
+                nonlocal last_dispatch, exhausted
+                async with dispatch_lock:
+                    if exhausted:
+                        return None
+                    if self.dispatch_delay > 0 and last_dispatch is not None:
+                        remaining = last_dispatch + self.dispatch_delay - time.time()
+                        if remaining > 0:
+                            await asyncio.sleep(remaining)
+                    task = None if should_stop() else next(task_iter, None)
+                    if task is None:
+                        exhausted = True
+                    last_dispatch = time.time()
+                    return task
+
+            async def worker(index):
+                while not exhausted:
+                    if concurrency_target and index >= concurrency_target(time.time() - start):
+                        if should_stop():
+                            break
+                        await asyncio.sleep(_GATE_INTERVAL)
+                        continue
+                    task = await next_task()
+                    if task is None:
+                        break
+                    result = await execute(client, task)
+                    on_result(task, result)
+
+            await asyncio.gather(*(worker(i) for i in range(self.concurrency)))
+
+    def run_open_loop(self, tasks: Iterable[Any], offsets: Iterable[float],
+                      execute: Callable[[AsyncMultiEndpointOllamaClient, Any, float], Awaitable[Dict]],
+                      on_result: Callable[[Any, Dict], None],
+                      should_stop: Callable[[], bool]) -> Dict:
+        """
+        依排程發送請求（開放迴路），不等待前一個請求完成
+
+        Args:
+            tasks: 任務來源
+            offsets: 與任務一一對應的預定發送時間（相對測試開始的秒數）
+            execute: 協程函數，以 (client, task, intended_start) 呼叫
+            on_result: 每個請求完成時的回呼
+            should_stop: 回傳True時停止派發新任務
+
+        Returns:
+            派發器統計，格式與 arrival_schedule.run_open_loop_threaded 相同
+        """
+        return asyncio.run(self._run_open_loop(tasks, offsets, execute, on_result, should_stop))
+
+    async def _run_open_loop(self, tasks, offsets, execute, on_result, should_stop):
+        async with self._client() as client:
+            if not await client.is_server_available():
+                raise Exception("Ollama server is not available")
+
+            # 同時進行中的請求上限；超過時在此排隊，排隊時間計入延遲
+            in_flight = asyncio.Semaphore(self.concurrency)
+            pending = set()
+            dispatched = 0
+            dispatch_lag = LatencyHistogram()
+
+            async def send(task, intended_start):
+                async with in_flight:
+                    if should_stop():
+                        return
+                    result = await execute(client, task, intended_start)
+                on_result(task, result)
+
+            start = time.time()
+            dispatch_end = start
+            for task, offset in zip(tasks, offsets):
+                intended_start = start + offset
+                while not should_stop() and time.time() < intended_start:
+                    await asyncio.sleep(min(intended_start - time.time(), 0.2))
+                if should_stop():
+                    break
+                dispatch_end = time.time()
+                dispatch_lag.record(dispatch_end - intended_start)
+                dispatched += 1
+                request_task = asyncio.create_task(send(task, intended_start))
+                pending.add(request_task)
+                request_task.add_done_callback(pending.discard)
+                # 落後排程時也讓出事件迴圈，讓已派發的請求開始執行
+                await asyncio.sleep(0)
+
+            if pending:
+                await asyncio.gather(*pending)
+
+            return {
+                'start': start,
+                'dispatched': dispatched,
+                'dispatch_end': dispatch_end,
+                'dispatch_lag': dispatch_lag
+            }
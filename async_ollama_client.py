@@ -0,0 +1,222 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import aiohttp
+
+from endpoint_balancer import BALANCE_ROUND_ROBIN, EndpointBalancer, normalize_endpoints
+from ollama_backends import BACKEND_GENERATE, create_backend
+from streaming_metrics import summarize_token_timestamps
+
+
+class AsyncOllamaClient:
+    def __init__(self, base_url: str = "http://localhost:11434", max_connections: int = 100,
+                 timeout: float = 120, backend: str = BACKEND_GENERATE,
+                 messages: Optional[List[Dict]] = None):
+        """
+        初始化非同步Ollama客戶端
+
+        Args:
+            base_url: Ollama服務器的基礎URL
+            max_connections: 連線池的最大連線數（應不小於並發請求數）
+            timeout: 單次生成請求的逾時秒數
+            backend: 生成API（generate、chat或openai，見ollama_backends）
+            messages: 放在每個提示詞之前的對話歷史（僅chat/openai）
+        """
+        self.base_url = base_url.rstrip('/')
+        self.backend = create_backend(backend, messages)
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        """建立共用的HTTP連線池"""
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_connections)
+            self.session = aiohttp.ClientSession(connector=connector)
+
+    async def close(self):
+        """關閉連線池"""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def is_server_available(self) -> bool:
+        """檢查Ollama服務器是否可用"""
+        try:
+            async with self.session.get(f"{self.base_url}/api/tags",
+                                        timeout=aiohttp.ClientTimeout(total=5)) as response:
+                return response.status == 200
+        except Exception:
+            return False
+
+    async def generate_response(self, model: str, prompt: str, stream: bool = False) -> Dict:
+        """
+        生成回應，回傳格式與OllamaClient.generate_response相同
+
+        Args:
+            model: 模型名稱
+            prompt: 輸入提示
+            stream: 是否使用流式回應
+
+        Returns:
+            包含回應資訊的字典
+        """
+        start_time = time.time()
+
+        try:
+            async with self.session.post(
+                f"{self.base_url}{self.backend.path}",
+                json=self.backend.payload(model, prompt, stream),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            ) as response:
+                response.raise_for_status()
+
+                if stream:
+                    # 處理流式回應，記錄每個Token區塊的到達時間
+                    chunks = []
+                    token_times = []
+                    final_data = {}
+                    async for line in response.content:
+                        chunk = self.backend.parse_chunk(line)
+                        if chunk is None:
+                            continue
+                        text, metrics_data, done = chunk
+                        if text:
+                            token_times.append(time.time())
+                            chunks.append(text)
+                        if metrics_data is not None:
+                            final_data = metrics_data
+                        if done:
+                            break
+
+                    end_time = time.time()
+                    result = {
+                        'success': True,
+                        'response': ''.join(chunks),
+                        'model': model,
+                        'prompt': prompt,
+                        'response_time': end_time - start_time,
+                        'timestamp': datetime.now().isoformat(),
+                        'backend': self.backend.name
+                    }
+                    result.update(summarize_token_timestamps(start_time, token_times))
+                    result.update(self.backend.metrics(final_data))
+                    return result
+                else:
+                    # 處理非流式回應
+                    data = await response.json(content_type=None)
+                    end_time = time.time()
+
+                    return {
+                        'success': True,
+                        'response': self.backend.response_text(data),
+                        'model': model,
+                        'prompt': prompt,
+                        'response_time': end_time - start_time,
+                        'timestamp': datetime.now().isoformat(),
+                        'backend': self.backend.name,
+                        **self.backend.response_fields(data),
+                        **self.backend.metrics(data)
+                    }
+
+        except asyncio.TimeoutError:
+            return {
+                'success': False,
+                'error': 'Request timeout',
+                'model': model,
+                'prompt': prompt,
+                'response_time': time.time() - start_time,
+                'timestamp': datetime.now().isoformat()
+            }
+
+        except aiohttp.ClientError as e:
+            return {
+                'success': False,
+                'error': f'Request error: {str(e)}',
+                'model': model,
+                'prompt': prompt,
+                'response_time': time.time() - start_time,
+                'timestamp': datetime.now().isoformat()
+            }
+
+        except Exception as e:
+            return {
+                'success': False,
+                'error': f'Unexpected error: {str(e)}',
+                'model': model,
+                'prompt': prompt,
+                'response_time': time.time() - start_time,
+                'timestamp': datetime.now().isoformat()
+            }
+
+
+class AsyncMultiEndpointOllamaClient:
+    """把生成請求分散到多個Ollama端點的非同步客戶端，每個端點一個連線池"""
+
+    def __init__(self, endpoints: Optional[List[str]] = None, balance_strategy: str = BALANCE_ROUND_ROBIN,
+                 max_connections: int = 100, timeout: float = 120, backend: str = BACKEND_GENERATE,
+                 messages: Optional[List[Dict]] = None):
+        """
+        Args:
+            endpoints: 端點URL列表；None時為本機的Ollama
+            balance_strategy: 負載平衡策略（見endpoint_balancer）
+            max_connections: 每個端點連線池的最大連線數（一致性雜湊可能把所有請求送到同一個端點）
+            timeout: 單次生成請求的逾時秒數
+            backend: 生成API（見ollama_backends）
+            messages: 放在每個提示詞之前的對話歷史（僅chat/openai）
+        """
+        self.balancer = EndpointBalancer(normalize_endpoints(endpoints), balance_strategy)
+        self.clients = {
+            endpoint: AsyncOllamaClient(endpoint, max_connections=max_connections, timeout=timeout,
+                                        backend=backend, messages=messages)
+            for endpoint in self.balancer.endpoints
+        }
+
+    @property
+    def endpoints(self) -> List[str]:
+        return self.balancer.endpoints
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        for client in self.clients.values():
+            await client.open()
+
+    async def close(self):
+        for client in self.clients.values():
+            await client.close()
+
+    async def is_server_available(self) -> bool:
+        """所有端點都可用時才回傳True"""
+        results = await asyncio.gather(*(client.is_server_available() for client in self.clients.values()))
+        return all(results)
+
+    async def generate_response(self, model: str, prompt: str, stream: bool = False,
+                                routing_key: Optional[str] = None) -> Dict:
+        """
+        由負載平衡選出的端點生成回應，回傳格式與AsyncOllamaClient.generate_response相同，另加上endpoint
+
+        Args:
+            routing_key: 一致性雜湊的鍵（例如用戶編號）
+        """
+        endpoint = self.balancer.acquire(routing_key)
+        try:
+            result = await self.clients[endpoint].generate_response(model, prompt, stream=stream)
+        finally:
+            self.balancer.release(endpoint)
+        result['endpoint'] = endpoint
+        return result
@@ -0,0 +1,441 @@
+"""
+壓力測試工具本身的開銷基準測試
+以零延遲的模擬Ollama服務器（mock_ollama_server.py，在另一個行程中執行）驅動測試管理器，
+並以合成的結果測量統計、TPM、圖表與資料庫保存在 100 到 1M 筆結果下的耗時：
+
+    python benchmark_harness.py --scales 100,1000,10000 --output benchmark_report.json
+    python benchmark_harness.py --baseline benchmark_report.json   # 與先前的報告比較
+
+每項基準測試回報每秒處理的結果數、每筆結果的CPU時間與記憶體；實際發送請求的測試另外回報
+工具本身增加的延遲（客戶端耗時減去模擬服務器回報的total_duration）與模擬服務器的CPU時間，
+用於判斷瓶頸在工具還是模擬服務器。報告為JSON，可與先前的報告比較以追蹤效能退化
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import psutil
+import requests
+
+from database import TestHistoryDatabase
+from mock_ollama_server import DEFAULT_MODEL
+from multi_user_stress_test import MultiUserStressTestManager
+from multi_user_test_config import COMMON_PROMPTS, MultiUserTestConfig, MultiUserTestResult, calculate_tpm
+from record_store import RecordStore
+from result_analysis import HAS_NUMPY, np
+from server_metrics import NS_PER_SECOND, extract_server_metrics, latency_breakdown
+from stress_test_simple import StressTestManager
+from streaming_metrics import summarize_values
+
+DEFAULT_SCALES = (100, 1_000, 10_000, 100_000, 1_000_000)
+
+# 實際發送請求的基準測試最多執行的請求數（模擬服務器每秒約可處理數千個請求）
+DEFAULT_LIVE_MAX = 10_000
+DEFAULT_CONCURRENCY = 16
+DEFAULT_ENGINES = ('thread', 'async')
+
+LIVE_BENCHMARKS = ('basic_live', 'multi_user_live')
+OFFLINE_BENCHMARKS = ('basic_statistics', 'multi_user_statistics', 'calculate_tpm',
+                      'test_charts', 'multi_user_charts', 'save_test_result')
+ALL_BENCHMARKS = LIVE_BENCHMARKS + OFFLINE_BENCHMARKS
+
+# 合成結果的到達率與失敗比例（每50筆一筆失敗）
+SYNTHETIC_REQUESTS_PER_SECOND = 50
+SYNTHETIC_FAILURE_EVERY = 50
+SYNTHETIC_OUTPUT_TOKENS = 64
+SYNTHETIC_RESPONSE = ' '.join(['lorem'] * SYNTHETIC_OUTPUT_TOKENS)
+
+# 多用戶測試的用戶數上限（見MultiUserTestConfig）
+MULTI_USER_COUNT = 10
+
+# 模擬服務器啟動的最長等待時間（秒）
+MOCK_STARTUP_TIMEOUT = 15
+
+# 比較報告時，每秒處理數低於基準的此比例即視為退化
+DEFAULT_TOLERANCE = 0.25
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class MockServerProcess:
+    """在另一個行程中執行零延遲的模擬服務器，使其CPU與記憶體不計入被測量的行程"""
+
+    def __init__(self, parallel: int):
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.command = [
+            sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mock_ollama_server.py'),
+            '--port', str(self.port), '--parallel', str(parallel), '--max-queue', '100000',
+            '--prefill-rate', '1e9', '--decode-rate', '1e9', '--output-tokens', '16'
+        ]
+        self.process: Optional[subprocess.Popen] = None
+
+    def __enter__(self):
+        self.process = subprocess.Popen(self.command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.time() + MOCK_STARTUP_TIMEOUT
+        while time.time() < deadline:
+            try:
+                if requests.get(f"{self.url}/api/tags", timeout=1).status_code == 200:
+                    return self
+            except requests.exceptions.RequestException:
+                time.sleep(0.1)
+        self.__exit__(None, None, None)
+        raise Exception("Mock Ollama server did not start in time")
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait(timeout=10)
+            self.process = None
+
+    def cpu_seconds(self) -> float:
+        times = psutil.Process(self.process.pid).cpu_times()
+        return times.user + times.system
+
+
+def _cpu_seconds() -> float:
+    """本行程（所有線程）與已結束子行程（例如多行程引擎的工作行程）的CPU時間"""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def _rss() -> int:
+    gc.collect()
+    return psutil.Process().memory_info().rss
+
+
+def _measure(operation: Callable[[], object], count: int) -> Dict:
+    """執行一次operation，回傳耗時、每秒處理數與每筆的CPU時間"""
+    gc.collect()
+    cpu_start = _cpu_seconds()
+    start = time.perf_counter()
+    operation()
+    seconds = time.perf_counter() - start
+    cpu = _cpu_seconds() - cpu_start
+    return {
+        'seconds': seconds,
+        'items_per_second': count / seconds if seconds > 0 else None,
+        'cpu_seconds_per_item': cpu / count if count else None
+    }
+
+
+def _allocated_bytes(build: Callable[[], object]):
+    """執行build並以tracemalloc測量其結果佔用的記憶體，回傳 (結果, 位元組數)"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        value = build()
+        gc.collect()
+        allocated = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    return value, allocated
+
+
+def synthetic_basic_results(count: int) -> List[Dict]:
+    """產生與基礎測試記錄的結果格式相同的合成結果"""
+    start = time.time() - count / SYNTHETIC_REQUESTS_PER_SECOND
+    results = []
+    for index in range(count):
+        response_time = 0.5 + (index % 97) / 100
+        timestamp = datetime.fromtimestamp(start + index / SYNTHETIC_REQUESTS_PER_SECOND).isoformat()
+        prompt = COMMON_PROMPTS[index % len(COMMON_PROMPTS)]
+        if index % SYNTHETIC_FAILURE_EVERY == SYNTHETIC_FAILURE_EVERY - 1:
+            result = {'success': False, 'error': 'Request error: synthetic failure', 'model': DEFAULT_MODEL,
+                      'prompt': prompt, 'response_time': response_time, 'timestamp': timestamp}
+        else:
+            server_ns = int((response_time - 0.01) * NS_PER_SECOND)
+            result = {
+                'success': True,
+                'response': SYNTHETIC_RESPONSE,
+                'model': DEFAULT_MODEL,
+                'prompt': prompt,
+                'response_time': response_time,
+                'timestamp': timestamp,
+                'backend': 'generate',
+                'context': [],
+                'done': True,
+                **extract_server_metrics({
+                    'prompt_eval_count': 20, 'eval_count': SYNTHETIC_OUTPUT_TOKENS,
+                    'prompt_eval_duration': server_ns // 10, 'eval_duration': server_ns * 8 // 10,
+                    'load_duration': 0, 'total_duration': server_ns
+                })
+            }
+        result['endpoint'] = 'http://localhost:11434'
+        result['task_id'] = index
+        result['worker_thread'] = f"worker-{index % DEFAULT_CONCURRENCY}"
+        result.update(latency_breakdown(result, response_time, 0.001))
+        results.append(result)
+    return results
+
+
+def synthetic_multi_user_result(count: int) -> MultiUserTestResult:
+    """產生含有合成QueryResult的多用戶測試結果（由管理器的_build_query_result轉換）"""
+    manager = MultiUserStressTestManager()
+    config = MultiUserTestConfig(model=DEFAULT_MODEL, user_count=MULTI_USER_COUNT,
+                                 queries_per_user=max(1, count // MULTI_USER_COUNT), save_history=False)
+    result = MultiUserTestResult(test_id='benchmark', config=config, start_time=datetime.now())
+    for index, basic in enumerate(synthetic_basic_results(count)):
+        result.query_results.append(manager._build_query_result(
+            index % MULTI_USER_COUNT + 1, basic['prompt'], basic, basic['response_time'],
+            datetime.fromisoformat(basic['timestamp']), basic['client_queue_time']
+        ))
+    return result
+
+
+def _latency_summary(values: List[float]) -> Dict:
+    summary = summarize_values(values)
+    return {key: summary.get(key) for key in ('mean', 'p50', 'p99', 'max')} if summary else {}
+
+
+def _live_report(count: int, seconds: float, cpu: float, mock_cpu: float, rss_delta: int,
+                 added_latencies: List[float]) -> Dict:
+    return {
+        'seconds': seconds,
+        'items_per_second': count / seconds if seconds > 0 else None,
+        'cpu_seconds_per_item': cpu / count,
+        'mock_cpu_seconds_per_item': mock_cpu / count,
+        'memory_bytes_per_item': rss_delta / count,
+        'added_latency': _latency_summary(added_latencies)
+    }
+
+
+def bench_basic_live(server: MockServerProcess, count: int, engine: str, concurrency: int) -> Dict:
+    """基礎測試管理器對零延遲服務器發送count個請求"""
+    manager = StressTestManager()
+    config = {'model': DEFAULT_MODEL, 'concurrent_requests': concurrency, 'total_requests': count,
+              'prompt': 'benchmark', 'engine': engine, 'endpoints': [server.url], 'save_history': False}
+    rss_start = _rss()
+    cpu_start, mock_cpu_start = _cpu_seconds(), server.cpu_seconds()
+    start = time.perf_counter()
+    test_id = manager.start_test(config)
+    while 'end_time' not in manager.get_test_status(test_id):
+        time.sleep(0.05)
+    seconds = time.perf_counter() - start
+    cpu, mock_cpu = _cpu_seconds() - cpu_start, server.cpu_seconds() - mock_cpu_start
+
+    status = manager.get_test_status(test_id)
+    if status['status'] != 'completed':
+        raise Exception(status.get('error') or status['status'])
+    results = manager.get_test_results(test_id)
+    # 測試結束後結果仍由管理器保存，RSS增加量即每筆結果的常駐記憶體
+    rss_delta = _rss() - rss_start
+    return _live_report(count, seconds, cpu, mock_cpu, rss_delta,
+                        [value for value in results.column('network_time') if value is not None])
+
+
+def bench_multi_user_live(server: MockServerProcess, count: int, engine: str, concurrency: int) -> Dict:
+    """多用戶測試管理器以10個用戶、無查詢間隔對零延遲服務器發送count個查詢"""
+    manager = MultiUserStressTestManager()
+    queries_per_user = max(1, count // MULTI_USER_COUNT)
+    config = {'model': DEFAULT_MODEL, 'user_count': MULTI_USER_COUNT, 'queries_per_user': queries_per_user,
+              'concurrent_limit': concurrency, 'delay_between_queries': 0, 'engine': engine,
+              'endpoints': [server.url], 'save_history': False}
+    rss_start = _rss()
+    cpu_start, mock_cpu_start = _cpu_seconds(), server.cpu_seconds()
+    start = time.perf_counter()
+    test_id = manager.start_multi_user_test(config)
+    while manager.get_test_status(test_id)['status'] not in ('completed', 'error'):
+        time.sleep(0.05)
+    seconds = time.perf_counter() - start
+    cpu, mock_cpu = _cpu_seconds() - cpu_start, server.cpu_seconds() - mock_cpu_start
+
+    status = manager.get_test_status(test_id)
+    if status['status'] != 'completed':
+        raise Exception(status.get('error') or status['status'])
+    query_results = manager.test_results[test_id].query_results
+    rss_delta = _rss() - rss_start
+    total = MULTI_USER_COUNT * queries_per_user
+    return _live_report(total, seconds, cpu, mock_cpu, rss_delta,
+                        [value for value in query_results.column('network_time') if value is not None])
+
+
+def bench_offline(name: str, count: int, database_path: str) -> Dict:
+    """以合成結果測量單一離線基準測試；memory_bytes_per_item為輸入資料每筆的記憶體"""
+    if name in ('basic_statistics', 'test_charts', 'save_test_result'):
+        # 與管理器保存的形式相同：以欄位格式保存
+        data, allocated = _allocated_bytes(lambda: RecordStore.from_records(synthetic_basic_results(count)))
+    else:
+        data, allocated = _allocated_bytes(lambda: synthetic_multi_user_result(count))
+
+    if name == 'basic_statistics':
+        operation = lambda: StressTestManager()._calculate_statistics(data)
+    elif name == 'multi_user_statistics':
+        operation = lambda: MultiUserStressTestManager()._calculate_final_statistics(data)
+    elif name == 'calculate_tpm':
+        operation = lambda: calculate_tpm(data.query_results)
+    elif name == 'test_charts':
+        from app import generate_test_charts  # 載入Flask應用程式較慢，只在需要時匯入
+        statistics = StressTestManager()._calculate_statistics(data)
+        operation = lambda: generate_test_charts(data, statistics)
+    elif name == 'multi_user_charts':
+        from app import generate_multi_user_test_charts
+        MultiUserStressTestManager()._calculate_final_statistics(data)
+        operation = lambda: generate_multi_user_test_charts(data)
+    else:
+        database = TestHistoryDatabase(database_path)
+        statistics = StressTestManager()._calculate_statistics(data)
+        # 與StressTestManager._save_test_to_database保存的內容相同
+        test_data = {
+            'test_id': f"benchmark-{count}",
+            'test_name': f"benchmark_{count}",
+            'test_type': 1,
+            'test_time': datetime.now(),
+            'model_name': DEFAULT_MODEL,
+            'hardware_info': {},
+            'test_config': {'model': DEFAULT_MODEL, 'total_requests': count},
+            'test_results': {'results': list(data), 'raw_data': list(data)},
+            'test_statistics': statistics,
+            'total_requests': statistics['total_requests'],
+            'successful_requests': statistics['successful_requests'],
+            'failed_requests': statistics['failed_requests'],
+            'avg_response_time': statistics['response_time_stats']['mean']
+        }
+        operation = lambda: database.save_test_result(test_data)
+
+    report = _measure(operation, count)
+    report['memory_bytes_per_item'] = allocated / count
+    return report
+
+
+def run_benchmarks(benchmarks: List[str], scales: List[int], engines: List[str], concurrency: int,
+                   live_max: int) -> Dict:
+    """執行基準測試並回傳報告"""
+    entries = []
+
+    def record(name: str, scale: int, engine: Optional[str], run: Callable[[], Dict]):
+        label = f"{name}[{engine}]" if engine else name
+        print(f"  {label:<28} {scale:>9} ...", end='', flush=True)
+        try:
+            measured = run()
+            print(f" {measured['items_per_second'] or 0:>12.1f} items/s")
+        except Exception as e:
+            measured = {'error': str(e)}
+            print(f" error: {e}")
+        entries.append({'benchmark': name, 'scale': scale, 'engine': engine, **measured})
+
+    live = [name for name in benchmarks if name in LIVE_BENCHMARKS]
+    live_scales = [scale for scale in scales if scale <= live_max]
+    if live and live_scales:
+        with MockServerProcess(concurrency) as server:
+            for name in live:
+                function = bench_basic_live if name == 'basic_live' else bench_multi_user_live
+                for engine in engines:
+                    for scale in live_scales:
+                        record(name, scale, engine, lambda: function(server, scale, engine, concurrency))
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_path = os.path.join(directory, 'benchmark.sqlite3')
+        for name in benchmarks:
+            if name in OFFLINE_BENCHMARKS:
+                for scale in scales:
+                    record(name, scale, None, lambda: bench_offline(name, scale, database_path))
+
+    return {
+        'created_at': datetime.now().isoformat(),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            # 統計與圖表在安裝NumPy時向量化計算，比較報告時須在相同的設定下
+            'numpy': np.__version__ if HAS_NUMPY else None,
+            'commit': _git_commit()
+        },
+        'settings': {'scales': scales, 'engines': engines, 'concurrency': concurrency, 'live_max': live_max},
+        'results': entries
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, timeout=5,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def compare_reports(report: Dict, baseline: Dict, tolerance: float = DEFAULT_TOLERANCE) -> List[Dict]:
+    """
+    比較兩份報告中相同(基準測試, 規模, 引擎)的每秒處理數
+
+    Returns:
+        每秒處理數低於基準 (1 - tolerance) 倍的項目
+    """
+    def key(entry):
+        return entry['benchmark'], entry['scale'], entry.get('engine')
+
+    previous = {key(entry): entry for entry in baseline.get('results', [])}
+    regressions = []
+    for entry in report['results']:
+        old = previous.get(key(entry))
+        if not old or not old.get('items_per_second') or not entry.get('items_per_second'):
+            continue
+        ratio = entry['items_per_second'] / old['items_per_second']
+        if ratio < 1 - tolerance:
+            regressions.append({'benchmark': entry['benchmark'], 'scale': entry['scale'],
+                                'engine': entry.get('engine'), 'ratio': ratio,
+                                'items_per_second': entry['items_per_second'],
+                                'baseline_items_per_second': old['items_per_second']})
+    return regressions
+
+
+def _parse_list(value: str) -> List[str]:
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='壓力測試工具開銷基準測試')
+    parser.add_argument('--scales', default=','.join(str(scale) for scale in DEFAULT_SCALES),
+                        help='以逗號分隔的結果數')
+    parser.add_argument('--benchmarks', default=','.join(ALL_BENCHMARKS), help='以逗號分隔的基準測試名稱')
+    parser.add_argument('--engines', default=','.join(DEFAULT_ENGINES), help='實際發送請求時使用的負載引擎')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help='實際發送請求時的並發數')
+    parser.add_argument('--live-max', type=int, default=DEFAULT_LIVE_MAX, help='實際發送請求的最大規模')
+    parser.add_argument('--output', default='benchmark_report.json', help='報告輸出路徑')
+    parser.add_argument('--baseline', help='先前的報告；每秒處理數退化超過容許比例時以非零狀態結束')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='容許的退化比例')
+    args = parser.parse_args()
+
+    benchmarks = _parse_list(args.benchmarks)
+    unknown = [name for name in benchmarks if name not in ALL_BENCHMARKS]
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(unknown)}")
+
+    # 先讀取基準報告：輸出路徑可能與基準相同
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    print("Running harness benchmarks...")
+    report = run_benchmarks(benchmarks, [int(scale) for scale in _parse_list(args.scales)],
+                            _parse_list(args.engines), args.concurrency, args.live_max)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Report written to {args.output}")
+
+    if baseline is not None:
+        regressions = compare_reports(report, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"  REGRESSION {regression['benchmark']}[{regression['engine'] or '-'}] "
+                  f"{regression['scale']}: {regression['items_per_second']:.1f} items/s "
+                  f"({regression['ratio']:.0%} of baseline)")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against baseline")
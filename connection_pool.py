@@ -0,0 +1,219 @@
+"""
+OllamaClient的連線池
+requests預設每個主機只保留10個連線：並發數超過10時，歸還的連線被丟棄、下一個請求重新建立TCP連線，
+建立連線的時間因而計入延遲。此模組依測試的並發數設定連線池大小，計算連線重用/新建/丟棄次數，
+並為每個請求記錄DNS解析、連線建立與首位元組時間 (TTFB)
+"""
+
+import socket
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+from requests.adapters import HTTPAdapter
+from urllib3 import PoolManager
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+from urllib3.util.connection import allowed_gai_family
+
+from streaming_metrics import summarize_values
+
+# requests（HTTPAdapter）預設的連線池大小
+DEFAULT_POOL_SIZE = 10
+
+# 每個請求的連線階段（秒）；新建連線時才有dns_time與connect_time
+CONNECTION_TIMING_FIELDS = (
+    'dns_time',       # 主機名稱解析
+    'connect_time',   # TCP連線（HTTPS另含TLS交握）
+    'ttfb'            # 從取得連線到收到回應標頭（含DNS與連線建立，同curl的time_starttransfer）
+)
+
+
+class ConnectionTracker:
+    """連線池的重用/新建/丟棄計數，以及每個線程最近一個請求的連線階段"""
+
+    def __init__(self, pool_size: int):
+        self.pool_size = pool_size
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.requests = 0
+        self.new_connections = 0
+        self.reused_connections = 0
+        self.discarded_connections = 0
+
+    def begin(self):
+        """在發送請求前呼叫，清除目前線程的上一筆記錄"""
+        self._local.timing = None
+
+    def record(self, reused: bool, dns_time: Optional[float], connect_time: Optional[float], ttfb: float):
+        with self._lock:
+            self.requests += 1
+            if reused:
+                self.reused_connections += 1
+            else:
+                self.new_connections += 1
+        self._local.timing = {
+            'connection_reused': reused,
+            'dns_time': dns_time,
+            'connect_time': connect_time,
+            'ttfb': ttfb
+        }
+
+    def record_discard(self):
+        with self._lock:
+            self.discarded_connections += 1
+
+    def last_request(self) -> Dict:
+        """目前線程最近一個請求的連線階段；請求在取得回應前失敗時為空字典"""
+        return getattr(self._local, 'timing', None) or {}
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                'pool_size': self.pool_size,
+                'requests': self.requests,
+                'new_connections': self.new_connections,
+                'reused_connections': self.reused_connections,
+                'discarded_connections': self.discarded_connections
+            }
+
+
+class _TimedConnectionMixin:
+    """建立連線時分別記錄DNS解析與連線耗時"""
+
+    dns_time: Optional[float] = None
+    connect_time: Optional[float] = None
+
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        self.connect_time = time.perf_counter() - start - (self.dns_time or 0.0)
+
+    def _new_conn(self):
+        # 先自行解析，再依序連線到解析出的位址（與urllib3相同，例如localhost的IPv6失敗時改用IPv4）
+        host = self._dns_host
+        start = time.perf_counter()
+        try:
+            addresses = list(dict.fromkeys(
+                info[4][0] for info in socket.getaddrinfo(host, self.port, allowed_gai_family(), socket.SOCK_STREAM)
+            ))
+        except socket.gaierror:
+            return super()._new_conn()  # 由urllib3轉換為NameResolutionError
+        self.dns_time = time.perf_counter() - start
+
+        try:
+            for index, address in enumerate(addresses):
+                self._dns_host = address
+                try:
+                    return super()._new_conn()
+                except NewConnectionError:
+                    if index == len(addresses) - 1:
+                        raise
+        finally:
+            self._dns_host = host
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _TrackedPoolMixin:
+    """記錄每個請求是否重用連線與其連線階段，並計算因連線池已滿而丟棄的連線"""
+
+    tracker: ConnectionTracker = None
+
+    def _make_request(self, conn, *args, **kwargs):
+        reused = conn.sock is not None
+        conn.dns_time = conn.connect_time = None
+        start = time.perf_counter()
+        response = super()._make_request(conn, *args, **kwargs)
+        self.tracker.record(reused, conn.dns_time, conn.connect_time, time.perf_counter() - start)
+        return response
+
+    def _put_conn(self, conn):
+        if conn is not None and self.pool is not None and self.pool.full():
+            self.tracker.record_discard()
+        super()._put_conn(conn)
+
+
+class _TrackedHTTPConnectionPool(_TrackedPoolMixin, HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TrackedHTTPSConnectionPool(_TrackedPoolMixin, HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TrackedPoolManager(PoolManager):
+    def __init__(self, tracker: ConnectionTracker, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tracker = tracker
+        self.pool_classes_by_scheme = {'http': _TrackedHTTPConnectionPool, 'https': _TrackedHTTPSConnectionPool}
+
+    def _new_pool(self, scheme, host, port, request_context=None):
+        pool = super()._new_pool(scheme, host, port, request_context)
+        pool.tracker = self.tracker
+        return pool
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """每個主機保留pool_size個連線的HTTPAdapter，並以ConnectionTracker記錄連線使用情況"""
+
+    def __init__(self, pool_size: int = DEFAULT_POOL_SIZE):
+        self.tracker = ConnectionTracker(pool_size)
+        super().__init__(pool_maxsize=pool_size)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        self._pool_connections = connections
+        self._pool_maxsize = maxsize
+        self._pool_block = block
+        self.poolmanager = _TrackedPoolManager(self.tracker, num_pools=connections, maxsize=maxsize,
+                                               block=block, **pool_kwargs)
+
+
+def aggregate_connection_timing(items: Iterable[Dict]) -> Dict:
+    """
+    彙總帶有連線階段的請求結果
+
+    Returns:
+        新建/重用連線數、重用率與各連線階段的分布；沒有任何請求記錄連線階段時為空字典
+    """
+    reused = new = 0
+    values = {field: [] for field in CONNECTION_TIMING_FIELDS}
+    for item in items:
+        connection_reused = item.get('connection_reused')
+        if connection_reused is None:
+            continue
+        if connection_reused:
+            reused += 1
+        else:
+            new += 1
+        for field in CONNECTION_TIMING_FIELDS:
+            value = item.get(field)
+            if value is not None:
+                values[field].append(value)
+
+    return connection_timing_summary(reused, new, {field: summarize_values(field_values)
+                                                   for field, field_values in values.items() if field_values})
+
+
+def connection_timing_summary(reused: int, new: int, stage_summaries: Dict[str, Dict]) -> Dict:
+    """
+    由連線數與各連線階段的分布產生連線統計（也用於向量化計算的結果）
+
+    Args:
+        stage_summaries: CONNECTION_TIMING_FIELDS中有數值的欄位 -> 該階段的摘要統計
+    """
+    if not reused + new:
+        return {}
+    return {
+        'new_connections': new,
+        'reused_connections': reused,
+        'reuse_rate': reused / (reused + new) * 100,
+        **stage_summaries
+    }
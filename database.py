@@ -34,7 +34,7 @@ class TestHistoryDatabase:
                         id INTEGER PRIMARY KEY AUTOINCREMENT,
                         test_id TEXT UNIQUE NOT NULL,
                         test_name TEXT NOT NULL,
-                        test_type INTEGER NOT NULL,  -- 1: 基礎壓力測試, 2: 多用戶並發測試
+                        test_type INTEGER NOT NULL,  -- 1: 基礎壓力測試, 2: 多用戶並發測試, 3: 容量搜尋
                         test_time TIMESTAMP NOT NULL,
                         model_name TEXT NOT NULL,
                         hardware_info TEXT NOT NULL,  -- JSON格式的硬體資訊
@@ -47,15 +47,28 @@ class TestHistoryDatabase:
                         failed_requests INTEGER,     -- 失敗請求數
                         avg_response_time REAL,      -- 平均回應時間
                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        parent_test_id TEXT,         -- 所屬容量搜尋的test_id（單次測試為NULL）
+                        p99_response_time REAL,      -- 回應時間p99（由延遲直方圖計算）
+                        p999_response_time REAL      -- 回應時間p99.9
                     )
                 ''')
                 
+                # 舊資料庫缺少後來新增的欄位時補上
+                cursor.execute('PRAGMA table_info(test_history)')
+                columns = [row[1] for row in cursor.fetchall()]
+                for column, column_type in (('parent_test_id', 'TEXT'),
+                                            ('p99_response_time', 'REAL'),
+                                            ('p999_response_time', 'REAL')):
+                    if column not in columns:
+                        cursor.execute(f'ALTER TABLE test_history ADD COLUMN {column} {column_type}')
+                
                 # 創建索引以提高查詢效能
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_test_time ON test_history(test_time)')
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_test_type ON test_history(test_type)')
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_model_name ON test_history(model_name)')
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_test_id ON test_history(test_id)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_parent_test_id ON test_history(parent_test_id)')
                 
                 conn.commit()
                 logger.info(f"Database initialized successfully at {self.db_path}")
@@ -95,6 +108,9 @@ class TestHistoryDatabase:
                 successful_requests = test_data.get('successful_requests', 0)
                 failed_requests = test_data.get('failed_requests', 0)
                 avg_response_time = test_data.get('avg_response_time', 0)
+                parent_test_id = test_data.get('parent_test_id')
+                p99_response_time = test_data.get('p99_response_time')
+                p999_response_time = test_data.get('p999_response_time')
                 
                 # 插入資料
                 cursor.execute('''
@@ -102,12 +118,13 @@ class TestHistoryDatabase:
                     (test_id, test_name, test_type, test_time, model_name, hardware_info, 
                      test_config, test_results, test_statistics, duration_seconds, 
                      total_requests, successful_requests, failed_requests, avg_response_time,
-                     updated_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                     parent_test_id, p99_response_time, p999_response_time, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
                 ''', (
                     test_id, test_name, test_type, test_time, model_name, hardware_info,
                     test_config, test_results, test_statistics, duration_seconds,
-                    total_requests, successful_requests, failed_requests, avg_response_time
+                    total_requests, successful_requests, failed_requests, avg_response_time,
+                    parent_test_id, p99_response_time, p999_response_time
                 ))
                 
                 conn.commit()
@@ -127,7 +144,7 @@ class TestHistoryDatabase:
         Args:
             limit: 限制返回記錄數
             offset: 偏移量
-            test_type: 測試類型篩選 (1 或 2)
+            test_type: 測試類型篩選 (1、2 或 3)
             model_name: 模型名稱篩選
             
         Returns:
@@ -158,7 +175,8 @@ class TestHistoryDatabase:
                 query = f'''
                     SELECT id, test_id, test_name, test_type, test_time, model_name,
                            duration_seconds, total_requests, successful_requests, 
-                           failed_requests, avg_response_time, created_at
+                           failed_requests, avg_response_time, parent_test_id,
+                           p99_response_time, p999_response_time, created_at
                     FROM test_history 
                     {where_clause}
                     ORDER BY test_time DESC 
@@ -210,6 +228,42 @@ class TestHistoryDatabase:
             logger.error(f"Failed to get test detail: {e}")
             return None
     
+    def get_child_tests(self, parent_test_id: str) -> List[Dict[str, Any]]:
+        """
+        獲取屬於某次容量搜尋的各步驟測試記錄
+        
+        Args:
+            parent_test_id: 容量搜尋的測試ID
+            
+        Returns:
+            List[Dict]: 依測試時間排序的步驟記錄（不含完整結果）
+        """
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.row_factory = sqlite3.Row
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    SELECT test_id, test_name, test_type, test_time, model_name, test_config,
+                           test_statistics, duration_seconds, total_requests, successful_requests,
+                           failed_requests, avg_response_time, parent_test_id
+                    FROM test_history
+                    WHERE parent_test_id = ?
+                    ORDER BY test_time ASC
+                ''', (parent_test_id,))
+                
+                records = []
+                for row in cursor.fetchall():
+                    record = dict(row)
+                    record['test_config'] = json.loads(record['test_config'])
+                    record['test_statistics'] = json.loads(record['test_statistics']) if record['test_statistics'] else {}
+                    records.append(record)
+                return records
+                
+        except Exception as e:
+            logger.error(f"Failed to get child tests: {e}")
+            return []
+    
     def delete_test_record(self, test_id: str) -> bool:
         """
         刪除測試記錄
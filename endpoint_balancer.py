@@ -0,0 +1,146 @@
+"""
+多端點負載平衡
+把請求分散到數個Ollama端點（輪流、最少進行中請求、或依用戶編號的一致性雜湊），
+並提供各端點統計的共用格式，讓端點之間的不平衡可以在圖表與歷史記錄中比較
+"""
+
+import bisect
+import hashlib
+import threading
+from typing import Dict, Iterable, List, Optional, Union
+
+from latency_histogram import LatencyHistogram
+
+DEFAULT_ENDPOINT = "http://localhost:11434"
+
+BALANCE_ROUND_ROBIN = 'round_robin'
+BALANCE_LEAST_OUTSTANDING = 'least_outstanding'
+BALANCE_CONSISTENT_HASH = 'consistent_hash'
+BALANCE_STRATEGIES = (BALANCE_ROUND_ROBIN, BALANCE_LEAST_OUTSTANDING, BALANCE_CONSISTENT_HASH)
+
+# 每個端點在雜湊環上的虛擬節點數；越多則各端點分到的鍵越平均
+HASH_REPLICAS = 100
+
+
+def normalize_endpoints(endpoints: Union[None, str, Iterable[str]]) -> List[str]:
+    """
+    整理端點列表：接受列表或以逗號/空白分隔的字串，去除結尾的斜線與重複的端點
+
+    Returns:
+        至少一個端點；未設定時為本機的Ollama
+    """
+    if endpoints is None:
+        endpoints = []
+    elif isinstance(endpoints, str):
+        endpoints = endpoints.replace(',', ' ').split()
+
+    normalized = []
+    for endpoint in endpoints:
+        endpoint = str(endpoint).strip().rstrip('/')
+        if endpoint and endpoint not in normalized:
+            normalized.append(endpoint)
+    return normalized or [DEFAULT_ENDPOINT]
+
+
+def validate_balance_strategy(strategy: str):
+    if strategy not in BALANCE_STRATEGIES:
+        raise ValueError(f"Unsupported balance strategy: {strategy}")
+
+
+def _hash(key: str) -> int:
+    return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+
+class EndpointBalancer:
+    """線程安全的端點選擇器；每次請求以acquire()取得端點，完成後以release()歸還"""
+
+    def __init__(self, endpoints: List[str], strategy: str = BALANCE_ROUND_ROBIN):
+        """
+        Args:
+            endpoints: 端點URL（已整理過，見normalize_endpoints）
+            strategy: BALANCE_ROUND_ROBIN、BALANCE_LEAST_OUTSTANDING 或 BALANCE_CONSISTENT_HASH
+        """
+        validate_balance_strategy(strategy)
+        if not endpoints:
+            raise ValueError("At least one endpoint is required")
+        self.endpoints = list(endpoints)
+        self.strategy = strategy
+        self.lock = threading.Lock()
+        self._next = 0
+        self._outstanding: Dict[str, int] = {endpoint: 0 for endpoint in self.endpoints}
+
+        # 一致性雜湊環：增減端點時只有相鄰區段的鍵改變端點
+        ring = sorted((_hash(f"{endpoint}#{replica}"), endpoint)
+                      for endpoint in self.endpoints for replica in range(HASH_REPLICAS))
+        self._ring_hashes = [point for point, _ in ring]
+        self._ring_endpoints = [endpoint for _, endpoint in ring]
+
+    def acquire(self, key: Optional[str] = None) -> str:
+        """
+        選擇這次請求的端點並計入進行中請求數
+
+        Args:
+            key: 一致性雜湊的鍵（例如用戶編號）；同一個鍵總是對應同一個端點。
+                其他策略忽略此參數
+        """
+        with self.lock:
+            if self.strategy == BALANCE_CONSISTENT_HASH:
+                if key is None:
+                    raise ValueError("consistent_hash balancing requires a routing key")
+                position = bisect.bisect(self._ring_hashes, _hash(str(key))) % len(self._ring_hashes)
+                endpoint = self._ring_endpoints[position]
+            elif self.strategy == BALANCE_LEAST_OUTSTANDING:
+                # 進行中請求數相同時從上次之後輪流，避免總是選到第一個端點
+                count = len(self.endpoints)
+                candidates = [self.endpoints[(self._next + i) % count] for i in range(count)]
+                endpoint = min(candidates, key=self._outstanding.__getitem__)
+                self._next = (self.endpoints.index(endpoint) + 1) % count
+            else:
+                endpoint = self.endpoints[self._next]
+                self._next = (self._next + 1) % len(self.endpoints)
+            self._outstanding[endpoint] += 1
+            return endpoint
+
+    def release(self, endpoint: str):
+        with self.lock:
+            self._outstanding[endpoint] -= 1
+
+    def outstanding(self) -> Dict[str, int]:
+        """各端點目前進行中的請求數"""
+        with self.lock:
+            return dict(self._outstanding)
+
+
+def endpoint_summary(endpoint: str, successful: int, failed: int, response_time_sum: float,
+                     output_tokens: int, histogram: LatencyHistogram, wall_clock_seconds: float,
+                     total_requests: int) -> Dict:
+    """
+    單一端點的統計（基礎測試與多用戶測試共用的格式）
+
+    Args:
+        wall_clock_seconds: 整個測試的測量時間；各端點以相同的時間計算吞吐量，才能直接比較
+        total_requests: 所有端點合計的請求數，用於計算此端點分到的比例
+    """
+    requests_count = successful + failed
+    elapsed = max(wall_clock_seconds, 0.0)
+    return {
+        'endpoint': endpoint,
+        'requests': requests_count,
+        'successful': successful,
+        'failed': failed,
+        'share': requests_count / total_requests * 100 if total_requests else 0.0,
+        'average_response_time': response_time_sum / successful if successful else 0.0,
+        'latency_percentiles': histogram.summary(),
+        'output_tokens': output_tokens,
+        'requests_per_second': successful / elapsed if elapsed > 0 else 0.0,
+        'output_tokens_per_second': output_tokens / elapsed if elapsed > 0 else 0.0
+    }
+
+
+def endpoint_options(config: Dict) -> Dict:
+    """
+    由測試配置取得端點設定（endpoints、balance_strategy），可直接作為客戶端與負載引擎的關鍵字參數
+    """
+    strategy = config.get('balance_strategy') or BALANCE_ROUND_ROBIN
+    validate_balance_strategy(strategy)
+    return {'endpoints': normalize_endpoints(config.get('endpoints')), 'balance_strategy': strategy}
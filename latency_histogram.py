@@ -0,0 +1,132 @@
+"""
+對數分桶延遲直方圖（HDR風格）
+以固定的相對精度把延遲分到對數間距的桶中，記憶體用量與樣本數無關；
+直方圖可在線程或行程之間合併，並可序列化後存入歷史記錄
+"""
+
+import math
+from typing import Dict, List, Optional, Tuple
+
+# 可記錄的最小值（秒），更小的值計入第一個桶
+MIN_VALUE = 1e-6
+
+# 相鄰桶邊界的比例；以桶的幾何中點代表桶內數值，相對誤差不超過約1%
+BUCKET_RATIO = 1.02
+
+# 最大桶編號（約對應 MIN_VALUE * BUCKET_RATIO**1200 ≈ 2萬秒），更大的值計入最後一個桶
+MAX_BUCKET = 1200
+
+# 預設回報的百分位數
+DEFAULT_PERCENTILES = (50, 90, 99, 99.9)
+
+_LOG_RATIO = math.log(BUCKET_RATIO)
+
+
+def percentile_key(p: float) -> str:
+    """百分位數的欄位名稱，例如 50 -> 'p50'、99.9 -> 'p999'"""
+    return 'p' + f"{p:g}".replace('.', '')
+
+
+class LatencyHistogram:
+    """固定記憶體的延遲直方圖"""
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}  # 桶編號 -> 樣本數（只記錄非空桶，最多 MAX_BUCKET + 1 個）
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    @staticmethod
+    def bucket_index(value: float) -> int:
+        if value <= MIN_VALUE:
+            return 0
+        return min(MAX_BUCKET, int(math.log(value / MIN_VALUE) / _LOG_RATIO))
+
+    @staticmethod
+    def bucket_bounds(index: int) -> Tuple[float, float]:
+        """桶的下界與上界"""
+        lower = MIN_VALUE * BUCKET_RATIO ** index
+        return lower, lower * BUCKET_RATIO
+
+    def record(self, value: float):
+        """記錄一個樣本"""
+        index = self.bucket_index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other: 'LatencyHistogram') -> 'LatencyHistogram':
+        """把另一個直方圖的樣本合併進來，回傳自己"""
+        # 先複製桶列表：來源可能是仍在其他線程記錄中的分片
+        for index, count in list(other.counts.items()):
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+        return self
+
+    def percentile(self, p: float) -> float:
+        """第p百分位數（以桶的幾何中點表示，並限制在實際最小值與最大值之間）"""
+        if self.count == 0:
+            return 0.0
+        rank = max(1, math.ceil(p / 100 * self.count))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                lower, upper = self.bucket_bounds(index)
+                return min(self.max, max(self.min, math.sqrt(lower * upper)))
+        return self.max
+
+    def summary(self, percentiles=DEFAULT_PERCENTILES) -> Dict:
+        """樣本數、平均值、最小/最大值與各百分位數"""
+        if self.count == 0:
+            return {}
+        summary = {
+            'count': self.count,
+            'mean': self.total / self.count,
+            'min': self.min,
+            'max': self.max
+        }
+        for p in percentiles:
+            summary[percentile_key(p)] = self.percentile(p)
+        return summary
+
+    def buckets(self) -> List[Tuple[float, float, int]]:
+        """非空桶的 (下界, 上界, 樣本數)，依數值排序"""
+        return [(*self.bucket_bounds(index), self.counts[index]) for index in sorted(self.counts)]
+
+    def to_dict(self) -> Dict:
+        """可JSON序列化的表示（桶編號轉為字串）"""
+        return {
+            'min_value': MIN_VALUE,
+            'bucket_ratio': BUCKET_RATIO,
+            'count': self.count,
+            'total': self.total,
+            'min': self.min,
+            'max': self.max,
+            'counts': {str(index): count for index, count in sorted(self.counts.items())}
+        }
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict]) -> 'LatencyHistogram':
+        """由 to_dict() 的結果還原；資料為空時回傳空的直方圖"""
+        histogram = cls()
+        if not data:
+            return histogram
+        if data.get('min_value') != MIN_VALUE or data.get('bucket_ratio') != BUCKET_RATIO:
+            raise ValueError("Histogram was recorded with a different bucket layout")
+        histogram.counts = {int(index): count for index, count in data.get('counts', {}).items()}
+        histogram.count = data.get('count', 0)
+        histogram.total = data.get('total', 0.0)
+        histogram.min = data.get('min')
+        histogram.max = data.get('max')
+        return histogram
@@ -0,0 +1,211 @@
+"""
+負載代理
+在產生負載的機器上執行（也可在同一台機器上以不同埠啟動多個代理）：
+
+    python load_agent.py --port 5101
+
+預設只監聽127.0.0.1；要讓其他機器連線時需以 --token（或環境變數LOAD_AGENT_TOKEN）設定共用權杖，
+主控端以相同的環境變數在請求標頭帶上權杖。
+
+代理接收Flask應用程式送來的測試計畫，在協調好的開始時間以本機的測試管理器執行，
+並回報累計計數、延遲直方圖與吞吐量時間桶供主控端合併；結果不寫入代理本機的歷史記錄
+"""
+
+import argparse
+import hmac
+import os
+import socket
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+from flask import Flask, jsonify, request
+
+from agent_coordinator import (
+    AGENT_TOKEN_ENV, AGENT_TOKEN_HEADER, FINISHED_STATUSES, PLAN_BASIC, PLAN_MULTI_USER
+)
+from multi_user_stress_test import MultiUserStressTestManager
+from stress_test_simple import StressTestManager
+
+app = Flask(__name__)
+# 共用權杖；None表示不驗證（只應在僅監聽本機位址時使用）
+app.config['AGENT_TOKEN'] = os.environ.get(AGENT_TOKEN_ENV) or None
+
+stress_test_manager = StressTestManager()
+multi_user_manager = MultiUserStressTestManager()
+
+# 計畫編號 -> 計畫（kind、config、start_at、stop_event、status、test_id、error、finished_at）
+plans: Dict[str, Dict] = {}
+plans_lock = threading.Lock()
+
+# 本機測試結束後計畫保留的秒數（主控端在此期間取得最終數據），逾時後移除
+PLAN_TTL = 600
+
+# 檢查本機測試是否結束的間隔（秒）
+PLAN_CHECK_INTERVAL = 1.0
+
+LOOPBACK_HOSTS = ('127.0.0.1', 'localhost', '::1')
+
+
+def _start_local_test(kind: str, config: Dict) -> str:
+    config = {**config, 'save_history': False}
+    if kind == PLAN_MULTI_USER:
+        return multi_user_manager.start_multi_user_test(config)
+    return stress_test_manager.start_test(config)
+
+
+def _stop_local_test(kind: str, test_id: str):
+    if kind == PLAN_MULTI_USER:
+        multi_user_manager.stop_test(test_id)
+    else:
+        stress_test_manager.stop_test(test_id)
+
+
+def _local_test_finished(kind: str, test_id: str) -> bool:
+    manager = multi_user_manager if kind == PLAN_MULTI_USER else stress_test_manager
+    status = manager.get_test_status(test_id)
+    if status is None:
+        return True
+    if kind == PLAN_MULTI_USER:
+        return status['status'] in FINISHED_STATUSES
+    return 'end_time' in status
+
+
+def _finish_plan(plan: Dict, status: str, error: Optional[str] = None):
+    with plans_lock:
+        plan['status'] = status
+        plan['error'] = error
+        plan['finished_at'] = time.time()
+
+
+def _prune_plans():
+    """移除本機測試已結束超過PLAN_TTL秒的計畫"""
+    cutoff = time.time() - PLAN_TTL
+    with plans_lock:
+        expired = [plan_id for plan_id, plan in plans.items()
+                   if plan['finished_at'] is not None and plan['finished_at'] < cutoff]
+        for plan_id in expired:
+            del plans[plan_id]
+
+
+def _run_plan(plan: Dict):
+    """等到開始時間後以本機的測試管理器執行計畫，並記錄本機測試的結束時間"""
+    # 開始前收到停止請求則不執行
+    if plan['stop_event'].wait(max(0.0, plan['start_at'] - time.time())):
+        _finish_plan(plan, 'completed')
+        return
+
+    try:
+        test_id = _start_local_test(plan['kind'], plan['config'])
+    except Exception as e:
+        _finish_plan(plan, 'error', str(e))
+        return
+
+    with plans_lock:
+        plan['test_id'] = test_id
+        plan['status'] = 'running'
+    if plan['stop_event'].is_set():
+        _stop_local_test(plan['kind'], test_id)
+
+    # 回報的狀態來自本機測試管理器；這裡只記下結束時間供清除過期計畫
+    while not _local_test_finished(plan['kind'], test_id):
+        time.sleep(PLAN_CHECK_INTERVAL)
+    with plans_lock:
+        plan['finished_at'] = time.time()
+
+
+@app.before_request
+def check_token():
+    """設定了共用權杖時，所有請求都必須在標頭帶上相同的權杖"""
+    token = app.config['AGENT_TOKEN']
+    if token is None:
+        return None
+    provided = request.headers.get(AGENT_TOKEN_HEADER, '')
+    if not hmac.compare_digest(provided.encode(), token.encode()):
+        return jsonify({'error': 'Invalid or missing agent token'}), 401
+    return None
+
+
+@app.route('/api/agent/health')
+def agent_health():
+    """代理資訊與目前時間（主控端以此估計時鐘差）"""
+    return jsonify({'status': 'ok', 'hostname': socket.gethostname(), 'time': time.time()})
+
+
+@app.route('/api/agent/plans', methods=['POST'])
+def submit_plan():
+    """接收測試計畫"""
+    data = request.json or {}
+    for field in ('plan_id', 'kind', 'config', 'start_at'):
+        if field not in data:
+            return jsonify({'error': f'Missing required field: {field}'}), 400
+    if data['kind'] not in (PLAN_BASIC, PLAN_MULTI_USER):
+        return jsonify({'error': f"Unsupported plan kind: {data['kind']}"}), 400
+
+    _prune_plans()
+    plan = {
+        'kind': data['kind'],
+        'config': data['config'],
+        'start_at': float(data['start_at']),
+        'stop_event': threading.Event(),
+        'status': 'scheduled',
+        'test_id': None,
+        'error': None,
+        'finished_at': None
+    }
+    with plans_lock:
+        if data['plan_id'] in plans:
+            return jsonify({'error': 'Plan already exists'}), 409
+        plans[data['plan_id']] = plan
+    threading.Thread(target=_run_plan, args=(plan,), daemon=True).start()
+    return jsonify({'plan_id': data['plan_id'], 'status': 'scheduled'})
+
+
+@app.route('/api/agent/plans/<plan_id>')
+def plan_status(plan_id):
+    """計畫的累計數據；測試開始前只有狀態"""
+    with plans_lock:
+        plan = plans.get(plan_id)
+        if plan is None:
+            return jsonify({'error': 'Plan not found'}), 404
+        status = {'plan_id': plan_id, 'status': plan['status'], 'error': plan['error']}
+        test_id = plan['test_id']
+        kind = plan['kind']
+
+    if test_id is not None:
+        manager = multi_user_manager if kind == PLAN_MULTI_USER else stress_test_manager
+        aggregates = manager.get_test_aggregates(test_id)
+        if aggregates is not None:
+            status.update(aggregates)
+    return jsonify(status)
+
+
+@app.route('/api/agent/plans/<plan_id>/stop', methods=['POST'])
+def stop_plan(plan_id):
+    with plans_lock:
+        plan = plans.get(plan_id)
+        if plan is None:
+            return jsonify({'error': 'Plan not found'}), 404
+        plan['stop_event'].set()
+        test_id = plan['test_id']
+    if test_id is not None:
+        _stop_local_test(plan['kind'], test_id)
+    return jsonify({'success': True})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Ollama壓力測試負載代理')
+    parser.add_argument('--host', default='127.0.0.1', help='監聽位址（非本機位址需設定共用權杖）')
+    parser.add_argument('--port', type=int, default=5101, help='監聽埠')
+    parser.add_argument('--token', default=None, help=f'共用權杖（預設讀取環境變數{AGENT_TOKEN_ENV}）')
+    args = parser.parse_args()
+
+    if args.token:
+        app.config['AGENT_TOKEN'] = args.token
+    if args.host not in LOOPBACK_HOSTS and app.config['AGENT_TOKEN'] is None:
+        print(f"Refusing to listen on {args.host} without a shared token (use --token or {AGENT_TOKEN_ENV})")
+        sys.exit(1)
+
+    print(f"Starting load agent on {args.host}:{args.port}...")
+    app.run(host=args.host, port=args.port, threaded=True)
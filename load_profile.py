@@ -0,0 +1,126 @@
+"""
+負載曲線(load profile)
+定義基礎壓力測試在不同時間點的目標並發數：線性爬升(ramp)、階梯(step)與突發(spike)
+"""
+
+import math
+from typing import Dict, List, Optional, Sequence
+
+from streaming_metrics import percentile, summarize_values
+
+PROFILE_RAMP = 'ramp'    # {'start': 1, 'end': N, 'duration': T}：T秒內由start線性增加到end
+PROFILE_STEP = 'step'    # {'steps': [[秒, 並發數], ...]}：到達各時間點後切換到該並發數
+PROFILE_SPIKE = 'spike'  # {'base': B, 'peak': P, 'at': t, 'duration': d}：第t秒起d秒內提高到P
+SUPPORTED_PROFILES = (PROFILE_RAMP, PROFILE_STEP, PROFILE_SPIKE)
+
+# 突發後延遲回到基準值的判定：連續RECOVERY_WINDOW個請求的中位數不超過基準的RECOVERY_TOLERANCE倍
+RECOVERY_WINDOW = 5
+RECOVERY_TOLERANCE = 1.2
+
+
+def validate_load_profile(profile: Dict):
+    """檢查負載曲線設定，不合法時拋出ValueError"""
+    profile_type = profile.get('type')
+    if profile_type not in SUPPORTED_PROFILES:
+        raise ValueError(f"Unsupported load profile: {profile_type}")
+
+    if profile_type == PROFILE_RAMP:
+        if int(profile.get('start', 1)) < 1 or int(profile.get('end', 0)) < 1:
+            raise ValueError("ramp start and end must be at least 1")
+        if float(profile.get('duration', 0)) <= 0:
+            raise ValueError("ramp duration must be greater than 0")
+    elif profile_type == PROFILE_STEP:
+        steps = profile.get('steps')
+        if not steps:
+            raise ValueError("step profile requires steps")
+        if any(int(concurrency) < 1 for _, concurrency in steps):
+            raise ValueError("step concurrency must be at least 1")
+    elif profile_type == PROFILE_SPIKE:
+        if int(profile.get('base', 0)) < 1 or int(profile.get('peak', 0)) < 1:
+            raise ValueError("spike base and peak must be at least 1")
+        if float(profile.get('duration', 0)) <= 0:
+            raise ValueError("spike duration must be greater than 0")
+
+
+def target_concurrency(profile: Dict, elapsed: float) -> int:
+    """取得測試開始後第elapsed秒的目標並發數"""
+    profile_type = profile['type']
+
+    if profile_type == PROFILE_RAMP:
+        start, end = int(profile.get('start', 1)), int(profile['end'])
+        progress = min(1.0, max(0.0, elapsed / float(profile['duration'])))
+        return max(1, math.floor(start + (end - start) * progress))
+
+    if profile_type == PROFILE_STEP:
+        current = None
+        for at, concurrency in sorted(profile['steps']):
+            if elapsed >= at or current is None:
+                current = int(concurrency)
+        return current
+
+    spike_start = float(profile.get('at', 0))
+    if spike_start <= elapsed < spike_start + float(profile['duration']):
+        return int(profile['peak'])
+    return int(profile['base'])
+
+
+def max_concurrency(profile: Dict) -> int:
+    """負載曲線中的最大並發數（用來決定工作線程/協程數量）"""
+    profile_type = profile['type']
+    if profile_type == PROFILE_RAMP:
+        return max(int(profile.get('start', 1)), int(profile['end']))
+    if profile_type == PROFILE_STEP:
+        return max(int(concurrency) for _, concurrency in profile['steps'])
+    return max(int(profile['base']), int(profile['peak']))
+
+
+def spike_recovery_time(profile: Dict, results: Sequence[Dict]) -> Optional[float]:
+    """
+    計算突發結束後延遲回到突發前水準所需的秒數
+
+    Args:
+        profile: spike負載曲線
+        results: 含有elapsed與response_time的成功請求
+
+    Returns:
+        秒數；缺少突發前的基準請求或測試結束前未恢復時回傳None
+    """
+    spike_start = float(profile.get('at', 0))
+    spike_end = spike_start + float(profile['duration'])
+    ordered = sorted(results, key=lambda r: r['elapsed'])
+
+    baseline = sorted(r['response_time'] for r in ordered if r['elapsed'] < spike_start)
+    if not baseline:
+        return None
+    threshold = percentile(baseline, 50) * RECOVERY_TOLERANCE
+
+    after = [r for r in ordered if r['elapsed'] >= spike_end]
+    for i in range(len(after) - RECOVERY_WINDOW + 1):
+        window = sorted(r['response_time'] for r in after[i:i + RECOVERY_WINDOW])
+        if percentile(window, 50) <= threshold:
+            return after[i]['elapsed'] - spike_end
+    return None
+
+
+def profile_statistics(profile: Dict, results: Sequence[Dict]) -> Dict:
+    """
+    彙總負載曲線測試：各目標並發數下的延遲分布，spike另計恢復時間
+
+    Args:
+        profile: 負載曲線
+        results: 成功請求，需含target_concurrency、elapsed與response_time
+    """
+    by_target: Dict[int, List[float]] = {}
+    for r in results:
+        by_target.setdefault(r['target_concurrency'], []).append(r['response_time'])
+
+    stats = {
+        'type': profile['type'],
+        'max_concurrency': max_concurrency(profile),
+        'by_target_concurrency': {
+            str(target): summarize_values(times) for target, times in sorted(by_target.items())
+        }
+    }
+    if profile['type'] == PROFILE_SPIKE:
+        stats['spike_recovery_time'] = spike_recovery_time(profile, results)
+    return stats
@@ -0,0 +1,492 @@
+"""
+模擬Ollama服務器
+不需要模型即可行為近似Ollama的本機服務，用於離線、可重現地調校與測試負載引擎：
+
+    python mock_ollama_server.py --port 11434 --parallel 4 --decode-rate 50
+
+支援 /api/tags、/api/generate、/api/chat、/api/show、/api/ps 與OpenAI相容的 /v1/chat/completions。
+模擬的行為：
+- 平行槽位數（同OLLAMA_NUM_PARALLEL）：超過的請求排隊，排隊超過上限時回傳503（同OLLAMA_MAX_QUEUE）
+- 模型首次使用時的載入時間
+- 每個輸入Token的預填充成本與每個輸出Token的解碼速度；可設定同時生成的請求越多，每個請求解碼越慢
+- 流式回應逐Token送出，最終回應帶有與Ollama相同的Token數量與耗時欄位（奈秒）
+- 依機率注入錯誤（HTTP 500）；設定seed時注入的序列可重現
+
+也可在同一個行程中啟動（例如測試或基準測試）：
+
+    with MockServerThread(MockOllamaConfig(parallel=2)) as server:
+        client = OllamaClient(server.url)
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional
+
+from flask import Flask, Response, jsonify, request
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from server_metrics import NS_PER_SECOND
+
+DEFAULT_MODEL = 'mock:latest'
+MOCK_VERSION = '0.0.0-mock'
+
+# 輸出文字的詞彙；每個Token一個詞（後接空白），以空白分詞粗估的Token數與eval_count相同
+_WORDS = ('lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit')
+
+# 估計輸入Token數：ASCII字元每4個算一個Token，其他字元（例如中文）每個算一個
+_ASCII_CHARS_PER_TOKEN = 4
+# 對話範本為每則訊息增加的Token數
+_TOKENS_PER_MESSAGE = 4
+
+
+@dataclass
+class MockOllamaConfig:
+    """模擬服務器的行為參數"""
+    models: List[str] = field(default_factory=lambda: [DEFAULT_MODEL])
+    parallel: int = 4                        # 同時生成的請求數（槽位）
+    max_queue: int = 512                     # 等待槽位的請求上限；超過時回傳503
+    prefill_tokens_per_second: float = 2000.0  # 預填充速度（輸入Token/秒）
+    decode_tokens_per_second: float = 50.0     # 單一請求的解碼速度（輸出Token/秒）
+    decode_slowdown: float = 0.0             # 每多一個同時生成的請求，每個Token的解碼時間增加的比例
+    output_tokens: int = 64                  # 每個回應的輸出Token數（請求的num_predict/max_tokens可覆蓋）
+    load_seconds: float = 0.0                # 模型首次使用時的載入時間
+    error_rate: float = 0.0                  # 注入錯誤的機率 (0-1)
+    seed: Optional[int] = None               # 錯誤注入的亂數種子
+
+    def __post_init__(self):
+        if not self.models:
+            raise ValueError("At least one model is required")
+        if self.parallel < 1:
+            raise ValueError("parallel must be at least 1")
+        if self.max_queue < 0:
+            raise ValueError("max_queue must not be negative")
+        if self.prefill_tokens_per_second <= 0 or self.decode_tokens_per_second <= 0:
+            raise ValueError("Token rates must be greater than 0")
+        if self.decode_slowdown < 0:
+            raise ValueError("decode_slowdown must not be negative")
+        if self.output_tokens < 1:
+            raise ValueError("output_tokens must be at least 1")
+        if self.load_seconds < 0:
+            raise ValueError("load_seconds must not be negative")
+        if not 0 <= self.error_rate <= 1:
+            raise ValueError("error_rate must be between 0 and 1")
+
+
+class ServerBusy(Exception):
+    """等待槽位的請求已達上限"""
+
+
+class InjectedError(Exception):
+    """依error_rate注入的錯誤"""
+
+
+def estimate_tokens(text: str) -> int:
+    """粗估文字的Token數（至少1）"""
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    return max(1, -(-ascii_chars // _ASCII_CHARS_PER_TOKEN) + len(text) - ascii_chars)
+
+
+def _timestamp() -> str:
+    return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def _ns(seconds: float) -> int:
+    return int(seconds * NS_PER_SECOND)
+
+
+class MockOllama:
+    """槽位、排隊、模型載入與計數的狀態（線程安全）"""
+
+    def __init__(self, config: MockOllamaConfig):
+        self.config = config
+        self.condition = threading.Condition()
+        self.active = 0
+        self.queued = 0
+        self.loaded: Dict[str, float] = {}  # 模型 -> 載入完成時間
+        self.random = random.Random(config.seed)
+        self.counts = {'requests': 0, 'completed': 0, 'rejected': 0, 'errors': 0,
+                       'peak_active': 0, 'peak_queued': 0}
+
+    def has_model(self, model: str) -> bool:
+        return model in self.config.models
+
+    def admit(self) -> float:
+        """
+        注入錯誤或等待槽位
+
+        Returns:
+            排隊等待的秒數
+
+        Raises:
+            InjectedError: 依error_rate注入錯誤
+            ServerBusy: 排隊的請求已達max_queue
+        """
+        start = time.time()
+        with self.condition:
+            self.counts['requests'] += 1
+            if self.config.error_rate and self.random.random() < self.config.error_rate:
+                self.counts['errors'] += 1
+                raise InjectedError("mock injected error")
+            if self.active >= self.config.parallel:
+                if self.queued >= self.config.max_queue:
+                    self.counts['rejected'] += 1
+                    raise ServerBusy("server busy, please try again.  maximum pending requests exceeded")
+                self.queued += 1
+                self.counts['peak_queued'] = max(self.counts['peak_queued'], self.queued)
+                while self.active >= self.config.parallel:
+                    self.condition.wait()
+                self.queued -= 1
+            self.active += 1
+            self.counts['peak_active'] = max(self.counts['peak_active'], self.active)
+        return time.time() - start
+
+    def release(self, completed: bool):
+        with self.condition:
+            self.active -= 1
+            if completed:
+                self.counts['completed'] += 1
+            self.condition.notify()
+
+    def load(self, model: str) -> float:
+        """模型尚未載入時模擬載入，回傳載入秒數（同一模型只載入一次）"""
+        with self.condition:
+            if model in self.loaded:
+                return 0.0
+            self.loaded[model] = time.time()
+        if self.config.load_seconds:
+            time.sleep(self.config.load_seconds)
+        return self.config.load_seconds
+
+    def decode_interval(self) -> float:
+        """目前每個輸出Token的解碼時間；同時生成的請求越多越慢"""
+        with self.condition:
+            others = max(0, self.active - 1)
+        return (1 + self.config.decode_slowdown * others) / self.config.decode_tokens_per_second
+
+    def statistics(self) -> Dict:
+        with self.condition:
+            return {**self.counts, 'active': self.active, 'queued': self.queued,
+                    'loaded_models': sorted(self.loaded)}
+
+
+class Generation:
+    """一個已取得槽位的生成；tokens()逐一產生輸出Token，結束（或中斷）時釋放槽位"""
+
+    def __init__(self, mock: MockOllama, model: str, prompt_tokens: int, output_tokens: int,
+                 received: float, queue_seconds: float):
+        self.mock = mock
+        self.model = model
+        self.prompt_tokens = prompt_tokens
+        self.output_tokens = output_tokens
+        self.received = received
+        self.queue_seconds = queue_seconds
+        self.load_seconds = 0.0
+        self.prefill_seconds = 0.0
+        self.decode_seconds = 0.0
+        self._released = False
+
+    def close(self, completed: bool = False):
+        """釋放槽位（可重複呼叫）；流式回應在開始送出前就被關閉時也由此釋放"""
+        if not self._released:
+            self._released = True
+            self.mock.release(completed)
+
+    def tokens(self) -> Iterator[str]:
+        completed = False
+        try:
+            self.load_seconds = self.mock.load(self.model)
+
+            prefill_start = time.time()
+            time.sleep(self.prompt_tokens / self.mock.config.prefill_tokens_per_second)
+            self.prefill_seconds = time.time() - prefill_start
+
+            # 依絕對時間排程每個Token，避免sleep的誤差逐漸累積
+            decode_start = next_at = time.time()
+            for index in range(self.output_tokens):
+                next_at += self.mock.decode_interval()
+                delay = next_at - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                yield _WORDS[index % len(_WORDS)] + ' '
+            self.decode_seconds = time.time() - decode_start
+            completed = True
+        finally:
+            self.close(completed)
+
+    def text(self) -> str:
+        """非流式：生成全部Token"""
+        return ''.join(self.tokens())
+
+    def metrics(self) -> Dict:
+        """與Ollama最終回應相同的Token數量與耗時欄位；total_duration包括排隊時間"""
+        return {
+            'total_duration': _ns(time.time() - self.received),
+            'load_duration': _ns(self.load_seconds),
+            'prompt_eval_count': self.prompt_tokens,
+            'prompt_eval_duration': _ns(self.prefill_seconds),
+            'eval_count': self.output_tokens,
+            'eval_duration': _ns(self.decode_seconds)
+        }
+
+
+def _ndjson(item: Dict) -> str:
+    return json.dumps(item) + '\n'
+
+
+def _sse(item) -> str:
+    return f"data: {item if isinstance(item, str) else json.dumps(item)}\n\n"
+
+
+def create_app(mock: MockOllama) -> Flask:
+    """建立模擬服務器的Flask應用程式"""
+    app = Flask(__name__)
+
+    def stream(body: Iterator[str], generation: Generation, mimetype: str) -> Response:
+        response = Response(body, mimetype=mimetype)
+        response.call_on_close(generation.close)
+        return response
+
+    def error(message: str, status: int, openai: bool = False):
+        body = {'error': {'message': message, 'type': 'api_error'}} if openai else {'error': message}
+        return jsonify(body), status
+
+    def start_generation(model: str, prompt_tokens: int, options: Dict, openai: bool = False):
+        """檢查模型並取得槽位；失敗時回傳錯誤回應"""
+        received = time.time()
+        if not mock.has_model(model):
+            return None, error(f'model "{model}" not found, try pulling it first', 404, openai)
+        try:
+            queue_seconds = mock.admit()
+        except ServerBusy as e:
+            return None, error(str(e), 503, openai)
+        except InjectedError as e:
+            return None, error(str(e), 500, openai)
+        output_tokens = int(options.get('num_predict') or mock.config.output_tokens)
+        return Generation(mock, model, prompt_tokens, max(1, output_tokens), received, queue_seconds), None
+
+    def chat_prompt_tokens(messages: List[Dict]) -> int:
+        return sum(estimate_tokens(str(m.get('content') or '')) + _TOKENS_PER_MESSAGE for m in messages)
+
+    @app.route('/')
+    def root():
+        return 'Ollama is running'
+
+    @app.route('/api/version')
+    def version():
+        return jsonify({'version': MOCK_VERSION})
+
+    @app.route('/api/tags')
+    def tags():
+        return jsonify({'models': [{
+            'name': model,
+            'model': model,
+            'modified_at': _timestamp(),
+            'size': 0,
+            'digest': uuid.uuid5(uuid.NAMESPACE_URL, model).hex,
+            'details': {'format': 'mock', 'family': 'mock', 'parameter_size': '0B', 'quantization_level': 'none'}
+        } for model in mock.config.models]})
+
+    @app.route('/api/show', methods=['POST'])
+    def show():
+        data = request.json or {}
+        model = data.get('model') or data.get('name') or ''
+        if not mock.has_model(model):
+            return error(f'model "{model}" not found', 404)
+        config = mock.config
+        return jsonify({
+            'modelfile': f'FROM {model}',
+            'parameters': f'num_predict {config.output_tokens}',
+            'template': '{{ .Prompt }}',
+            'details': {'format': 'mock', 'family': 'mock', 'parameter_size': '0B', 'quantization_level': 'none'},
+            'model_info': {
+                'mock.parallel': config.parallel,
+                'mock.prefill_tokens_per_second': config.prefill_tokens_per_second,
+                'mock.decode_tokens_per_second': config.decode_tokens_per_second
+            }
+        })
+
+    @app.route('/api/ps')
+    def ps():
+        statistics = mock.statistics()
+        return jsonify({'models': [{
+            'name': model,
+            'model': model,
+            'size': 0,
+            'size_vram': 0,
+            'digest': uuid.uuid5(uuid.NAMESPACE_URL, model).hex,
+            'expires_at': None
+        } for model in statistics['loaded_models']]})
+
+    @app.route('/api/mock/stats')
+    def mock_stats():
+        """模擬服務器自己的計數（請求、完成、拒絕、注入錯誤、目前與峰值的進行中/排隊數）"""
+        return jsonify(mock.statistics())
+
+    @app.route('/api/generate', methods=['POST'])
+    def generate():
+        data = request.json or {}
+        model = data.get('model', '')
+        generation, failure = start_generation(model, estimate_tokens(data.get('prompt') or ''),
+                                               data.get('options') or {})
+        if failure:
+            return failure
+
+        def piece(text: str, done: bool = False) -> Dict:
+            return {'model': model, 'created_at': _timestamp(), 'response': text, 'done': done}
+
+        if data.get('stream', True):
+            def body():
+                for token in generation.tokens():
+                    yield _ndjson(piece(token))
+                yield _ndjson({**piece('', True), 'done_reason': 'stop', 'context': [1, 2, 3],
+                               **generation.metrics()})
+            return stream(body(), generation, 'application/x-ndjson')
+
+        text = generation.text()
+        return jsonify({**piece(text, True), 'done_reason': 'stop', 'context': [1, 2, 3], **generation.metrics()})
+
+    @app.route('/api/chat', methods=['POST'])
+    def chat():
+        data = request.json or {}
+        model = data.get('model', '')
+        generation, failure = start_generation(model, chat_prompt_tokens(data.get('messages') or []),
+                                               data.get('options') or {})
+        if failure:
+            return failure
+
+        def piece(text: str, done: bool = False) -> Dict:
+            return {'model': model, 'created_at': _timestamp(),
+                    'message': {'role': 'assistant', 'content': text}, 'done': done}
+
+        if data.get('stream', True):
+            def body():
+                for token in generation.tokens():
+                    yield _ndjson(piece(token))
+                yield _ndjson({**piece('', True), 'done_reason': 'stop', **generation.metrics()})
+            return stream(body(), generation, 'application/x-ndjson')
+
+        text = generation.text()
+        return jsonify({**piece(text, True), 'done_reason': 'stop', **generation.metrics()})
+
+    @app.route('/v1/chat/completions', methods=['POST'])
+    def chat_completions():
+        data = request.json or {}
+        model = data.get('model', '')
+        generation, failure = start_generation(model, chat_prompt_tokens(data.get('messages') or []),
+                                               {'num_predict': data.get('max_tokens')}, openai=True)
+        if failure:
+            return failure
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+
+        def usage() -> Dict:
+            return {'prompt_tokens': generation.prompt_tokens, 'completion_tokens': generation.output_tokens,
+                    'total_tokens': generation.prompt_tokens + generation.output_tokens}
+
+        def chunk(delta: Dict, finish_reason: Optional[str] = None) -> Dict:
+            return {'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                    'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]}
+
+        if data.get('stream', False):
+            include_usage = bool((data.get('stream_options') or {}).get('include_usage'))
+
+            def body():
+                for token in generation.tokens():
+                    yield _sse(chunk({'role': 'assistant', 'content': token}))
+                yield _sse(chunk({}, 'stop'))
+                if include_usage:
+                    yield _sse({'id': completion_id, 'object': 'chat.completion.chunk', 'created': created,
+                                'model': model, 'choices': [], 'usage': usage()})
+                yield _sse('[DONE]')
+            return stream(body(), generation, 'text/event-stream')
+
+        text = generation.text()
+        return jsonify({
+            'id': completion_id,
+            'object': 'chat.completion',
+            'created': created,
+            'model': model,
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}],
+            'usage': usage()
+        })
+
+    return app
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    """在同一行程中執行時不輸出每個請求的存取記錄"""
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class MockServerThread:
+    """在背景線程中執行模擬服務器；port為0時使用系統分配的空閒埠"""
+
+    def __init__(self, config: Optional[MockOllamaConfig] = None, host: str = '127.0.0.1', port: int = 0):
+        self.mock = MockOllama(config or MockOllamaConfig())
+        self.server = make_server(host, port, create_app(self.mock), threaded=True,
+                                  request_handler=_QuietRequestHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server.host}:{self.server.port}"
+
+    def start(self) -> 'MockServerThread':
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+if __name__ == '__main__':
+    defaults = MockOllamaConfig()
+    parser = argparse.ArgumentParser(description='模擬Ollama服務器')
+    parser.add_argument('--host', default='127.0.0.1', help='監聽位址')
+    parser.add_argument('--port', type=int, default=11434, help='監聽埠')
+    parser.add_argument('--models', default=DEFAULT_MODEL, help='以逗號分隔的模型名稱')
+    parser.add_argument('--parallel', type=int, default=defaults.parallel, help='平行槽位數')
+    parser.add_argument('--max-queue', type=int, default=defaults.max_queue, help='排隊請求上限')
+    parser.add_argument('--prefill-rate', type=float, default=defaults.prefill_tokens_per_second,
+                        help='預填充速度（輸入Token/秒）')
+    parser.add_argument('--decode-rate', type=float, default=defaults.decode_tokens_per_second,
+                        help='單一請求的解碼速度（輸出Token/秒）')
+    parser.add_argument('--decode-slowdown', type=float, default=defaults.decode_slowdown,
+                        help='每多一個同時生成的請求，每個Token的解碼時間增加的比例')
+    parser.add_argument('--output-tokens', type=int, default=defaults.output_tokens, help='每個回應的輸出Token數')
+    parser.add_argument('--load-seconds', type=float, default=defaults.load_seconds, help='模型首次載入時間')
+    parser.add_argument('--error-rate', type=float, default=defaults.error_rate, help='注入錯誤的機率 (0-1)')
+    parser.add_argument('--seed', type=int, default=None, help='錯誤注入的亂數種子')
+    args = parser.parse_args()
+
+    config = MockOllamaConfig(
+        models=[model.strip() for model in args.models.split(',') if model.strip()],
+        parallel=args.parallel,
+        max_queue=args.max_queue,
+        prefill_tokens_per_second=args.prefill_rate,
+        decode_tokens_per_second=args.decode_rate,
+        decode_slowdown=args.decode_slowdown,
+        output_tokens=args.output_tokens,
+        load_seconds=args.load_seconds,
+        error_rate=args.error_rate,
+        seed=args.seed
+    )
+    print(f"Starting mock Ollama server on {args.host}:{args.port} "
+          f"(parallel={config.parallel}, decode={config.decode_tokens_per_second} tokens/s)...")
+    create_app(MockOllama(config)).run(host=args.host, port=args.port, threaded=True)
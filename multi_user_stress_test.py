@@ -6,29 +6,60 @@
 import threading
 import time
 import uuid
-import queue
 import random
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import statistics
+from typing import Dict, Iterator, List, Optional
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import asdict, replace
 
 from multi_user_test_config import (
     MultiUserTestConfig, UserSession, QueryResult,
-    MultiUserTestResult, COMMON_PROMPTS, assign_prompts_to_users,
-    calculate_tpm
+    MultiUserTestResult, COMMON_PROMPTS, assign_prompts_to_users
 )
-from ollama_client import OllamaClient
+from ollama_client import MultiEndpointOllamaClient
+from async_load_engine import AsyncLoadEngine, ENGINE_ASYNC, ENGINE_THREAD
 from database import db
+from streaming_metrics import summarize_values
+from throughput_series import build_throughput_series, choose_bucket_seconds
+from arrival_schedule import ARRIVAL_CLOSED, arrival_offsets, run_open_loop_threaded, summarize_schedule
+from server_metrics import SERVER_METRIC_FIELDS, LATENCY_COMPONENTS, count_output_tokens, latency_breakdown
 from hardware_info import get_hardware_info
+from endpoint_balancer import BALANCE_ROUND_ROBIN
+from ollama_backends import BACKEND_GENERATE
+from soak_monitor import SoakMonitor
+from latency_histogram import LatencyHistogram
+from record_store import RecordStore
+from result_analysis import ResultAnalysis, describe
+from result_retention import (
+    DEFAULT_RESPONSE_SAMPLE_EVERY, RESPONSE_FULL, SPILL_RECENT_RESULTS, CompletedTestStore, ResponseBodyPolicy,
+    ResultSpill, RetentionPolicy, estimate_size, remove_spill
+)
+from connection_pool import CONNECTION_TIMING_FIELDS
+from agent_coordinator import (
+    AGENT_POLL_INTERVAL, PLAN_MULTI_USER, AgentRun, merge_multi_user_snapshots, split_multi_user_plan
+)
+
+# soak模式下保留的最近查詢結果數，其餘只計入快照
+SOAK_RECENT_RESULTS = 1000
 
 
 class MultiUserStressTestManager:
     """多用戶壓力測試管理器"""
     
-    def __init__(self):
+    def __init__(self, retention: Optional[RetentionPolicy] = None):
+        """
+        Args:
+            retention: 已完成測試的保留與溢寫策略；None時使用預設值
+        """
+        self.retention = retention or RetentionPolicy()
         self.active_tests = {}
-        self.test_results = {}
+        # 已完成的測試依數量、大小與存活時間移除，移除後由歷史記錄提供
+        self.test_results = CompletedTestStore(
+            self.retention,
+            sizer=lambda result: estimate_size(result.query_results) + estimate_size(result.tpm_samples),
+            # 移除的測試改由歷史記錄提供，溢寫檔案一併刪除
+            on_evict=lambda test_id, result: remove_spill(result.spill_statistics.get('path'))
+        )
         self.lock = threading.Lock()
     
     def start_multi_user_test(self, config_dict: Dict) -> str:
@@ -52,14 +83,18 @@ class MultiUserStressTestManager:
                     'result': test_result,
                     'status': 'starting',
                     'progress': 0,
-                    'stop_requested': False,
-                    'current_tpm': 0.0,
-                    'active_users': 0
+                    'lock': threading.Lock(),  # 保護此測試的結果與進度
+                    'stop_event': threading.Event(),
+                    'active_users': 0,
+                    'completed_tasks': 0,
+                    'soak_monitor': None,
+                    'spill': None,
+                    'response_policy': ResponseBodyPolicy(config.response_retention, config.response_sample_every)
                 }
             
             # 在新線程中運行測試
             test_thread = threading.Thread(
-                target=self._run_multi_user_test,
+                target=self._run_distributed_test if config.agents else self._run_multi_user_test,
                 args=(test_id, config, test_result),
                 daemon=True
             )
@@ -72,7 +107,8 @@ class MultiUserStressTestManager:
                 self.active_tests[test_id] = {
                     'status': 'error',
                     'error': str(e),
-                    'progress': 0
+                    'progress': 0,
+                    'lock': threading.Lock()
                 }
             raise e
     
@@ -100,18 +136,40 @@ class MultiUserStressTestManager:
             custom_prompts=custom_prompts,
             concurrent_limit=int(config_dict.get('concurrent_limit', 10)),
             delay_between_queries=float(config_dict.get('delay_between_queries', 0.5)),
+            engine=config_dict.get('engine', ENGINE_THREAD),
+            stream=bool(config_dict.get('stream', False)),
+            arrival_mode=config_dict.get('arrival_mode', ARRIVAL_CLOSED),
+            arrival_rate=float(config_dict['arrival_rate']) if config_dict.get('arrival_rate') else None,
+            rate_curve=config_dict.get('rate_curve'),
+            test_duration_minutes=(float(config_dict['test_duration_minutes'])
+                                   if config_dict.get('test_duration_minutes') else None),
+            soak=bool(config_dict.get('soak', False)),
+            snapshot_interval_seconds=float(config_dict.get('snapshot_interval_seconds', 60)),
             enable_tpm_monitoring=config_dict.get('enable_tpm_monitoring', True),
-            enable_detailed_logging=config_dict.get('enable_detailed_logging', False)
+            enable_detailed_logging=config_dict.get('enable_detailed_logging', False),
+            agents=config_dict.get('agents') or None,
+            save_history=config_dict.get('save_history', True),
+            endpoints=config_dict.get('endpoints') or None,
+            balance_strategy=config_dict.get('balance_strategy') or BALANCE_ROUND_ROBIN,
+            backend=config_dict.get('backend') or BACKEND_GENERATE,
+            messages=config_dict.get('messages') or None,
+            spill_results=(bool(config_dict['spill_results'])
+                           if config_dict.get('spill_results') is not None else None),
+            response_retention=config_dict.get('response_retention') or RESPONSE_FULL,
+            response_sample_every=int(config_dict.get('response_sample_every') or DEFAULT_RESPONSE_SAMPLE_EVERY)
         )
     
     def _run_multi_user_test(self, test_id: str, config: MultiUserTestConfig, result: MultiUserTestResult):
         """運行多用戶測試的主邏輯"""
+        test_info = self.active_tests[test_id]
         try:
-            with self.lock:
-                self.active_tests[test_id]['status'] = 'running'
+            with test_info['lock']:
+                test_info['status'] = 'running'
             
-            # 創建Ollama客戶端
-            ollama_client = OllamaClient()
+            # 創建Ollama客戶端（多端點時依負載平衡策略分散查詢；連線池大小等於並發上限）
+            ollama_client = MultiEndpointOllamaClient(config.endpoints, config.balance_strategy,
+                                                      config.backend, config.messages,
+                                                      pool_size=config.concurrent_limit)
             
             # 檢查服務器可用性
             if not ollama_client.is_server_available():
@@ -130,39 +188,63 @@ class MultiUserStressTestManager:
                     assigned_prompts=user_prompts[user_id]
                 )
             
-            # 創建任務隊列
-            task_queue = queue.Queue()
-            total_tasks = config.user_count * config.queries_per_user
+            # 查詢數很多時每個查詢結果溢寫到磁碟，記憶體只保留最近的結果
+            planned_queries = None if config.test_duration_minutes else config.user_count * config.queries_per_user
+            spill = None
+            if self.retention.should_spill(planned_queries, config.spill_results):
+                spill = ResultSpill(self.retention.spill_path(test_id))
+                with test_info['lock']:
+                    test_info['spill'] = spill
             
-            # 為每個用戶的每個查詢創建任務
-            for user_id in range(1, config.user_count + 1):
-                for query_index, prompt in enumerate(user_prompts[user_id]):
-                    task_queue.put({
-                        'user_id': user_id,
-                        'query_index': query_index,
-                        'prompt': prompt
-                    })
+            # soak模式只保留最近的結果；依時間執行或soak時定期產生快照
+            if config.soak:
+                result.query_results = RecordStore(SOAK_RECENT_RESULTS, row_factory=QueryResult)
+            elif spill:
+                result.query_results = RecordStore(SPILL_RECENT_RESULTS, row_factory=QueryResult)
+            monitor = None
+            if config.soak or config.test_duration_minutes:
+                monitor = SoakMonitor(interval=config.snapshot_interval_seconds)
+                with test_info['lock']:
+                    test_info['soak_monitor'] = monitor
+            
+            # 依查詢次數或測試時間產生任務
+            total_tasks = config.user_count * config.queries_per_user
+            tasks = self._generate_tasks(config, user_prompts)
             
             # 執行並發測試
-            self._execute_concurrent_queries(
-                test_id, config, result, task_queue, total_tasks, ollama_client
-            )
+            if monitor:
+                monitor.start()
+            try:
+                self._execute_concurrent_queries(
+                    test_id, config, result, tasks, total_tasks, ollama_client
+                )
+            finally:
+                if monitor:
+                    monitor.stop()
+                    result.soak_statistics = monitor.summary()
+                if spill:
+                    spill.close()
+                    result.spill_statistics = spill.summary()
             
-            # 計算最終統計
-            self._calculate_final_statistics(result)
+            # 計算最終統計；之後的狀態查詢不再以即時統計覆蓋
+            with test_info['lock']:
+                self._calculate_final_statistics(result)
             
             with self.lock:
-                self.active_tests[test_id]['status'] = 'completed'
-                self.active_tests[test_id]['progress'] = 100
                 self.test_results[test_id] = result
 
-                # 保存測試結果到資料庫
-                self._save_multi_user_test_to_database(test_id, config, result)
+            # 保存測試結果到資料庫；寫入後才標記完成，使狀態為completed時歷史記錄已可讀取
+            self._save_multi_user_test_to_database(test_id, config, result)
+
+            with test_info['lock']:
+                test_info['status'] = 'completed'
+                test_info['progress'] = 100
+            self._release_completed_test(test_id)
 
         except Exception as e:
-            with self.lock:
-                self.active_tests[test_id]['status'] = 'error'
-                self.active_tests[test_id]['error'] = str(e)
+            with test_info['lock']:
+                test_info['status'] = 'error'
+                test_info['error'] = str(e)
 
                 # 即使發生錯誤，也嘗試保存部分結果（如果有的話）
                 if result.query_results:
@@ -172,6 +254,92 @@ class MultiUserStressTestManager:
                     except Exception as save_error:
                         print(f"Failed to save partial results: {save_error}")
     
+    def _run_distributed_test(self, test_id: str, config: MultiUserTestConfig, result: MultiUserTestResult):
+        """把用戶分配給負載代理執行，定期合併各代理回報的累計數據"""
+        test_info = self.active_tests[test_id]
+        try:
+            with test_info['lock']:
+                test_info['status'] = 'running'
+            
+            # 代理以與API相同的字典格式接收配置
+            config_dict = {**asdict(config), 'custom_prompts': '\n'.join(config.custom_prompts or [])}
+            plans = split_multi_user_plan(config_dict, len(config.agents))
+            run = AgentRun(config.agents, PLAN_MULTI_USER, plans)
+            start_at = run.start()
+            
+            stopped = False
+            while True:
+                if test_info['stop_event'].is_set() and not stopped:
+                    run.stop()
+                    stopped = True
+                snapshots = run.poll()
+                merged = merge_multi_user_snapshots(snapshots, time.time() - start_at)
+                with test_info['lock']:
+                    self._apply_agent_statistics(result, merged)
+                    test_info['progress'] = self._distributed_progress(config, result, start_at)
+                if AgentRun.finished(snapshots):
+                    break
+                time.sleep(AGENT_POLL_INTERVAL)
+            
+            error = AgentRun.first_error(snapshots)
+            if error:
+                raise Exception(error)
+            
+            with test_info['lock']:
+                result.end_time = datetime.now()
+            with self.lock:
+                self.test_results[test_id] = result
+            
+            self._save_multi_user_test_to_database(test_id, config, result)
+            
+            with test_info['lock']:
+                test_info['status'] = 'completed'
+                test_info['progress'] = 100
+            self._release_completed_test(test_id)
+        
+        except Exception as e:
+            with test_info['lock']:
+                test_info['status'] = 'error'
+                test_info['error'] = str(e)
+    
+    def _release_completed_test(self, test_id: str):
+        """已完成的測試只保留在test_results中，由其保留策略決定何時移除"""
+        with self.lock:
+            self.active_tests.pop(test_id, None)
+    
+    @staticmethod
+    def _distributed_progress(config: MultiUserTestConfig, result: MultiUserTestResult, start_at: float) -> float:
+        """依測試時間或合併後的查詢數計算進度"""
+        if config.test_duration_minutes:
+            return min(100, max(0.0, time.time() - start_at) / (config.test_duration_minutes * 60) * 100)
+        return min(100, result.total_queries / (config.user_count * config.queries_per_user) * 100)
+    
+    def _apply_agent_statistics(self, result: MultiUserTestResult, merged: Dict):
+        """把各代理合併後的數據寫入測試結果（呼叫時須持有該測試的鎖）"""
+        counters = merged['counters']
+        histogram = merged['latency_histogram']
+        result.total_queries = int(counters.get('total_queries', 0))
+        result.successful_queries = int(counters.get('successful_queries', 0))
+        result.failed_queries = int(counters.get('failed_queries', 0))
+        result.total_tokens = int(counters.get('total_tokens', 0))
+        result.average_response_time = (counters.get('response_time_sum', 0.0) / result.successful_queries
+                                        if result.successful_queries else 0.0)
+        result.min_response_time = histogram.min or 0.0
+        result.max_response_time = histogram.max or 0.0
+        result.latency_histogram = histogram
+        result.latency_percentiles = histogram.summary()
+        result.agent_statistics = merged['agents']
+        if len(result.config.endpoints) > 1:
+            result.endpoint_statistics = merged['endpoints']
+        
+        series = merged['throughput_series']
+        if series is not None and result.config.enable_tpm_monitoring:
+            result.tpm_samples = series.series()
+            result.throughput_statistics = series.summary(result.tpm_samples)
+            if result.tpm_samples:
+                result.average_tpm = result.throughput_statistics['average_tokens_per_minute']
+                result.peak_tpm = result.throughput_statistics['peak_tokens_per_minute']
+    
     def _assign_custom_prompts(self, config: MultiUserTestConfig) -> Dict[int, List[str]]:
         """為用戶分配自定義提示詞"""
         user_prompts = {}
@@ -187,68 +355,122 @@ class MultiUserStressTestManager:
         
         return user_prompts
     
+    def _generate_tasks(self, config: MultiUserTestConfig,
+                        user_prompts: Dict[int, List[str]]) -> Iterator[Dict]:
+        """
+        產生查詢任務
+
+        未設定test_duration_minutes時依序產生每個用戶的每個查詢；
+        設定時輪流為每個用戶重複使用其提示詞，直到測試時間結束
+        """
+        if not config.test_duration_minutes:
+            for user_id in range(1, config.user_count + 1):
+                for query_index, prompt in enumerate(user_prompts[user_id]):
+                    yield {
+                        'user_id': user_id,
+                        'query_index': query_index,
+                        'prompt': prompt
+                    }
+            return
+
+        deadline = time.time() + config.test_duration_minutes * 60
+        query_index = 0
+        while True:
+            for user_id in range(1, config.user_count + 1):
+                if time.time() >= deadline:
+                    return
+                prompts = user_prompts[user_id]
+                yield {
+                    'user_id': user_id,
+                    'query_index': query_index,
+                    'prompt': prompts[query_index % len(prompts)]
+                }
+            query_index += 1
+
+    def _record_query_result(self, test_id: str, result: MultiUserTestResult,
+                             total_tasks: int, query_result: QueryResult):
+        """保存單一查詢結果並更新進度"""
+        test_info = self.active_tests[test_id]
+        if query_result.success:
+            query_result.response_text, summary = test_info['response_policy'].retain(query_result.response_text)
+            for field, value in summary.items():
+                setattr(query_result, field, value)
+        with test_info['lock']:
+            result.query_results.append(query_result)
+            result.running_statistics.record(query_result.success, query_result.response_time,
+                                             query_result.tokens_count, endpoint=query_result.endpoint)
+            test_info['completed_tasks'] += 1
+            monitor = test_info['soak_monitor']
+            spill = test_info['spill']
+
+            # 更新進度：依時間執行時以經過時間計算
+            if result.config.test_duration_minutes:
+                elapsed = (datetime.now() - result.start_time).total_seconds()
+                progress = elapsed / (result.config.test_duration_minutes * 60) * 100
+            else:
+                progress = test_info['completed_tasks'] / total_tasks * 100
+            test_info['progress'] = min(100, progress)
+
+        if monitor:
+            monitor.record(query_result.success, query_result.response_time, query_result.tokens_count)
+        if spill:
+            spill.append(vars(query_result))
+
+    def _stop_requested(self, test_id: str) -> bool:
+        return self.active_tests[test_id]['stop_event'].is_set()
+
     def _execute_concurrent_queries(self, test_id: str, config: MultiUserTestConfig, 
-                                  result: MultiUserTestResult, task_queue: queue.Queue,
-                                  total_tasks: int, ollama_client: OllamaClient):
+                                  result: MultiUserTestResult, tasks: Iterator[Dict],
+                                  total_tasks: int, ollama_client: MultiEndpointOllamaClient):
         """執行並發查詢"""
-        completed_tasks = 0
+        if config.arrival_mode != ARRIVAL_CLOSED:
+            self._execute_concurrent_queries_open_loop(
+                test_id, config, result, tasks, total_tasks, ollama_client
+            )
+            return
+        
+        if config.engine == ENGINE_ASYNC:
+            self._execute_concurrent_queries_async(test_id, config, result, tasks, total_tasks)
+            return
+        
+        def collect(done_futures):
+            for future in done_futures:
+                query_result = future.result()
+                if query_result:
+                    self._record_query_result(test_id, result, total_tasks, query_result)
         
         with ThreadPoolExecutor(max_workers=config.concurrent_limit) as executor:
-            # 提交所有任務
-            futures = []
+            # 進行中的任務
+            pending = set()
             
-            while not task_queue.empty() and not self.active_tests[test_id]['stop_requested']:
-                try:
-                    task = task_queue.get_nowait()
-                    future = executor.submit(
-                        self._execute_single_query,
-                        test_id, config, task, ollama_client
-                    )
-                    futures.append(future)
-                    
-                    # 控制並發數量
-                    if len(futures) >= config.concurrent_limit:
-                        # 等待一些任務完成
-                        for future in as_completed(futures[:config.concurrent_limit//2]):
-                            query_result = future.result()
-                            if query_result:
-                                result.query_results.append(query_result)
-                                completed_tasks += 1
-                                
-                                # 更新進度
-                                progress = (completed_tasks / total_tasks) * 100
-                                with self.lock:
-                                    self.active_tests[test_id]['progress'] = progress
-                        
-                        # 移除已完成的futures
-                        futures = [f for f in futures if not f.done()]
-                    
-                    # 查詢間隔
-                    if config.delay_between_queries > 0:
-                        time.sleep(config.delay_between_queries)
-                        
-                except queue.Empty:
+            for task in tasks:
+                if self._stop_requested(test_id):
                     break
+                
+                task['submitted_at'] = time.time()
+                pending.add(executor.submit(
+                    self._execute_single_query,
+                    test_id, config, task, ollama_client
+                ))
+                
+                # 控制並發數量：達到上限時等待至少一個任務完成
+                if len(pending) >= config.concurrent_limit:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                
+                # 查詢間隔
+                if config.delay_between_queries > 0:
+                    time.sleep(config.delay_between_queries)
             
             # 等待剩餘任務完成
-            for future in as_completed(futures):
-                if self.active_tests[test_id]['stop_requested']:
-                    break
-                    
-                query_result = future.result()
-                if query_result:
-                    result.query_results.append(query_result)
-                    completed_tasks += 1
-                    
-                    # 更新進度
-                    progress = (completed_tasks / total_tasks) * 100
-                    with self.lock:
-                        self.active_tests[test_id]['progress'] = progress
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
     
     def _execute_single_query(self, test_id: str, config: MultiUserTestConfig, 
-                            task: Dict, ollama_client: OllamaClient) -> Optional[QueryResult]:
+                            task: Dict, ollama_client: MultiEndpointOllamaClient) -> Optional[QueryResult]:
         """執行單個查詢"""
-        if self.active_tests[test_id]['stop_requested']:
+        if self._stop_requested(test_id):
             return None
         
         user_id = task['user_id']
@@ -258,43 +480,19 @@ class MultiUserStressTestManager:
         
         try:
             # 更新活躍用戶數
-            with self.lock:
-                self.active_tests[test_id]['active_users'] = len(set(
+            test_info = self.active_tests[test_id]
+            with test_info['lock']:
+                test_info['active_users'] = len(set(
                     task['user_id'] for task in [task]  # 簡化版本，實際應該追蹤所有活躍用戶
                 ))
             
             # 執行查詢
-            response_data = ollama_client.generate_response(config.model, prompt)
+            response_data = ollama_client.generate_response(config.model, prompt, stream=config.stream,
+                                                            routing_key=str(user_id))
             response_time = time.time() - start_time
 
-            # 檢查查詢是否成功
-            if response_data.get('success', False):
-                response_text = response_data.get('response', '')
-                # 估算token數量（簡化版本，實際應該使用tokenizer）
-                tokens_count = len(response_text.split()) if response_text else 0
-
-                return QueryResult(
-                    user_id=user_id,
-                    prompt=prompt,
-                    response_text=response_text,
-                    tokens_count=tokens_count,
-                    response_time=response_time,
-                    timestamp=timestamp,
-                    success=True
-                )
-            else:
-                # 查詢失敗
-                error_message = response_data.get('error', 'Unknown error')
-                return QueryResult(
-                    user_id=user_id,
-                    prompt=prompt,
-                    response_text="",
-                    tokens_count=0,
-                    response_time=response_time,
-                    timestamp=timestamp,
-                    success=False,
-                    error_message=error_message
-                )
+            return self._build_query_result(user_id, prompt, response_data, response_time, timestamp,
+                                            start_time - task.get('submitted_at', start_time))
             
         except Exception as e:
             response_time = time.time() - start_time
@@ -309,50 +507,247 @@ class MultiUserStressTestManager:
                 error_message=str(e)
             )
     
+    def _build_query_result(self, user_id: int, prompt: str, response_data: Dict,
+                            response_time: float, timestamp: datetime,
+                            client_queue_time: Optional[float] = None) -> QueryResult:
+        """將客戶端回應字典轉換為QueryResult"""
+        breakdown = latency_breakdown(response_data, response_time, client_queue_time)
+        # 檢查查詢是否成功
+        if response_data.get('success', False):
+            response_text = response_data.get('response', '')
+            # 使用伺服器回報的eval_count作為Token數量
+            tokens_count = count_output_tokens(response_data, response_text)
+
+            return QueryResult(
+                user_id=user_id,
+                prompt=prompt,
+                response_text=response_text,
+                tokens_count=tokens_count,
+                response_time=response_time,
+                timestamp=timestamp,
+                success=True,
+                ttft=response_data.get('ttft'),
+                inter_token_latencies=response_data.get('inter_token_latencies'),
+                decode_tokens_per_second=response_data.get('decode_tokens_per_second'),
+                **{field: response_data.get(field) for field in SERVER_METRIC_FIELDS},
+                **breakdown,
+                connection_reused=response_data.get('connection_reused'),
+                **{field: response_data.get(field) for field in CONNECTION_TIMING_FIELDS},
+                endpoint=response_data.get('endpoint')
+            )
+        else:
+            # 查詢失敗
+            error_message = response_data.get('error', 'Unknown error')
+            return QueryResult(
+                user_id=user_id,
+                prompt=prompt,
+                response_text="",
+                tokens_count=0,
+                response_time=response_time,
+                timestamp=timestamp,
+                success=False,
+                error_message=error_message,
+                client_queue_time=client_queue_time,
+                endpoint=response_data.get('endpoint')
+            )
+
+    def _execute_concurrent_queries_open_loop(self, test_id: str, config: MultiUserTestConfig,
+                                              result: MultiUserTestResult, tasks: Iterator[Dict],
+                                              total_tasks: int, ollama_client: MultiEndpointOllamaClient):
+        """依到達率排程發送查詢（開放迴路），concurrent_limit為同時進行中查詢的上限"""
+        def mark_schedule(query_result: QueryResult, intended_start: float):
+            # 客戶端佇列時間即為實際發送落後排程的時間
+            schedule_lag = query_result.client_queue_time or 0.0
+            query_result.intended_start = intended_start
+            query_result.schedule_lag = schedule_lag
+            query_result.corrected_response_time = query_result.response_time + schedule_lag
+            return query_result
+
+        def on_result(task, query_result: Optional[QueryResult]):
+            if query_result:
+                self._record_query_result(test_id, result, total_tasks, query_result)
+
+        def stop_requested():
+            return self._stop_requested(test_id)
+
+        offsets = arrival_offsets(config.arrival_mode, config.arrival_rate, config.rate_curve)
+
+        if config.engine == ENGINE_ASYNC:
+            async def execute(client, task, intended_start):
+                start_time = time.time()
+                timestamp = datetime.now()
+                response_data = await client.generate_response(config.model, task['prompt'],
+                                                               stream=config.stream,
+                                                               routing_key=str(task['user_id']))
+                response_time = time.time() - start_time
+                query_result = self._build_query_result(task['user_id'], task['prompt'], response_data,
+                                                        response_time, timestamp,
+                                                        start_time - intended_start)
+                return mark_schedule(query_result, intended_start)
+
+            dispatcher = AsyncLoadEngine(
+                config.concurrent_limit, endpoints=config.endpoints, balance_strategy=config.balance_strategy,
+                backend=config.backend, messages=config.messages
+            ).run_open_loop(
+                tasks, offsets, execute, on_result, stop_requested
+            )
+        else:
+            def execute(task, intended_start):
+                task['submitted_at'] = intended_start
+                query_result = self._execute_single_query(test_id, config, task, ollama_client)
+                if query_result:
+                    mark_schedule(query_result, intended_start)
+                on_result(task, query_result)
+
+            dispatcher = run_open_loop_threaded(
+                tasks, offsets, config.concurrent_limit, execute, stop_requested
+            )
+
+        result.schedule_statistics = summarize_schedule(
+            config.arrival_mode, config.arrival_rate, dispatcher,
+            [lag for lag in result.query_results.column('schedule_lag') if lag is not None]
+        )
+        corrected_times = [value for value in result.query_results.column(
+            'corrected_response_time', where=result.query_results.column('success')
+        ) if value is not None]
+        if corrected_times:
+            result.schedule_statistics['corrected_response_time_stats'] = summarize_values(corrected_times)
+
+    def _execute_concurrent_queries_async(self, test_id: str, config: MultiUserTestConfig,
+                                          result: MultiUserTestResult, tasks: Iterator[Dict],
+                                          total_tasks: int):
+        """以單一事件迴圈執行並發查詢"""
+        def submitted_tasks():
+            for task in tasks:
+                task['submitted_at'] = time.time()
+                yield task
+
+        async def execute(client, task):
+            start_time = time.time()
+            timestamp = datetime.now()
+            response_data = await client.generate_response(config.model, task['prompt'],
+                                                           stream=config.stream,
+                                                           routing_key=str(task['user_id']))
+            response_time = time.time() - start_time
+            return self._build_query_result(task['user_id'], task['prompt'], response_data,
+                                            response_time, timestamp,
+                                            start_time - task['submitted_at'])
+
+        def on_result(task, query_result: QueryResult):
+            self._record_query_result(test_id, result, total_tasks, query_result)
+
+        AsyncLoadEngine(
+            config.concurrent_limit,
+            dispatch_delay=config.delay_between_queries,
+            endpoints=config.endpoints,
+            balance_strategy=config.balance_strategy,
+            backend=config.backend,
+            messages=config.messages
+        ).run(submitted_tasks(), execute, on_result, lambda: self._stop_requested(test_id))
+
     def _calculate_final_statistics(self, result: MultiUserTestResult):
         """計算最終統計數據"""
         if not result.query_results:
             return
         
+        # 各統計由ResultAnalysis直接讀取RecordStore的欄位陣列，不重建每個QueryResult
+        analysis = ResultAnalysis(result.query_results)
+        success = analysis.mask('success')
+        
         # 基本統計
-        result.total_queries = len(result.query_results)
-        result.successful_queries = sum(1 for r in result.query_results if r.success)
+        result.total_queries = len(analysis)
+        result.successful_queries = analysis.count(success)
         result.failed_queries = result.total_queries - result.successful_queries
-        result.total_tokens = sum(r.tokens_count for r in result.query_results if r.success)
+        result.total_tokens = int(analysis.total('tokens_count', where=success))
         
         # 響應時間統計
-        response_times = [r.response_time for r in result.query_results if r.success]
-        if response_times:
-            result.average_response_time = statistics.mean(response_times)
-            result.min_response_time = min(response_times)
-            result.max_response_time = max(response_times)
+        response_time_stats = describe(analysis.values('response_time', where=success))
+        if response_time_stats:
+            result.average_response_time = response_time_stats['mean']
+            result.min_response_time = response_time_stats['min']
+            result.max_response_time = response_time_stats['max']
+        
+        # 伺服器回報的Token統計
+        result.token_stats = analysis.server_metrics(where=success)
+        result.total_prompt_tokens = result.token_stats.get('total_prompt_tokens', 0)
+        result.latency_breakdown = analysis.latency_breakdown(where=success)
+        result.connection_timing = analysis.connection_timing(where=success)
+        if result.connection_timing:
+            result.connection_timing['pool_size'] = result.config.concurrent_limit
+        
+        # 流式測量統計
+        streaming_statistics = analysis.streaming_statistics(where=success)
+        if streaming_statistics:
+            result.streaming_statistics = streaming_statistics
         
-        # TPM統計
+        # TPM統計：平均值為總Token數除以實際時間，峰值為滑動窗口的最大值
         if result.config.enable_tpm_monitoring:
-            result.tpm_samples = calculate_tpm(result.query_results)
+            if result.spill_statistics and not result.config.soak:
+                # 溢寫的測試只保留最近的結果，改用增量統計中涵蓋全部查詢的時間桶（依測試長度合併成較大的桶）
+                running_series = result.running_statistics.throughput
+                series = running_series.coarsen(max(running_series.bucket_seconds,
+                                                    choose_bucket_seconds(running_series.span_seconds())))
+            else:
+                series = build_throughput_series(result.query_results)
+            result.tpm_samples = series.series()
+            result.throughput_statistics = series.summary(result.tpm_samples)
             if result.tpm_samples:
-                tpm_values = [sample['tokens_per_minute'] for sample in result.tpm_samples]
-                result.average_tpm = statistics.mean(tpm_values) if tpm_values else 0.0
-                result.peak_tpm = max(tpm_values) if tpm_values else 0.0
+                result.average_tpm = result.throughput_statistics['average_tokens_per_minute']
+                result.peak_tpm = result.throughput_statistics['peak_tokens_per_minute']
+        
+        self._apply_spill_totals(result)
+        self._apply_soak_totals(result)
+        result.latency_percentiles = result.latency_histogram.summary()
+        if len(result.config.endpoints) > 1:
+            # 由增量統計取得（soak模式下也涵蓋已丟棄的結果）
+            result.endpoint_statistics = result.running_statistics.endpoint_statistics()
         
         # 設置結束時間
         result.end_time = datetime.now()
     
+    def _apply_spill_totals(self, result: MultiUserTestResult):
+        """
+        溢寫的測試只保留最近的結果，總數與回應時間改用涵蓋全部查詢的增量統計；
+        平均與峰值TPM維持由吞吐量序列計算（與未溢寫的測試定義相同）
+        """
+        if not result.spill_statistics or result.config.soak:
+            return
+        
+        self._apply_running_statistics(result)
+        if result.config.enable_tpm_monitoring and result.tpm_samples:
+            result.average_tpm = result.throughput_statistics['average_tokens_per_minute']
+            result.peak_tpm = result.throughput_statistics['peak_tokens_per_minute']
+    
+    def _apply_soak_totals(self, result: MultiUserTestResult):
+        """soak模式只保留最近的結果，總數與TPM改用監控器的累計值"""
+        soak = result.soak_statistics
+        if not result.config.soak or not soak:
+            return
+        
+        result.total_queries = soak['total_requests']
+        result.successful_queries = soak['successful_requests']
+        result.failed_queries = soak['failed_requests']
+        result.total_tokens = soak['total_output_tokens']
+        result.average_response_time = soak['average_response_time']
+        result.average_tpm = soak['average_tokens_per_minute']
+        result.peak_tpm = max(result.peak_tpm, soak['peak_tokens_per_minute'])
+    
     def stop_test(self, test_id: str) -> bool:
         """停止測試"""
         with self.lock:
-            if test_id in self.active_tests:
-                self.active_tests[test_id]['stop_requested'] = True
-                return True
+            test_info = self.active_tests.get(test_id)
+        if test_info is None or 'stop_event' not in test_info:
             return False
+        test_info['stop_event'].set()
+        return True
     
     def get_test_status(self, test_id: str) -> Optional[Dict]:
         """獲取測試狀態"""
         with self.lock:
             if test_id not in self.active_tests:
                 # 檢查是否在已完成的測試中
-                if test_id in self.test_results:
-                    result = self.test_results[test_id]
+                result = self.test_results.get(test_id)
+                if result is not None:
                     return {
                         'test_id': test_id,
                         'status': 'completed',
@@ -366,17 +761,36 @@ class MultiUserStressTestManager:
                             'total_tokens': result.total_tokens,
                             'average_tpm': result.average_tpm,
                             'peak_tpm': result.peak_tpm,
-                            'average_response_time': result.average_response_time
+                            'average_response_time': result.average_response_time,
+                            'total_prompt_tokens': result.total_prompt_tokens,
+                            'token_stats': result.token_stats,
+                            'latency_breakdown': result.latency_breakdown,
+                            'connection_timing': result.connection_timing,
+                            'schedule': result.schedule_statistics,
+                            'soak': result.soak_statistics,
+                            'spill': result.spill_statistics,
+                            'throughput': result.throughput_statistics,
+                            'agents': result.agent_statistics,
+                            'endpoints': result.endpoint_statistics,
+                            'backend': result.config.backend,
+                            'latency_percentiles': result.latency_percentiles,
+                            **result.streaming_statistics
                         }
                     }
-                return None
+                test_info = None
+            else:
+                test_info = self.active_tests[test_id]
+        
+        if test_info is None:
+            return self._history_status(test_id)
 
-            test_info = self.active_tests[test_id]
+        # 讀取單一測試的狀態只需要該測試的鎖
+        with test_info['lock']:
             status = {
                 'test_id': test_id,
                 'status': test_info['status'],
                 'progress': test_info['progress'],
-                'current_tpm': test_info.get('current_tpm', 0.0),
+                'current_tpm': 0.0,
                 'active_users': test_info.get('active_users', 0)
             }
 
@@ -385,8 +799,18 @@ class MultiUserStressTestManager:
 
             if 'result' in test_info:
                 result = test_info['result']
-                # 實時計算當前統計
-                self._update_real_time_statistics(result)
+                if test_info['status'] == 'completed' or result.end_time is not None:
+                    status['current_tpm'] = result.average_tpm
+                elif result.config.agents:
+                    # 分散式測試的數據由協調線程合併後寫入，取最近一個時間桶的滑動窗口TPM
+                    status['current_tpm'] = result.tpm_samples[-1]['tokens_per_minute'] if result.tpm_samples else 0.0
+                else:
+                    # 即時統計取自每次完成時的增量更新，不重新掃描全部結果
+                    self._apply_running_statistics(result)
+                    status['current_tpm'] = result.running_statistics.current_tpm()
+                if test_info.get('soak_monitor'):
+                    result.soak_statistics = test_info['soak_monitor'].summary()
+                    self._apply_soak_totals(result)
 
                 status['statistics'] = {
                     'total_queries': result.total_queries,
@@ -395,40 +819,126 @@ class MultiUserStressTestManager:
                     'total_tokens': result.total_tokens,
                     'average_tpm': result.average_tpm,
                     'peak_tpm': result.peak_tpm,
-                    'average_response_time': result.average_response_time
+                    'average_response_time': result.average_response_time,
+                    'total_prompt_tokens': result.total_prompt_tokens,
+                    'token_stats': result.token_stats,
+                    'latency_breakdown': result.latency_breakdown,
+                    'connection_timing': result.connection_timing,
+                    'schedule': result.schedule_statistics,
+                    'soak': result.soak_statistics,
+                    'spill': result.spill_statistics,
+                    'throughput': result.throughput_statistics,
+                    'agents': result.agent_statistics,
+                    'endpoints': result.endpoint_statistics,
+                    'backend': result.config.backend,
+                    'latency_percentiles': result.latency_percentiles,
+                    **result.streaming_statistics
                 }
 
             return status
 
-    def _update_real_time_statistics(self, result: MultiUserTestResult):
-        """更新實時統計數據"""
-        if not result.query_results:
-            return
+    @staticmethod
+    def _history_status(test_id: str) -> Optional[Dict]:
+        """已從記憶體移除的多用戶測試改由歷史記錄提供狀態"""
+        record = db.get_test_detail(test_id)
+        if not record or record['test_type'] != 2:
+            return None
+        statistics = record['test_statistics']
+        return {
+            'test_id': test_id,
+            'status': 'completed',
+            'progress': 100,
+            'current_tpm': statistics.get('average_tpm', 0.0),
+            'active_users': 0,
+            'statistics': statistics,
+            'from_history': True
+        }
+    
+    def get_result_snapshot(self, test_id: str) -> Optional[MultiUserTestResult]:
+        """
+        進行中測試結果的副本（供繪製圖表）：在測試的鎖內複製查詢結果、TPM序列與延遲直方圖，
+        讀取時不受工作線程同時附加或丟棄記錄的影響
 
-        # 更新基本統計
-        result.total_queries = len(result.query_results)
-        result.successful_queries = sum(1 for r in result.query_results if r.success)
-        result.failed_queries = result.total_queries - result.successful_queries
-        result.total_tokens = sum(r.tokens_count for r in result.query_results if r.success)
-
-        # 更新響應時間統計
-        successful_results = [r for r in result.query_results if r.success]
-        if successful_results:
-            response_times = [r.response_time for r in successful_results]
-            result.average_response_time = sum(response_times) / len(response_times)
-            result.min_response_time = min(response_times)
-            result.max_response_time = max(response_times)
-
-        # 更新TPM統計
-        if result.config.enable_tpm_monitoring and len(result.query_results) > 0:
-            result.tpm_samples = calculate_tpm(result.query_results)
-            if result.tpm_samples:
-                tpm_values = [sample['tokens_per_minute'] for sample in result.tpm_samples]
-                result.average_tpm = sum(tpm_values) / len(tpm_values) if tpm_values else 0.0
-                result.peak_tpm = max(tpm_values) if tpm_values else 0.0
+        Returns:
+            不在進行中的測試回傳None（已完成的測試不再變動，直接使用test_results）
+        """
+        with self.lock:
+            test_info = self.active_tests.get(test_id)
+        if test_info is None or 'result' not in test_info:
+            return None
+        with test_info['lock']:
+            result = test_info['result']
+            return replace(
+                result,
+                query_results=result.query_results.copy(),
+                tpm_samples=list(result.tpm_samples),
+                latency_histogram=LatencyHistogram().merge(result.latency_histogram),
+                running_statistics=None
+            )
+
+    def get_test_aggregates(self, test_id: str) -> Optional[Dict]:
+        """
+        可直接相加合併的累計計數、直方圖與吞吐量時間桶（負載代理回報給主控端）
+
+        Returns:
+            status在測試完全結束前為running
+        """
+        with self.lock:
+            test_info = self.active_tests.get(test_id)
+        if test_info is None:
+            # 已完成的測試只保留在test_results中
+            result = self.test_results.get(test_id)
+            if result is None:
+                return None
+            return self._aggregates_from_result({'status': 'completed', 'error': None}, result)
+        with test_info['lock']:
+            aggregates = {'status': test_info['status'], 'error': test_info.get('error')}
+            if aggregates['status'] not in ('completed', 'error'):
+                aggregates['status'] = 'running'
+            result = test_info.get('result')
+            if result is None:
+                return aggregates
+            return self._aggregates_from_result(aggregates, result)
+    
+    @staticmethod
+    def _aggregates_from_result(aggregates: Dict, result: MultiUserTestResult) -> Dict:
+        """把測試結果的增量統計加入累計數據"""
+        running = result.running_statistics
+        aggregates.update({
+            'counters': running.counters(),
+            'latency_histogram': running.histogram.to_dict(),
+            'throughput': running.throughput.to_dict(),
+            'endpoints': {
+                endpoint: {
+                    'counters': statistics.counters(),
+                    'latency_histogram': statistics.histogram.to_dict()
+                } for endpoint, statistics in running.endpoints.items()
+            }
+        })
+        return aggregates
+    
+    def _apply_running_statistics(self, result: MultiUserTestResult):
+        """把增量統計的目前數值寫入測試結果（呼叫時須持有該測試的鎖）"""
+        running = result.running_statistics.summary()
+        result.total_queries = running['total_queries']
+        result.successful_queries = running['successful_queries']
+        result.failed_queries = running['failed_queries']
+        result.total_tokens = running['total_tokens']
+        result.average_response_time = running['average_response_time']
+        result.min_response_time = running['min_response_time']
+        result.max_response_time = running['max_response_time']
+        result.latency_percentiles = running['latency_percentiles']
+        if len(result.config.endpoints) > 1:
+            result.endpoint_statistics = result.running_statistics.endpoint_statistics()
+        if result.config.enable_tpm_monitoring:
+            result.average_tpm = running['average_tpm']
+            result.peak_tpm = running['peak_tpm']
 
     def _save_multi_user_test_to_database(self, test_id: str, config: MultiUserTestConfig, result: MultiUserTestResult):
         """保存多用戶測試結果到資料庫"""
+        # 負載代理執行的部分測試由主控端合併後保存
+        if not config.save_history:
+            return
         try:
             # 獲取當前硬體資訊
             hardware_info = get_hardware_info()
@@ -444,6 +954,20 @@ class MultiUserStressTestManager:
                 'max_response_time': result.max_response_time,
                 'average_tpm': result.average_tpm,
                 'peak_tpm': result.peak_tpm,
+                'total_prompt_tokens': result.total_prompt_tokens,
+                'token_stats': result.token_stats,
+                'latency_breakdown': result.latency_breakdown,
+                'connection_timing': result.connection_timing,
+                'schedule': result.schedule_statistics,
+                'soak': result.soak_statistics,
+                'spill': result.spill_statistics,
+                'throughput': result.throughput_statistics,
+                'agents': result.agent_statistics,
+                'endpoints': result.endpoint_statistics,
+                'backend': result.config.backend,
+                'latency_percentiles': result.latency_percentiles,
+                'latency_histogram': result.latency_histogram.to_dict(),
+                **result.streaming_statistics,
                 'user_count': config.user_count,
                 'queries_per_user': config.queries_per_user
             }
@@ -455,17 +979,33 @@ class MultiUserStressTestManager:
                         'user_id': r.user_id,
                         'prompt': r.prompt,
                         'response': r.response_text,  # 修正屬性名稱
+                        'response_length': r.response_length,
+                        'response_hash': r.response_hash,
                         'success': r.success,
                         'response_time': r.response_time,
                         'tokens_count': r.tokens_count,
                         'timestamp': r.timestamp.isoformat() if r.timestamp else None,
-                        'error_message': r.error_message
+                        'error_message': r.error_message,
+                        'ttft': r.ttft,
+                        'inter_token_latencies': r.inter_token_latencies,
+                        'decode_tokens_per_second': r.decode_tokens_per_second,
+                        **{field: getattr(r, field) for field in SERVER_METRIC_FIELDS},
+                        **{component: getattr(r, component) for component in LATENCY_COMPONENTS},
+                        'intended_start': r.intended_start,
+                        'schedule_lag': r.schedule_lag,
+                        'corrected_response_time': r.corrected_response_time,
+                        'endpoint': r.endpoint
                     } for r in result.query_results
                 ],
                 'tpm_samples': [
                     {
                         'timestamp': sample['timestamp'].isoformat(),
-                        'tokens_per_minute': sample['tokens_per_minute']
+                        'queries_count': sample['queries_count'],
+                        'tokens': sample['tokens'],
+                        'tokens_per_second': sample['tokens_per_second'],
+                        'tokens_per_minute': sample['tokens_per_minute'],
+                        'requests_per_second': sample['requests_per_second'],
+                        'in_flight': sample['in_flight']
                     } for sample in (result.tpm_samples or [])
                 ],
                 'user_sessions': {
@@ -477,11 +1017,14 @@ class MultiUserStressTestManager:
                     } for user_id, session in result.user_sessions.items()
                 }
             }
+            if result.spill_statistics:
+                # 溢寫的測試只保存最近的查詢結果；完整的每個查詢記錄在溢寫檔案中
+                test_results_data['spill_file'] = result.spill_statistics['path']
 
             # 準備保存的資料
             db_data = {
                 'test_id': test_id,
-                'test_name': f"多用戶並發測試_{result.start_time.strftime('%Y%m%d_%H%M%S')}",
+                'test_name': f"{'分散式多用戶測試' if config.agents else '多用戶並發測試'}_{result.start_time.strftime('%Y%m%d_%H%M%S')}",
                 'test_type': 2,  # 多用戶並發測試
                 'test_time': result.start_time,
                 'model_name': config.model,  # 修正屬性名稱
@@ -492,10 +1035,26 @@ class MultiUserStressTestManager:
                     'queries_per_user': config.queries_per_user,
                     'concurrent_limit': config.concurrent_limit,
                     'delay_between_queries': config.delay_between_queries,
+                    'engine': config.engine,
+                    'stream': config.stream,
+                    'arrival_mode': config.arrival_mode,
+                    'arrival_rate': config.arrival_rate,
+                    'rate_curve': config.rate_curve,
+                    'test_duration_minutes': config.test_duration_minutes,
+                    'soak': config.soak,
+                    'snapshot_interval_seconds': config.snapshot_interval_seconds,
                     'use_random_prompts': config.use_random_prompts,
                     'custom_prompts': config.custom_prompts,
                     'enable_tpm_monitoring': config.enable_tpm_monitoring,
-                    'enable_detailed_logging': config.enable_detailed_logging
+                    'enable_detailed_logging': config.enable_detailed_logging,
+                    'agents': config.agents,
+                    'endpoints': config.endpoints,
+                    'balance_strategy': config.balance_strategy,
+                    'backend': config.backend,
+                    'messages': config.messages,
+                    'spill_results': config.spill_results,
+                    'response_retention': config.response_retention,
+                    'response_sample_every': config.response_sample_every
                 },
                 'test_results': test_results_data,
                 'test_statistics': statistics,
@@ -503,7 +1062,9 @@ class MultiUserStressTestManager:
                 'total_requests': result.total_queries,
                 'successful_requests': result.successful_queries,
                 'failed_requests': result.failed_queries,
-                'avg_response_time': result.average_response_time
+                'avg_response_time': result.average_response_time,
+                'p99_response_time': result.latency_percentiles.get('p99'),
+                'p999_response_time': result.latency_percentiles.get('p999')
             }
 
             # 保存到資料庫
@@ -3,17 +3,26 @@
 """
 
 from dataclasses import dataclass
-from typing import List, Dict, Optional
+from typing import Dict, Iterable, List, Optional
 from datetime import datetime
 import random
 
+from arrival_schedule import validate_arrival_config
+from endpoint_balancer import BALANCE_ROUND_ROBIN, normalize_endpoints, validate_balance_strategy
+from latency_histogram import LatencyHistogram
+from record_store import RecordStore
+from ollama_backends import BACKEND_GENERATE, validate_backend
+from result_retention import DEFAULT_RESPONSE_SAMPLE_EVERY, RESPONSE_FULL, validate_response_retention
+from running_statistics import RunningQueryStatistics
+from throughput_series import build_throughput_series, choose_bucket_seconds
+
 @dataclass
 class MultiUserTestConfig:
     """多用戶並發測試配置"""
     model: str                          # 測試的模型名稱
     user_count: int                     # 模擬用戶數量 (1-10)
     queries_per_user: int               # 每個用戶的查詢次數
-    test_duration_minutes: Optional[int] = None  # 測試持續時間（分鐘），如果設定則忽略queries_per_user
+    test_duration_minutes: Optional[float] = None  # 測試持續時間（分鐘），如果設定則忽略queries_per_user
     
     # 提示詞相關
     use_random_prompts: bool = True     # 是否使用隨機提示詞
@@ -22,11 +31,41 @@ class MultiUserTestConfig:
     # 測試控制
     concurrent_limit: int = 10          # 最大並發限制
     delay_between_queries: float = 0.5  # 查詢間隔（秒）
+    engine: str = 'thread'              # 負載引擎: thread (線程池) 或 async (單一事件迴圈)
+    stream: bool = False                # 流式測量模式（記錄TTFT與Token間延遲）
+    
+    # 到達模式：closed為封閉迴路；constant/poisson/curve依排程發送，忽略查詢間隔
+    arrival_mode: str = 'closed'
+    arrival_rate: Optional[float] = None        # 每秒查詢數（constant/poisson）
+    rate_curve: Optional[List[List[float]]] = None  # [[秒, 每秒查詢數], ...]（curve）
+    
+    # 長時間測試：只保留最近的查詢結果，並定期產生彙總快照
+    soak: bool = False
+    snapshot_interval_seconds: float = 60.0
+    
+    # 回應內容：full全部保留；sampled每response_sample_every個保留一個；none只保留長度、雜湊與Token數
+    response_retention: str = RESPONSE_FULL
+    response_sample_every: int = DEFAULT_RESPONSE_SAMPLE_EVERY
+    
+    # 把每個查詢結果溢寫到磁碟、記憶體只保留最近的結果；None時依預定查詢數自動決定（見result_retention）
+    spill_results: Optional[bool] = None
     
     # 監控選項
     enable_tpm_monitoring: bool = True  # 啟用TPM監控
     enable_detailed_logging: bool = False  # 詳細日誌
     
+    # 分散式執行：由這些負載代理(load_agent.py)分擔用戶；代理本身執行的部分測試不保存歷史記錄
+    agents: Optional[List[str]] = None
+    save_history: bool = True
+    
+    # 多個Ollama端點：依負載平衡策略分散查詢（round_robin / least_outstanding / consistent_hash依用戶編號）
+    endpoints: Optional[List[str]] = None
+    balance_strategy: str = BALANCE_ROUND_ROBIN
+    
+    # 生成API：generate / chat / openai（OpenAI相容的chat completions）；messages為chat/openai提示詞之前的對話歷史
+    backend: str = BACKEND_GENERATE
+    messages: Optional[List[Dict]] = None
+    
     def __post_init__(self):
         """驗證配置參數"""
         if self.user_count < 1 or self.user_count > 10:
@@ -35,8 +74,26 @@ class MultiUserTestConfig:
         if self.queries_per_user < 1:
             raise ValueError("每用戶查詢次數必須大於0")
         
+        if self.test_duration_minutes is not None and self.test_duration_minutes <= 0:
+            raise ValueError("測試持續時間必須大於0")
+        
+        if self.snapshot_interval_seconds <= 0:
+            raise ValueError("快照間隔必須大於0")
+        
         if self.custom_prompts and len(self.custom_prompts) == 0:
             raise ValueError("自定義提示詞列表不能為空")
+        
+        if self.engine not in ('thread', 'async'):
+            raise ValueError("負載引擎必須是 thread 或 async")
+        
+        validate_arrival_config(self.arrival_mode, self.arrival_rate, self.rate_curve)
+        
+        validate_balance_strategy(self.balance_strategy)
+        self.endpoints = normalize_endpoints(self.endpoints)
+        
+        validate_backend(self.backend, self.messages)
+        
+        validate_response_retention(self.response_retention, self.response_sample_every)
 
 @dataclass
 class UserSession:
@@ -65,6 +122,44 @@ class QueryResult:
     timestamp: datetime
     success: bool
     error_message: Optional[str] = None
+    
+    # 流式測量指標（僅在stream模式下記錄）
+    ttft: Optional[float] = None                        # 首Token延遲（秒）
+    inter_token_latencies: Optional[List[float]] = None # Token間延遲（秒）
+    decode_tokens_per_second: Optional[float] = None    # 解碼速度
+    
+    # 伺服器回報的Token數量與耗時（奈秒），tokens_count取自eval_count
+    prompt_eval_count: Optional[int] = None
+    eval_count: Optional[int] = None
+    prompt_eval_duration: Optional[int] = None
+    eval_duration: Optional[int] = None
+    load_duration: Optional[int] = None
+    total_duration: Optional[int] = None
+    
+    # 延遲分解（秒）
+    client_queue_time: Optional[float] = None   # 在客戶端執行器中等待
+    network_time: Optional[float] = None        # 客戶端耗時減去伺服器總耗時
+    server_queue_time: Optional[float] = None   # 在Ollama佇列中等待
+    load_time: Optional[float] = None           # 模型載入
+    prefill_time: Optional[float] = None        # 預填充
+    decode_time: Optional[float] = None         # 解碼
+    
+    # 連線階段（秒，僅線程引擎記錄）：是否重用連線、DNS解析、連線建立、首位元組時間
+    connection_reused: Optional[bool] = None
+    dns_time: Optional[float] = None
+    connect_time: Optional[float] = None
+    ttfb: Optional[float] = None
+    
+    # 開放迴路排程（僅在非closed到達模式下記錄）
+    intended_start: Optional[float] = None           # 預定發送時間 (time.time())
+    schedule_lag: Optional[float] = None             # 實際發送落後預定時間的秒數
+    corrected_response_time: Optional[float] = None  # 從預定發送時間起算的延遲
+    
+    endpoint: Optional[str] = None  # 處理此查詢的Ollama端點
+    
+    # 未保留回應內容時（response_retention為sampled/none）的內容長度與雜湊
+    response_length: Optional[int] = None
+    response_hash: Optional[str] = None
 
 @dataclass
 class MultiUserTestResult:
@@ -77,8 +172,8 @@ class MultiUserTestResult:
     # 用戶會話
     user_sessions: Dict[int, UserSession] = None
     
-    # 查詢結果
-    query_results: List[QueryResult] = None
+    # 查詢結果（以欄位保存，迭代時為QueryResult）
+    query_results: RecordStore = None
     
     # 統計數據
     total_queries: int = 0
@@ -96,13 +191,77 @@ class MultiUserTestResult:
     min_response_time: float = 0.0
     max_response_time: float = 0.0
     
+    # 流式測量統計 (ttft_stats / inter_token_latency_stats / decode_tokens_per_second_stats)
+    streaming_statistics: Dict = None
+    
+    # 伺服器回報的Token統計（預填充/解碼吞吐量）
+    total_prompt_tokens: int = 0
+    token_stats: Dict = None
+    
+    # 延遲分解統計（每個組成的平均值與百分位數）
+    latency_breakdown: Dict = None
+    
+    # 連線重用率與DNS/連線/TTFB耗時的分布
+    connection_timing: Dict = None
+    
+    # 開放迴路排程統計（派發落後、實際到達率、修正後延遲）
+    schedule_statistics: Dict = None
+    
+    # 依時間執行/soak測試的定期快照與趨勢
+    soak_statistics: Dict = None
+    
+    # 成功查詢的回應時間直方圖（涵蓋全部查詢，soak模式下也包括已丟棄的結果）與其百分位數
+    latency_histogram: LatencyHistogram = None
+    latency_percentiles: Dict = None
+    
+    # 每完成一個查詢增量更新的即時統計（與latency_histogram共用直方圖）
+    running_statistics: RunningQueryStatistics = None
+    
+    # 吞吐量序列的整體統計（平均/峰值TPM、每秒請求數、最大進行中請求數）
+    throughput_statistics: Dict = None
+    
+    # 分散式測試各負載代理的摘要
+    agent_statistics: List[Dict] = None
+    
+    # 多端點測試各Ollama端點的請求數、延遲與吞吐量
+    endpoint_statistics: List[Dict] = None
+    
+    # 查詢結果溢寫檔案的路徑、筆數與大小；未溢寫時為空字典
+    spill_statistics: Dict = None
+    
     def __post_init__(self):
         if self.user_sessions is None:
             self.user_sessions = {}
+        if self.streaming_statistics is None:
+            self.streaming_statistics = {}
+        if self.token_stats is None:
+            self.token_stats = {}
+        if self.latency_breakdown is None:
+            self.latency_breakdown = {}
+        if self.connection_timing is None:
+            self.connection_timing = {}
+        if self.schedule_statistics is None:
+            self.schedule_statistics = {}
+        if self.soak_statistics is None:
+            self.soak_statistics = {}
         if self.query_results is None:
-            self.query_results = []
+            self.query_results = RecordStore(row_factory=QueryResult)
         if self.tpm_samples is None:
             self.tpm_samples = []
+        if self.latency_histogram is None:
+            self.latency_histogram = LatencyHistogram()
+        if self.latency_percentiles is None:
+            self.latency_percentiles = {}
+        if self.throughput_statistics is None:
+            self.throughput_statistics = {}
+        if self.spill_statistics is None:
+            self.spill_statistics = {}
+        if self.running_statistics is None:
+            # 依時間執行的測試依預定長度選擇時間桶，使即時序列的大小有上限
+            bucket_seconds = choose_bucket_seconds(
+                (self.config.test_duration_minutes or 0) * 60
+            )
+            self.running_statistics = RunningQueryStatistics(self.latency_histogram, bucket_seconds)
 
 # 50組常用提示詞庫
 COMMON_PROMPTS = [
@@ -184,37 +343,12 @@ def assign_prompts_to_users(user_count: int, queries_per_user: int) -> Dict[int,
     
     return user_prompts
 
-def calculate_tpm(query_results: List[QueryResult], time_window_minutes: int = 1) -> List[Dict]:
-    """計算每分鐘Token數量(TPM)"""
-    if not query_results:
-        return []
-    
-    # 按時間排序
-    sorted_results = sorted(query_results, key=lambda x: x.timestamp)
-    
-    start_time = sorted_results[0].timestamp
-    end_time = sorted_results[-1].timestamp
-    
-    tpm_samples = []
-    current_time = start_time
-    
-    while current_time <= end_time:
-        window_end = current_time.replace(second=0, microsecond=0)
-        window_start = window_end.replace(minute=window_end.minute - time_window_minutes if window_end.minute >= time_window_minutes else 0)
-        
-        # 計算時間窗口內的token總數
-        tokens_in_window = sum(
-            result.tokens_count for result in sorted_results
-            if window_start <= result.timestamp < window_end and result.success
-        )
-        
-        tpm_samples.append({
-            'timestamp': window_end,
-            'tokens_per_minute': tokens_in_window,
-            'queries_count': len([r for r in sorted_results if window_start <= r.timestamp < window_end])
-        })
-        
-        # 移動到下一分鐘
-        current_time = window_end.replace(minute=window_end.minute + 1)
-    
-    return tpm_samples
+def calculate_tpm(query_results: Iterable[QueryResult], bucket_seconds: Optional[float] = None) -> List[Dict]:
+    """
+    計算吞吐量時間序列（每個時間桶的滑動窗口TPM、tokens/秒、每秒請求數與進行中請求數）
+
+    Args:
+        query_results: 查詢結果
+        bucket_seconds: 時間桶大小（秒）；None時依測試長度選擇1/10/60秒
+    """
+    return build_throughput_series(query_results, bucket_seconds).series()
@@ -0,0 +1,164 @@
+"""
+Ollama API後端
+把 /api/generate、/api/chat 與OpenAI相容的 /v1/chat/completions 轉換為相同的結果格式：
+回應文字、流式區塊的文字，以及Token數量與伺服器耗時（SERVER_METRIC_FIELDS，後端未回報的欄位為None），
+讓同步/非同步客戶端在流式與非流式模式下都能使用任一後端，並以相同的統計比較各路徑的開銷
+"""
+
+import json
+from typing import Dict, List, Optional, Tuple
+
+from server_metrics import extract_server_metrics
+
+BACKEND_GENERATE = 'generate'
+BACKEND_CHAT = 'chat'
+BACKEND_OPENAI = 'openai'
+SUPPORTED_BACKENDS = (BACKEND_GENERATE, BACKEND_CHAT, BACKEND_OPENAI)
+
+MESSAGE_ROLES = ('system', 'user', 'assistant')
+
+# 流式區塊解析結果：(區塊文字, 含有Token數量/耗時的資料或None, 是否為最後一個區塊)
+Chunk = Tuple[str, Optional[Dict], bool]
+
+
+class GenerateBackend:
+    """/api/generate：單一提示詞，NDJSON流式回應，最後一個區塊(done)帶有Token數量與耗時"""
+
+    name = BACKEND_GENERATE
+    path = '/api/generate'
+
+    def __init__(self, messages: Optional[List[Dict]] = None):
+        """
+        Args:
+            messages: 放在提示詞之前的對話歷史（僅chat/openai後端使用）
+        """
+        self.messages = list(messages or [])
+
+    def payload(self, model: str, prompt: str, stream: bool) -> Dict:
+        return {"model": model, "prompt": prompt, "stream": stream}
+
+    def parse_chunk(self, line: bytes) -> Optional[Chunk]:
+        """解析流式回應的一行；空行或無法解析的行回傳None"""
+        line = line.strip()
+        if not line:
+            return None
+        try:
+            data = json.loads(line.decode('utf-8'))
+        except json.JSONDecodeError:
+            return None
+        done = bool(data.get('done', False))
+        return self.chunk_text(data), data if done else None, done
+
+    def chunk_text(self, data: Dict) -> str:
+        return data.get('response') or ''
+
+    def response_text(self, data: Dict) -> str:
+        """非流式回應的文字"""
+        return data.get('response', '')
+
+    def response_fields(self, data: Dict) -> Dict:
+        """非流式回應另外保留的欄位"""
+        return {'context': data.get('context', []), 'done': data.get('done', False)}
+
+    def metrics(self, data: Dict) -> Dict:
+        """Token數量與伺服器耗時（格式同extract_server_metrics）"""
+        return extract_server_metrics(data)
+
+
+class ChatBackend(GenerateBackend):
+    """/api/chat：對話歷史加上提示詞作為最後一則用戶訊息，回應在message.content"""
+
+    name = BACKEND_CHAT
+    path = '/api/chat'
+
+    def conversation(self, prompt: str) -> List[Dict]:
+        return self.messages + [{"role": "user", "content": prompt}]
+
+    def payload(self, model: str, prompt: str, stream: bool) -> Dict:
+        return {"model": model, "messages": self.conversation(prompt), "stream": stream}
+
+    def chunk_text(self, data: Dict) -> str:
+        return (data.get('message') or {}).get('content') or ''
+
+    def response_text(self, data: Dict) -> str:
+        return (data.get('message') or {}).get('content', '')
+
+    def response_fields(self, data: Dict) -> Dict:
+        return {'done': data.get('done', False)}
+
+
+class OpenAIChatBackend(ChatBackend):
+    """
+    OpenAI相容的 /v1/chat/completions：流式回應為SSE（data: ...，以 [DONE] 結束），
+    Token數量取自usage；此路徑不回報伺服器耗時，延遲分解只有客戶端部分
+    """
+
+    name = BACKEND_OPENAI
+    path = '/v1/chat/completions'
+
+    def payload(self, model: str, prompt: str, stream: bool) -> Dict:
+        payload = super().payload(model, prompt, stream)
+        if stream:
+            # 要求在最後一個區塊回報usage
+            payload["stream_options"] = {"include_usage": True}
+        return payload
+
+    def parse_chunk(self, line: bytes) -> Optional[Chunk]:
+        line = line.strip()
+        if not line.startswith(b'data:'):
+            return None
+        body = line[len(b'data:'):].strip()
+        if body == b'[DONE]':
+            return '', None, True
+        try:
+            data = json.loads(body.decode('utf-8'))
+        except json.JSONDecodeError:
+            return None
+        choices = data.get('choices') or []
+        text = ((choices[0].get('delta') or {}).get('content') or '') if choices else ''
+        return text, data if data.get('usage') else None, False
+
+    def response_text(self, data: Dict) -> str:
+        choices = data.get('choices') or []
+        return (choices[0].get('message') or {}).get('content', '') if choices else ''
+
+    def response_fields(self, data: Dict) -> Dict:
+        choices = data.get('choices') or []
+        return {'done': bool(choices and choices[0].get('finish_reason'))}
+
+    def metrics(self, data: Dict) -> Dict:
+        usage = data.get('usage') or {}
+        return extract_server_metrics({
+            'prompt_eval_count': usage.get('prompt_tokens'),
+            'eval_count': usage.get('completion_tokens')
+        })
+
+
+_BACKENDS = {backend.name: backend for backend in (GenerateBackend, ChatBackend, OpenAIChatBackend)}
+
+
+def validate_backend(backend: str, messages: Optional[List[Dict]] = None):
+    if backend not in SUPPORTED_BACKENDS:
+        raise ValueError(f"Unsupported backend: {backend}")
+    if not messages:
+        return
+    if backend == BACKEND_GENERATE:
+        raise ValueError("messages require the chat or openai backend")
+    for message in messages:
+        if not isinstance(message, dict) or message.get('role') not in MESSAGE_ROLES \
+                or not isinstance(message.get('content'), str):
+            raise ValueError("Each message must have a role (system/user/assistant) and string content")
+
+
+def create_backend(backend: str = BACKEND_GENERATE, messages: Optional[List[Dict]] = None) -> GenerateBackend:
+    """依名稱建立後端"""
+    validate_backend(backend, messages)
+    return _BACKENDS[backend](messages)
+
+
+def backend_options(config: Dict) -> Dict:
+    """由測試配置取得後端設定（backend、messages），可直接作為客戶端與負載引擎的關鍵字參數"""
+    backend = config.get('backend') or BACKEND_GENERATE
+    messages = config.get('messages') or None
+    validate_backend(backend, messages)
+    return {'backend': backend, 'messages': messages}
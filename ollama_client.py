@@ -1,20 +1,37 @@
 import requests
-import json
 import time
 from datetime import datetime
 from typing import List, Dict, Optional
+from connection_pool import DEFAULT_POOL_SIZE, PooledHTTPAdapter
+from endpoint_balancer import BALANCE_ROUND_ROBIN, EndpointBalancer, normalize_endpoints
+from ollama_backends import BACKEND_GENERATE, create_backend
+from streaming_metrics import summarize_token_timestamps
 
 class OllamaClient:
-    def __init__(self, base_url: str = "http://localhost:11434"):
+    def __init__(self, base_url: str = "http://localhost:11434", backend: str = BACKEND_GENERATE,
+                 messages: Optional[List[Dict]] = None, pool_size: int = DEFAULT_POOL_SIZE):
         """
         初始化Ollama客戶端
         
         Args:
             base_url: Ollama服務器的基礎URL
+            backend: 生成API（generate、chat或openai，見ollama_backends）
+            messages: 放在每個提示詞之前的對話歷史（僅chat/openai）
+            pool_size: 保留的連線數；多個線程共用客戶端時應不小於並發數，否則連線會被丟棄並重新建立
         """
         self.base_url = base_url.rstrip('/')
+        self.backend = create_backend(backend, messages)
         self.session = requests.Session()
         self.session.timeout = 30
+        # 連線池：依並發數保留連線，並記錄每個請求的連線重用與DNS/連線/TTFB耗時
+        adapter = PooledHTTPAdapter(max(1, int(pool_size)))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.connections = adapter.tracker
+    
+    def connection_statistics(self) -> Dict:
+        """連線池大小與連線重用/新建/丟棄次數"""
+        return self.connections.snapshot()
     
     def is_server_available(self) -> bool:
         """檢查Ollama服務器是否可用"""
@@ -64,60 +81,68 @@ class OllamaClient:
             包含回應資訊的字典
         """
         start_time = time.time()
+        self.connections.begin()
         
         try:
-            payload = {
-                "model": model,
-                "prompt": prompt,
-                "stream": stream
-            }
-            
-            response = self.session.post(
-                f"{self.base_url}/api/generate",
-                json=payload,
-                timeout=120
-            )
-            
-            response.raise_for_status()
+            # 以with關閉回應：流式回應在讀完或中途失敗時都會釋放連線回連線池
+            with self.session.post(
+                f"{self.base_url}{self.backend.path}",
+                json=self.backend.payload(model, prompt, stream),
+                timeout=120,
+                stream=stream
+            ) as response:
+                response.raise_for_status()
+                connection_timing = self.connections.last_request()
             
-            if stream:
-                # 處理流式回應
-                full_response = ""
-                for line in response.iter_lines():
-                    if line:
-                        try:
-                            data = json.loads(line.decode('utf-8'))
-                            if 'response' in data:
-                                full_response += data['response']
-                            if data.get('done', False):
-                                break
-                        except json.JSONDecodeError:
+                if stream:
+                    # 處理流式回應，記錄每個Token區塊的到達時間
+                    chunks = []
+                    token_times = []
+                    final_data = {}
+                    for line in response.iter_lines():
+                        chunk = self.backend.parse_chunk(line)
+                        if chunk is None:
                             continue
+                        text, metrics_data, done = chunk
+                        if text:
+                            token_times.append(time.time())
+                            chunks.append(text)
+                        if metrics_data is not None:
+                            final_data = metrics_data
+                        if done:
+                            break
                 
-                end_time = time.time()
-                return {
-                    'success': True,
-                    'response': full_response,
-                    'model': model,
-                    'prompt': prompt,
-                    'response_time': end_time - start_time,
-                    'timestamp': datetime.now().isoformat()
-                }
-            else:
-                # 處理非流式回應
-                data = response.json()
-                end_time = time.time()
+                    end_time = time.time()
+                    result = {
+                        'success': True,
+                        'response': ''.join(chunks),
+                        'model': model,
+                        'prompt': prompt,
+                        'response_time': end_time - start_time,
+                        'timestamp': datetime.now().isoformat(),
+                        'backend': self.backend.name,
+                        **connection_timing
+                    }
+                    result.update(summarize_token_timestamps(start_time, token_times))
+                    result.update(self.backend.metrics(final_data))
+                    return result
+                else:
+                    # 處理非流式回應
+                    data = response.json()
+                    end_time = time.time()
                 
-                return {
-                    'success': True,
-                    'response': data.get('response', ''),
-                    'model': model,
-                    'prompt': prompt,
-                    'response_time': end_time - start_time,
-                    'timestamp': datetime.now().isoformat(),
-                    'context': data.get('context', []),
-                    'done': data.get('done', False)
-                }
+                    return {
+                        'success': True,
+                        'response': self.backend.response_text(data),
+                        'model': model,
+                        'prompt': prompt,
+                        'response_time': end_time - start_time,
+                        'timestamp': datetime.now().isoformat(),
+                        'backend': self.backend.name,
+                        **connection_timing,
+                        **self.backend.response_fields(data),
+                        **self.backend.metrics(data)
+                    }
         
         except requests.exceptions.Timeout:
             return {
@@ -189,6 +214,59 @@ class OllamaClient:
         except Exception as e:
             return {'error': f'Failed to get model info: {str(e)}'}
 
+class MultiEndpointOllamaClient:
+    """把生成請求分散到多個Ollama端點的客戶端"""
+
+    def __init__(self, endpoints: Optional[List[str]] = None, balance_strategy: str = BALANCE_ROUND_ROBIN,
+                 backend: str = BACKEND_GENERATE, messages: Optional[List[Dict]] = None,
+                 pool_size: int = DEFAULT_POOL_SIZE):
+        """
+        Args:
+            endpoints: 端點URL列表；None時為本機的Ollama
+            balance_strategy: 負載平衡策略（見endpoint_balancer）
+            backend: 生成API（見ollama_backends）
+            messages: 放在每個提示詞之前的對話歷史（僅chat/openai）
+            pool_size: 每個端點保留的連線數（任一端點都可能同時承接全部並發請求）
+        """
+        self.balancer = EndpointBalancer(normalize_endpoints(endpoints), balance_strategy)
+        self.clients = {endpoint: OllamaClient(endpoint, backend, messages, pool_size)
+                        for endpoint in self.balancer.endpoints}
+
+    @property
+    def endpoints(self) -> List[str]:
+        return self.balancer.endpoints
+
+    def connection_statistics(self) -> Dict:
+        """各端點連線池計數的合計"""
+        totals = {}
+        for client in self.clients.values():
+            for key, value in client.connection_statistics().items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def unavailable_endpoints(self) -> List[str]:
+        return [endpoint for endpoint, client in self.clients.items() if not client.is_server_available()]
+
+    def is_server_available(self) -> bool:
+        """所有端點都可用時才回傳True（任一端點無法連線都會使各端點的比較失真）"""
+        return not self.unavailable_endpoints()
+
+    def generate_response(self, model: str, prompt: str, stream: bool = False,
+                          routing_key: Optional[str] = None) -> Dict:
+        """
+        由負載平衡選出的端點生成回應，回傳格式與OllamaClient.generate_response相同，另加上endpoint
+
+        Args:
+            routing_key: 一致性雜湊的鍵（例如用戶編號）
+        """
+        endpoint = self.balancer.acquire(routing_key)
+        try:
+            result = self.clients[endpoint].generate_response(model, prompt, stream=stream)
+        finally:
+            self.balancer.release(endpoint)
+        result['endpoint'] = endpoint
+        return result
+
 if __name__ == "__main__":
     # 測試Ollama客戶端
     client = OllamaClient()
@@ -0,0 +1,298 @@
+"""
+多行程負載引擎
+把並發數分配給數個工作行程，每個行程以自己的事件迴圈發送請求並解析回應；
+延遲分解、回應內容的保留方式與累計計數/直方圖都在工作行程中完成，
+結果以RecordStore的欄位格式分批經由佇列（管線）傳回主行程（不保留的回應內容不傳送），
+主行程只以欄位為單位接上每批結果並合併計數，避免單一Python行程成為被測量的瓶頸
+"""
+
+import multiprocessing
+import os
+import queue
+import time
+from typing import Callable, Dict, List, Optional
+
+from async_load_engine import AsyncLoadEngine, SUPPORTED_ENGINES
+from endpoint_balancer import BALANCE_ROUND_ROBIN, DEFAULT_ENDPOINT, normalize_endpoints
+from latency_histogram import LatencyHistogram
+from ollama_backends import BACKEND_GENERATE
+from record_store import RecordStore
+from result_log import count_result
+from result_retention import DEFAULT_RESPONSE_SAMPLE_EVERY, RESPONSE_FULL, ResponseBodyPolicy
+from server_metrics import latency_breakdown
+from worker_counters import WorkerCounters
+
+ENGINE_PROCESS = 'process'
+
+# 基礎壓力測試可使用的引擎（多用戶測試仍只支援 thread/async）
+BASIC_TEST_ENGINES = SUPPORTED_ENGINES + (ENGINE_PROCESS,)
+
+# 工作行程累積多少筆結果或多久（秒）送回一批
+RESULT_BATCH_SIZE = 500
+RESULT_FLUSH_INTERVAL = 0.2
+
+# 主行程等待結果佇列的間隔（秒），也是檢查停止請求的頻率
+_POLL_INTERVAL = 0.1
+
+
+def default_process_count(concurrency: int) -> int:
+    """預設行程數：CPU核心數，但不超過並發數"""
+    return max(1, min(os.cpu_count() or 1, concurrency))
+
+
+def split_concurrency(concurrency: int, processes: int) -> List[int]:
+    """把並發數盡量平均地分配給各行程，例如 10 分給 3 個行程為 [4, 3, 3]"""
+    processes = max(1, min(processes, concurrency))
+    base, extra = divmod(concurrency, processes)
+    return [base + (1 if i < extra else 0) for i in range(processes)]
+
+
+def _worker_main(index: int, concurrency: int, endpoints: List[str], balance_strategy: str,
+                 backend: str, messages: Optional[List[Dict]], model: str, prompt: str, stream: bool,
+                 latency_slo: Optional[float], response_retention: str, response_sample_every: int,
+                 shared, start_event, stop_event, results):
+    """
+    工作行程的進入點
+
+    行程啟動後先回報就緒並等待開始信號，使行程啟動時間不計入測量；
+    任務編號由共享記憶體中的計數器分配，各行程輪流取用；
+    每批結果以RecordStore連同這批的累計計數與直方圖送回，結束時另外送回本行程的直方圖與計數
+    """
+    results.put(('ready', index, None))
+    start_event.wait()
+    next_task, total_value, deadline_value = shared
+    # 共享數值以負數表示未設定
+    total_requests = total_value.value if total_value.value >= 0 else None
+    deadline = deadline_value.value if deadline_value.value >= 0 else None
+
+    worker_name = f"process-{index}"
+    response_policy = ResponseBodyPolicy(response_retention, response_sample_every)
+    histogram = LatencyHistogram()
+    counts = {'requests': 0, 'failed': 0}
+    batch = RecordStore()
+    batch_counters = WorkerCounters()
+    last_flush = time.time()
+
+    def tasks():
+        while deadline is None or time.time() < deadline:
+            with next_task.get_lock():
+                task_id = next_task.value
+                if total_requests is not None and task_id >= total_requests:
+                    return
+                next_task.value = task_id + 1
+            # 客戶端佇列時間從取得任務（開始等待工作槽位）起算，與其他引擎相同
+            yield task_id, time.time()
+
+    async def execute(client, task):
+        _, task_enqueued_at = task
+        client_queue_time = time.time() - task_enqueued_at
+        result = await client.generate_response(model, prompt, stream=stream)
+        result['client_queue_time'] = client_queue_time
+        return result
+
+    def flush():
+        nonlocal batch, batch_counters, last_flush
+        if batch:
+            results.put(('results', index, (batch, batch_counters.totals(), batch_counters.histograms())))
+            batch = RecordStore()
+            batch_counters = WorkerCounters()
+        last_flush = time.time()
+
+    def on_result(task, result):
+        # 與線程引擎的record_result相同的欄位，在送回前完成
+        result['task_id'] = task[0]
+        result['worker_thread'] = worker_name
+        result.update(latency_breakdown(result, result['response_time'], result.pop('client_queue_time')))
+        response_policy.apply(result)
+        count_result(batch_counters, result, latency_slo)
+        counts['requests'] += 1
+        if result.get('success'):
+            histogram.record(result['response_time'])
+        else:
+            counts['failed'] += 1
+        batch.append(result)
+        if len(batch) >= RESULT_BATCH_SIZE or time.time() - last_flush >= RESULT_FLUSH_INTERVAL:
+            flush()
+
+    try:
+        if stop_event.is_set():
+            raise Exception("Stopped before start")
+        AsyncLoadEngine(concurrency, endpoints=endpoints, balance_strategy=balance_strategy,
+                        backend=backend, messages=messages).run(
+            tasks(), execute, on_result, stop_event.is_set
+        )
+        flush()
+        results.put(('done', index, {
+            'pid': os.getpid(),
+            **counts,
+            'latency_histogram': histogram.to_dict()
+        }))
+    except Exception as e:
+        flush()
+        results.put(('error', index, str(e)))
+
+
+class ProcessLoadEngine:
+    """以數個工作行程驅動並行請求（封閉迴路）"""
+
+    def __init__(self, concurrency: int, processes: Optional[int] = None,
+                 base_url: str = DEFAULT_ENDPOINT, endpoints: Optional[List[str]] = None,
+                 balance_strategy: str = BALANCE_ROUND_ROBIN, backend: str = BACKEND_GENERATE,
+                 messages: Optional[List[Dict]] = None):
+        """
+        Args:
+            concurrency: 所有行程合計同時進行中的請求數
+            processes: 工作行程數；None時使用CPU核心數（不超過並發數）
+            base_url: Ollama服務器的基礎URL（未設定endpoints時使用）
+            endpoints: 多個Ollama端點；每個行程各自依balance_strategy分散請求
+                （least_outstanding只比較同一行程內的進行中請求數）
+            balance_strategy: 多端點的負載平衡策略
+            backend: 生成API（見ollama_backends）
+            messages: 放在每個提示詞之前的對話歷史（僅chat/openai）
+        """
+        self.concurrency = max(1, int(concurrency))
+        self.processes = int(processes) if processes else default_process_count(self.concurrency)
+        if self.processes < 1:
+            raise ValueError("worker_processes must be at least 1")
+        self.endpoints = normalize_endpoints(endpoints or [base_url])
+        self.balance_strategy = balance_strategy
+        self.backend = backend
+        self.messages = messages
+
+    def start(self, model: str, prompt: str, stream: bool, timeout: float = 60,
+              latency_slo: Optional[float] = None, response_retention: str = RESPONSE_FULL,
+              response_sample_every: int = DEFAULT_RESPONSE_SAMPLE_EVERY):
+        """
+        啟動工作行程並等待全部就緒（行程啟動與模組載入不計入測量時間）
+
+        Args:
+            timeout: 等待就緒的最長秒數
+            latency_slo: 延遲目標（秒），工作行程累計goodput時使用
+            response_retention / response_sample_every: 回應內容的保留方式（見ResponseBodyPolicy）；
+                在工作行程中處理，不保留的內容不會傳回主行程
+        """
+        # spawn：主行程是有多個線程的Flask服務，fork可能複製到持有中的鎖
+        context = multiprocessing.get_context('spawn')
+        self._shared = (context.Value('q', 0), context.Value('q', -1), context.Value('d', -1.0))
+        self._start_event = context.Event()
+        self._stop_event = context.Event()
+        self._results = context.Queue()
+
+        self.shares = split_concurrency(self.concurrency, self.processes)
+        self._workers = [
+            context.Process(
+                target=_worker_main,
+                args=(index, share, self.endpoints, self.balance_strategy, self.backend, self.messages,
+                      model, prompt, stream, latency_slo, response_retention, response_sample_every,
+                      self._shared, self._start_event, self._stop_event, self._results),
+                daemon=True
+            )
+            for index, share in enumerate(self.shares)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+        ready = 0
+        wait_until = time.time() + timeout
+        while ready < len(self._workers):
+            try:
+                kind, _, _ = self._results.get(timeout=max(0.0, wait_until - time.time()))
+            except queue.Empty:
+                self._shutdown()
+                raise Exception("Worker processes did not start in time")
+            if kind == 'ready':
+                ready += 1
+
+    def run(self, total_requests: Optional[int], deadline: Optional[float],
+            on_batch: Callable[[RecordStore, Dict[str, float], Dict[str, LatencyHistogram]], None],
+            should_stop: Callable[[], bool]) -> Dict:
+        """
+        通知已就緒的工作行程開始發送，並在目前線程中接收結果，直到所有行程結束
+
+        Args:
+            total_requests: 總請求數；None表示依deadline執行
+            deadline: 停止派發新請求的時間（epoch秒）；None表示依總請求數執行
+            on_batch: 每收到一批結果時以 (RecordStore, 累計計數, 直方圖) 呼叫（見ResultLog.append_batch）
+            should_stop: 回傳True時通知所有行程停止派發新任務
+
+        Returns:
+            各行程的請求數、失敗數與延遲百分位數，以及合併後的直方圖摘要
+        """
+        _, total_value, deadline_value = self._shared
+        total_value.value = total_requests if total_requests is not None else -1
+        deadline_value.value = deadline if deadline is not None else -1.0
+        self._start_event.set()
+
+        workers = self._workers
+        summaries: Dict[int, Dict] = {}
+        errors: Dict[int, str] = {}
+        exited_unreported = set()
+        try:
+            while len(summaries) + len(errors) < len(workers):
+                if should_stop():
+                    self._stop_event.set()
+                try:
+                    kind, index, payload = self._results.get(timeout=_POLL_INTERVAL)
+                except queue.Empty:
+                    # 行程已結束卻沒有回報：連續兩次輪詢都如此才視為異常結束（避免與最後一批結果競爭）
+                    for index, worker in enumerate(workers):
+                        if index in summaries or index in errors or worker.is_alive():
+                            continue
+                        if index in exited_unreported:
+                            errors[index] = f"Worker process exited with code {worker.exitcode}"
+                        else:
+                            exited_unreported.add(index)
+                    continue
+
+                if kind == 'results':
+                    on_batch(*payload)
+                elif kind == 'done':
+                    summaries[index] = payload
+                elif kind == 'error':
+                    errors[index] = payload
+        finally:
+            self._shutdown()
+
+        if errors and not summaries:
+            # 所有行程都失敗（例如服務器無法連線），與其他引擎一樣以例外結束測試
+            raise Exception(errors[min(errors)])
+
+        return self._merge_summaries(self.shares, summaries, errors)
+
+    def _shutdown(self):
+        """通知所有行程停止並等待結束"""
+        self._stop_event.set()
+        self._start_event.set()
+        for worker in self._workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+
+    @staticmethod
+    def _merge_summaries(shares: List[int], summaries: Dict[int, Dict], errors: Dict[int, str]) -> Dict:
+        """合併各行程的直方圖與計數"""
+        merged = LatencyHistogram()
+        workers = []
+        for index, share in enumerate(shares):
+            worker = {'index': index, 'concurrency': share}
+            if index in summaries:
+                summary = summaries[index]
+                histogram = LatencyHistogram.from_dict(summary['latency_histogram'])
+                merged.merge(histogram)
+                worker.update({
+                    'pid': summary['pid'],
+                    'requests': summary['requests'],
+                    'failed': summary['failed'],
+                    'latency_percentiles': histogram.summary()
+                })
+            else:
+                worker['error'] = errors.get(index)
+            workers.append(worker)
+
+        return {
+            'processes': len(shares),
+            'requests': sum(worker.get('requests', 0) for worker in workers),
+            'failed': sum(worker.get('failed', 0) for worker in workers),
+            'latency_percentiles': merged.summary(),
+            'workers': workers
+        }
@@ -0,0 +1,541 @@
+"""
+緊湊的每請求記錄儲存
+每個請求的結果原本是約30個鍵的字典（基礎測試）或QueryResult（多用戶測試），每筆約1~2KB。
+RecordStore改以欄位為單位保存：數值存放在array中，提示詞、模型等重複的字串以編號保存，
+時間戳記存為微秒整數，從未出現過值的欄位不佔空間；每筆的鍵集合（形狀）也以編號保存，
+讀回的字典與原本的鍵、順序及值相同。統計與圖表以column()直接讀取欄位，不需要重建每筆記錄
+"""
+
+import array
+import math
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# 以編號保存的字串欄位（重複出現的少數幾個值）；其餘字串（回應內容、錯誤訊息）逐筆保存
+INTERNED_FIELDS = frozenset(('prompt', 'model', 'backend', 'endpoint', 'worker_thread'))
+
+# ISO格式字串或datetime的時間戳記欄位，存為自epoch起的微秒數
+TIMESTAMP_FIELDS = frozenset(('timestamp',))
+
+# 單一欄位最多的不同字串數；超過時改為逐筆保存，避免長時間測試中編號表無限成長
+MAX_INTERNED_VALUES = 4096
+
+_INT_NONE = -2 ** 63
+_INT_MAX = 2 ** 63 - 1
+
+
+def _micros(value: datetime) -> int:
+    return round(value.timestamp() * 1_000_000)
+
+
+def _from_micros(micros: int) -> datetime:
+    seconds, microsecond = divmod(micros, 1_000_000)
+    return datetime.fromtimestamp(seconds).replace(microsecond=microsecond)
+
+
+class _NoneColumn:
+    """到目前為止只有None的欄位，不佔空間"""
+
+    def __init__(self, length: int = 0):
+        self.length = length
+
+    def __len__(self) -> int:
+        return self.length
+
+    def append(self, value) -> bool:
+        if value is not None:
+            return False
+        self.length += 1
+        return True
+
+    def get(self, index: int):
+        return None
+
+    def values(self, start: int, stop: int) -> List:
+        return [None] * (stop - start)
+
+    def delete_head(self, count: int):
+        self.length -= count
+
+    def slice(self, start: int, stop: int) -> '_NoneColumn':
+        return _NoneColumn(stop - start)
+
+    def nbytes(self) -> int:
+        return 0
+
+
+class _ArrayColumn:
+    """以array保存的欄位；None以哨兵值表示"""
+
+    typecode = 'd'
+    none = math.nan
+
+    def __init__(self, length: int = 0):
+        self.data = array.array(self.typecode, [self.none]) * length
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def encode(self, value):
+        """可保存時回傳編碼後的值，否則回傳None"""
+        raise NotImplementedError
+
+    def decode(self, raw):
+        return raw
+
+    def is_none(self, raw) -> bool:
+        return raw == self.none
+
+    def append(self, value) -> bool:
+        if value is None:
+            self.data.append(self.none)
+            return True
+        raw = self.encode(value)
+        if raw is None:
+            return False
+        self.data.append(raw)
+        return True
+
+    def get(self, index: int):
+        raw = self.data[index]
+        return None if self.is_none(raw) else self.decode(raw)
+
+    def values(self, start: int, stop: int) -> List:
+        none, decode = self.none, self.decode
+        if type(self).decode is _ArrayColumn.decode:
+            return [None if raw == none else raw for raw in self.data[start:stop]]
+        return [None if raw == none else decode(raw) for raw in self.data[start:stop]]
+
+    def delete_head(self, count: int):
+        del self.data[:count]
+
+    def slice(self, start: int, stop: int) -> '_ArrayColumn':
+        column = type(self)()
+        column.data = self.data[start:stop]
+        return column
+
+    def nbytes(self) -> int:
+        return self.data.buffer_info()[1] * self.data.itemsize
+
+
+class _FloatColumn(_ArrayColumn):
+    typecode = 'd'
+    none = math.nan
+
+    def encode(self, value):
+        if type(value) is float and value == value:
+            return value
+        return None
+
+    def is_none(self, raw) -> bool:
+        return raw != raw
+
+    def values(self, start: int, stop: int) -> List:
+        return [None if raw != raw else raw for raw in self.data[start:stop]]
+
+
+class _IntColumn(_ArrayColumn):
+    typecode = 'q'
+    none = _INT_NONE
+
+    def encode(self, value):
+        if type(value) is int and _INT_NONE < value <= _INT_MAX:
+            return value
+        return None
+
+
+class _BoolColumn(_ArrayColumn):
+    typecode = 'b'
+    none = -1
+
+    def encode(self, value):
+        if type(value) is bool:
+            return int(value)
+        return None
+
+    def decode(self, raw):
+        return raw == 1
+
+
+class _InternedColumn(_ArrayColumn):
+    """字串以編號保存，編號表與欄位一起複製"""
+
+    typecode = 'i'
+    none = -1
+
+    def __init__(self, length: int = 0):
+        super().__init__(length)
+        self.strings: List[str] = []
+        self.ids: Dict[str, int] = {}
+
+    def encode(self, value):
+        if type(value) is not str:
+            return None
+        string_id = self.ids.get(value)
+        if string_id is None:
+            if len(self.strings) >= MAX_INTERNED_VALUES:
+                return None
+            string_id = self.ids[value] = len(self.strings)
+            self.strings.append(value)
+        return string_id
+
+    def decode(self, raw):
+        return self.strings[raw]
+
+    def slice(self, start: int, stop: int) -> '_InternedColumn':
+        column = super().slice(start, stop)
+        column.strings = list(self.strings)
+        column.ids = dict(self.ids)
+        return column
+
+    def nbytes(self) -> int:
+        return super().nbytes() + sum(len(string) for string in self.strings)
+
+
+class _DatetimeColumn(_ArrayColumn):
+    """不含時區的datetime，存為微秒數"""
+
+    typecode = 'q'
+    none = _INT_NONE
+
+    def encode(self, value):
+        if type(value) is datetime and value.tzinfo is None:
+            return _micros(value)
+        return None
+
+    def decode(self, raw):
+        return _from_micros(raw)
+
+
+class _IsoColumn(_DatetimeColumn):
+    """datetime.isoformat()產生的字串，存為微秒數；無法原樣還原的字串不在此保存"""
+
+    def encode(self, value):
+        if type(value) is not str:
+            return None
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+        if parsed.tzinfo is not None or parsed.isoformat() != value:
+            return None
+        return _micros(parsed)
+
+    def decode(self, raw):
+        return _from_micros(raw).isoformat()
+
+
+class _ObjectColumn:
+    """無法以array保存的值（長字串、列表等）逐筆保存"""
+
+    def __init__(self, items: Optional[List] = None):
+        self.items = items if items is not None else []
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def append(self, value) -> bool:
+        self.items.append(value)
+        return True
+
+    def get(self, index: int):
+        return self.items[index]
+
+    def values(self, start: int, stop: int) -> List:
+        return self.items[start:stop]
+
+    def delete_head(self, count: int):
+        del self.items[:count]
+
+    def slice(self, start: int, stop: int) -> '_ObjectColumn':
+        return _ObjectColumn(self.items[start:stop])
+
+    def nbytes(self) -> int:
+        return len(self.items) * 8
+
+
+def _column_for(field: str, value: Any, length: int):
+    """依欄位名稱與第一個非None的值選擇欄位類型，並以None補齊前length筆"""
+    if type(value) is bool:
+        column = _BoolColumn(length)
+    elif type(value) is int:
+        column = _IntColumn(length)
+    elif type(value) is float:
+        column = _FloatColumn(length)
+    elif type(value) is datetime:
+        column = _DatetimeColumn(length)
+    elif type(value) is str and field in TIMESTAMP_FIELDS:
+        column = _IsoColumn(length)
+    elif type(value) is str and field in INTERNED_FIELDS:
+        column = _InternedColumn(length)
+    else:
+        return _ObjectColumn([None] * length)
+    return column if column.encode(value) is not None else _ObjectColumn([None] * length)
+
+
+def _concat_columns(own, theirs):
+    """
+    把theirs的值接在own之後，回傳接好的欄位（類型不同時改為逐筆保存，與append()遇到無法保存的值時相同）
+    """
+    if isinstance(theirs, _NoneColumn):
+        if isinstance(own, _NoneColumn):
+            own.length += theirs.length
+        elif isinstance(own, _ArrayColumn):
+            own.data.extend(array.array(own.typecode, [own.none]) * theirs.length)
+        else:
+            own.items.extend([None] * theirs.length)
+        return own
+    if isinstance(own, _NoneColumn):
+        # 沿用theirs的欄位類型（包括字串編號表），前面補上own的None
+        padded = theirs.slice(0, 0)
+        if isinstance(padded, _ArrayColumn):
+            padded.data = array.array(padded.typecode, [padded.none]) * own.length
+        else:
+            padded.items = [None] * own.length
+        own = padded
+    if isinstance(own, _InternedColumn) and isinstance(theirs, _InternedColumn):
+        mapping = [own.encode(string) for string in theirs.strings]
+        if None not in mapping:
+            if mapping == list(range(len(mapping))):
+                own.data.extend(theirs.data)
+            else:
+                none = own.none
+                own.data.extend(array.array(own.typecode, [none if raw == none else mapping[raw]
+                                                           for raw in theirs.data]))
+            return own
+    elif type(own) is type(theirs):
+        if isinstance(own, _ArrayColumn):
+            own.data.extend(theirs.data)
+        else:
+            own.items.extend(theirs.items)
+        return own
+    return _ObjectColumn(own.values(0, len(own)) + theirs.values(0, len(theirs)))
+
+
+class RecordStore:
+    """
+    以欄位保存的每請求記錄
+
+    append() 接受字典或具有 __dict__ 的物件（例如QueryResult）；迭代與索引回傳字典，
+    指定row_factory時回傳 row_factory(**記錄)。不是線程安全的，呼叫端須自行加鎖
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, row_factory: Optional[Callable[..., Any]] = None):
+        """
+        Args:
+            max_entries: 最多保留的記錄數（與deque的maxlen相同）；None表示全部保留
+            row_factory: 讀取單筆記錄時以欄位為關鍵字參數建立物件；None時回傳字典
+        """
+        self.max_entries = max_entries
+        self.row_factory = row_factory
+        self.dropped = 0  # 因max_entries而丟棄的記錄總數
+        self._columns: Dict[str, Any] = {}
+        self._shapes: List[tuple] = []
+        self._shape_ids: Dict[tuple, int] = {}
+        self._row_shapes = array.array('i')
+        self._hidden = 0  # 已丟棄但尚未從陣列刪除的記錄數
+
+    @classmethod
+    def from_records(cls, records: Iterable, row_factory: Optional[Callable[..., Any]] = None) -> 'RecordStore':
+        store = cls(row_factory=row_factory)
+        for record in records:
+            store.append(record)
+        return store
+
+    def append(self, record):
+        fields = record if isinstance(record, dict) else vars(record)
+        length = len(self._row_shapes)
+        for field, column in self._columns.items():
+            value = fields.get(field)
+            if not column.append(value):
+                self._columns[field] = column = self._widen(field, column, value, length)
+                column.append(value)
+        for field, value in fields.items():
+            if field not in self._columns:
+                column = _NoneColumn(length) if value is None else _column_for(field, value, length)
+                column.append(value)
+                self._columns[field] = column
+
+        shape = tuple(fields)
+        shape_id = self._shape_ids.get(shape)
+        if shape_id is None:
+            shape_id = self._shape_ids[shape] = len(self._shapes)
+            self._shapes.append(shape)
+        # 形狀最後寫入：len()只計入所有欄位都已寫入的記錄
+        self._row_shapes.append(shape_id)
+        self._trim()
+
+    def extend(self, records: Iterable):
+        for record in records:
+            self.append(record)
+
+    def extend_store(self, other: 'RecordStore'):
+        """
+        附加另一個RecordStore目前保留的記錄（例如工作行程分批送回的結果）；
+        以欄位為單位接上陣列，不重建每筆記錄
+        """
+        start, stop = other._bounds()
+        count = stop - start
+        if count == 0:
+            return
+        length = len(self._row_shapes)
+        fields = list(self._columns) + [field for field in other._columns if field not in self._columns]
+        for field in fields:
+            own = self._columns.get(field)
+            theirs = other._columns.get(field)
+            self._columns[field] = _concat_columns(
+                own if own is not None else _NoneColumn(length),
+                theirs.slice(start, stop) if theirs is not None else _NoneColumn(count)
+            )
+
+        shape_ids = []
+        for shape in other._shapes:
+            shape_id = self._shape_ids.get(shape)
+            if shape_id is None:
+                shape_id = self._shape_ids[shape] = len(self._shapes)
+                self._shapes.append(shape)
+            shape_ids.append(shape_id)
+        rows = other._row_shapes[start:stop]
+        if shape_ids != list(range(len(shape_ids))):
+            rows = array.array('i', [shape_ids[shape_id] for shape_id in rows])
+        self._row_shapes.extend(rows)
+        self._trim()
+
+    def _trim(self):
+        """超過max_entries的最舊記錄改為隱藏"""
+        if self.max_entries is None or len(self) <= self.max_entries:
+            return
+        excess = len(self) - self.max_entries
+        self._hidden += excess
+        self.dropped += excess
+        # 丟棄的記錄累積到max_entries筆時才一次刪除，使附加的成本維持攤銷O(1)
+        if self._hidden >= max(self.max_entries, 1):
+            for column in self._columns.values():
+                column.delete_head(self._hidden)
+            del self._row_shapes[:self._hidden]
+            self._hidden = 0
+
+    @staticmethod
+    def _widen(field: str, column, value, length: int):
+        """值無法以目前的欄位類型保存時，改用可保存它的欄位"""
+        if isinstance(column, _NoneColumn):
+            return _column_for(field, value, length)
+        return _ObjectColumn(column.values(0, length))
+
+    def __len__(self) -> int:
+        return len(self._row_shapes) - self._hidden
+
+    def _bounds(self):
+        return self._hidden, len(self._row_shapes)
+
+    def _record(self, index: int) -> Dict:
+        """第index筆（陣列中的位置）記錄的字典"""
+        columns = self._columns
+        return {field: columns[field].get(index) for field in self._shapes[self._row_shapes[index]]}
+
+    def _row(self, index: int):
+        record = self._record(index)
+        return self.row_factory(**record) if self.row_factory is not None else record
+
+    def __getitem__(self, index):
+        start, stop = self._bounds()
+        if isinstance(index, slice):
+            return [self._row(i) for i in range(start, stop)[index]]
+        if index < 0:
+            index += stop - start
+        if not 0 <= index < stop - start:
+            raise IndexError('record index out of range')
+        return self._row(start + index)
+
+    def __iter__(self) -> Iterator:
+        start, stop = self._bounds()
+        for index in range(start, stop):
+            yield self._row(index)
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def fields(self) -> List[str]:
+        return list(self._columns)
+
+    def column(self, field: str, where: Optional[Sequence[bool]] = None) -> List:
+        """
+        欄位在每筆記錄中的值（缺少此欄位的記錄為None）
+
+        Args:
+            where: 與記錄等長的布林序列；提供時只回傳其中為True的記錄
+        """
+        start, stop = self._bounds()
+        column = self._columns.get(field)
+        values = column.values(start, stop) if column is not None else [None] * (stop - start)
+        if where is None:
+            return values
+        return [value for value, selected in zip(values, where) if selected]
+
+    def seconds(self, field: str, where: Optional[Sequence[bool]] = None) -> List[Optional[float]]:
+        """時間戳記欄位自epoch起的秒數，不必建立datetime"""
+        start, stop = self._bounds()
+        column = self._columns.get(field)
+        if isinstance(column, _DatetimeColumn):
+            values = [None if raw == _INT_NONE else raw / 1_000_000 for raw in column.data[start:stop]]
+        else:
+            values = [None if value is None else
+                      (datetime.fromisoformat(value) if isinstance(value, str) else value).timestamp()
+                      for value in self.column(field)]
+        if where is None:
+            return values
+        return [value for value, selected in zip(values, where) if selected]
+
+    def raw_column(self, field: str) -> Optional[Tuple[array.array, Any]]:
+        """
+        以array保存的欄位中目前保留部分的副本，供向量化計算直接轉換（不逐筆建立Python物件）
+
+        Returns:
+            (array, 代表None的哨兵值)；時間戳記為微秒數、布林為0/1、字串為編號。
+            逐筆保存或不存在的欄位回傳None
+        """
+        column = self._columns.get(field)
+        if not isinstance(column, _ArrayColumn):
+            return None
+        start, stop = self._bounds()
+        return column.data[start:stop], column.none
+
+    def iter_fields(self, fields: Sequence[str], where: Optional[Sequence[bool]] = None) -> Iterator[Dict]:
+        """
+        逐筆產生只含指定欄位的小字典（供以字典為輸入的彙總函數使用，不重建完整記錄）
+
+        Args:
+            where: 與記錄等長的布林序列；提供時只產生其中為True的記錄
+        """
+        columns = [(field, self.column(field)) for field in fields]
+        length = len(columns[0][1]) if columns else len(self)
+        for index in range(length):
+            if where is None or where[index]:
+                yield {field: values[index] for field, values in columns}
+
+    def copy(self) -> 'RecordStore':
+        return self.tail(len(self))
+
+    def tail(self, count: int) -> 'RecordStore':
+        """最近count筆記錄的副本（複製陣列，不重建記錄）"""
+        start, stop = self._bounds()
+        start = max(start, stop - max(0, count))
+        store = RecordStore(self.max_entries, self.row_factory)
+        store.dropped = self.dropped + start - self._hidden
+        store._columns = {field: column.slice(start, stop) for field, column in self._columns.items()}
+        store._shapes = list(self._shapes)
+        store._shape_ids = dict(self._shape_ids)
+        store._row_shapes = self._row_shapes[start:stop]
+        return store
+
+    def nbytes(self) -> int:
+        """欄位陣列佔用的位元組數（逐筆保存的物件只計入參照）"""
+        return (sum(column.nbytes() for column in self._columns.values())
+                + self._row_shapes.buffer_info()[1] * self._row_shapes.itemsize)
+
+
+def as_record_store(records: Iterable, row_factory: Optional[Callable[..., Any]] = None) -> RecordStore:
+    """RecordStore原樣回傳；字典或物件的列表（例如歷史記錄）轉換為RecordStore"""
+    if isinstance(records, RecordStore):
+        return records
+    return RecordStore.from_records(records or [], row_factory)
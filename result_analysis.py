@@ -0,0 +1,418 @@
+"""
+結果的向量化分析
+統計與圖表需要的摘要統計、百分位數、各用戶分組、直方圖與時間桶，直接由RecordStore的欄位陣列計算。
+安裝NumPy時以NumPy陣列一次處理整欄（數值欄位由array緩衝區轉換，不逐筆建立Python物件）；
+沒有安裝時以純Python計算相同的結果，兩種方式回傳的字典格式相同
+"""
+
+import itertools
+import math
+import statistics
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # NumPy是選用的依賴
+    np = None
+
+from connection_pool import CONNECTION_TIMING_FIELDS, aggregate_connection_timing, connection_timing_summary
+from record_store import as_record_store
+from server_metrics import (
+    LATENCY_COMPONENTS, SERVER_METRIC_FIELDS, aggregate_latency_breakdown, aggregate_server_metrics,
+    server_metrics_from_totals
+)
+from streaming_metrics import aggregate_streaming_statistics, percentile, summarize_values
+
+HAS_NUMPY = np is not None
+
+# 百分位數摘要的欄位（與summarize_values相同）
+SUMMARY_PERCENTILES = (50, 90, 95, 99)
+
+
+def to_list(values: Sequence) -> List:
+    """轉為Python列表（plotly對NumPy陣列使用base64編碼，頁面載入的plotly.js 1.x無法讀取）"""
+    return values.tolist() if HAS_NUMPY and isinstance(values, np.ndarray) else list(values)
+
+
+def _number(value) -> float:
+    """NumPy的總和轉為Python數值；整數值回傳int（與逐筆加總整數欄位的結果相同）"""
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+def summarize(values: Sequence[float]) -> Dict:
+    """與 summarize_values() 相同的摘要統計（min/max/mean/p50/p90/p95/p99/count）"""
+    if not len(values):
+        return {}
+    if not HAS_NUMPY:
+        return summarize_values(values)
+
+    values = np.asarray(values, dtype=float)
+    # NumPy預設的線性插值與streaming_metrics.percentile相同
+    percentiles = np.percentile(values, SUMMARY_PERCENTILES)
+    return {
+        'min': float(values.min()),
+        'max': float(values.max()),
+        'mean': float(values.mean()),
+        **{f'p{pct}': float(value) for pct, value in zip(SUMMARY_PERCENTILES, percentiles)},
+        'count': int(len(values))
+    }
+
+
+def describe(values: Sequence[float]) -> Dict:
+    """回應時間統計：min/max/mean/median與樣本標準差（只有一筆時為0）"""
+    if not len(values):
+        return {}
+    if not HAS_NUMPY:
+        return {
+            'min': min(values),
+            'max': max(values),
+            'mean': statistics.mean(values),
+            'median': statistics.median(values),
+            'std_dev': statistics.stdev(values) if len(values) > 1 else 0
+        }
+
+    values = np.asarray(values, dtype=float)
+    return {
+        'min': float(values.min()),
+        'max': float(values.max()),
+        'mean': float(values.mean()),
+        'median': float(np.median(values)),
+        'std_dev': float(values.std(ddof=1)) if len(values) > 1 else 0
+    }
+
+
+def histogram(values: Sequence[float], bins: int = 20) -> Tuple[List[int], List[float]]:
+    """
+    等寬直方圖（與numpy.histogram相同：最後一個區間包含最大值，全部相同時以該值±0.5為範圍）
+
+    Returns:
+        (各區間的數量, bins+1個區間邊界)
+    """
+    if not len(values):
+        return [], []
+    if HAS_NUMPY:
+        counts, edges = np.histogram(np.asarray(values, dtype=float), bins=bins)
+        return counts.tolist(), edges.tolist()
+
+    low, high = min(values), max(values)
+    if low == high:
+        low, high = low - 0.5, high + 0.5
+    width = (high - low) / bins
+    counts = [0] * bins
+    for value in values:
+        counts[min(int((value - low) / width), bins - 1)] += 1
+    return counts, [low + width * i for i in range(bins)] + [high]
+
+
+def group_by(keys: Sequence, **columns: Sequence[float]) -> Dict:
+    """
+    依鍵分組計數與加總（單次走訪；NumPy時以bincount計算）
+
+    Args:
+        keys: 每筆記錄的分組鍵（例如user_id）
+        columns: 名稱 -> 與keys等長的數值，各組回傳其總和
+
+    Returns:
+        鍵 -> {'count': 筆數, 名稱: 總和, ...}，依鍵第一次出現的順序排列
+    """
+    if not len(keys):
+        return {}
+    if not HAS_NUMPY:
+        groups: Dict = {}
+        for index, key in enumerate(keys):
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = {'count': 0, **{name: 0 for name in columns}}
+            group['count'] += 1
+            for name, values in columns.items():
+                group[name] += values[index]
+        return groups
+
+    unique, first, inverse = np.unique(np.asarray(keys), return_index=True, return_inverse=True)
+    counts = np.bincount(inverse, minlength=len(unique))
+    sums = {name: np.bincount(inverse, weights=np.asarray(values, dtype=float), minlength=len(unique))
+            for name, values in columns.items()}
+    return {
+        unique[position].item(): {'count': int(counts[position]),
+                                  **{name: _number(total[position]) for name, total in sums.items()}}
+        for position in np.argsort(first, kind='stable')
+    }
+
+
+def sample_step(count: int, max_points: int) -> int:
+    """等距取樣的間隔（count不超過max_points時為1，即不取樣）"""
+    return max(1, math.ceil(count / max_points))
+
+
+def box_statistics(values: Sequence[float]) -> Dict:
+    """
+    箱線圖的預先計算統計：四分位數、Tukey圍欄（1.5倍IQR內的最小/最大值）與平均值
+
+    大型測試以此繪製箱線圖，不需要把每個數值都傳給圖表
+    """
+    if not len(values):
+        return {}
+    if HAS_NUMPY:
+        values = np.asarray(values, dtype=float)
+        q1, median, q3 = (float(value) for value in np.percentile(values, (25, 50, 75)))
+        low, high = q1 - 1.5 * (q3 - q1), q3 + 1.5 * (q3 - q1)
+        return {
+            'q1': q1, 'median': median, 'q3': q3,
+            'lowerfence': float(values[values >= low].min()),
+            'upperfence': float(values[values <= high].max()),
+            'mean': float(values.mean())
+        }
+
+    ordered = sorted(values)
+    q1, median, q3 = (percentile(ordered, pct) for pct in (25, 50, 75))
+    low, high = q1 - 1.5 * (q3 - q1), q3 + 1.5 * (q3 - q1)
+    return {
+        'q1': q1, 'median': median, 'q3': q3,
+        'lowerfence': next(value for value in ordered if value >= low),
+        'upperfence': next(value for value in reversed(ordered) if value <= high),
+        'mean': sum(ordered) / len(ordered)
+    }
+
+
+def span_seconds(starts: Sequence[float], ends: Sequence[float]) -> float:
+    """最早開始到最晚結束的秒數"""
+    if not len(starts):
+        return 0
+    if HAS_NUMPY:
+        return float(np.max(ends) - np.min(starts))
+    return max(ends) - min(starts)
+
+
+def time_buckets(starts: Sequence[float], ends: Sequence[float], tokens: Sequence[float],
+                 success: Sequence[bool], bucket_seconds: float) -> Dict[int, List[int]]:
+    """
+    把查詢依開始/完成時間放入固定長度的時間桶（ThroughputSeries.buckets的格式）
+
+    Returns:
+        桶編號 -> [完成數, 成功數, Token數, 開始數, 結束數]；Token數只計成功的查詢
+    """
+    if not len(starts):
+        return {}
+    if not HAS_NUMPY:
+        buckets: Dict[int, List[int]] = {}
+        for start, end, count, ok in zip(starts, ends, tokens, success):
+            index = int(end // bucket_seconds)
+            finished = buckets.get(index)
+            if finished is None:
+                finished = buckets[index] = [0, 0, 0, 0, 0]
+            finished[0] += 1
+            if ok:
+                finished[1] += 1
+                finished[2] += count
+            finished[4] += 1
+            index = int(start // bucket_seconds)
+            started = buckets.get(index)
+            if started is None:
+                started = buckets[index] = [0, 0, 0, 0, 0]
+            started[3] += 1
+        return buckets
+
+    ok = np.asarray(success, dtype=bool)
+    finished_index = np.floor_divide(np.asarray(ends, dtype=float), bucket_seconds).astype(np.int64)
+    started_index = np.floor_divide(np.asarray(starts, dtype=float), bucket_seconds).astype(np.int64)
+    indexes, inverse = np.unique(np.concatenate((finished_index, started_index)), return_inverse=True)
+    finished_slots, started_slots = inverse[:len(finished_index)], inverse[len(finished_index):]
+    size = len(indexes)
+    queries = np.bincount(finished_slots, minlength=size)
+    successful = np.bincount(finished_slots, weights=ok, minlength=size)
+    token_totals = np.bincount(finished_slots, weights=np.where(ok, np.asarray(tokens, dtype=float), 0),
+                               minlength=size)
+    started = np.bincount(started_slots, minlength=size)
+    return {
+        int(index): [int(queries[slot]), int(successful[slot]), int(token_totals[slot]),
+                     int(started[slot]), int(queries[slot])]
+        for slot, index in enumerate(indexes)
+    }
+
+
+class ResultAnalysis:
+    """
+    一組結果（RecordStore或結果的列表）的欄位讀取與彙總
+
+    mask()回傳的選取條件（NumPy布林陣列或布林列表）可傳給各方法的where參數；
+    values()回傳所選記錄中不為None的數值
+    """
+
+    def __init__(self, results: Iterable):
+        self.store = as_record_store(results)
+        self._numeric: Dict[str, Sequence] = {}
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def _numeric_column(self, field: str):
+        """NumPy時為float陣列（None為NaN），否則為含None的列表"""
+        cached = self._numeric.get(field)
+        if cached is not None:
+            return cached
+        if not HAS_NUMPY:
+            column = self.store.column(field)
+        else:
+            raw = self.store.raw_column(field)
+            if raw is None:
+                column = np.fromiter((math.nan if value is None else value for value in self.store.column(field)),
+                                     dtype=float, count=len(self.store))
+            else:
+                data, none = raw
+                stored = np.frombuffer(data, dtype=data.typecode) if len(data) else np.empty(0)
+                if data.typecode == 'd':
+                    column = stored
+                else:
+                    column = stored.astype(float)
+                    column[stored == none] = math.nan
+        self._numeric[field] = column
+        return column
+
+    def mask(self, field: str):
+        """欄位為真值的記錄"""
+        if not HAS_NUMPY:
+            return [bool(value) for value in self.store.column(field)]
+        raw = self.store.raw_column(field)
+        if raw is not None and raw[0].typecode == 'b':
+            return np.frombuffer(raw[0], dtype='b') == 1 if len(raw[0]) else np.zeros(0, dtype=bool)
+        return np.fromiter((bool(value) for value in self.store.column(field)), dtype=bool, count=len(self.store))
+
+    def present(self, field: str, where=None):
+        """欄位不為None（且符合where）的記錄"""
+        if not HAS_NUMPY:
+            column = self.store.column(field)
+            if where is None:
+                return [value is not None for value in column]
+            return [value is not None and selected for value, selected in zip(column, where)]
+        selected = ~np.isnan(self._numeric_column(field))
+        return selected if where is None else selected & where
+
+    @staticmethod
+    def count(where) -> int:
+        if HAS_NUMPY:
+            return int(np.count_nonzero(where))
+        return sum(1 for selected in where if selected)
+
+    @staticmethod
+    def any(where) -> bool:
+        return bool(np.any(where)) if HAS_NUMPY else any(where)
+
+    def sample(self, where, max_points: int):
+        """最多選取max_points筆的等距取樣（只從where選取的記錄中取樣），回傳同樣格式的選取條件"""
+        step = sample_step(self.count(where), max_points)
+        if step == 1:
+            return where
+        if HAS_NUMPY:
+            sampled = np.zeros(len(where), dtype=bool)
+            sampled[np.flatnonzero(where)[::step]] = True
+            return sampled
+        positions = set([index for index, selected in enumerate(where) if selected][::step])
+        return [index in positions for index in range(len(where))]
+
+    def values(self, field: str, where=None) -> Sequence[float]:
+        """所選記錄中不為None的數值（NumPy陣列或列表）"""
+        column = self._numeric_column(field)
+        if not HAS_NUMPY:
+            if where is None:
+                return [value for value in column if value is not None]
+            return [value for value, selected in zip(column, where) if selected and value is not None]
+        return column[self.present(field, where)]
+
+    def total(self, field: str, where=None) -> float:
+        """所選記錄中欄位的總和（None不計）"""
+        values = self.values(field, where)
+        return _number(np.sum(values)) if HAS_NUMPY else sum(values)
+
+    def keys(self, field: str, where=None) -> Sequence:
+        """分組鍵（例如user_id）；整數欄位直接由array轉換"""
+        raw = self.store.raw_column(field) if HAS_NUMPY else None
+        if raw is not None and raw[0].typecode in ('q', 'i'):
+            keys = np.frombuffer(raw[0], dtype=raw[0].typecode) if len(raw[0]) else np.empty(0, dtype=np.int64)
+            return keys if where is None else keys[where]
+        return self.store.column(field, where=where)
+
+    def seconds(self, field: str = 'timestamp') -> Sequence[Optional[float]]:
+        """時間戳記欄位自epoch起的秒數（NumPy時None為NaN）"""
+        if not HAS_NUMPY:
+            return self.store.seconds(field)
+        raw = self.store.raw_column(field)
+        if raw is None or raw[0].typecode != 'q':
+            return np.fromiter((math.nan if value is None else value for value in self.store.seconds(field)),
+                               dtype=float, count=len(self.store))
+        data, none = raw
+        micros = np.frombuffer(data, dtype='q') if len(data) else np.empty(0, dtype=np.int64)
+        seconds = micros / 1_000_000
+        seconds[micros == none] = math.nan
+        return seconds
+
+    def request_intervals(self) -> Tuple[Sequence[float], Sequence[float], Sequence[float], Sequence[bool]]:
+        """
+        有timestamp的查詢的 (開始時間, 完成時間, tokens_count, success)，供時間桶使用
+
+        開始時間為timestamp，完成時間為開始時間加上response_time
+        """
+        starts = self.seconds('timestamp')
+        durations = self._numeric_column('response_time')
+        tokens = self._numeric_column('tokens_count')
+        success = self.mask('success')
+        if not HAS_NUMPY:
+            rows = [(start, start + duration, count, ok)
+                    for start, duration, count, ok in zip(starts, durations, tokens, success) if start is not None]
+            return tuple(list(column) for column in zip(*rows)) if rows else ([], [], [], [])
+        selected = ~np.isnan(starts)
+        starts = starts[selected]
+        return starts, starts + durations[selected], np.nan_to_num(tokens[selected]), success[selected]
+
+    def server_metrics(self, where=None) -> Dict:
+        """伺服器指標彙總；沒有NumPy時直接以 aggregate_server_metrics() 計算"""
+        if not HAS_NUMPY:
+            return aggregate_server_metrics(self.store.iter_fields(SERVER_METRIC_FIELDS, where))
+        reported = self.present('eval_count', where)
+        totals = {field: self.total(field, reported) for field in SERVER_METRIC_FIELDS}
+        return server_metrics_from_totals(totals, self.count(reported))
+
+    def latency_breakdown(self, where=None) -> Dict:
+        """每個延遲組成的摘要統計；沒有NumPy時直接以 aggregate_latency_breakdown() 計算"""
+        if not HAS_NUMPY:
+            return aggregate_latency_breakdown(self.store.iter_fields(LATENCY_COMPONENTS, where))
+        breakdown = {}
+        for component in LATENCY_COMPONENTS:
+            values = self.values(component, where)
+            if len(values):
+                breakdown[component] = summarize(values)
+        return breakdown
+
+    def connection_timing(self, where=None) -> Dict:
+        """新建/重用連線數、重用率與各連線階段的分布；沒有NumPy時直接以 aggregate_connection_timing() 計算"""
+        if not HAS_NUMPY:
+            return aggregate_connection_timing(
+                self.store.iter_fields(('connection_reused',) + CONNECTION_TIMING_FIELDS, where))
+        recorded = self.present('connection_reused', where)
+        reused = self.count(recorded & self.mask('connection_reused'))
+        stages = {}
+        for field in CONNECTION_TIMING_FIELDS:
+            values = self.values(field, recorded)
+            if len(values):
+                stages[field] = summarize(values)
+        return connection_timing_summary(reused, self.count(recorded) - reused, stages)
+
+    def streaming_statistics(self, where=None) -> Dict:
+        """
+        流式測量請求（有ttft）的TTFT、Token間延遲與解碼速度；
+        沒有NumPy時直接以 aggregate_streaming_statistics() 計算
+        """
+        streamed = self.present('ttft', where)
+        if not self.any(streamed):
+            return {}
+        itl_lists = self.store.column('inter_token_latencies', where=streamed)
+        inter_token_latencies = itertools.chain.from_iterable(itls or [] for itls in itl_lists)
+        if not HAS_NUMPY:
+            return aggregate_streaming_statistics(self.values('ttft', streamed), list(inter_token_latencies),
+                                                  self.values('decode_tokens_per_second', streamed))
+        inter_token_latencies = np.fromiter(inter_token_latencies, dtype=float)
+        return {
+            'ttft_stats': summarize(self.values('ttft', streamed)),
+            'inter_token_latency_stats': summarize(inter_token_latencies),
+            'decode_tokens_per_second_stats': summarize(self.values('decode_tokens_per_second', streamed))
+        }
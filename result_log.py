@@ -0,0 +1,251 @@
+"""
+只能附加的測試結果記錄
+工作線程完成請求時附加一筆結果並更新累計數據；狀態查詢以游標(cursor)只取得新增的結果，
+不需要在每次完成或每次輪詢時複製整個結果列表。結果以RecordStore的欄位格式保存
+"""
+
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from endpoint_balancer import endpoint_summary
+from latency_histogram import LatencyHistogram
+from record_store import RecordStore
+from result_retention import ResultSpill
+from server_metrics import count_output_tokens
+from worker_counters import WorkerCounters
+
+
+def aggregates_from_totals(totals: Dict[str, float], histogram: LatencyHistogram) -> Dict:
+    """由累計計數與回應時間直方圖產生累計數據（也用於合併多個負載代理的計數）"""
+    successful = int(totals.get('successful', 0))
+    failed = int(totals.get('failed', 0))
+    response_time_sum = totals.get('response_time_sum', 0.0)
+    return {
+        'total_results': successful + failed,
+        'successful_results': successful,
+        'failed_results': failed,
+        'response_time_sum': response_time_sum,
+        'average_response_time': response_time_sum / successful if successful else 0.0,
+        'latency_percentiles': histogram.summary()
+    }
+
+
+def throughput_from_totals(totals: Dict[str, float], wall_clock_seconds: float,
+                           latency_slo: Optional[float] = None) -> Dict:
+    """
+    以實際經過時間計算的系統吞吐量與goodput
+
+    Args:
+        totals: 累計計數（successful、failed、output_tokens，設定延遲目標時另有good_requests、good_tokens）
+        wall_clock_seconds: 測量窗口的秒數
+        latency_slo: 延遲目標（秒）；None時不回報goodput
+    """
+    successful = int(totals.get('successful', 0))
+    output_tokens = int(totals.get('output_tokens', 0))
+    elapsed = max(wall_clock_seconds, 0.0)
+    throughput = {
+        'wall_clock_seconds': elapsed,
+        'requests_per_second': successful / elapsed if elapsed > 0 else 0.0,
+        'output_tokens': output_tokens,
+        'output_tokens_per_second': output_tokens / elapsed if elapsed > 0 else 0.0,
+        'latency_slo_seconds': latency_slo
+    }
+    if latency_slo is not None:
+        good_requests = int(totals.get('good_requests', 0))
+        good_tokens = int(totals.get('good_tokens', 0))
+        completed = successful + int(totals.get('failed', 0))
+        throughput.update({
+            'good_requests': good_requests,
+            'goodput_requests_per_second': good_requests / elapsed if elapsed > 0 else 0.0,
+            'goodput_tokens_per_second': good_tokens / elapsed if elapsed > 0 else 0.0,
+            # 失敗的請求視為未達標
+            'slo_attainment': good_requests / completed * 100 if completed else 0.0
+        })
+    return throughput
+
+
+# 各端點的計數器名稱為 "endpoint|<URL>|<計數器>"，與整體計數器放在同一組分片中
+ENDPOINT_COUNTER_PREFIX = 'endpoint|'
+
+
+def endpoint_counter(endpoint: str, name: str) -> str:
+    return f"{ENDPOINT_COUNTER_PREFIX}{endpoint}|{name}"
+
+
+def split_endpoint_totals(totals: Dict[str, float]) -> Dict[str, Dict[str, float]]:
+    """由累計計數取出各端點的計數：端點 -> {計數器: 數值}"""
+    endpoints: Dict[str, Dict[str, float]] = {}
+    for key, value in totals.items():
+        if key.startswith(ENDPOINT_COUNTER_PREFIX):
+            endpoint, _, name = key[len(ENDPOINT_COUNTER_PREFIX):].rpartition('|')
+            endpoints.setdefault(endpoint, {})[name] = value
+    return endpoints
+
+
+def endpoint_statistics_from_totals(totals: Dict[str, float], histograms: Dict[str, LatencyHistogram],
+                                    wall_clock_seconds: float) -> List[Dict]:
+    """
+    各端點的請求數、延遲與吞吐量（也用於合併多個負載代理的計數）
+
+    Args:
+        histograms: 端點 -> 該端點成功請求的回應時間直方圖
+    """
+    endpoints = split_endpoint_totals(totals)
+    total_requests = sum(int(counts.get('successful', 0) + counts.get('failed', 0))
+                         for counts in endpoints.values())
+    return [
+        endpoint_summary(
+            endpoint, int(counts.get('successful', 0)), int(counts.get('failed', 0)),
+            counts.get('response_time_sum', 0.0), int(counts.get('output_tokens', 0)),
+            histograms.get(endpoint) or LatencyHistogram(), wall_clock_seconds, total_requests
+        )
+        for endpoint, counts in sorted(endpoints.items())
+    ]
+
+
+def count_result(counters: WorkerCounters, result: Dict, latency_slo: Optional[float] = None):
+    """
+    把一筆結果計入累計數據；帶有endpoint的結果另外計入該端點
+
+    ResultLog.append使用，工作行程也以此在送回結果前先行累計
+    """
+    endpoint = result.get('endpoint')
+    if result.get('success'):
+        response_time = result.get('response_time', 0.0)
+        output_tokens = count_output_tokens(result, result.get('response', ''))
+        counters.add('successful')
+        counters.add('response_time_sum', response_time)
+        counters.add('output_tokens', output_tokens)
+        counters.record('response_time', response_time)
+        # 開放迴路的延遲從預定發送時間起算
+        latency = result.get('corrected_response_time', response_time)
+        if latency_slo is not None and latency <= latency_slo:
+            counters.add('good_requests')
+            counters.add('good_tokens', output_tokens)
+        if endpoint:
+            counters.add(endpoint_counter(endpoint, 'successful'))
+            counters.add(endpoint_counter(endpoint, 'response_time_sum'), response_time)
+            counters.add(endpoint_counter(endpoint, 'output_tokens'), output_tokens)
+            counters.record(endpoint_counter(endpoint, 'response_time'), response_time)
+    else:
+        counters.add('failed')
+        if endpoint:
+            counters.add(endpoint_counter(endpoint, 'failed'))
+
+
+class ResultLog:
+    """以絕對位置為游標的結果記錄，可選擇只保留最近的結果"""
+
+    def __init__(self, max_entries: Optional[int] = None, latency_slo: Optional[float] = None,
+                 spill: Optional[ResultSpill] = None):
+        """
+        Args:
+            max_entries: 最多保留的結果數；None表示全部保留。
+                超過時丟棄最舊的結果，但游標與累計數據仍涵蓋全部結果
+            latency_slo: 延遲目標（秒）；設定時另外累計在目標內完成的請求與Token（goodput）
+            spill: 設定時每筆結果另外寫入磁碟（通常搭配max_entries，使記憶體只保留最近的結果）
+        """
+        self.max_entries = max_entries
+        self.latency_slo = latency_slo
+        self.spill = spill
+        self.lock = threading.Lock()
+        # 超過max_entries時丟棄最舊的結果；_entries.dropped 即 _entries[0] 的絕對位置
+        self._entries = RecordStore(max_entries)
+        self.counters = WorkerCounters()
+
+    def append(self, result: Dict):
+        """附加一筆結果；累計數據記在呼叫線程自己的分片上"""
+        count_result(self.counters, result, self.latency_slo)
+
+        if self.spill is not None:
+            self.spill.append(result)
+
+        with self.lock:
+            self._entries.append(result)
+
+    def append_batch(self, records: RecordStore, totals: Dict[str, float],
+                     histograms: Dict[str, LatencyHistogram]):
+        """
+        附加一批已在其他行程以count_result累計的結果（以欄位為單位接上，不逐筆處理；溢寫時除外）
+
+        Args:
+            records: 這批結果
+            totals / histograms: 這批結果的累計計數與直方圖（WorkerCounters.totals() / histograms()）
+        """
+        self.counters.merge(totals, histograms)
+
+        if self.spill is not None:
+            for result in records:
+                self.spill.append(result)
+
+        with self.lock:
+            self._entries.extend_store(records)
+
+    @property
+    def cursor(self) -> int:
+        """下一筆結果的絕對位置（即目前附加過的結果總數）"""
+        with self.lock:
+            return self._entries.dropped + len(self._entries)
+
+    def since(self, cursor: int) -> Tuple[List[Dict], int]:
+        """
+        取得游標之後的結果
+
+        Args:
+            cursor: 上次呼叫回傳的游標；0表示從頭開始
+
+        Returns:
+            (結果列表, 新的游標)；游標指向已丟棄的結果時從仍保留的最舊結果開始
+        """
+        with self.lock:
+            dropped = self._entries.dropped
+            start = max(int(cursor), dropped) - dropped
+            return self._entries[start:], dropped + len(self._entries)
+
+    def entries(self) -> RecordStore:
+        """目前保留的結果（有上限時為最近的max_entries筆）的副本"""
+        with self.lock:
+            return self._entries.copy()
+
+    def latency_histogram(self) -> LatencyHistogram:
+        """涵蓋全部成功結果（包括已丟棄的結果）的回應時間直方圖"""
+        return self.counters.histogram('response_time')
+
+    def aggregates(self) -> Dict:
+        """涵蓋全部結果的累計數據"""
+        return aggregates_from_totals(self.counters.totals(), self.latency_histogram())
+
+    def throughput(self, wall_clock_seconds: float) -> Dict:
+        """
+        以實際經過時間計算的系統吞吐量與goodput
+
+        Args:
+            wall_clock_seconds: 測量窗口（測試開始至今或至全部請求結束）的秒數
+        """
+        return throughput_from_totals(self.counters.totals(), wall_clock_seconds, self.latency_slo)
+
+    def endpoint_histograms(self, totals: Optional[Dict[str, float]] = None) -> Dict[str, LatencyHistogram]:
+        """各端點成功請求的回應時間直方圖"""
+        totals = self.counters.totals() if totals is None else totals
+        return {endpoint: self.counters.histogram(endpoint_counter(endpoint, 'response_time'))
+                for endpoint in split_endpoint_totals(totals)}
+
+    def endpoint_statistics(self, wall_clock_seconds: float) -> List[Dict]:
+        """
+        各端點的統計；結果沒有endpoint欄位時為空列表
+
+        Args:
+            wall_clock_seconds: 測量窗口的秒數（各端點共用）
+        """
+        totals = self.counters.totals()
+        return endpoint_statistics_from_totals(totals, self.endpoint_histograms(totals), wall_clock_seconds)
+
+    def export(self) -> Dict:
+        """可JSON序列化的累計計數與直方圖，供負載代理回報後合併"""
+        totals = self.counters.totals()
+        return {
+            'counters': totals,
+            'latency_histogram': self.latency_histogram().to_dict(),
+            'endpoint_histograms': {endpoint: histogram.to_dict()
+                                    for endpoint, histogram in self.endpoint_histograms(totals).items()}
+        }
@@ -0,0 +1,334 @@
+"""
+已完成測試的保留策略
+測試管理器把已完成的測試放在記憶體中供狀態查詢與圖表使用；長時間執行的服務會不斷累積完整的回應內容。
+CompletedTestStore依數量、估計的位元組數 (LRU) 與存活時間 (TTL) 移除已完成的測試，移除後由歷史記錄提供；
+請求數很多的測試以ResultSpill在執行期間把每個請求的結果逐行寫入磁碟，記憶體只保留最近的結果；
+ResponseBodyPolicy依測試配置捨棄回應內容，只保留長度、內容雜湊與Token數
+"""
+
+import hashlib
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from record_store import RecordStore
+from server_metrics import count_output_tokens
+
+# 估計大型結果列表的大小時抽樣的筆數
+SIZE_SAMPLE = 200
+
+# 溢寫到磁碟時記憶體中保留的最近結果數（用於圖表與分布統計）
+SPILL_RECENT_RESULTS = 1000
+
+# 回應內容的保留方式
+RESPONSE_FULL = 'full'          # 保留每個回應的內容
+RESPONSE_SAMPLED = 'sampled'    # 每N個成功回應保留一個的內容
+RESPONSE_NONE = 'none'          # 不保留內容
+RESPONSE_RETENTION_MODES = (RESPONSE_FULL, RESPONSE_SAMPLED, RESPONSE_NONE)
+
+# sampled模式預設每100個回應保留一個
+DEFAULT_RESPONSE_SAMPLE_EVERY = 100
+
+_MISSING = object()
+
+
+@dataclass
+class RetentionPolicy:
+    """已完成測試的保留與溢寫設定"""
+    max_tests: Optional[int] = 20                    # 記憶體中最多保留的已完成測試數
+    max_bytes: Optional[int] = 512 * 1024 * 1024     # 已完成測試結果的估計總大小上限
+    ttl_seconds: Optional[float] = 3600              # 完成後保留的秒數
+    spill_threshold: Optional[int] = 100_000         # 預定請求數達到此數量時把結果溢寫到磁碟
+    spill_directory: str = 'result_spill'            # 溢寫檔案的目錄
+
+    def __post_init__(self):
+        """驗證設定；None表示不限制"""
+        if self.max_tests is not None and self.max_tests < 1:
+            raise ValueError("max_tests must be at least 1")
+        if self.max_bytes is not None and self.max_bytes <= 0:
+            raise ValueError("max_bytes must be greater than 0")
+        if self.ttl_seconds is not None and self.ttl_seconds <= 0:
+            raise ValueError("ttl_seconds must be greater than 0")
+        if self.spill_threshold is not None and self.spill_threshold < 1:
+            raise ValueError("spill_threshold must be at least 1")
+
+    def should_spill(self, planned_results: Optional[int], requested: Optional[bool] = None) -> bool:
+        """
+        是否把結果溢寫到磁碟
+
+        Args:
+            planned_results: 預定的請求數；依時間執行時為None
+            requested: 測試配置的spill_results；None時依spill_threshold自動決定
+        """
+        if requested is not None:
+            return bool(requested)
+        return (self.spill_threshold is not None and planned_results is not None
+                and planned_results >= self.spill_threshold)
+
+    def spill_path(self, test_id: str) -> str:
+        return os.path.join(self.spill_directory, f"{test_id}.jsonl")
+
+
+def _deep_size(obj: Any, seen: set) -> int:
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_size(key, seen) + _deep_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(_deep_size(item, seen) for item in obj)
+    elif hasattr(obj, '__dict__'):
+        size += _deep_size(vars(obj), seen)
+    return size
+
+
+def estimate_size(items: Sequence) -> int:
+    """
+    估計結果列表佔用的位元組數
+
+    超過SIZE_SAMPLE筆時只計算平均分布的樣本再依筆數放大，估計成本與列表長度無關；
+    RecordStore直接回報欄位陣列的大小
+    """
+    if isinstance(items, RecordStore):
+        return items.nbytes()
+    items = list(items) if isinstance(items, deque) else items
+    count = len(items)
+    if count == 0:
+        return sys.getsizeof(items)
+    step = max(1, count // SIZE_SAMPLE)
+    sample = items[::step]
+    seen: set = set()
+    sampled = sum(_deep_size(item, seen) for item in sample)
+    return sys.getsizeof(items) + int(sampled * count / len(sample))
+
+
+class CompletedTestStore:
+    """
+    以LRU與TTL限制記憶體用量的已完成測試字典
+
+    介面與dict相同（get、in、[]、pop），讀取時更新最近使用順序；
+    超過數量或大小上限時移除最久未使用的測試，但剛加入的測試一定保留，使最近一次測試總是可以查詢
+    """
+
+    def __init__(self, policy: Optional[RetentionPolicy] = None, sizer: Callable[[Any], int] = estimate_size,
+                 on_evict: Optional[Callable[[str, Any], None]] = None):
+        """
+        Args:
+            policy: 保留策略；None時使用預設值
+            sizer: 估計單一測試佔用位元組數的函數
+            on_evict: 測試因數量、大小或TTL被移除時以(test_id, 測試)呼叫（例如刪除溢寫檔案）；
+                呼叫時持有內部的鎖，不可再存取此字典
+        """
+        self.policy = policy or RetentionPolicy()
+        self.sizer = sizer
+        self.on_evict = on_evict
+        self._lock = threading.Lock()
+        self._tests: "OrderedDict[str, Any]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._stored_at: Dict[str, float] = {}
+        self.evictions = 0
+
+    def __setitem__(self, test_id: str, value: Any):
+        size = self.sizer(value)
+        with self._lock:
+            self._remove(test_id)
+            self._tests[test_id] = value
+            self._sizes[test_id] = size
+            self._stored_at[test_id] = time.time()
+            self._enforce(keep=test_id)
+
+    def get(self, test_id: str, default: Any = None) -> Any:
+        with self._lock:
+            self._expire()
+            if test_id not in self._tests:
+                return default
+            self._tests.move_to_end(test_id)
+            return self._tests[test_id]
+
+    def __getitem__(self, test_id: str) -> Any:
+        value = self.get(test_id, _MISSING)
+        if value is _MISSING:
+            raise KeyError(test_id)
+        return value
+
+    def __contains__(self, test_id: str) -> bool:
+        with self._lock:
+            self._expire()
+            return test_id in self._tests
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._expire()
+            return len(self._tests)
+
+    def pop(self, test_id: str, default: Any = None) -> Any:
+        with self._lock:
+            value = self._tests.get(test_id, default)
+            self._remove(test_id)
+            return value
+
+    def keys(self) -> List[str]:
+        with self._lock:
+            self._expire()
+            return list(self._tests)
+
+    def snapshot(self) -> Dict:
+        """目前保留的測試數、估計大小與累計移除數"""
+        with self._lock:
+            self._expire()
+            return {
+                'tests': len(self._tests),
+                'bytes': sum(self._sizes.values()),
+                'evictions': self.evictions,
+                'max_tests': self.policy.max_tests,
+                'max_bytes': self.policy.max_bytes,
+                'ttl_seconds': self.policy.ttl_seconds
+            }
+
+    def _remove(self, test_id: str):
+        self._tests.pop(test_id, None)
+        self._sizes.pop(test_id, None)
+        self._stored_at.pop(test_id, None)
+
+    def _evict(self, test_id: str):
+        value = self._tests.get(test_id)
+        self._remove(test_id)
+        self.evictions += 1
+        if self.on_evict is not None:
+            try:
+                self.on_evict(test_id, value)
+            except Exception as e:
+                print(f"Failed to clean up evicted test {test_id}: {e}")
+
+    def _expire(self):
+        ttl = self.policy.ttl_seconds
+        if ttl is None:
+            return
+        deadline = time.time() - ttl
+        for test_id in [test_id for test_id, stored_at in self._stored_at.items() if stored_at < deadline]:
+            self._evict(test_id)
+
+    def _enforce(self, keep: str):
+        self._expire()
+        max_tests = self.policy.max_tests
+        max_bytes = self.policy.max_bytes
+        for test_id in list(self._tests):
+            over_count = max_tests is not None and len(self._tests) > max_tests
+            over_bytes = max_bytes is not None and sum(self._sizes.values()) > max_bytes
+            if not (over_count or over_bytes):
+                break
+            if test_id != keep:
+                self._evict(test_id)
+
+
+class ResultSpill:
+    """把每個請求的結果逐行寫入JSONL檔案（多個線程可同時附加）"""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.records = 0
+        self._lock = threading.Lock()
+        self._file = open(path, 'w', encoding='utf-8')
+
+    def append(self, record: Dict):
+        """附加一筆結果；無法JSON序列化的值（例如datetime）以字串保存"""
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(line + '\n')
+            self.records += 1
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def summary(self) -> Dict:
+        """溢寫檔案的路徑、筆數與大小"""
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+            return {
+                'path': self.path,
+                'records': self.records,
+                'bytes': os.path.getsize(self.path) if os.path.exists(self.path) else 0
+            }
+
+
+def validate_response_retention(mode: str, sample_every: int):
+    if mode not in RESPONSE_RETENTION_MODES:
+        raise ValueError(f"Unsupported response_retention: {mode}")
+    if sample_every < 1:
+        raise ValueError("response_sample_every must be at least 1")
+
+
+class ResponseBodyPolicy:
+    """
+    依保留方式捨棄成功回應的內容
+
+    full以外的模式為每個成功回應記錄 response_length（字元數）與 response_hash（內容的BLAKE2b雜湊），
+    捨棄的內容以空字串取代；Token數在捨棄前取得，統計與圖表不需要回應內容
+    """
+
+    def __init__(self, mode: str = RESPONSE_FULL, sample_every: int = DEFAULT_RESPONSE_SAMPLE_EVERY):
+        """
+        Args:
+            mode: full / sampled / none
+            sample_every: sampled模式每幾個成功回應保留一個的內容
+        """
+        validate_response_retention(mode, sample_every)
+        self.mode = mode
+        self.sample_every = sample_every
+        self._responses = itertools.count()  # next()在多個線程間不會重複
+
+    def retain(self, text: str) -> Tuple[str, Dict]:
+        """
+        Returns:
+            (保留的內容, 摘要欄位)；full模式摘要為空字典，捨棄時內容為空字串
+        """
+        if self.mode == RESPONSE_FULL:
+            return text, {}
+        text = text or ''
+        summary = {
+            'response_length': len(text),
+            'response_hash': hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+        }
+        keep = self.mode == RESPONSE_SAMPLED and next(self._responses) % self.sample_every == 0
+        return (text if keep else ''), summary
+
+    def apply(self, result: Dict):
+        """處理基礎測試的結果字典（只處理成功的結果），捨棄前先以tokens_count記下輸出Token數"""
+        if self.mode == RESPONSE_FULL or not result.get('success'):
+            return
+        result['tokens_count'] = count_output_tokens(result, result.get('response', ''))
+        result['response'], summary = self.retain(result.get('response', ''))
+        result.update(summary)
+
+
+def remove_spill(path: Optional[str]):
+    """刪除溢寫檔案；檔案已不存在時忽略"""
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def read_spill(path: str) -> Iterator[Dict]:
+    """逐筆讀取溢寫檔案中的結果"""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
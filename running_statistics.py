@@ -0,0 +1,172 @@
+"""
+增量統計
+每完成一個查詢更新一次（計數、Token總數、Welford平均值/變異數、延遲直方圖、TPM環形緩衝），
+狀態查詢直接讀取目前數值，不需要重新掃描全部結果
+"""
+
+import math
+import time
+from typing import Dict, List, Optional
+
+from endpoint_balancer import endpoint_summary
+from latency_histogram import LatencyHistogram
+from throughput_series import ThroughputSeries
+
+
+class RunningStats:
+    """Welford演算法的線上平均值與變異數"""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    @property
+    def variance(self) -> float:
+        """樣本變異數（與 statistics.variance 相同，以 n-1 為分母）"""
+        return self._m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std_dev(self) -> float:
+        return math.sqrt(self.variance)
+
+
+class TokenRateWindow:
+    """以每秒一格的環形緩衝計算最近window_seconds秒內的Token數"""
+
+    def __init__(self, window_seconds: int = 60):
+        self.window_seconds = window_seconds
+        self._seconds: List[int] = [-1] * window_seconds  # 每一格目前代表的整數秒
+        self._tokens: List[int] = [0] * window_seconds
+
+    def add(self, timestamp: float, tokens: int):
+        second = int(timestamp)
+        slot = second % self.window_seconds
+        if self._seconds[slot] != second:
+            # 這一格屬於已經離開窗口的秒數，重新使用
+            self._seconds[slot] = second
+            self._tokens[slot] = 0
+        self._tokens[slot] += tokens
+
+    def tokens_in_window(self, now: Optional[float] = None) -> int:
+        """最近window_seconds秒（含目前這一秒）內的Token總數"""
+        current = int(time.time() if now is None else now)
+        oldest = current - self.window_seconds
+        return sum(tokens for second, tokens in zip(self._seconds, self._tokens)
+                   if oldest < second <= current)
+
+
+class RunningQueryStatistics:
+    """多用戶測試的即時統計；更新與summary()都是O(1)（TPM窗口為固定的60格），吞吐量序列另在繪圖時產生"""
+
+    def __init__(self, histogram: Optional[LatencyHistogram] = None, bucket_seconds: float = 1,
+                 tpm_window_seconds: int = 60):
+        """
+        Args:
+            histogram: 成功查詢回應時間的直方圖（可與測試結果共用同一個物件）
+            bucket_seconds: 吞吐量序列的時間桶大小
+            tpm_window_seconds: 即時TPM的滑動窗口長度
+        """
+        self.start_time = time.time()
+        self.total_queries = 0
+        self.successful_queries = 0
+        self.failed_queries = 0
+        self.total_tokens = 0
+        self.response_times = RunningStats()
+        self.histogram = histogram if histogram is not None else LatencyHistogram()
+        self.tpm_window = TokenRateWindow(tpm_window_seconds)
+        self.throughput = ThroughputSeries(bucket_seconds, tpm_window_seconds)
+        self.peak_tpm = 0.0
+        # 端點 -> 該端點的即時統計（只在查詢帶有endpoint時建立）
+        self.endpoints: Dict[str, 'RunningQueryStatistics'] = {}
+
+    def record(self, success: bool, response_time: float, tokens: int, completed_at: Optional[float] = None,
+               endpoint: Optional[str] = None):
+        """記錄一個完成的查詢；指定endpoint時另外計入該端點"""
+        completed_at = time.time() if completed_at is None else completed_at
+        if endpoint is not None:
+            statistics = self.endpoints.get(endpoint)
+            if statistics is None:
+                statistics = RunningQueryStatistics(bucket_seconds=self.throughput.bucket_seconds,
+                                                    tpm_window_seconds=self.tpm_window.window_seconds)
+                statistics.start_time = self.start_time
+                self.endpoints[endpoint] = statistics
+            statistics.record(success, response_time, tokens, completed_at)
+
+        self.total_queries += 1
+        self.throughput.add(completed_at - response_time, completed_at, tokens, success)
+        if not success:
+            self.failed_queries += 1
+            return
+
+        self.successful_queries += 1
+        self.total_tokens += tokens
+        self.response_times.add(response_time)
+        self.histogram.record(response_time)
+        self.tpm_window.add(completed_at, tokens)
+        # 窗口填滿前以實際經過時間換算，避免測試剛開始時低估
+        self.peak_tpm = max(self.peak_tpm, self.current_tpm(completed_at))
+
+    def current_tpm(self, now: Optional[float] = None) -> float:
+        """最近一個窗口的每分鐘Token數"""
+        now = time.time() if now is None else now
+        window = min(self.tpm_window.window_seconds, max(now - self.start_time, 1.0))
+        return self.tpm_window.tokens_in_window(now) / window * 60
+
+    def average_tpm(self, now: Optional[float] = None) -> float:
+        """測試開始至今的平均每分鐘Token數"""
+        now = time.time() if now is None else now
+        elapsed = now - self.start_time
+        return self.total_tokens / elapsed * 60 if elapsed > 0 else 0.0
+
+    def counters(self) -> Dict:
+        """可直接相加合併的計數（負載代理回報給主控端）"""
+        return {
+            'total_queries': self.total_queries,
+            'successful_queries': self.successful_queries,
+            'failed_queries': self.failed_queries,
+            'total_tokens': self.total_tokens,
+            'response_time_sum': self.response_times.mean * self.response_times.count
+        }
+
+    def endpoint_statistics(self, now: Optional[float] = None) -> List[Dict]:
+        """各端點的統計，吞吐量以測試開始至今的時間計算"""
+        elapsed = (time.time() if now is None else now) - self.start_time
+        total_queries = sum(statistics.total_queries for statistics in self.endpoints.values())
+        return [
+            endpoint_summary(
+                endpoint, statistics.successful_queries, statistics.failed_queries,
+                statistics.counters()['response_time_sum'], statistics.total_tokens,
+                statistics.histogram, elapsed, total_queries
+            )
+            for endpoint, statistics in sorted(self.endpoints.items())
+        ]
+
+    def summary(self) -> Dict:
+        now = time.time()
+        return {
+            'total_queries': self.total_queries,
+            'successful_queries': self.successful_queries,
+            'failed_queries': self.failed_queries,
+            'total_tokens': self.total_tokens,
+            'average_response_time': self.response_times.mean,
+            'min_response_time': self.response_times.min or 0.0,
+            'max_response_time': self.response_times.max or 0.0,
+            'response_time_std_dev': self.response_times.std_dev,
+            'current_tpm': self.current_tpm(now),
+            'average_tpm': self.average_tpm(now),
+            'peak_tpm': self.peak_tpm,
+            'latency_percentiles': self.histogram.summary()
+        }
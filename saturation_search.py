@@ -0,0 +1,465 @@
+"""
+容量搜尋（飽和點搜尋）
+逐步或以二分搜尋調整並發數（或到達率），每一步沿用StressTestManager執行一次基礎壓力測試，
+直到p95/p99延遲或錯誤率超出SLO，並找出吞吐量-延遲曲線的拐點(knee)
+"""
+
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from arrival_schedule import ARRIVAL_CLOSED, ARRIVAL_POISSON
+from database import db
+from hardware_info import get_hardware_info
+from record_store import as_record_store
+from stress_test_simple import StressTestManager
+from streaming_metrics import summarize_values
+
+SEARCH_CONCURRENCY = 'concurrency'    # 調整 concurrent_requests（封閉迴路）
+SEARCH_ARRIVAL_RATE = 'arrival_rate'  # 調整 arrival_rate（開放迴路）
+SUPPORTED_SEARCH_DIMENSIONS = (SEARCH_CONCURRENCY, SEARCH_ARRIVAL_RATE)
+
+STRATEGY_STEP = 'step'      # 由start每次增加step_size
+STRATEGY_BINARY = 'binary'  # 在start與max之間二分搜尋
+SUPPORTED_STRATEGIES = (STRATEGY_STEP, STRATEGY_BINARY)
+
+# 單一步驟測試的輪詢間隔（秒）
+_POLL_INTERVAL = 0.5
+
+# 單一步驟測試預設最多等待的秒數
+DEFAULT_STEP_TIMEOUT = 3600
+
+
+def evaluate_slo(step_metrics: Dict, slo: Dict) -> List[str]:
+    """
+    檢查單一步驟是否符合SLO
+
+    Args:
+        step_metrics: summarize_step 的結果
+        slo: 可包含 max_p95_latency、max_p99_latency（秒）與 max_error_rate（百分比）
+
+    Returns:
+        違反的SLO項目名稱列表；空列表表示通過
+    """
+    violations = []
+    if step_metrics['successful_requests'] == 0:
+        violations.append('no_successful_requests')
+    if slo.get('max_p95_latency') is not None and step_metrics['p95_latency'] > slo['max_p95_latency']:
+        violations.append('max_p95_latency')
+    if slo.get('max_p99_latency') is not None and step_metrics['p99_latency'] > slo['max_p99_latency']:
+        violations.append('max_p99_latency')
+    if slo.get('max_error_rate') is not None and step_metrics['error_rate'] > slo['max_error_rate']:
+        violations.append('max_error_rate')
+    return violations
+
+
+def summarize_step(test_status: Dict, results: Sequence[Dict]) -> Dict:
+    """
+    由一次基礎壓力測試的最終狀態與結果計算容量搜尋所需的指標
+
+    開放迴路測試使用從預定發送時間起算的延遲，吞吐量以測試的實際經過時間計算
+    """
+    results = as_record_store(results)
+    success = [bool(ok) for ok in results.column('success')]
+    successful = sum(success)
+    latencies = [response_time if corrected is None else corrected for response_time, corrected in zip(
+        results.column('response_time', where=success), results.column('corrected_response_time', where=success)
+    )]
+    latency_stats = summarize_values(latencies)
+    duration = test_status.get('duration') or 0
+    token_stats = test_status.get('statistics', {}).get('token_stats', {})
+
+    return {
+        'total_requests': len(results),
+        'successful_requests': successful,
+        'error_rate': (len(results) - successful) / len(results) * 100 if results else 100.0,
+        'p50_latency': latency_stats.get('p50', 0.0),
+        'p95_latency': latency_stats.get('p95', 0.0),
+        'p99_latency': latency_stats.get('p99', 0.0),
+        'mean_latency': latency_stats.get('mean', 0.0),
+        'duration': duration,
+        'throughput': successful / duration if duration > 0 else 0.0,
+        'output_tokens_per_second': token_stats.get('total_output_tokens', 0) / duration if duration > 0 else 0.0
+    }
+
+
+def find_knee(points: Sequence[Tuple[float, float]]) -> Optional[int]:
+    """
+    以Kneedle方法找出吞吐量-延遲曲線的拐點
+
+    Args:
+        points: (延遲, 吞吐量) 列表
+
+    Returns:
+        拐點在points中的索引；點數不足或曲線沒有變化時回傳None
+    """
+    if len(points) < 3:
+        return None
+
+    order = sorted(range(len(points)), key=lambda i: points[i][0])
+    xs = [points[i][0] for i in order]
+    ys = [points[i][1] for i in order]
+    x_range = xs[-1] - xs[0]
+    y_range = max(ys) - min(ys)
+    if x_range <= 0 or y_range <= 0:
+        return None
+
+    # 正規化到[0, 1]後，與對角線距離最大的點即為吞吐量增益開始遞減的位置
+    differences = [
+        (ys[i] - min(ys)) / y_range - (xs[i] - xs[0]) / x_range
+        for i in range(len(points))
+    ]
+    best = max(range(len(points)), key=lambda i: differences[i])
+    if differences[best] <= 0:
+        return None
+    return order[best]
+
+
+class SaturationSearchManager:
+    def __init__(self, stress_test_manager: StressTestManager):
+        """
+        Args:
+            stress_test_manager: 用來執行每一步測試的基礎壓力測試管理器
+        """
+        self.stress_test_manager = stress_test_manager
+        self.active_searches = {}
+        self.search_results = {}
+        self.lock = threading.Lock()
+
+    def start_search(self, config: Dict) -> str:
+        """開始容量搜尋"""
+        search_config = self._normalize_config(config)
+        search_id = str(uuid.uuid4())
+
+        with self.lock:
+            self.active_searches[search_id] = {
+                'config': search_config,
+                'status': 'starting',
+                'start_time': datetime.now(),
+                'progress': 0,
+                'steps': [],
+                'current_step_test_id': None,
+                'stop_requested': False
+            }
+
+        search_thread = threading.Thread(
+            target=self._run_search,
+            args=(search_id, search_config),
+            daemon=True
+        )
+        search_thread.start()
+
+        return search_id
+
+    def stop_search(self, search_id: str) -> bool:
+        """停止容量搜尋（同時停止進行中的步驟）"""
+        with self.lock:
+            if search_id not in self.active_searches:
+                return False
+            search = self.active_searches[search_id]
+            search['stop_requested'] = True
+            search['status'] = 'stopping'
+            step_test_id = search['current_step_test_id']
+
+        if step_test_id:
+            self.stress_test_manager.stop_test(step_test_id)
+        return True
+
+    def get_search_status(self, search_id: str) -> Optional[Dict]:
+        """獲取容量搜尋狀態"""
+        with self.lock:
+            if search_id in self.active_searches:
+                search = self.active_searches[search_id].copy()
+                search['steps'] = list(search['steps'])
+                return search
+            elif search_id in self.search_results:
+                return self.search_results[search_id].copy()
+            return None
+
+    def _normalize_config(self, config: Dict) -> Dict:
+        """檢查並補齊搜尋配置，不合法時拋出ValueError"""
+        for field in ('model', 'prompt', 'total_requests', 'start', 'max'):
+            if field not in config:
+                raise ValueError(f"Missing required field: {field}")
+
+        dimension = config.get('search_dimension', SEARCH_CONCURRENCY)
+        if dimension not in SUPPORTED_SEARCH_DIMENSIONS:
+            raise ValueError(f"Unsupported search dimension: {dimension}")
+        strategy = config.get('strategy', STRATEGY_STEP)
+        if strategy not in SUPPORTED_STRATEGIES:
+            raise ValueError(f"Unsupported search strategy: {strategy}")
+
+        slo = config.get('slo') or {}
+        if not any(slo.get(key) is not None for key in ('max_p95_latency', 'max_p99_latency', 'max_error_rate')):
+            raise ValueError("slo must define max_p95_latency, max_p99_latency or max_error_rate")
+
+        cast = int if dimension == SEARCH_CONCURRENCY else float
+        start, maximum = cast(config['start']), cast(config['max'])
+        if start <= 0 or maximum < start:
+            raise ValueError("start must be positive and not greater than max")
+
+        normalized = dict(config)
+        normalized.update({
+            'search_dimension': dimension,
+            'strategy': strategy,
+            'slo': slo,
+            'start': start,
+            'max': maximum,
+            'step_size': cast(config.get('step_size') or start),
+            # 二分搜尋在上下界差距小於此值時停止
+            'resolution': cast(config.get('resolution') or (1 if dimension == SEARCH_CONCURRENCY else start / 10)),
+            'max_steps': int(config.get('max_steps', 20)),
+            'step_timeout_seconds': float(config.get('step_timeout_seconds') or DEFAULT_STEP_TIMEOUT)
+        })
+        if normalized['step_size'] <= 0 or normalized['resolution'] <= 0:
+            raise ValueError("step_size and resolution must be positive")
+        if normalized['step_timeout_seconds'] <= 0:
+            raise ValueError("step_timeout_seconds must be greater than 0")
+        return normalized
+
+    def _run_search(self, search_id: str, config: Dict):
+        """執行容量搜尋的主要邏輯"""
+        try:
+            with self.lock:
+                self.active_searches[search_id]['status'] = 'running'
+
+            if config['strategy'] == STRATEGY_BINARY:
+                max_passing = self._binary_search(search_id, config)
+            else:
+                max_passing = self._step_search(search_id, config)
+
+            with self.lock:
+                search = self.active_searches[search_id]
+                search['statistics'] = self._calculate_search_statistics(search['steps'], config, max_passing)
+                search['progress'] = 100
+
+        except Exception as e:
+            with self.lock:
+                self.active_searches[search_id]['status'] = 'error'
+                self.active_searches[search_id]['error'] = str(e)
+
+        finally:
+            with self.lock:
+                if search_id in self.active_searches:
+                    search_data = self.active_searches.pop(search_id)
+                    search_data['end_time'] = datetime.now()
+                    search_data['duration'] = (search_data['end_time'] - search_data['start_time']).total_seconds()
+                    search_data['current_step_test_id'] = None
+
+                    if search_data.get('status') != 'error':
+                        search_data['status'] = 'completed'
+
+                    self.search_results[search_id] = search_data
+                    self._save_search_to_database(search_id, search_data)
+
+    def _step_search(self, search_id: str, config: Dict):
+        """由start每次增加step_size，直到違反SLO或達到max"""
+        max_passing = None
+        level = config['start']
+        while level <= config['max'] and not self._stop_requested(search_id):
+            step = self._run_step(search_id, config, level)
+            if step is None:
+                break
+            if not step['passed']:
+                break
+            max_passing = level
+            level += config['step_size']
+        return max_passing
+
+    def _binary_search(self, search_id: str, config: Dict):
+        """在start與max之間二分搜尋最後一個符合SLO的負載"""
+        low, high = config['start'], config['max']
+
+        step = self._run_step(search_id, config, low)
+        if step is None or not step['passed']:
+            return None
+        if high == low:
+            return low
+
+        step = self._run_step(search_id, config, high)
+        if step is None:
+            return low
+        if step['passed']:
+            return high
+
+        # 不變式：low符合SLO，high違反SLO
+        while high - low > config['resolution'] and not self._stop_requested(search_id):
+            with self.lock:
+                if len(self.active_searches[search_id]['steps']) >= config['max_steps']:
+                    break
+            mid = (low + high) // 2 if config['search_dimension'] == SEARCH_CONCURRENCY else (low + high) / 2
+            if mid in (low, high):
+                break
+            step = self._run_step(search_id, config, mid)
+            if step is None:
+                break
+            if step['passed']:
+                low = mid
+            else:
+                high = mid
+        return low
+
+    def _stop_requested(self, search_id: str) -> bool:
+        with self.lock:
+            return self.active_searches[search_id]['stop_requested']
+
+    def _build_step_config(self, search_id: str, config: Dict, level, step_number: int) -> Dict:
+        """依搜尋維度產生單一步驟的基礎壓力測試配置"""
+        step_config = {
+            'model': config['model'],
+            'prompt': config['prompt'],
+            'total_requests': int(config['total_requests']),
+            'engine': config.get('engine', 'thread'),
+            'stream': bool(config.get('stream', False)),
+            'parent_test_id': search_id,
+            'search_step': step_number
+        }
+        if config['search_dimension'] == SEARCH_CONCURRENCY:
+            step_config['concurrent_requests'] = level
+            # 每個並發槽位至少執行一次請求
+            step_config['total_requests'] = max(step_config['total_requests'], level)
+            step_config['arrival_mode'] = ARRIVAL_CLOSED
+        else:
+            step_config['concurrent_requests'] = int(config.get('concurrent_requests', 64))
+            step_config['arrival_mode'] = config.get('arrival_mode', ARRIVAL_POISSON)
+            step_config['arrival_rate'] = level
+        return step_config
+
+    def _run_step(self, search_id: str, config: Dict, level) -> Optional[Dict]:
+        """
+        以指定負載執行一步測試並等待完成
+
+        Returns:
+            步驟摘要；搜尋被停止或達到步驟上限時回傳None
+
+        Raises:
+            Exception: 步驟出錯、超過step_timeout_seconds仍未完成，或測試狀態已不存在
+                （例如已從記憶體移除且未保存歷史記錄）
+        """
+        with self.lock:
+            search = self.active_searches[search_id]
+            if search['stop_requested'] or len(search['steps']) >= config['max_steps']:
+                return None
+            step_number = len(search['steps']) + 1
+
+        step_config = self._build_step_config(search_id, config, level, step_number)
+        test_id = self.stress_test_manager.start_test(step_config)
+        with self.lock:
+            self.active_searches[search_id]['current_step_test_id'] = test_id
+
+        deadline = time.time() + config['step_timeout_seconds']
+        while True:
+            if self._stop_requested(search_id):
+                # stop_search可能在步驟登記前讀取current_step_test_id，此處再停止一次
+                self.stress_test_manager.stop_test(test_id)
+                with self.lock:
+                    self.active_searches[search_id]['current_step_test_id'] = None
+                return None
+            status = self.stress_test_manager.get_test_status(test_id)
+            if status is None:
+                raise Exception(f"Step {step_number} status is no longer available")
+            # end_time在測試移入結果存儲（並已寫入資料庫）後才會出現
+            if 'end_time' in status:
+                break
+            if time.time() >= deadline:
+                self.stress_test_manager.stop_test(test_id)
+                raise Exception(f"Step {step_number} did not finish within "
+                                f"{config['step_timeout_seconds']:g} seconds")
+            time.sleep(_POLL_INTERVAL)
+
+        if status.get('status') == 'error':
+            raise Exception(f"Step {step_number} failed: {status.get('error')}")
+
+        step_metrics = summarize_step(status, self.stress_test_manager.get_test_results(test_id) or [])
+        violations = evaluate_slo(step_metrics, config['slo'])
+        step = {
+            'step': step_number,
+            'test_id': test_id,
+            'level': level,
+            'passed': not violations,
+            'violations': violations,
+            **step_metrics
+        }
+
+        with self.lock:
+            search = self.active_searches[search_id]
+            search['current_step_test_id'] = None
+            if search['stop_requested']:
+                # 被中斷的步驟不代表該負載下的真實表現
+                return None
+            search['steps'].append(step)
+            search['progress'] = min(99, len(search['steps']) / config['max_steps'] * 100)
+        return step
+
+    def _calculate_search_statistics(self, steps: List[Dict], config: Dict, max_passing) -> Dict:
+        """彙總搜尋結果：符合SLO的最大負載與拐點"""
+        statistics = {
+            'search_dimension': config['search_dimension'],
+            'strategy': config['strategy'],
+            'slo': config['slo'],
+            'step_count': len(steps),
+            'max_passing_level': max_passing,
+            'knee': None
+        }
+
+        passing_steps = [s for s in steps if s['passed'] and s['level'] == max_passing]
+        if passing_steps:
+            best = passing_steps[-1]
+            statistics['max_passing_throughput'] = best['throughput']
+            statistics['max_passing_p95_latency'] = best['p95_latency']
+            statistics['max_passing_p99_latency'] = best['p99_latency']
+            statistics['max_passing_mean_latency'] = best['mean_latency']
+
+        measured = [s for s in steps if s['successful_requests'] > 0]
+        knee_index = find_knee([(s['p95_latency'], s['throughput']) for s in measured])
+        if knee_index is not None:
+            knee = measured[knee_index]
+            statistics['knee'] = {
+                'level': knee['level'],
+                'throughput': knee['throughput'],
+                'p95_latency': knee['p95_latency'],
+                'test_id': knee['test_id']
+            }
+        return statistics
+
+    def _save_search_to_database(self, search_id: str, search_data: Dict):
+        """保存容量搜尋摘要；各步驟已由StressTestManager以parent_test_id連結保存"""
+        try:
+            if search_data.get('status') != 'completed':
+                return
+
+            config = search_data.get('config', {})
+            steps = search_data.get('steps', [])
+            statistics = search_data.get('statistics', {})
+            total_requests = sum(s['total_requests'] for s in steps)
+            successful_requests = sum(s['successful_requests'] for s in steps)
+
+            db_data = {
+                'test_id': search_id,
+                'test_name': f"容量搜尋_{search_data['start_time'].strftime('%Y%m%d_%H%M%S')}",
+                'test_type': 3,  # 容量搜尋
+                'test_time': search_data['start_time'],
+                'model_name': config.get('model', ''),
+                'hardware_info': get_hardware_info(),
+                'test_config': config,
+                'test_results': {
+                    'steps': steps
+                },
+                'test_statistics': statistics,
+                'duration_seconds': search_data.get('duration', 0),
+                'total_requests': total_requests,
+                'successful_requests': successful_requests,
+                'failed_requests': total_requests - successful_requests,
+                'avg_response_time': statistics.get('max_passing_mean_latency', 0)
+            }
+
+            success = db.save_test_result(db_data)
+            if success:
+                print(f"Saturation search saved to database: {search_id}")
+            else:
+                print(f"Failed to save saturation search to database: {search_id}")
+
+        except Exception as e:
+            print(f"Error saving saturation search to database: {e}")
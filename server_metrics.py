@@ -0,0 +1,174 @@
+"""
+Ollama伺服器回報指標
+從 /api/generate 的最終回應擷取Token數量與各階段耗時（奈秒），並換算為吞吐量
+"""
+
+from typing import Dict, Iterable, Optional
+
+from streaming_metrics import summarize_values
+
+NS_PER_SECOND = 1_000_000_000
+
+# Ollama在完成回應(done=true)時回傳的欄位
+SERVER_METRIC_FIELDS = (
+    'prompt_eval_count',     # 輸入(預填充)Token數
+    'eval_count',            # 輸出(解碼)Token數
+    'prompt_eval_duration',  # 預填充耗時 (ns)
+    'eval_duration',         # 解碼耗時 (ns)
+    'load_duration',         # 模型載入耗時 (ns)
+    'total_duration'         # 伺服器端總耗時 (ns)
+)
+
+
+def extract_server_metrics(data: Dict) -> Dict:
+    """從Ollama回應中擷取Token數量與耗時，缺少的欄位為None"""
+    metrics = {field: data.get(field) for field in SERVER_METRIC_FIELDS}
+    metrics.update(server_throughput(metrics))
+    return metrics
+
+
+def _rate(count: Optional[int], duration_ns: Optional[int]) -> Optional[float]:
+    if not count or not duration_ns:
+        return None
+    return count / (duration_ns / NS_PER_SECOND)
+
+
+def server_throughput(metrics: Dict) -> Dict:
+    """根據伺服器耗時計算單一請求的預填充與解碼速度 (tokens/s)"""
+    return {
+        'prefill_tokens_per_second': _rate(metrics.get('prompt_eval_count'),
+                                           metrics.get('prompt_eval_duration')),
+        'eval_tokens_per_second': _rate(metrics.get('eval_count'),
+                                        metrics.get('eval_duration'))
+    }
+
+
+def count_output_tokens(metrics: Dict, response_text: str) -> int:
+    """
+    取得輸出Token數：優先使用伺服器回報的eval_count，
+    其次為捨棄回應內容前記下的tokens_count，
+    都沒有時才以空白分詞粗估（對中文會嚴重低估）
+    """
+    eval_count = metrics.get('eval_count')
+    if eval_count is not None:
+        return eval_count
+    if metrics.get('tokens_count') is not None:
+        return metrics['tokens_count']
+    return len(response_text.split()) if response_text else 0
+
+
+def aggregate_server_metrics(items: Iterable[Dict]) -> Dict:
+    """
+    彙總多個請求的伺服器指標
+
+    Args:
+        items: 每個元素為包含SERVER_METRIC_FIELDS的字典
+
+    Returns:
+        Token總數與以總耗時加權的預填充/解碼吞吐量；沒有任何伺服器指標時回傳空字典
+    """
+    totals = {field: 0 for field in SERVER_METRIC_FIELDS}
+    reported = 0
+
+    for item in items:
+        if item.get('eval_count') is None:
+            continue
+        reported += 1
+        for field in SERVER_METRIC_FIELDS:
+            totals[field] += item.get(field) or 0
+
+    return server_metrics_from_totals(totals, reported)
+
+
+def server_metrics_from_totals(totals: Dict[str, float], reported: int) -> Dict:
+    """
+    由各SERVER_METRIC_FIELDS的總和產生伺服器指標的彙總（也用於向量化計算的結果）
+
+    Args:
+        totals: 欄位 -> 有回報eval_count的請求中該欄位的總和
+        reported: 有回報eval_count的請求數
+
+    Returns:
+        伺服器未回報耗時（例如OpenAI相容後端只回報Token數）時，吞吐量與各階段時間為None
+    """
+    if reported == 0:
+        return {}
+
+    def average_time(field: str) -> Optional[float]:
+        # 以總耗時判斷伺服器是否回報耗時；有回報時模型載入等個別階段可以是0
+        if not totals.get('total_duration') and not totals.get(field):
+            return None
+        return (totals.get(field) or 0) / reported / NS_PER_SECOND
+
+    return {
+        'reported_requests': reported,
+        'total_prompt_tokens': totals['prompt_eval_count'],
+        'total_output_tokens': totals['eval_count'],
+        'average_prompt_tokens': totals['prompt_eval_count'] / reported,
+        'average_output_tokens': totals['eval_count'] / reported,
+        'prefill_tokens_per_second': _rate(totals['prompt_eval_count'], totals.get('prompt_eval_duration')),
+        'eval_tokens_per_second': _rate(totals['eval_count'], totals.get('eval_duration')),
+        'average_load_time': average_time('load_duration'),
+        'average_prefill_time': average_time('prompt_eval_duration'),
+        'average_decode_time': average_time('eval_duration'),
+        'average_server_time': average_time('total_duration')
+    }
+
+
+# 單一請求延遲分解的各個組成（依時間先後排列）
+LATENCY_COMPONENTS = (
+    'client_queue_time',   # 任務取出後等待客戶端工作槽位的時間（開放迴路為落後排程的時間）
+    'network_time',        # 客戶端觀測時間減去伺服器總耗時（連線、傳輸、解析）
+    'server_queue_time',   # 在Ollama排程佇列中等待（total減去load、prompt_eval、eval）
+    'load_time',           # 模型載入
+    'prefill_time',        # 預填充 (prompt_eval)
+    'decode_time'          # 解碼 (eval)
+)
+
+
+def latency_breakdown(metrics: Dict, response_time: float,
+                      client_queue_time: Optional[float] = None) -> Dict:
+    """
+    將單一請求的延遲分解為客戶端佇列、網路、伺服器佇列、模型載入、預填充與解碼
+
+    Args:
+        metrics: 含有SERVER_METRIC_FIELDS的字典
+        response_time: 客戶端量測的請求耗時（秒，不含客戶端佇列）
+        client_queue_time: 任務從開始等待客戶端工作槽位到請求送出的時間（秒）
+
+    Returns:
+        以LATENCY_COMPONENTS為鍵的字典；伺服器未回報耗時時僅包含客戶端部分
+    """
+    breakdown = {component: None for component in LATENCY_COMPONENTS}
+    breakdown['client_queue_time'] = client_queue_time
+
+    total_ns = metrics.get('total_duration')
+    if total_ns is None:
+        return breakdown
+
+    load_ns = metrics.get('load_duration') or 0
+    prefill_ns = metrics.get('prompt_eval_duration') or 0
+    decode_ns = metrics.get('eval_duration') or 0
+
+    breakdown['network_time'] = max(0.0, response_time - total_ns / NS_PER_SECOND)
+    breakdown['server_queue_time'] = max(0, total_ns - load_ns - prefill_ns - decode_ns) / NS_PER_SECOND
+    breakdown['load_time'] = load_ns / NS_PER_SECOND
+    breakdown['prefill_time'] = prefill_ns / NS_PER_SECOND
+    breakdown['decode_time'] = decode_ns / NS_PER_SECOND
+    return breakdown
+
+
+def aggregate_latency_breakdown(items: Iterable[Dict]) -> Dict:
+    """彙總每個延遲組成的平均值與百分位數"""
+    values = {component: [] for component in LATENCY_COMPONENTS}
+    for item in items:
+        for component in LATENCY_COMPONENTS:
+            value = item.get(component)
+            if value is not None:
+                values[component].append(value)
+
+    return {
+        component: summarize_values(component_values)
+        for component, component_values in values.items()
+        if component_values
+    }
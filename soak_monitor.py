@@ -0,0 +1,253 @@
+"""
+長時間(soak)測試監控
+以固定間隔產生彙總快照（吞吐量、延遲百分位數、錯誤率、Ollama與本程式的RSS），
+記憶體用量與測試長度無關，並以線性迴歸偵測延遲漂移與記憶體成長
+"""
+
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence
+
+import psutil
+
+from streaming_metrics import summarize_values
+
+# 每個快照區間最多保留的延遲樣本數（超過時以蓄水池抽樣）
+MAX_WINDOW_SAMPLES = 1000
+
+# 快照數量上限；超過時每隔一個丟棄，使解析度減半
+MAX_SNAPSHOTS = 1440
+
+# 結束時最後一段區間短於快照間隔的此比例時不產生快照（已有其他快照時）：
+# 收尾期間只有進行中的請求陸續完成，把短區間的Token數換算為每分鐘會嚴重高估峰值；累計數據仍包括這些請求
+MIN_FINAL_WINDOW_FRACTION = 0.5
+
+# 趨勢判定門檻：相對於第一個快照，每小時變化超過此百分比即視為漂移/成長
+LATENCY_DRIFT_PERCENT_PER_HOUR = 10.0
+THROUGHPUT_DROP_PERCENT_PER_HOUR = 10.0
+RSS_GROWTH_PERCENT_PER_HOUR = 5.0
+
+
+def get_process_rss(name_fragment: str = 'ollama') -> Optional[int]:
+    """加總名稱包含name_fragment的行程RSS（bytes），找不到時回傳None"""
+    total = 0
+    found = False
+    for process in psutil.process_iter(['name', 'memory_info']):
+        try:
+            name = process.info['name'] or ''
+            memory_info = process.info['memory_info']
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+        if name_fragment in name.lower() and memory_info is not None:
+            total += memory_info.rss
+            found = True
+    return total if found else None
+
+
+def linear_slope(xs: Sequence[float], ys: Sequence[float]) -> Optional[float]:
+    """最小平方法斜率；點數不足或x沒有變化時回傳None"""
+    if len(xs) < 2:
+        return None
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    variance = sum((x - mean_x) ** 2 for x in xs)
+    if variance == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance
+
+
+def detect_trends(snapshots: Sequence[Dict]) -> Dict:
+    """
+    偵測快照序列中的長期趨勢
+
+    Returns:
+        每個指標的每小時斜率、相對第一個快照的每小時變化百分比與是否超過門檻
+    """
+    checks = (
+        ('p95_latency', LATENCY_DRIFT_PERCENT_PER_HOUR, 'latency_drift'),
+        ('throughput', -THROUGHPUT_DROP_PERCENT_PER_HOUR, 'throughput_drop'),
+        ('server_rss_mb', RSS_GROWTH_PERCENT_PER_HOUR, 'server_rss_growth'),
+        ('client_rss_mb', RSS_GROWTH_PERCENT_PER_HOUR, 'client_rss_growth')
+    )
+    trends = {}
+    for metric, threshold, flag in checks:
+        points = [(s['elapsed'] / 3600, s[metric]) for s in snapshots if s.get(metric) is not None]
+        if len(points) < 3:
+            continue
+        slope = linear_slope([p[0] for p in points], [p[1] for p in points])
+        if slope is None:
+            continue
+        baseline = points[0][1]
+        percent_per_hour = slope / baseline * 100 if baseline else None
+        detected = percent_per_hour is not None and (
+            percent_per_hour > threshold if threshold > 0 else percent_per_hour < threshold
+        )
+        trends[metric] = {
+            'slope_per_hour': slope,
+            'percent_per_hour': percent_per_hour,
+            flag: detected
+        }
+    return trends
+
+
+class SoakMonitor:
+    """以背景線程定期產生快照的soak測試監控器"""
+
+    def __init__(self, interval: float = 60.0, server_process: str = 'ollama',
+                 on_snapshot: Optional[Callable[[Dict], None]] = None):
+        """
+        Args:
+            interval: 快照間隔（秒）
+            server_process: 用來量測伺服器RSS的行程名稱片段
+            on_snapshot: 每次產生快照後以 summary() 的結果呼叫
+        """
+        self.interval = interval
+        self.server_process = server_process
+        self.on_snapshot = on_snapshot
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+        self.start_time = time.time()
+        self.snapshots: List[Dict] = []
+        self.totals = {'requests': 0, 'successful': 0, 'failed': 0,
+                       'output_tokens': 0, 'response_time_sum': 0.0}
+        self._reset_window()
+
+    def _reset_window(self):
+        self.window_start = time.time()
+        self.window_requests = 0
+        self.window_failed = 0
+        self.window_tokens = 0
+        self.window_seen = 0
+        self.window_latencies: List[float] = []
+
+    def start(self):
+        """開始定期快照"""
+        self.start_time = time.time()
+        self._reset_window()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """停止定期快照；最後一段未滿間隔的區間夠長（或是唯一的區間）時為它產生快照"""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        self._take_snapshot(final=True)
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self._take_snapshot()
+            if self.on_snapshot:
+                self.on_snapshot(self.summary())
+
+    def record(self, success: bool, response_time: float, output_tokens: int = 0):
+        """記錄單一請求"""
+        with self.lock:
+            self.totals['requests'] += 1
+            self.window_requests += 1
+            if not success:
+                self.totals['failed'] += 1
+                self.window_failed += 1
+                return
+
+            self.totals['successful'] += 1
+            self.totals['output_tokens'] += output_tokens
+            self.totals['response_time_sum'] += response_time
+            self.window_tokens += output_tokens
+            self._sample_latency(response_time)
+
+    def record_batch(self, successful: int, failed: int, output_tokens: int,
+                     response_times: Sequence[float]):
+        """
+        記錄一批請求（例如工作行程送回的一批結果）
+
+        Args:
+            response_times: 這批成功請求的回應時間
+        """
+        with self.lock:
+            self.totals['requests'] += successful + failed
+            self.totals['successful'] += successful
+            self.totals['failed'] += failed
+            self.totals['output_tokens'] += output_tokens
+            self.totals['response_time_sum'] += sum(response_times)
+            self.window_requests += successful + failed
+            self.window_failed += failed
+            self.window_tokens += output_tokens
+            for response_time in response_times:
+                self._sample_latency(response_time)
+
+    def _sample_latency(self, response_time: float):
+        """蓄水池抽樣，使每個區間的樣本數有上限（呼叫時須持有lock）"""
+        self.window_seen += 1
+        if len(self.window_latencies) < MAX_WINDOW_SAMPLES:
+            self.window_latencies.append(response_time)
+        else:
+            index = random.randrange(self.window_seen)
+            if index < MAX_WINDOW_SAMPLES:
+                self.window_latencies[index] = response_time
+
+    def _take_snapshot(self, final: bool = False):
+        """
+        產生目前區間的快照
+
+        行程記憶體在取得lock之前讀取（get_process_rss逐一檢查所有行程），
+        lock只用於建立快照與重設區間，不阻塞記錄請求的線程
+
+        Args:
+            final: 測試結束時的最後一段區間；區間夠長（或是唯一的區間）且有請求時才產生快照
+        """
+        server_rss = get_process_rss(self.server_process)
+        client_rss = psutil.Process().memory_info().rss
+
+        with self.lock:
+            now = time.time()
+            window_seconds = now - self.window_start
+            if final and not (self.window_requests > 0 and (
+                    not self.snapshots or window_seconds >= self.interval * MIN_FINAL_WINDOW_FRACTION)):
+                return
+            window_seconds = max(window_seconds, 1e-9)
+            latency_stats = summarize_values(self.window_latencies)
+
+            self.snapshots.append({
+                'timestamp': datetime.now().isoformat(),
+                'elapsed': now - self.start_time,
+                'requests': self.window_requests,
+                'failed': self.window_failed,
+                'error_rate': self.window_failed / self.window_requests * 100 if self.window_requests else 0.0,
+                'throughput': (self.window_requests - self.window_failed) / window_seconds,
+                'tokens_per_minute': self.window_tokens / window_seconds * 60,
+                'p50_latency': latency_stats.get('p50'),
+                'p95_latency': latency_stats.get('p95'),
+                'p99_latency': latency_stats.get('p99'),
+                'mean_latency': latency_stats.get('mean'),
+                'server_rss_mb': server_rss / 1024 / 1024 if server_rss is not None else None,
+                'client_rss_mb': client_rss / 1024 / 1024
+            })
+            if len(self.snapshots) > MAX_SNAPSHOTS:
+                self.snapshots = self.snapshots[::2]
+            self._reset_window()
+
+    def summary(self) -> Dict:
+        """目前的累計數據、快照與趨勢"""
+        with self.lock:
+            totals = dict(self.totals)
+            snapshots = list(self.snapshots)
+
+        elapsed = time.time() - self.start_time
+        successful = totals['successful']
+        return {
+            'elapsed': elapsed,
+            'total_requests': totals['requests'],
+            'successful_requests': successful,
+            'failed_requests': totals['failed'],
+            'total_output_tokens': totals['output_tokens'],
+            'average_response_time': totals['response_time_sum'] / successful if successful else 0.0,
+            'average_tokens_per_minute': totals['output_tokens'] / elapsed * 60 if elapsed > 0 else 0.0,
+            'peak_tokens_per_minute': max((s['tokens_per_minute'] for s in snapshots), default=0.0),
+            'snapshots': snapshots,
+            'trends': detect_trends(snapshots)
+        }
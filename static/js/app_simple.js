@@ -4,6 +4,7 @@ let currentMultiUserTestId = null;
 let progressInterval = null;
 let multiUserProgressInterval = null;
 let testResults = [];
+let resultsCursor = 0;
 
 // 初始化
 document.addEventListener('DOMContentLoaded', function() {
@@ -247,9 +248,45 @@ function startTest(event) {
         model: model,
         concurrent_requests: concurrentRequests,
         total_requests: totalRequests,
-        prompt: prompt
+        prompt: prompt,
+        engine: document.getElementById('engine-select')?.value || 'thread',
+        stream: document.getElementById('stream-mode')?.checked || false
     };
 
+    const workerProcesses = parseInt(document.getElementById('worker-processes')?.value);
+    if (testConfig.engine === 'process' && workerProcesses > 0) {
+        testConfig.worker_processes = workerProcesses;
+    }
+
+    const loadProfile = buildLoadProfile(concurrentRequests);
+    if (loadProfile) {
+        testConfig.load_profile = loadProfile;
+    }
+
+    const durationMinutes = parseFloat(document.getElementById('test-duration')?.value);
+    if (durationMinutes > 0) {
+        testConfig.test_duration_minutes = durationMinutes;
+    }
+    testConfig.soak = document.getElementById('soak-mode')?.checked || false;
+
+    const agents = parseUrlList('load-agents');
+    if (agents.length > 0) {
+        testConfig.agents = agents;
+    }
+
+    const endpoints = parseUrlList('ollama-endpoints');
+    if (endpoints.length > 0) {
+        testConfig.endpoints = endpoints;
+        testConfig.balance_strategy = document.getElementById('balance-strategy')?.value || 'round_robin';
+    }
+    testConfig.backend = document.getElementById('api-backend')?.value || 'generate';
+    testConfig.response_retention = document.getElementById('response-retention')?.value || 'full';
+
+    const latencySlo = parseFloat(document.getElementById('latency-slo')?.value);
+    if (latencySlo > 0) {
+        testConfig.latency_slo_seconds = latencySlo;
+    }
+
     fetch('/api/start_test', {
         method: 'POST',
         headers: {
@@ -339,7 +376,7 @@ function stopProgressPolling() {
 
 // 檢查測試進度
 function checkTestProgress() {
-    fetch(`/api/test_status/${currentTestId}`)
+    fetch(`/api/test_status/${currentTestId}?cursor=${resultsCursor}`)
         .then(response => response.json())
         .then(data => {
             if (data.error) {
@@ -391,19 +428,27 @@ function updateProgress(data) {
     completedCount.textContent = data.completed_requests || 0;
     failedCount.textContent = data.failed_requests || 0;
     
-    // 計算平均回應時間
-    if (data.current_results && data.current_results.length > 0) {
-        const successfulResults = data.current_results.filter(r => r.success);
-        if (successfulResults.length > 0) {
-            const avgTime = successfulResults.reduce((sum, r) => sum + r.response_time, 0) / successfulResults.length;
-            document.getElementById('avg-response-time').textContent = `${avgTime.toFixed(2)}s`;
-            
-            // 計算每秒請求數
-            const totalTime = successfulResults.reduce((sum, r) => sum + r.response_time, 0);
-            const rps = totalTime > 0 ? successfulResults.length / totalTime : 0;
-            document.getElementById('requests-per-second').textContent = rps.toFixed(2);
+    // 只接收上次游標之後新增的結果
+    if (data.new_results) {
+        for (const result of data.new_results) {
+            testResults.push(result);
         }
     }
+    if (data.results_cursor !== undefined) {
+        resultsCursor = data.results_cursor;
+    }
+    
+    // 平均回應時間取自伺服器端的累計數據
+    const aggregates = data.result_aggregates;
+    if (aggregates && aggregates.successful_results > 0) {
+        document.getElementById('avg-response-time').textContent = `${aggregates.average_response_time.toFixed(2)}s`;
+    }
+    
+    // 吞吐量與goodput以實際經過時間計算
+    const throughput = data.throughput || data.statistics?.throughput;
+    if (throughput) {
+        updateThroughputDisplay(throughput);
+    }
     
     // 更新狀態
     if (data.status) {
@@ -411,6 +456,17 @@ function updateProgress(data) {
     }
 }
 
+// 更新即時吞吐量與goodput
+function updateThroughputDisplay(throughput) {
+    document.getElementById('requests-per-second').textContent = throughput.requests_per_second.toFixed(2);
+    document.getElementById('output-tokens-per-second').textContent = throughput.output_tokens_per_second.toFixed(1);
+    const hasSlo = throughput.latency_slo_seconds != null;
+    document.getElementById('goodput-requests-per-second').textContent =
+        hasSlo ? throughput.goodput_requests_per_second.toFixed(2) : 'N/A';
+    document.getElementById('slo-attainment').textContent =
+        hasSlo ? `${throughput.slo_attainment.toFixed(1)}%` : 'N/A';
+}
+
 // 獲取狀態顯示名稱
 function getStatusDisplayName(status) {
     const statusMap = {
@@ -428,6 +484,7 @@ function getStatusDisplayName(status) {
 function showProgressContainer() {
     document.getElementById('progress-container').style.display = 'block';
     testResults = [];
+    resultsCursor = 0;
 }
 
 // 顯示測試結果
@@ -451,6 +508,10 @@ function showTestResults(statistics) {
         <tr><td>標準差</td><td>${statistics.response_time_stats?.std_dev?.toFixed(2) || 'N/A'}s</td></tr>
         <tr><td>每秒請求數</td><td>${(statistics.requests_per_second || 0).toFixed(2)}</td></tr>
     `;
+    tableBody.innerHTML += formatThroughputRows(statistics) +
+        formatLatencyPercentileRows(statistics) + formatTokenStatisticsRows(statistics) +
+        formatStreamingStatisticsRows(statistics) + formatLoadProfileRows(statistics) +
+        formatConnectionTimingRows(statistics) + formatEndpointRows(statistics);
 
     // 載入測試一圖表
     loadTestCharts();
@@ -725,6 +786,162 @@ function displayCharts(chartsData) {
             showChartError('response-time-box', '載入箱線圖時發生錯誤');
         }
     }
+
+    // 其他圖表
+    renderExtraCharts('test1-extra-charts', chartsData,
+        ['response_time_histogram', 'success_rate_pie', 'response_time_timeline', 'response_time_box']);
+}
+
+// 將沒有固定位置的圖表依序渲染到指定容器
+function renderExtraCharts(containerId, chartsData, knownKeys) {
+    const container = document.getElementById(containerId);
+    if (!container) {
+        return;
+    }
+    container.innerHTML = '';
+
+    Object.keys(chartsData).forEach(key => {
+        if (knownKeys.includes(key)) {
+            return;
+        }
+        try {
+            const chart = JSON.parse(chartsData[key]);
+            const chartId = `${containerId}-${key}`;
+            const col = document.createElement('div');
+            col.className = 'col-lg-6 mb-4';
+            col.innerHTML = `
+                <div class="card">
+                    <div class="card-body">
+                        <div id="${chartId}" style="height: 400px;"></div>
+                    </div>
+                </div>
+            `;
+            container.appendChild(col);
+            Plotly.newPlot(chartId, chart.data, chart.layout, {responsive: true});
+        } catch (error) {
+            console.error(`Error displaying chart ${key}:`, error);
+        }
+    });
+}
+
+// 延遲直方圖百分位數的表格列
+function formatLatencyPercentileRows(statistics) {
+    const percentiles = statistics.latency_percentiles;
+    if (!percentiles || !percentiles.count) {
+        return '';
+    }
+    return `
+        <tr><td>p50 / p90 回應時間</td><td>${percentiles.p50.toFixed(3)}s / ${percentiles.p90.toFixed(3)}s</td></tr>
+        <tr><td>p99 / p99.9 回應時間</td><td>${percentiles.p99.toFixed(3)}s / ${percentiles.p999.toFixed(3)}s</td></tr>
+    `;
+}
+
+// 吞吐量與goodput的表格列
+function formatThroughputRows(statistics) {
+    const throughput = statistics.throughput;
+    if (!throughput) {
+        return '';
+    }
+    let rows = `
+        <tr><td>測量時間</td><td>${throughput.wall_clock_seconds.toFixed(1)}s</td></tr>
+        <tr><td>輸出Token/秒 (系統)</td><td>${throughput.output_tokens_per_second.toFixed(1)}</td></tr>
+    `;
+    if (throughput.latency_slo_seconds != null) {
+        rows += `
+        <tr><td>Goodput (延遲 ≤ ${throughput.latency_slo_seconds}s)</td><td>${throughput.goodput_requests_per_second.toFixed(2)} 請求/秒 / ${throughput.goodput_tokens_per_second.toFixed(1)} tokens/秒</td></tr>
+        <tr><td>SLO達成率</td><td>${throughput.slo_attainment.toFixed(1)}% (${throughput.good_requests}個請求)</td></tr>
+        `;
+    }
+    return rows;
+}
+
+// 各Ollama端點統計的表格列（多端點測試）
+function formatEndpointRows(statistics) {
+    const endpoints = statistics.endpoints;
+    if (!endpoints || endpoints.length === 0) {
+        return '';
+    }
+    return endpoints.map(endpoint => {
+        const p99 = endpoint.latency_percentiles?.count ? `${endpoint.latency_percentiles.p99.toFixed(3)}s` : 'N/A';
+        return `
+        <tr><td>${endpoint.endpoint}</td><td>${endpoint.requests}個請求 (${endpoint.share.toFixed(1)}%，失敗 ${endpoint.failed}) / 平均 ${endpoint.average_response_time.toFixed(2)}s / p99 ${p99} / ${endpoint.output_tokens_per_second.toFixed(1)} tokens/秒</td></tr>
+        `;
+    }).join('');
+}
+
+// 連線重用與DNS/連線/TTFB耗時的表格列（線程引擎）
+function formatConnectionTimingRows(statistics) {
+    const connections = statistics.connection_timing;
+    if (!connections || connections.reuse_rate === undefined) {
+        return '';
+    }
+    const ms = value => value !== undefined ? `${(value * 1000).toFixed(1)}ms` : 'N/A';
+    const connect = connections.connect_time || {};
+    const ttfb = connections.ttfb || {};
+    return `
+        <tr><td>連線重用率 (連線池 ${connections.pool_size ?? 'N/A'})</td><td>${connections.reuse_rate.toFixed(1)}% (新建 ${connections.new_connections} / 重用 ${connections.reused_connections})</td></tr>
+        <tr><td>建立連線 平均 / p99</td><td>${ms(connect.mean)} / ${ms(connect.p99)}</td></tr>
+        <tr><td>TTFB p50 / p99</td><td>${ms(ttfb.p50)} / ${ms(ttfb.p99)}</td></tr>
+    `;
+}
+
+// 伺服器回報Token統計的表格列
+function formatTokenStatisticsRows(statistics) {
+    const tokens = statistics.token_stats;
+    if (!tokens || !tokens.reported_requests) {
+        return '';
+    }
+    // 後端未回報耗時（例如OpenAI相容API）時速度為null，不顯示該列
+    const rateRow = (label, value) => value != null ? `<tr><td>${label}</td><td>${value.toFixed(1)} tokens/秒</td></tr>` : '';
+    return `
+        <tr><td>輸入 / 輸出Token總數</td><td>${tokens.total_prompt_tokens} / ${tokens.total_output_tokens}</td></tr>
+        ${rateRow('預填充速度', tokens.prefill_tokens_per_second)}
+        ${rateRow('解碼速度 (伺服器)', tokens.eval_tokens_per_second)}
+    `;
+}
+
+// 流式測量統計的表格列
+function formatStreamingStatisticsRows(statistics) {
+    const ttft = statistics.ttft_stats;
+    if (!ttft) {
+        return '';
+    }
+    const itl = statistics.inter_token_latency_stats || {};
+    const decode = statistics.decode_tokens_per_second_stats || {};
+    const ms = value => value !== undefined ? `${(value * 1000).toFixed(1)}ms` : 'N/A';
+    return `
+        <tr><td>TTFT p50 / p95 / p99</td><td>${ms(ttft.p50)} / ${ms(ttft.p95)} / ${ms(ttft.p99)}</td></tr>
+        <tr><td>Token間延遲 p50 / p95 / p99</td><td>${ms(itl.p50)} / ${ms(itl.p95)} / ${ms(itl.p99)}</td></tr>
+        <tr><td>平均解碼速度</td><td>${decode.mean?.toFixed(1) || 'N/A'} tokens/秒</td></tr>
+    `;
+}
+
+// 依表單建立負載曲線：爬升為1到並發數，突發為第N秒起N秒內由1提高到並發數
+function buildLoadProfile(concurrentRequests) {
+    const profileType = document.getElementById('load-profile-select')?.value;
+    const duration = parseFloat(document.getElementById('load-profile-duration')?.value) || 30;
+    if (profileType === 'ramp') {
+        return {type: 'ramp', start: 1, end: concurrentRequests, duration: duration};
+    }
+    if (profileType === 'spike') {
+        return {type: 'spike', base: 1, peak: concurrentRequests, at: duration, duration: duration};
+    }
+    return null;
+}
+
+function formatLoadProfileRows(statistics) {
+    const profile = statistics.load_profile;
+    if (!profile) {
+        return '';
+    }
+    const rows = Object.entries(profile.by_target_concurrency || {}).map(([target, stats]) => `
+        <tr><td>並發數 ${target} 回應時間 p50 / p95</td><td>${stats.p50.toFixed(3)}s / ${stats.p95.toFixed(3)}s (${stats.count}個請求)</td></tr>
+    `).join('');
+    let recovery = '';
+    if (profile.type === 'spike') {
+        recovery = `<tr><td>突發後恢復時間</td><td>${profile.spike_recovery_time != null ? profile.spike_recovery_time.toFixed(1) + 's' : '未恢復'}</td></tr>`;
+    }
+    return rows + recovery;
 }
 
 // 顯示單個圖表錯誤
@@ -959,13 +1176,28 @@ function getMultiUserTestConfig() {
         queries_per_user: parseInt(document.getElementById('queries-per-user-2')?.value) || 5,
         concurrent_limit: parseInt(document.getElementById('concurrent-limit-2')?.value) || 5,
         delay_between_queries: parseFloat(document.getElementById('query-delay-2')?.value) || 0.5,
+        engine: document.getElementById('engine-select-2')?.value || 'thread',
+        stream: document.getElementById('stream-mode-2')?.checked || false,
+        test_duration_minutes: parseFloat(document.getElementById('test-duration-2')?.value) || null,
+        soak: document.getElementById('soak-mode-2')?.checked || false,
         use_random_prompts: useRandomPrompts,
         custom_prompts: useRandomPrompts ? '' : customPrompts,
         enable_tpm_monitoring: document.getElementById('enable-tpm-monitoring-2')?.checked || true,
-        enable_detailed_logging: document.getElementById('enable-detailed-logs-2')?.checked || false
+        enable_detailed_logging: document.getElementById('enable-detailed-logs-2')?.checked || false,
+        agents: parseUrlList('load-agents-2'),
+        endpoints: parseUrlList('ollama-endpoints-2'),
+        balance_strategy: document.getElementById('balance-strategy-2')?.value || 'round_robin',
+        backend: document.getElementById('api-backend-2')?.value || 'generate',
+        response_retention: document.getElementById('response-retention-2')?.value || 'full'
     };
 }
 
+// 讀取以逗號或空白分隔的URL（負載代理、Ollama端點）
+function parseUrlList(inputId) {
+    const value = document.getElementById(inputId)?.value || '';
+    return value.split(/[\s,]+/).filter(url => url.length > 0);
+}
+
 // 獲取進階測試配置 (保留原函數以兼容)
 function getAdvancedTestConfig() {
     return getMultiUserTestConfig();
@@ -1134,6 +1366,11 @@ function showMultiUserTestResults(statistics) {
             <tr><td>平均TPM</td><td>${statistics.average_tpm?.toFixed(1) || 0} tokens/分鐘</td></tr>
             <tr><td>峰值TPM</td><td>${statistics.peak_tpm?.toFixed(1) || 0} tokens/分鐘</td></tr>
             <tr><td>平均響應時間</td><td>${statistics.average_response_time?.toFixed(2) || 0} 秒</td></tr>
+            ${formatLatencyPercentileRows(statistics)}
+            ${formatTokenStatisticsRows(statistics)}
+            ${formatStreamingStatisticsRows(statistics)}
+            ${formatConnectionTimingRows(statistics)}
+            ${formatEndpointRows(statistics)}
         `;
     }
 
@@ -1280,6 +1517,9 @@ function loadMultiUserTestCharts(testId) {
                 addLog('響應時間vs Token分析圖已載入', 'success');
             }
 
+            renderExtraCharts('test2-extra-charts', data,
+                ['tpm_timeline', 'user_distribution', 'user_success_rate', 'response_vs_tokens']);
+
             addLog('所有測試二圖表載入完成', 'success');
         })
         .catch(error => {
@@ -223,3 +223,42 @@ function generateMultiUserTestCharts(queryResults, tpmSamples) {
         Plotly.newPlot('user-success-rate', successRateData, successRateLayout);
     }
 }
+
+// 由伺服器產生、沒有固定位置的圖表（延遲百分位數、延遲分解、soak趨勢等）依序渲染到指定容器
+function renderHistoryExtraCharts(testId, containerId, knownKeys) {
+    fetch(`/api/history/${testId}/charts`)
+        .then(response => response.json())
+        .then(data => {
+            const container = document.getElementById(containerId);
+            if (!data.success || !container) {
+                return;
+            }
+            container.innerHTML = '';
+
+            Object.keys(data.charts).forEach(key => {
+                if (knownKeys.includes(key)) {
+                    return;
+                }
+                try {
+                    const chart = JSON.parse(data.charts[key]);
+                    const chartId = `${containerId}-${key}`;
+                    const col = document.createElement('div');
+                    col.className = 'col-lg-6 mb-4';
+                    col.innerHTML = `
+                        <div class="card">
+                            <div class="card-body">
+                                <div id="${chartId}" style="height: 400px;"></div>
+                            </div>
+                        </div>
+                    `;
+                    container.appendChild(col);
+                    Plotly.newPlot(chartId, chart.data, chart.layout, {responsive: true});
+                } catch (error) {
+                    console.error(`Error displaying chart ${key}:`, error);
+                }
+            });
+        })
+        .catch(error => {
+            console.error('Error loading extra charts:', error);
+        });
+}
@@ -0,0 +1,106 @@
+"""
+流式測量工具
+根據每個NDJSON區塊的到達時間計算首Token延遲(TTFT)、Token間延遲(ITL)與解碼速度
+"""
+
+import math
+from typing import Dict, List, Optional, Sequence
+
+
+def percentile(sorted_values: Sequence[float], pct: float) -> float:
+    """
+    計算已排序數列的百分位數（線性插值）
+
+    Args:
+        sorted_values: 由小到大排序的數值
+        pct: 百分位數 (0-100)
+    """
+    if not sorted_values:
+        return 0.0
+    if len(sorted_values) == 1:
+        return float(sorted_values[0])
+
+    rank = (pct / 100) * (len(sorted_values) - 1)
+    lower = math.floor(rank)
+    upper = math.ceil(rank)
+    if lower == upper:
+        return float(sorted_values[lower])
+    weight = rank - lower
+    return sorted_values[lower] * (1 - weight) + sorted_values[upper] * weight
+
+
+def summarize_values(values: Sequence[float]) -> Dict:
+    """計算一組延遲數值的摘要統計（含尾端百分位數）"""
+    if not values:
+        return {}
+
+    ordered = sorted(values)
+    return {
+        'min': ordered[0],
+        'max': ordered[-1],
+        'mean': sum(ordered) / len(ordered),
+        'p50': percentile(ordered, 50),
+        'p90': percentile(ordered, 90),
+        'p95': percentile(ordered, 95),
+        'p99': percentile(ordered, 99),
+        'count': len(ordered)
+    }
+
+
+def summarize_token_timestamps(start_time: float, token_times: List[float]) -> Dict:
+    """
+    根據請求發送時間與每個Token區塊的到達時間計算單一請求的流式指標
+
+    Args:
+        start_time: 請求發送的時間 (time.time())
+        token_times: 每個含有Token的區塊到達時間
+
+    Returns:
+        包含ttft、inter_token_latencies、itl_stats、decode_tokens_per_second的字典
+    """
+    if not token_times:
+        return {
+            'ttft': None,
+            'inter_token_latencies': [],
+            'itl_stats': {},
+            'decode_tokens_per_second': None,
+            'chunk_count': 0
+        }
+
+    inter_token_latencies = [
+        token_times[i] - token_times[i - 1] for i in range(1, len(token_times))
+    ]
+    decode_time = token_times[-1] - token_times[0]
+    decode_tokens_per_second: Optional[float] = None
+    if decode_time > 0:
+        # 第一個Token屬於預填充階段，解碼速度以之後的Token計算
+        decode_tokens_per_second = (len(token_times) - 1) / decode_time
+
+    return {
+        'ttft': token_times[0] - start_time,
+        'inter_token_latencies': inter_token_latencies,
+        'itl_stats': summarize_values(inter_token_latencies),
+        'decode_tokens_per_second': decode_tokens_per_second,
+        'chunk_count': len(token_times)
+    }
+
+
+def aggregate_streaming_statistics(ttfts: Sequence[float],
+                                   inter_token_latencies: Sequence[float],
+                                   decode_rates: Sequence[float]) -> Dict:
+    """
+    彙總整個測試的流式指標
+
+    Args:
+        ttfts: 每個成功請求的TTFT
+        inter_token_latencies: 所有請求的Token間延遲
+        decode_rates: 每個請求的解碼速度 (tokens/s)
+    """
+    if not ttfts:
+        return {}
+
+    return {
+        'ttft_stats': summarize_values(ttfts),
+        'inter_token_latency_stats': summarize_values(inter_token_latencies),
+        'decode_tokens_per_second_stats': summarize_values(decode_rates)
+    }
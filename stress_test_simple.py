@@ -1,25 +1,91 @@
 import threading
 import time
 import uuid
-import queue
-from datetime import datetime
+from datetime import datetime, timedelta
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Dict, List, Optional
-from ollama_client import OllamaClient
-import statistics
+from functools import partial
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+from ollama_client import MultiEndpointOllamaClient
+from async_load_engine import AsyncLoadEngine, ENGINE_ASYNC, ENGINE_THREAD
+from process_load_engine import BASIC_TEST_ENGINES, ENGINE_PROCESS, ProcessLoadEngine
+from arrival_schedule import (
+    ARRIVAL_CLOSED, arrival_offsets, run_open_loop_threaded,
+    summarize_schedule, validate_arrival_config
+)
+from load_profile import max_concurrency, profile_statistics, target_concurrency, validate_load_profile
+from server_metrics import count_output_tokens, latency_breakdown
+from soak_monitor import SoakMonitor
+from agent_coordinator import (
+    AGENT_POLL_INTERVAL, PLAN_BASIC, AgentRun, merge_basic_snapshots, split_basic_plan
+)
+from endpoint_balancer import BALANCE_CONSISTENT_HASH, endpoint_options, normalize_endpoints
+from ollama_backends import BACKEND_GENERATE, backend_options
+from result_analysis import ResultAnalysis, describe, summarize
+from result_log import ResultLog
+from result_retention import (
+    DEFAULT_RESPONSE_SAMPLE_EVERY, RESPONSE_FULL, SPILL_RECENT_RESULTS, CompletedTestStore, ResponseBodyPolicy,
+    ResultSpill, RetentionPolicy, estimate_size, remove_spill
+)
 from database import db
 from hardware_info import get_hardware_info
 
+# soak模式下保留的最近結果數（用於圖表與百分位數），其餘只計入快照
+SOAK_RECENT_RESULTS = 1000
+
+# 測試資料中不回傳給狀態查詢的內部欄位
+_INTERNAL_KEYS = ('result_log', 'final_results', 'lock', 'stop_event', 'measurement_start', 'measurement_end')
+
+def _client_options(config: Dict) -> Dict:
+    """客戶端與負載引擎共用的關鍵字參數：多端點設定與生成API後端"""
+    return {**endpoint_options(config), **backend_options(config)}
+
+def _worker_error_result(model: str, prompt: str, error: Exception, start_time: float) -> Dict:
+    """工作線程執行請求時發生例外：以失敗結果記錄（與客戶端回傳的失敗結果欄位相同）"""
+    return {
+        'success': False,
+        'error': f'Worker error: {str(error)}',
+        'model': model,
+        'prompt': prompt,
+        'response_time': time.time() - start_time,
+        'timestamp': datetime.now().isoformat()
+    }
+
+def _remove_test_spill(test_id: str, test_data: Dict):
+    """已完成的測試從記憶體移除後改由歷史記錄提供，溢寫檔案一併刪除"""
+    spill = test_data['result_log'].spill
+    if spill is not None:
+        remove_spill(spill.path)
+
 class StressTestManager:
-    def __init__(self):
+    def __init__(self, retention: Optional[RetentionPolicy] = None):
+        """
+        Args:
+            retention: 已完成測試的保留與溢寫策略；None時使用預設值
+        """
+        self.retention = retention or RetentionPolicy()
         self.active_tests = {}
-        self.test_results = {}
+        # 已完成的測試依數量、大小與存活時間移除，移除後由歷史記錄提供
+        self.test_results = CompletedTestStore(
+            self.retention, sizer=lambda test_data: estimate_size(test_data.get('final_results') or []),
+            on_evict=_remove_test_spill
+        )
+        # 只保護active_tests/test_results本身；各測試的欄位由測試自己的lock保護
         self.lock = threading.Lock()
     
     def start_test(self, config: Dict) -> str:
         """開始壓力測試"""
         test_id = str(uuid.uuid4())
         
+        # 請求數很多時每個請求的結果溢寫到磁碟，記憶體只保留最近的結果（分散式測試的結果留在各代理）
+        spill = None
+        planned_requests = None if config.get('test_duration_minutes') else config.get('total_requests')
+        if not config.get('agents') and self.retention.should_spill(planned_requests, config.get('spill_results')):
+            spill = ResultSpill(self.retention.spill_path(test_id))
+        if config.get('soak'):
+            recent_results = SOAK_RECENT_RESULTS
+        else:
+            recent_results = SPILL_RECENT_RESULTS if spill else None
+        
         with self.lock:
             self.active_tests[test_id] = {
                 'config': config,
@@ -28,9 +94,9 @@ class StressTestManager:
                 'progress': 0,
                 'completed_requests': 0,
                 'failed_requests': 0,
-                'results': [],
-                'stop_requested': False,
-                'current_results': []
+                'lock': threading.Lock(),
+                'stop_event': threading.Event(),
+                'result_log': ResultLog(recent_results, spill=spill)
             }
         
         # 在新線程中運行測試
@@ -45,187 +111,695 @@ class StressTestManager:
     
     def stop_test(self, test_id: str) -> bool:
         """停止壓力測試"""
-        with self.lock:
-            if test_id in self.active_tests:
-                self.active_tests[test_id]['stop_requested'] = True
-                self.active_tests[test_id]['status'] = 'stopping'
-                return True
+        test_data = self._get_test_data(test_id, active_only=True)
+        if test_data is None:
             return False
+        test_data['stop_event'].set()
+        with test_data['lock']:
+            test_data['status'] = 'stopping'
+        return True
     
-    def get_test_status(self, test_id: str) -> Optional[Dict]:
-        """獲取測試狀態"""
+    def _get_test_data(self, test_id: str, active_only: bool = False) -> Optional[Dict]:
+        """取得測試資料（不複製）"""
         with self.lock:
             if test_id in self.active_tests:
-                return self.active_tests[test_id].copy()
-            elif test_id in self.test_results:
-                return self.test_results[test_id].copy()
+                return self.active_tests[test_id]
+            if active_only:
+                return None
+            return self.test_results.get(test_id)
+    
+    def get_test_status(self, test_id: str, cursor: Optional[int] = None) -> Optional[Dict]:
+        """
+        獲取測試狀態（不含完整結果列表）
+
+        Args:
+            cursor: 上次回傳的results_cursor；提供時另外回傳此游標之後新增的結果(new_results)
+        """
+        test_data = self._get_test_data(test_id)
+        if test_data is None:
+            return self._history_status(test_id, cursor)
+        with test_data['lock']:
+            status = {k: v for k, v in test_data.items() if k not in _INTERNAL_KEYS}
+        result_log = test_data['result_log']
+        
+        # 進行中的測試：完成數與進度由工作線程的分片計數器（分散式測試為各代理的合併數據）在讀取時加總
+        distributed = status.get('distributed')
+        aggregates = distributed['aggregates'] if distributed else result_log.aggregates()
+        status['result_aggregates'] = aggregates
+        if status['status'] in ('running', 'stopping'):
+            status['completed_requests'] = aggregates['successful_results']
+            status['failed_requests'] = aggregates['failed_results']
+            status['progress'] = self._live_progress(test_data['config'], status['start_time'],
+                                                     aggregates['total_results'])
+            # 吞吐量以實際經過時間計算（不是平均延遲的倒數）
+            measurement_start = test_data.get('measurement_start')
+            if distributed:
+                status['throughput'] = distributed['throughput']
+                if self._multiple_endpoints(test_data['config']):
+                    status['endpoints'] = distributed['endpoints']
+            elif measurement_start is not None:
+                status['throughput'] = result_log.throughput(time.time() - measurement_start)
+                if self._multiple_endpoints(test_data['config']):
+                    status['endpoints'] = result_log.endpoint_statistics(time.time() - measurement_start)
+        if cursor is None:
+            status['results_cursor'] = result_log.cursor
+        else:
+            status['new_results'], status['results_cursor'] = result_log.since(cursor)
+        return status
+    
+    def get_test_aggregates(self, test_id: str) -> Optional[Dict]:
+        """
+        可直接相加合併的累計計數與直方圖（負載代理回報給主控端）
+
+        Returns:
+            status在測試完全結束前為running；measurement_start/end為本機時鐘的測量窗口
+        """
+        test_data = self._get_test_data(test_id)
+        if test_data is None:
             return None
+        with test_data['lock']:
+            finished = 'end_time' in test_data
+            aggregates = {
+                'status': test_data['status'] if finished else 'running',
+                'error': test_data.get('error'),
+                'measurement_start': test_data.get('measurement_start'),
+                'measurement_end': test_data.get('measurement_end')
+            }
+        aggregates.update(test_data['result_log'].export())
+        return aggregates
+    
+    def get_test_results(self, test_id: str) -> Optional[Sequence[Dict]]:
+        """
+        獲取測試的結果：完成後為最終結果，進行中為目前已記錄結果的副本
+
+        Returns:
+            RecordStore（迭代時為結果字典）；已從記憶體移除的測試為歷史記錄中的字典列表
+        """
+        test_data = self._get_test_data(test_id)
+        if test_data is None:
+            record = self._history_record(test_id)
+            return record['test_results'].get('results', []) if record else None
+        with test_data['lock']:
+            if 'final_results' in test_data:
+                return test_data['final_results']
+        return test_data['result_log'].entries()
+    
+    @staticmethod
+    def _history_record(test_id: str) -> Optional[Dict]:
+        """已從記憶體移除的基礎測試改由歷史記錄提供"""
+        record = db.get_test_detail(test_id)
+        if not record or record['test_type'] != 1:
+            return None
+        return record
+    
+    def _history_status(self, test_id: str, cursor: Optional[int] = None) -> Optional[Dict]:
+        """以歷史記錄組成與記憶體中已完成測試相同格式的狀態"""
+        record = self._history_record(test_id)
+        if record is None:
+            return None
+        start_time = datetime.fromisoformat(str(record['test_time']))
+        duration = record.get('duration_seconds') or 0
+        status = {
+            'config': record['test_config'],
+            'status': 'completed',
+            'start_time': start_time,
+            'end_time': start_time + timedelta(seconds=duration),
+            'duration': duration,
+            'progress': 100,
+            'completed_requests': record.get('successful_requests') or 0,
+            'failed_requests': record.get('failed_requests') or 0,
+            'statistics': record['test_statistics'],
+            'from_history': True,
+            'results_cursor': len(record['test_results'].get('results', []))
+        }
+        if cursor is not None:
+            status['new_results'] = []
+        return status
+    
+    @staticmethod
+    def _multiple_endpoints(config: Dict) -> bool:
+        """設定多個Ollama端點時才回報各端點的統計"""
+        return len(normalize_endpoints(config.get('endpoints'))) > 1
+    
+    @staticmethod
+    def _live_progress(config: Dict, start_time: datetime, finished: int) -> float:
+        """依總請求數或測試時間計算進度百分比"""
+        if config.get('test_duration_minutes'):
+            elapsed = (datetime.now() - start_time).total_seconds()
+            return min(100, elapsed / (float(config['test_duration_minutes']) * 60) * 100)
+        total_requests = config.get('total_requests') or 0
+        return min(100, finished / total_requests * 100) if total_requests else 0
     
     def _run_stress_test(self, test_id: str, config: Dict):
         """執行壓力測試的主要邏輯"""
+        test_data = self._get_test_data(test_id)
         try:
             # 更新狀態為運行中
-            with self.lock:
-                self.active_tests[test_id]['status'] = 'running'
+            with test_data['lock']:
+                test_data['status'] = 'running'
             
             # 執行測試
             self._execute_test(test_id, config)
             
         except Exception as e:
-            with self.lock:
-                self.active_tests[test_id]['status'] = 'error'
-                self.active_tests[test_id]['error'] = str(e)
+            with test_data['lock']:
+                test_data['status'] = 'error'
+                test_data['error'] = str(e)
         
         finally:
-            # 移動到結果存儲並清理活動測試
-            with self.lock:
-                if test_id in self.active_tests:
-                    test_data = self.active_tests.pop(test_id)
-                    test_data['end_time'] = datetime.now()
-                    test_data['duration'] = (test_data['end_time'] - test_data['start_time']).total_seconds()
+            end_time = datetime.now()
+            with test_data['lock']:
+                test_data['duration'] = (end_time - test_data['start_time']).total_seconds()
+
+                # 確保狀態為完成（如果沒有錯誤的話）
+                if test_data.get('status') != 'error':
+                    test_data['status'] = 'completed'
 
-                    # 確保狀態為完成（如果沒有錯誤的話）
-                    if test_data.get('status') != 'error':
-                        test_data['status'] = 'completed'
+            spill = test_data['result_log'].spill
+            if spill is not None:
+                spill.close()
 
-                    self.test_results[test_id] = test_data
+            # 保存測試結果到資料庫（不持有任何鎖，避免阻塞其他測試的狀態查詢）
+            self._save_test_to_database(test_id, test_data)
 
-                    # 保存測試結果到資料庫
-                    self._save_test_to_database(test_id, test_data)
+            # end_time在寫入資料庫後才出現，作為測試已完全結束的標記
+            with test_data['lock']:
+                test_data['end_time'] = end_time
+
+            # 移動到結果存儲並清理活動測試
+            with self.lock:
+                self.active_tests.pop(test_id, None)
+                self.test_results[test_id] = test_data
     
     def _execute_test(self, test_id: str, config: Dict):
         """執行具體的測試邏輯"""
+        if config.get('agents'):
+            self._execute_distributed_test(test_id, config)
+            return
+        
         model = config['model']
         concurrent_requests = config['concurrent_requests']
         total_requests = config['total_requests']
         prompt = config['prompt']
+        stream = bool(config.get('stream', False))  # 流式測量模式
         
-        # 創建Ollama客戶端
-        ollama_client = OllamaClient()
+        engine = config.get('engine', ENGINE_THREAD)
+        if engine not in BASIC_TEST_ENGINES:
+            raise ValueError(f"Unsupported engine: {engine}")
         
-        # 檢查服務器可用性
-        if not ollama_client.is_server_available():
-            raise Exception("Ollama server is not available")
+        # 多端點：請求依負載平衡策略分散到各Ollama端點；基礎測試沒有用戶編號可供一致性雜湊
+        # 後端：generate、chat或OpenAI相容的chat completions（見ollama_backends）
+        client_options = _client_options(config)
+        if client_options['balance_strategy'] == BALANCE_CONSISTENT_HASH:
+            raise ValueError("consistent_hash balancing requires user ids; use it with the multi-user test")
         
-        # 創建任務隊列
-        task_queue = queue.Queue()
-        for i in range(total_requests):
-            task_queue.put(i)
+        # 到達模式：closed為封閉迴路，其餘依排程發送（開放迴路）
+        arrival_mode = config.get('arrival_mode', ARRIVAL_CLOSED)
+        arrival_rate = config.get('arrival_rate')
+        rate_curve = config.get('rate_curve')
+        validate_arrival_config(arrival_mode, arrival_rate, rate_curve)
         
-        # 結果收集
-        results = []
-        completed_count = 0
-        failed_count = 0
+        # 負載曲線：目標並發數隨時間變化（ramp/step/spike），取代固定的concurrent_requests
+        load_profile = config.get('load_profile')
+        concurrency_target = None
+        if load_profile:
+            validate_load_profile(load_profile)
+            if arrival_mode != ARRIVAL_CLOSED:
+                raise ValueError("load_profile cannot be combined with an open-loop arrival mode")
+            concurrent_requests = max_concurrency(load_profile)
+            concurrency_target = partial(target_concurrency, load_profile)
         
-        def worker():
-            """工作線程函數"""
-            nonlocal completed_count, failed_count
+        # 多行程引擎：各行程以共享計數器取得任務，只支援固定並發數的封閉迴路
+        if engine == ENGINE_PROCESS and (arrival_mode != ARRIVAL_CLOSED or load_profile):
+            raise ValueError("The process engine does not support open-loop arrival modes or load profiles")
+        
+        # 依時間執行：設定test_duration_minutes時持續發送直到時間結束，忽略total_requests
+        duration_seconds = None
+        if config.get('test_duration_minutes'):
+            duration_seconds = float(config['test_duration_minutes']) * 60
+            if duration_seconds <= 0:
+                raise ValueError("test_duration_minutes must be greater than 0")
+        
+        # 延遲目標：在目標內完成的請求與Token另外計為goodput
+        latency_slo = config.get('latency_slo_seconds')
+        if latency_slo is not None:
+            latency_slo = float(latency_slo)
+            if latency_slo <= 0:
+                raise ValueError("latency_slo_seconds must be greater than 0")
+        
+        # 回應內容：full全部保留；sampled每N個保留一個；none只保留長度、雜湊與Token數
+        response_policy = ResponseBodyPolicy(
+            config.get('response_retention') or RESPONSE_FULL,
+            int(config.get('response_sample_every') or DEFAULT_RESPONSE_SAMPLE_EVERY)
+        )
+        
+        # soak模式：只保留最近的結果，長期趨勢由定期快照記錄
+        soak = bool(config.get('soak', False))
+        test_data = self._get_test_data(test_id)
+        monitor = None
+        if soak or duration_seconds:
+            def publish_snapshot(summary):
+                with test_data['lock']:
+                    test_data['soak'] = summary
             
+            monitor = SoakMonitor(
+                interval=float(config.get('snapshot_interval_seconds', 60)),
+                on_snapshot=publish_snapshot
+            )
+        
+        # 結果收集（soak模式只保留最近的結果）；完成數由記錄的分片計數器提供，不在每次完成時取得鎖
+        result_log = test_data['result_log']
+        result_log.latency_slo = latency_slo
+        stop_event = test_data['stop_event']
+        
+        def record_result(task_id, result, worker_name, client_queue_time):
+            """記錄單一請求的結果"""
+            result['task_id'] = task_id
+            result['worker_thread'] = worker_name
+            # 延遲分解：客戶端佇列 / 網路 / 伺服器佇列 / 載入 / 預填充 / 解碼
+            result.update(latency_breakdown(result, result['response_time'], client_queue_time))
+            if 'schedule_lag' in result:
+                # 開放迴路：延遲從預定發送時間起算
+                result['corrected_response_time'] = result['response_time'] + result['schedule_lag']
+            if load_profile:
+                # 發送時間（相對測試開始）與當時的目標並發數
+                result['elapsed'] = time.time() - result['response_time'] - test_start
+                result['target_concurrency'] = target_concurrency(load_profile, result['elapsed'])
+            response_policy.apply(result)
+            result_log.append(result)
+            if monitor:
+                monitor.record(result['success'], result['response_time'],
+                               count_output_tokens(result, result.get('response', '')))
+        
+        def record_batch(records, totals, histograms):
+            """記錄工作行程送回的一批結果（延遲分解、回應內容處理與累計已在工作行程中完成）"""
+            result_log.append_batch(records, totals, histograms)
+            if monitor:
+                monitor.record_batch(int(totals.get('successful', 0)), int(totals.get('failed', 0)),
+                                     int(totals.get('output_tokens', 0)),
+                                     records.column('response_time', where=records.column('success')))
+        
+        stop_requested = stop_event.is_set
+        
+        process_engine = None
+        if engine == ENGINE_PROCESS:
+            # 先啟動工作行程，行程啟動時間不計入測量
+            process_engine = ProcessLoadEngine(concurrent_requests, config.get('worker_processes'),
+                                               **client_options)
+            process_engine.start(model, prompt, stream, latency_slo=latency_slo,
+                                 response_retention=response_policy.mode,
+                                 response_sample_every=response_policy.sample_every)
+        
+        test_start = time.time()
+        deadline = test_start + duration_seconds if duration_seconds else None
+        with test_data['lock']:
+            test_data['measurement_start'] = test_start
+        
+        def task_ids():
+            """依總請求數或測試時間產生任務編號"""
+            i = 0
+            while (time.time() < deadline) if deadline else (i < total_requests):
+                yield i
+                i += 1
+        
+        if monitor:
+            monitor.start()
+        dispatcher = None
+        process_statistics = None
+        try:
+            if process_engine:
+                process_statistics = process_engine.run(
+                    None if deadline else total_requests, deadline,
+                    record_batch, stop_requested
+                )
+            else:
+                dispatcher = self._dispatch_requests(
+                    config, engine, model, prompt, stream, concurrent_requests, task_ids(),
+                    record_result, stop_requested, concurrency_target
+                )
+        finally:
+            if monitor:
+                monitor.stop()
+        # 測量窗口：開始發送至最後一個請求結束（包括時間到後仍在進行的請求）
+        wall_clock_seconds = time.time() - test_start
+        with test_data['lock']:
+            test_data['measurement_end'] = test_start + wall_clock_seconds
+        
+        # 計算統計資訊
+        results = result_log.entries()
+        stats = self._calculate_statistics(results)
+        if stats:
+            throughput = result_log.throughput(wall_clock_seconds)
+            stats['throughput'] = throughput
+            stats['requests_per_second'] = throughput['requests_per_second']
+            stats['backend'] = client_options['backend']
+            if 'connection_timing' in stats:
+                stats['connection_timing']['pool_size'] = concurrent_requests
+            if len(client_options['endpoints']) > 1:
+                stats['endpoints'] = result_log.endpoint_statistics(wall_clock_seconds)
+        if dispatcher is not None:
+            stats['schedule'] = summarize_schedule(
+                arrival_mode, arrival_rate, dispatcher,
+                [lag for lag in results.column('schedule_lag') if lag is not None]
+            )
+        # 回應時間直方圖涵蓋全部成功請求（soak模式下也包括已丟棄的結果）
+        histogram = result_log.latency_histogram()
+        if histogram.count:
+            stats['latency_percentiles'] = histogram.summary()
+            stats['latency_histogram'] = histogram.to_dict()
+        if process_statistics and stats:
+            stats['process_workers'] = process_statistics
+        if load_profile and stats:
+            stats['load_profile'] = profile_statistics(load_profile, list(results.iter_fields(
+                ('target_concurrency', 'elapsed', 'response_time'), where=results.column('success')
+            )))
+        if result_log.spill is not None and stats:
+            # 記憶體只保留最近的結果：分布統計涵蓋最近的結果，總數取自涵蓋全部結果的累計數據
+            spill_aggregates = result_log.aggregates()
+            stats['spill'] = result_log.spill.summary()
+            stats['retained_results'] = len(results)
+            stats['total_requests'] = spill_aggregates['total_results']
+            stats['successful_requests'] = spill_aggregates['successful_results']
+            stats['failed_requests'] = spill_aggregates['failed_results']
+            stats['success_rate'] = (spill_aggregates['successful_results'] / spill_aggregates['total_results'] * 100
+                                     if spill_aggregates['total_results'] else 0)
+        if monitor:
+            soak_summary = monitor.summary()
+            stats['soak'] = soak_summary
+            if soak:
+                # 分布統計只涵蓋最近的結果，總數取自監控器
+                stats['retained_results'] = len(results)
+                stats['total_requests'] = soak_summary['total_requests']
+                stats['successful_requests'] = soak_summary['successful_requests']
+                stats['failed_requests'] = soak_summary['failed_requests']
+                stats['success_rate'] = (soak_summary['successful_requests'] / soak_summary['total_requests'] * 100
+                                         if soak_summary['total_requests'] else 0)
+        
+        # 更新最終狀態
+        aggregates = result_log.aggregates()
+        with test_data['lock']:
+            test_data['status'] = 'completed'
+            test_data['progress'] = 100
+            test_data['completed_requests'] = aggregates['successful_results']
+            test_data['failed_requests'] = aggregates['failed_results']
+            test_data['statistics'] = stats
+            test_data['final_results'] = results  # 保存完整結果用於圖表
+
+    def _execute_distributed_test(self, test_id: str, config: Dict):
+        """把測試分配給負載代理執行，定期合併各代理回報的累計數據"""
+        test_data = self._get_test_data(test_id)
+        latency_slo = config.get('latency_slo_seconds')
+        latency_slo = float(latency_slo) if latency_slo is not None else None
+        
+        plans = split_basic_plan(config, len(config['agents']))
+        run = AgentRun(config['agents'], PLAN_BASIC, plans)
+        start_at = run.start()
+        with test_data['lock']:
+            test_data['measurement_start'] = start_at
+        
+        stopped = False
+        while True:
+            if test_data['stop_event'].is_set() and not stopped:
+                run.stop()
+                stopped = True
+            snapshots = run.poll()
+            merged = merge_basic_snapshots(snapshots, latency_slo)
+            with test_data['lock']:
+                test_data['distributed'] = {key: merged[key]
+                                            for key in ('aggregates', 'throughput', 'agents', 'endpoints')}
+            if AgentRun.finished(snapshots):
+                break
+            time.sleep(AGENT_POLL_INTERVAL)
+        
+        error = AgentRun.first_error(snapshots)
+        if error:
+            raise Exception(error)
+        
+        aggregates = merged['aggregates']
+        histogram = merged['latency_histogram']
+        stats = {}
+        if aggregates['total_results']:
+            stats = {
+                'total_requests': aggregates['total_results'],
+                'successful_requests': aggregates['successful_results'],
+                'failed_requests': aggregates['failed_results'],
+                'success_rate': aggregates['successful_results'] / aggregates['total_results'] * 100,
+                # 只有直方圖：中位數為直方圖的p50
+                'response_time_stats': {
+                    'min': histogram.min,
+                    'max': histogram.max,
+                    'mean': aggregates['average_response_time'],
+                    'median': histogram.percentile(50)
+                } if histogram.count else {},
+                'requests_per_second': merged['throughput']['requests_per_second'],
+                'throughput': merged['throughput'],
+                'agents': merged['agents'],
+                'backend': config.get('backend') or BACKEND_GENERATE
+            }
+            if self._multiple_endpoints(config):
+                stats['endpoints'] = merged['endpoints']
+            if histogram.count:
+                stats['latency_percentiles'] = histogram.summary()
+                stats['latency_histogram'] = histogram.to_dict()
+        
+        with test_data['lock']:
+            test_data['status'] = 'completed'
+            test_data['progress'] = 100
+            test_data['completed_requests'] = aggregates['successful_results']
+            test_data['failed_requests'] = aggregates['failed_results']
+            test_data['statistics'] = stats
+            test_data['final_results'] = []  # 個別結果留在各代理，不傳回主控端
+
+    def _dispatch_requests(self, config: Dict, engine: str, model: str, prompt: str, stream: bool,
+                           concurrent_requests: int, tasks: Iterator[int],
+                           record_result, stop_requested, concurrency_target) -> Optional[Dict]:
+        """
+        依到達模式與引擎發送請求
+
+        客戶端佇列時間在所有引擎中的定義相同：從任務被取出、開始等待工作槽位起，到請求送出為止；
+        任務在需要時才產生，不會在測試開始時一次全部標記時間
+
+        Args:
+            tasks: 任務編號來源
+        
+        Returns:
+            開放迴路的派發器統計；封閉迴路為None
+        """
+        if config.get('arrival_mode', ARRIVAL_CLOSED) != ARRIVAL_CLOSED:
+            return self._execute_test_open_loop(
+                config, engine, model, prompt, stream, concurrent_requests, tasks,
+                record_result, stop_requested
+            )
+
+        def queued_tasks() -> Iterator[Tuple[int, float]]:
+            # 取出任務的時間即為開始等待工作槽位的時間
+            for task_id in tasks:
+                yield task_id, time.time()
+
+        if engine == ENGINE_ASYNC:
+            # 單一事件迴圈驅動所有並發請求
+            async def execute(client, task):
+                task_id, enqueued_at = task
+                client_queue_time = time.time() - enqueued_at
+                result = await client.generate_response(model, prompt, stream=stream)
+                result['client_queue_time'] = client_queue_time
+                return result
+            
+            AsyncLoadEngine(concurrent_requests, **_client_options(config)).run(
+                queued_tasks(),
+                execute,
+                lambda task, result: record_result(task[0], result, 'asyncio',
+                                                   result.pop('client_queue_time')),
+                stop_requested,
+                concurrency_target
+            )
+        else:
+            self._execute_test_threaded(
+                model, prompt, stream, concurrent_requests, queued_tasks(),
+                record_result, stop_requested, concurrency_target, _client_options(config)
+            )
+        return None
+
+    def _execute_test_open_loop(self, config: Dict, engine: str, model: str, prompt: str,
+                                stream: bool, concurrent_requests: int, tasks: Iterator[int],
+                                record_result, stop_requested) -> Dict:
+        """依到達率排程發送請求；concurrent_requests為同時進行中請求的上限"""
+        offsets = arrival_offsets(
+            config['arrival_mode'], config.get('arrival_rate'),
+            config.get('rate_curve'), config.get('arrival_seed')
+        )
+
+        if engine == ENGINE_ASYNC:
+            async def execute(client, task_id, intended_start):
+                schedule_lag = time.time() - intended_start
+                result = await client.generate_response(model, prompt, stream=stream)
+                result['intended_start'] = intended_start
+                result['schedule_lag'] = schedule_lag
+                return result
+
+            return AsyncLoadEngine(concurrent_requests, **_client_options(config)).run_open_loop(
+                tasks,
+                offsets,
+                execute,
+                lambda task_id, result: record_result(task_id, result, 'asyncio', result['schedule_lag']),
+                stop_requested
+            )
+
+        ollama_client = MultiEndpointOllamaClient(**_client_options(config), pool_size=concurrent_requests)
+        if not ollama_client.is_server_available():
+            raise Exception("Ollama server is not available")
+
+        def execute(task_id, intended_start):
+            try:
+                if stop_requested():
+                    return
+                request_start = time.time()
+                schedule_lag = request_start - intended_start
+                try:
+                    result = ollama_client.generate_response(model, prompt, stream=stream)
+                except Exception as e:
+                    result = _worker_error_result(model, prompt, e, request_start)
+                result['intended_start'] = intended_start
+                result['schedule_lag'] = schedule_lag
+                record_result(task_id, result, threading.current_thread().name, schedule_lag)
+            except Exception as e:
+                print(f"Worker error: {e}")
+
+        return run_open_loop_threaded(
+            tasks, offsets, concurrent_requests, execute, stop_requested
+        )
+
+    def _execute_test_threaded(self, model: str, prompt: str, stream: bool,
+                               concurrent_requests: int, tasks: Iterator[Tuple[int, float]],
+                               record_result, stop_requested, concurrency_target=None,
+                               client_options: Optional[Dict] = None):
+        """
+        以線程池執行測試（每個並發請求一個線程）
+
+        tasks產生 (任務編號, 取出任務的時間)，由所有線程共用；
+        concurrency_target以經過秒數回傳目標並發數，編號不小於目標的線程暫停取用新任務；
+        client_options為客戶端設定（endpoints、balance_strategy、backend、messages）
+        """
+        # 創建Ollama客戶端（所有線程共用，依負載平衡選擇端點；連線池大小等於並發數，連線不會被丟棄重建）
+        ollama_client = MultiEndpointOllamaClient(**(client_options or {}), pool_size=concurrent_requests)
+
+        # 檢查服務器可用性
+        if not ollama_client.is_server_available():
+            raise Exception("Ollama server is not available")
+
+        # 共用的任務來源
+        task_lock = threading.Lock()
+        exhausted = threading.Event()
+
+        def next_task():
+            with task_lock:
+                task = next(tasks, None)
+            if task is None:
+                exhausted.set()
+            return task
+
+        start = time.time()
+
+        def worker(index):
+            """工作線程函數"""
             while True:
                 try:
                     # 檢查是否需要停止
-                    with self.lock:
-                        if self.active_tests[test_id]['stop_requested']:
-                            break
-                    
+                    if stop_requested() or exhausted.is_set():
+                        break
+
+                    # 負載曲線：目前不需要這個線程
+                    if concurrency_target and index >= concurrency_target(time.time() - start):
+                        time.sleep(0.05)
+                        continue
+
                     # 獲取任務
-                    try:
-                        task_id = task_queue.get_nowait()
-                    except queue.Empty:
+                    task = next_task()
+                    if task is None:
                         break
-                    
+                    task_id, enqueued_at = task
+
                     # 執行請求
-                    start_time = time.time()
-                    result = ollama_client.generate_response(model, prompt)
-                    end_time = time.time()
-                    
+                    request_start = time.time()
+                    client_queue_time = request_start - enqueued_at
+                    try:
+                        result = ollama_client.generate_response(model, prompt, stream=stream)
+                    except Exception as e:
+                        # 已取出的任務計為失敗請求
+                        result = _worker_error_result(model, prompt, e, request_start)
+
                     # 記錄結果
-                    result['task_id'] = task_id
-                    result['worker_thread'] = threading.current_thread().name
-                    results.append(result)
-                    
-                    # 更新計數器
-                    if result['success']:
-                        completed_count += 1
-                    else:
-                        failed_count += 1
-                    
-                    # 更新進度
-                    progress = ((completed_count + failed_count) / total_requests) * 100
-                    
-                    with self.lock:
-                        self.active_tests[test_id]['progress'] = progress
-                        self.active_tests[test_id]['completed_requests'] = completed_count
-                        self.active_tests[test_id]['failed_requests'] = failed_count
-                        self.active_tests[test_id]['current_results'] = results.copy()
-                    
-                    task_queue.task_done()
-                    
+                    record_result(task_id, result, threading.current_thread().name, client_queue_time)
+
                 except Exception as e:
-                    failed_count += 1
                     print(f"Worker error: {e}")
-                    
-                    with self.lock:
-                        self.active_tests[test_id]['failed_requests'] = failed_count
-        
+
         # 啟動工作線程
         with ThreadPoolExecutor(max_workers=concurrent_requests) as executor:
-            futures = [executor.submit(worker) for _ in range(concurrent_requests)]
-            
+            futures = [executor.submit(worker, i) for i in range(concurrent_requests)]
+
             # 等待所有任務完成或停止請求
             while True:
-                with self.lock:
-                    if self.active_tests[test_id]['stop_requested']:
-                        break
-                
-                if task_queue.empty() and all(f.done() for f in futures):
+                if stop_requested():
+                    break
+
+                if all(f.done() for f in futures):
                     break
-                
+
                 time.sleep(0.1)
-        
-        # 計算統計資訊
-        stats = self._calculate_statistics(results)
-        
-        # 更新最終狀態
-        with self.lock:
-            self.active_tests[test_id]['status'] = 'completed'
-            self.active_tests[test_id]['progress'] = 100
-            self.active_tests[test_id]['statistics'] = stats
-            self.active_tests[test_id]['final_results'] = results  # 保存完整結果用於圖表
-    
-    def _calculate_statistics(self, results: List[Dict]) -> Dict:
-        """計算測試統計資訊"""
+
+    def _calculate_statistics(self, results) -> Dict:
+        """
+        計算測試統計資訊
+
+        Args:
+            results: RecordStore（或結果字典的列表），各統計直接讀取所需的欄位
+        """
         if not results:
             return {}
         
-        successful_results = [r for r in results if r['success']]
-        failed_results = [r for r in results if not r['success']]
+        # 各統計由ResultAnalysis直接讀取欄位陣列（安裝NumPy時向量化計算）
+        analysis = ResultAnalysis(results)
+        success = analysis.mask('success')
+        successful_count = analysis.count(success)
+        failed_count = len(analysis) - successful_count
         
-        if successful_results:
-            response_times = [r['response_time'] for r in successful_results]
-            
+        if successful_count:
             stats = {
-                'total_requests': len(results),
-                'successful_requests': len(successful_results),
-                'failed_requests': len(failed_results),
-                'success_rate': (len(successful_results) / len(results)) * 100,
-                'response_time_stats': {
-                    'min': min(response_times),
-                    'max': max(response_times),
-                    'mean': statistics.mean(response_times),
-                    'median': statistics.median(response_times),
-                    'std_dev': statistics.stdev(response_times) if len(response_times) > 1 else 0
-                },
-                'requests_per_second': len(successful_results) / sum(response_times) if sum(response_times) > 0 else 0
+                'total_requests': len(analysis),
+                'successful_requests': successful_count,
+                'failed_requests': failed_count,
+                'success_rate': (successful_count / len(analysis)) * 100,
+                'response_time_stats': describe(analysis.values('response_time', where=success))
             }
+
+            # 伺服器回報的Token數量與預填充/解碼吞吐量
+            token_stats = analysis.server_metrics(where=success)
+            if token_stats:
+                stats['token_stats'] = token_stats
+
+            # 開放迴路：從預定發送時間起算的延遲（修正協同遺漏）
+            corrected_times = analysis.values('corrected_response_time', where=success)
+            if len(corrected_times):
+                stats['corrected_response_time_stats'] = summarize(corrected_times)
+
+            # 每個延遲組成的分布
+            stats['latency_breakdown'] = analysis.latency_breakdown(where=success)
+
+            # 連線重用率與DNS/連線/TTFB耗時（線程引擎的同步客戶端記錄）
+            connection_timing = analysis.connection_timing(where=success)
+            if connection_timing:
+                stats['connection_timing'] = connection_timing
+
+            # 流式測量模式的TTFT與Token間延遲
+            stats.update(analysis.streaming_statistics(where=success))
         else:
             stats = {
-                'total_requests': len(results),
+                'total_requests': len(analysis),
                 'successful_requests': 0,
-                'failed_requests': len(failed_results),
+                'failed_requests': failed_count,
                 'success_rate': 0,
-                'response_time_stats': {},
-                'requests_per_second': 0
+                'response_time_stats': {}
             }
         
         return stats
@@ -237,18 +811,29 @@ class StressTestManager:
             if test_data.get('status') != 'completed':
                 return
 
-            # 準備資料庫資料
+            # 準備資料庫資料（負載代理執行的部分測試由主控端合併後保存）
             config = test_data.get('config', {})
+            if not config.get('save_history', True):
+                return
             statistics = test_data.get('statistics', {})
-            results = test_data.get('final_results', [])
+            # 歷史記錄保存為字典列表
+            results = list(test_data.get('final_results') or [])
 
             # 獲取當前硬體資訊
             hardware_info = get_hardware_info()
 
+            # 容量搜尋的步驟以parent_test_id連結到搜尋記錄
+            parent_test_id = config.get('parent_test_id')
+            test_name = f"基礎壓力測試_{test_data['start_time'].strftime('%Y%m%d_%H%M%S')}"
+            if config.get('agents'):
+                test_name = f"分散式壓力測試_{test_data['start_time'].strftime('%Y%m%d_%H%M%S')}"
+            if parent_test_id:
+                test_name = f"容量搜尋步驟{config.get('search_step', '')}_{test_data['start_time'].strftime('%Y%m%d_%H%M%S')}"
+
             # 準備保存的資料
             db_data = {
                 'test_id': test_id,
-                'test_name': f"基礎壓力測試_{test_data['start_time'].strftime('%Y%m%d_%H%M%S')}",
+                'test_name': test_name,
                 'test_type': 1,  # 基礎壓力測試
                 'test_time': test_data['start_time'],
                 'model_name': config.get('model', ''),
@@ -257,7 +842,25 @@ class StressTestManager:
                     'model': config.get('model', ''),
                     'concurrent_requests': config.get('concurrent_requests', 0),
                     'total_requests': config.get('total_requests', 0),
-                    'prompt': config.get('prompt', '')
+                    'prompt': config.get('prompt', ''),
+                    'engine': config.get('engine', ENGINE_THREAD),
+                    'worker_processes': config.get('worker_processes'),
+                    'stream': bool(config.get('stream', False)),
+                    'arrival_mode': config.get('arrival_mode', ARRIVAL_CLOSED),
+                    'arrival_rate': config.get('arrival_rate'),
+                    'rate_curve': config.get('rate_curve'),
+                    'load_profile': config.get('load_profile'),
+                    'test_duration_minutes': config.get('test_duration_minutes'),
+                    'soak': bool(config.get('soak', False)),
+                    'latency_slo_seconds': config.get('latency_slo_seconds'),
+                    'agents': config.get('agents'),
+                    'endpoints': config.get('endpoints'),
+                    'balance_strategy': config.get('balance_strategy'),
+                    'backend': config.get('backend') or BACKEND_GENERATE,
+                    'messages': config.get('messages'),
+                    'spill_results': config.get('spill_results'),
+                    'response_retention': config.get('response_retention') or RESPONSE_FULL,
+                    'response_sample_every': config.get('response_sample_every')
                 },
                 'test_results': {
                     'results': results,
@@ -268,9 +871,19 @@ class StressTestManager:
                 'total_requests': statistics.get('total_requests', 0),
                 'successful_requests': statistics.get('successful_requests', 0),
                 'failed_requests': statistics.get('failed_requests', 0),
-                'avg_response_time': statistics.get('response_time_stats', {}).get('mean', 0)
+                'avg_response_time': statistics.get('response_time_stats', {}).get('mean', 0),
+                'p99_response_time': statistics.get('latency_percentiles', {}).get('p99'),
+                'p999_response_time': statistics.get('latency_percentiles', {}).get('p999'),
+                'parent_test_id': parent_test_id
             }
 
+            if parent_test_id:
+                db_data['test_config']['search_step'] = config.get('search_step')
+            spill = test_data['result_log'].spill
+            if spill is not None:
+                # 溢寫的測試只保存最近的結果；完整的每個請求記錄在溢寫檔案中
+                db_data['test_results']['spill_file'] = spill.path
+
             # 保存到資料庫
             success = db.save_test_result(db_data)
             if success:
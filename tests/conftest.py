@@ -0,0 +1,20 @@
+"""
+單元測試的共用設定
+database.py在匯入時於目前目錄建立db.sqlite3，結果溢寫也寫入相對路徑；
+測試在暫存目錄中執行，不在專案目錄留下檔案
+"""
+
+import os
+import shutil
+import tempfile
+
+_workdir = tempfile.mkdtemp(prefix='ollama-stress-tests-')
+
+
+def pytest_sessionstart(session):
+    # 在收集測試模組（匯入database.py）之前切換目錄
+    os.chdir(_workdir)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(_workdir, ignore_errors=True)
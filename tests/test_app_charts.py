@@ -0,0 +1,58 @@
+"""app的圖表：大型測試的點圖取樣與預先計算的Token間延遲"""
+
+import json
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import app
+from record_store import RecordStore
+
+
+def make_results(count):
+    rng = random.Random(2)
+    start = datetime(2024, 1, 1, 12, 0, 0)
+    return RecordStore.from_records({
+        'task_id': index,
+        'success': True,
+        'timestamp': (start + timedelta(seconds=index * 0.1)).isoformat(),
+        'elapsed': index * 0.1,
+        'target_concurrency': 1 + index // 100,
+        'response_time': rng.uniform(0.1, 1.0),
+        'tokens_count': 10,
+        'ttft': rng.uniform(0.01, 0.1),
+        'decode_tokens_per_second': rng.uniform(20, 40),
+        'inter_token_latencies': [rng.uniform(0.01, 0.03) for _ in range(3)]
+    } for index in range(count))
+
+
+def figure(charts, name):
+    return json.loads(charts[name])
+
+
+@pytest.fixture
+def small_charts(monkeypatch):
+    monkeypatch.setattr(app, 'MAX_CHART_POINTS', 50)
+
+
+def test_point_charts_are_sampled(small_charts):
+    charts = app.generate_test_charts(make_results(500), {})
+    profile = figure(charts, 'load_profile')
+    assert all(len(trace['x']) == 50 for trace in profile['data'])
+    assert profile['data'][0]['x'] == sorted(profile['data'][0]['x'])
+    assert '每10筆取1筆' in profile['layout']['title']['text']
+    decode = figure(charts, 'decode_tokens_per_second')
+    assert len(decode['data'][0]['x']) == 50
+    assert decode['data'][0]['x'][:2] == [0, 10]
+
+
+def test_inter_token_latency_chart_uses_precomputed_statistics(small_charts):
+    precomputed = {'p50': 0.001, 'p90': 0.002, 'p95': 0.003, 'p99': 0.004, 'max': 0.005}
+    charts = app.generate_test_charts(make_results(500), {'inter_token_latency_stats': precomputed})
+    itl = figure(charts, 'inter_token_latency_percentiles')
+    assert itl['data'][0]['y'] == pytest.approx([1.0, 2.0, 3.0, 4.0, 5.0])
+
+    # 沒有預先計算的統計時只展開取樣請求的Token間延遲
+    charts = app.generate_test_charts(make_results(500), {})
+    assert figure(charts, 'inter_token_latency_percentiles')['data'][0]['y']
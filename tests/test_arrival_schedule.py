@@ -0,0 +1,123 @@
+"""arrival_schedule：各到達模式的排程與開放迴路派發"""
+
+import itertools
+import threading
+
+import pytest
+
+from arrival_schedule import (
+    ARRIVAL_CLOSED, ARRIVAL_CONSTANT, ARRIVAL_CURVE, ARRIVAL_POISSON,
+    arrival_offsets, rate_at, run_open_loop_threaded, summarize_schedule, validate_arrival_config
+)
+
+
+def take(offsets, count):
+    return list(itertools.islice(offsets, count))
+
+
+def test_constant_offsets_are_evenly_spaced():
+    assert take(arrival_offsets(ARRIVAL_CONSTANT, 4), 5) == [0.0, 0.25, 0.5, 0.75, 1.0]
+
+
+def test_poisson_offsets_are_reproducible_with_seed():
+    first = take(arrival_offsets(ARRIVAL_POISSON, 10, seed=7), 2000)
+    assert first == take(arrival_offsets(ARRIVAL_POISSON, 10, seed=7), 2000)
+    assert first[0] == 0.0
+    assert all(later > earlier for earlier, later in zip(first, first[1:]))
+    # 間隔為指數分布，平均間隔接近 1 / rate
+    assert first[-1] / (len(first) - 1) == pytest.approx(0.1, rel=0.1)
+
+
+def test_curve_offsets_follow_interpolated_rate():
+    offsets = take(arrival_offsets(ARRIVAL_CURVE, rate_curve=[[0, 1], [10, 10]]), 200)
+    assert all(later > earlier for earlier, later in zip(offsets, offsets[1:]))
+    # 前10秒的請求數約為速率曲線下的面積 (1 + 10) / 2 * 10 = 55
+    assert sum(1 for offset in offsets if offset < 10) == pytest.approx(55, abs=5)
+    # 曲線結束後沿用最後的速率
+    tail = [offset for offset in offsets if offset >= 12]
+    assert tail[1] - tail[0] == pytest.approx(0.1)
+
+
+def test_curve_skips_zero_rate_segment():
+    offsets = take(arrival_offsets(ARRIVAL_CURVE, rate_curve=[[0, 4], [1, 0], [3, 0], [4, 4]]), 12)
+    assert not [offset for offset in offsets if 1 <= offset <= 3]
+    assert offsets[-1] > 4
+
+
+def test_curve_ending_at_zero_is_rejected():
+    with pytest.raises(ValueError):
+        validate_arrival_config(ARRIVAL_CURVE, None, [[0, 5], [10, 0]])
+    # 產生器在第一次取值時驗證，不會無限迴圈等待速率回升
+    with pytest.raises(ValueError):
+        next(arrival_offsets(ARRIVAL_CURVE, rate_curve=[[10, 0], [0, 5]]))
+
+
+@pytest.mark.parametrize('mode, rate, curve', [
+    ('bursty', 1, None),
+    (ARRIVAL_CONSTANT, 0, None),
+    (ARRIVAL_POISSON, None, None),
+    (ARRIVAL_CURVE, None, []),
+    (ARRIVAL_CURVE, None, [[0, 0], [5, 0]]),
+    (ARRIVAL_CURVE, None, [[0, -1], [5, 2]]),
+])
+def test_invalid_configs_are_rejected(mode, rate, curve):
+    with pytest.raises(ValueError):
+        validate_arrival_config(mode, rate, curve)
+
+
+def test_closed_mode_has_no_schedule():
+    validate_arrival_config(ARRIVAL_CLOSED, None, None)
+    with pytest.raises(ValueError):
+        next(arrival_offsets(ARRIVAL_CLOSED))
+
+
+def test_rate_at_holds_endpoint_values():
+    curve = [[5, 2], [15, 12]]
+    assert rate_at(curve, 0) == 2
+    assert rate_at(curve, 10) == pytest.approx(7)
+    assert rate_at(curve, 20) == 12
+
+
+def test_run_open_loop_threaded_dispatches_every_task():
+    executed = []
+    lock = threading.Lock()
+
+    def execute(task, intended_start):
+        with lock:
+            executed.append(task)
+
+    dispatcher = run_open_loop_threaded(range(10), arrival_offsets(ARRIVAL_CONSTANT, 200), 4,
+                                        execute, lambda: False)
+    assert sorted(executed) == list(range(10))
+    assert dispatcher['dispatched'] == 10
+    assert dispatcher['dispatch_lag'].count == 10
+
+    schedule = summarize_schedule(ARRIVAL_CONSTANT, 200, dispatcher, [0.001] * 10)
+    assert schedule['dispatched_requests'] == 10
+    assert schedule['offered_rate'] > 0
+    assert schedule['max_send_lag'] == 0.001
+    assert set(schedule['dispatch_lag_stats']) == set(schedule['send_lag_stats'])
+
+
+def test_run_open_loop_threaded_stops_dispatching():
+    dispatcher = run_open_loop_threaded(range(1000), arrival_offsets(ARRIVAL_CONSTANT, 1), 2,
+                                        lambda task, intended_start: None, lambda: True)
+    assert dispatcher['dispatched'] == 0
+
+
+def test_run_open_loop_threaded_cancels_queued_requests_on_stop():
+    started = []
+    stop = threading.Event()
+    release = threading.Event()
+
+    def execute(task, intended_start):
+        # 唯一的工作線程停在第一個請求，其餘請求在池中排隊
+        started.append(task)
+        release.wait(5)
+
+    threading.Timer(0.1, stop.set).start()
+    threading.Timer(0.3, release.set).start()
+    dispatcher = run_open_loop_threaded(range(10_000), arrival_offsets(ARRIVAL_CONSTANT, 500), 1,
+                                        execute, stop.is_set)
+    assert dispatcher['dispatched'] > 1
+    assert started == [0]
@@ -0,0 +1,87 @@
+"""endpoint_balancer：端點整理與各平衡策略"""
+
+import pytest
+
+from endpoint_balancer import (
+    BALANCE_CONSISTENT_HASH, BALANCE_LEAST_OUTSTANDING, BALANCE_ROUND_ROBIN, DEFAULT_ENDPOINT,
+    EndpointBalancer, endpoint_options, endpoint_summary, normalize_endpoints
+)
+from latency_histogram import LatencyHistogram
+
+ENDPOINTS = ['http://a:11434', 'http://b:11434', 'http://c:11434']
+
+
+def test_normalize_endpoints_accepts_strings_and_lists():
+    assert normalize_endpoints(None) == [DEFAULT_ENDPOINT]
+    assert normalize_endpoints('') == [DEFAULT_ENDPOINT]
+    assert normalize_endpoints('http://a:11434/, http://b:11434 http://a:11434') == ENDPOINTS[:2]
+    assert normalize_endpoints(['http://b:11434/', ' http://c:11434 ']) == ENDPOINTS[1:]
+
+
+def test_invalid_strategy_and_empty_endpoints_are_rejected():
+    with pytest.raises(ValueError):
+        EndpointBalancer(ENDPOINTS, 'random')
+    with pytest.raises(ValueError):
+        EndpointBalancer([])
+    with pytest.raises(ValueError):
+        endpoint_options({'balance_strategy': 'random'})
+
+
+def test_round_robin_cycles_through_endpoints():
+    balancer = EndpointBalancer(ENDPOINTS, BALANCE_ROUND_ROBIN)
+    assert [balancer.acquire() for _ in range(7)] == ENDPOINTS * 2 + ENDPOINTS[:1]
+    assert balancer.outstanding() == {'http://a:11434': 3, 'http://b:11434': 2, 'http://c:11434': 2}
+
+
+def test_least_outstanding_prefers_idle_endpoints():
+    balancer = EndpointBalancer(ENDPOINTS, BALANCE_LEAST_OUTSTANDING)
+    # 都沒有進行中請求時輪流選擇
+    assert [balancer.acquire() for _ in range(3)] == ENDPOINTS
+    balancer.release('http://b:11434')
+    assert balancer.acquire() == 'http://b:11434'
+
+    balancer.release('http://a:11434')
+    balancer.release('http://c:11434')
+    # a與c都空閒：從上次選到的b之後輪流，先選c
+    assert balancer.acquire() == 'http://c:11434'
+    assert balancer.acquire() == 'http://a:11434'
+    assert balancer.outstanding() == {endpoint: 1 for endpoint in ENDPOINTS}
+
+
+def test_consistent_hash_is_stable_per_key():
+    balancer = EndpointBalancer(ENDPOINTS, BALANCE_CONSISTENT_HASH)
+    keys = [f"user_{i}" for i in range(300)]
+    assignment = {key: balancer.acquire(key) for key in keys}
+    assert all(balancer.acquire(key) == assignment[key] for key in keys)
+    # 虛擬節點讓每個端點都分到一部分用戶
+    assert set(assignment.values()) == set(ENDPOINTS)
+
+    with pytest.raises(ValueError):
+        balancer.acquire()
+
+
+def test_consistent_hash_moves_only_keys_of_removed_endpoint():
+    keys = [f"user_{i}" for i in range(300)]
+    full = EndpointBalancer(ENDPOINTS, BALANCE_CONSISTENT_HASH)
+    reduced = EndpointBalancer(ENDPOINTS[:2], BALANCE_CONSISTENT_HASH)
+    for key in keys:
+        before = full.acquire(key)
+        if before != 'http://c:11434':
+            assert reduced.acquire(key) == before
+
+
+def test_endpoint_summary_uses_shared_wall_clock():
+    histogram = LatencyHistogram()
+    for value in (0.1, 0.2, 0.3):
+        histogram.record(value)
+    summary = endpoint_summary('http://a:11434', successful=3, failed=1, response_time_sum=0.6,
+                               output_tokens=30, histogram=histogram, wall_clock_seconds=2.0,
+                               total_requests=8)
+    assert summary['requests'] == 4
+    assert summary['share'] == pytest.approx(50.0)
+    assert summary['average_response_time'] == pytest.approx(0.2)
+    assert summary['requests_per_second'] == pytest.approx(1.5)
+    assert summary['output_tokens_per_second'] == pytest.approx(15.0)
+
+    empty = endpoint_summary('http://b:11434', 0, 0, 0.0, 0, LatencyHistogram(), 0.0, 0)
+    assert empty['share'] == 0.0 and empty['requests_per_second'] == 0.0
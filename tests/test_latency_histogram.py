@@ -0,0 +1,85 @@
+"""latency_histogram：百分位數精度、合併與序列化"""
+
+import json
+import random
+
+import pytest
+
+from latency_histogram import BUCKET_RATIO, MAX_BUCKET, LatencyHistogram, percentile_key
+from streaming_metrics import percentile
+
+
+def recorded(values):
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+    return histogram
+
+
+def test_percentiles_are_within_bucket_precision():
+    rng = random.Random(1)
+    values = [rng.lognormvariate(0, 1) for _ in range(20000)]
+    histogram = recorded(values)
+    ordered = sorted(values)
+    for p in (50, 90, 99, 99.9):
+        exact = ordered[max(0, int(p / 100 * len(ordered) + 0.5) - 1)]
+        assert histogram.percentile(p) == pytest.approx(exact, rel=BUCKET_RATIO - 1)
+    assert histogram.percentile(50) == pytest.approx(percentile(ordered, 50), rel=0.02)
+
+
+def test_summary_keys_and_extremes():
+    histogram = recorded([0.5, 1.0, 2.0, 30.0])
+    summary = histogram.summary()
+    assert summary['count'] == 4
+    assert summary['mean'] == pytest.approx(33.5 / 4)
+    assert summary['min'] == 0.5
+    assert summary['max'] == 30.0
+    assert set(summary) >= {'p50', 'p90', 'p99', 'p999'}
+    # 百分位數限制在實際最小值與最大值之間
+    assert histogram.percentile(100) == 30.0
+    assert histogram.percentile(0) == 0.5
+
+
+def test_empty_histogram():
+    histogram = LatencyHistogram()
+    assert histogram.summary() == {}
+    assert histogram.percentile(99) == 0.0
+
+
+def test_out_of_range_values_use_edge_buckets():
+    histogram = recorded([0.0, 1e9])
+    assert histogram.count == 2
+    assert sorted(histogram.counts) == [0, MAX_BUCKET]
+    assert histogram.max == 1e9
+
+
+def test_merge_matches_single_histogram():
+    rng = random.Random(2)
+    values = [rng.uniform(0.01, 5) for _ in range(5000)]
+    merged = recorded(values[:1000]).merge(recorded(values[1000:])).merge(LatencyHistogram())
+    single = recorded(values)
+    assert merged.counts == single.counts
+    assert merged.count == single.count
+    assert merged.total == pytest.approx(single.total)
+    assert (merged.min, merged.max) == (single.min, single.max)
+    assert merged.summary() == pytest.approx(single.summary())
+
+
+def test_round_trip_through_json():
+    histogram = recorded([0.1, 0.2, 0.2, 3.5])
+    restored = LatencyHistogram.from_dict(json.loads(json.dumps(histogram.to_dict())))
+    assert restored.counts == histogram.counts
+    assert restored.summary() == histogram.summary()
+    assert LatencyHistogram.from_dict(None).count == 0
+
+
+def test_from_dict_rejects_other_bucket_layout():
+    data = recorded([1.0]).to_dict()
+    data['bucket_ratio'] = 1.5
+    with pytest.raises(ValueError):
+        LatencyHistogram.from_dict(data)
+
+
+def test_percentile_key():
+    assert percentile_key(50) == 'p50'
+    assert percentile_key(99.9) == 'p999'
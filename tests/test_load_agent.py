@@ -0,0 +1,65 @@
+"""load_agent：共用權杖與過期計畫的清除"""
+
+import threading
+import time
+
+import pytest
+
+import load_agent
+from agent_coordinator import AGENT_TOKEN_HEADER, AgentClient, PLAN_BASIC
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setitem(load_agent.app.config, 'AGENT_TOKEN', None)
+    monkeypatch.setattr(load_agent, 'plans', {})
+    return load_agent.app.test_client()
+
+
+def make_plan(finished_at=None):
+    return {'kind': PLAN_BASIC, 'config': {}, 'start_at': 0.0, 'stop_event': threading.Event(),
+            'status': 'completed', 'test_id': None, 'error': None, 'finished_at': finished_at}
+
+
+def test_requests_need_the_shared_token_when_configured(client, monkeypatch):
+    monkeypatch.setitem(load_agent.app.config, 'AGENT_TOKEN', 'secret')
+    assert client.get('/api/agent/health').status_code == 401
+    assert client.get('/api/agent/health', headers={AGENT_TOKEN_HEADER: 'wrong'}).status_code == 401
+    assert client.post('/api/agent/plans', json={}).status_code == 401
+    assert client.get('/api/agent/health', headers={AGENT_TOKEN_HEADER: 'secret'}).status_code == 200
+
+
+def test_no_token_configured_allows_requests(client):
+    assert client.get('/api/agent/health').status_code == 200
+
+
+def test_agent_client_sends_token_from_environment(monkeypatch):
+    monkeypatch.setenv('LOAD_AGENT_TOKEN', 'from-env')
+    assert AgentClient('http://agent:5101').session.headers[AGENT_TOKEN_HEADER] == 'from-env'
+    assert AgentClient('http://agent:5101', token='explicit').session.headers[AGENT_TOKEN_HEADER] == 'explicit'
+    monkeypatch.delenv('LOAD_AGENT_TOKEN')
+    assert AGENT_TOKEN_HEADER not in AgentClient('http://agent:5101').session.headers
+
+
+def test_prune_removes_only_plans_finished_longer_than_ttl(client):
+    now = time.time()
+    load_agent.plans.update({
+        'expired': make_plan(finished_at=now - load_agent.PLAN_TTL - 1),
+        'recent': make_plan(finished_at=now - 1),
+        'running': make_plan()
+    })
+    load_agent._prune_plans()
+    assert set(load_agent.plans) == {'recent', 'running'}
+
+
+def test_plan_stopped_before_start_is_marked_finished(client):
+    response = client.post('/api/agent/plans', json={
+        'plan_id': 'p1', 'kind': PLAN_BASIC, 'config': {}, 'start_at': time.time() + 60})
+    assert response.status_code == 200
+    assert client.post('/api/agent/plans/p1/stop').status_code == 200
+
+    deadline = time.time() + 5
+    while load_agent.plans['p1']['finished_at'] is None and time.time() < deadline:
+        time.sleep(0.01)
+    assert load_agent.plans['p1']['finished_at'] is not None
+    assert client.get('/api/agent/plans/p1').get_json()['status'] == 'completed'
@@ -0,0 +1,147 @@
+"""mock_ollama_server：模擬服務器的行為，以及測試管理器對模擬服務器的完整執行"""
+
+import json
+import time
+
+import pytest
+
+from mock_ollama_server import (
+    DEFAULT_MODEL, InjectedError, MockOllama, MockOllamaConfig, MockServerThread, ServerBusy, create_app
+)
+from multi_user_stress_test import MultiUserStressTestManager
+from ollama_client import MultiEndpointOllamaClient
+from result_retention import RetentionPolicy
+from stress_test_simple import StressTestManager
+
+# 快速的模擬服務器：測試的耗時主要是請求本身的開銷
+FAST = dict(prefill_tokens_per_second=1e6, decode_tokens_per_second=5000, output_tokens=8)
+
+
+def fast_client(**overrides):
+    return create_app(MockOllama(MockOllamaConfig(**{**FAST, **overrides}))).test_client()
+
+
+def test_generate_reports_token_counts_and_durations():
+    client = fast_client()
+    data = client.post('/api/generate', json={'model': DEFAULT_MODEL, 'prompt': 'hello', 'stream': False}).get_json()
+    assert data['done'] is True
+    assert data['eval_count'] == 8
+    assert data['prompt_eval_count'] >= 1
+    assert data['total_duration'] >= data['eval_duration'] > 0
+
+    options = {'model': DEFAULT_MODEL, 'prompt': 'hello', 'stream': False, 'options': {'num_predict': 3}}
+    assert client.post('/api/generate', json=options).get_json()['eval_count'] == 3
+
+
+def test_generate_streams_one_chunk_per_token():
+    client = fast_client()
+    response = client.post('/api/generate', json={'model': DEFAULT_MODEL, 'prompt': 'hello'})
+    chunks = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [chunk['done'] for chunk in chunks] == [False] * 8 + [True]
+    assert chunks[-1]['eval_count'] == 8
+
+
+def test_unknown_model_and_injected_errors():
+    assert fast_client().post('/api/generate', json={'model': 'missing', 'prompt': 'x'}).status_code == 404
+    client = fast_client(error_rate=1.0, seed=1)
+    assert client.post('/api/generate', json={'model': DEFAULT_MODEL, 'prompt': 'x'}).status_code == 500
+
+
+def test_slots_queue_and_reject():
+    mock = MockOllama(MockOllamaConfig(parallel=1, max_queue=0))
+    assert mock.admit() >= 0
+    with pytest.raises(ServerBusy):
+        mock.admit()
+    mock.release(True)
+    mock.admit()
+    assert mock.statistics()['rejected'] == 1
+    assert mock.statistics()['peak_active'] == 1
+
+    with pytest.raises(InjectedError):
+        MockOllama(MockOllamaConfig(error_rate=1.0)).admit()
+
+
+def wait_for(condition, timeout=30):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "test did not finish in time"
+        time.sleep(0.05)
+
+
+@pytest.fixture(scope='module')
+def server():
+    with MockServerThread(MockOllamaConfig(parallel=8, **FAST)) as server:
+        yield server
+
+
+@pytest.mark.parametrize('engine, stream', [('thread', False), ('async', False), ('thread', True)])
+def test_stress_test_runs_end_to_end(server, engine, stream):
+    manager = StressTestManager(RetentionPolicy(spill_threshold=None))
+    test_id = manager.start_test({
+        'model': DEFAULT_MODEL, 'prompt': 'hello', 'concurrent_requests': 4, 'total_requests': 20,
+        'endpoints': [server.url], 'engine': engine, 'stream': stream, 'save_history': False
+    })
+    wait_for(lambda: 'end_time' in manager.get_test_status(test_id))
+
+    status = manager.get_test_status(test_id)
+    assert status['status'] == 'completed', status.get('error')
+    statistics = status['statistics']
+    assert statistics['total_requests'] == 20
+    assert statistics['successful_requests'] == 20
+    assert statistics['token_stats']['total_output_tokens'] == 20 * 8
+    assert statistics['token_stats']['eval_tokens_per_second'] > 0
+    if stream:
+        assert statistics['ttft_stats']['count'] == 20
+    results = manager.get_test_results(test_id)
+    assert sorted(results.column('task_id')) == list(range(20))
+
+
+@pytest.mark.parametrize('arrival', [{}, {'arrival_mode': 'constant', 'arrival_rate': 200}])
+def test_worker_exceptions_count_as_failed_requests(server, monkeypatch, arrival):
+    def broken(self, model, prompt, stream=False):
+        raise RuntimeError('broken client')
+
+    monkeypatch.setattr(MultiEndpointOllamaClient, 'generate_response', broken)
+    manager = StressTestManager(RetentionPolicy(spill_threshold=None))
+    test_id = manager.start_test({
+        'model': DEFAULT_MODEL, 'prompt': 'hello', 'concurrent_requests': 2, 'total_requests': 6,
+        'endpoints': [server.url], 'engine': 'thread', 'save_history': False, **arrival
+    })
+    wait_for(lambda: 'end_time' in manager.get_test_status(test_id))
+
+    statistics = manager.get_test_status(test_id)['statistics']
+    assert statistics['total_requests'] == 6
+    assert statistics['failed_requests'] == 6
+    errors = manager.get_test_results(test_id).column('error')
+    assert all('broken client' in error for error in errors)
+
+
+def test_multi_user_test_runs_end_to_end(server):
+    manager = MultiUserStressTestManager()
+    test_id = manager.start_multi_user_test({
+        'model': DEFAULT_MODEL, 'user_count': 3, 'queries_per_user': 4, 'delay_between_queries': 0,
+        'endpoints': [server.url], 'save_history': False
+    })
+    wait_for(lambda: manager.get_test_status(test_id)['status'] in ('completed', 'error'))
+
+    status = manager.get_test_status(test_id)
+    assert status['status'] == 'completed'
+    assert status['statistics']['total_queries'] == 12
+    assert status['statistics']['successful_queries'] == 12
+    assert status['statistics']['total_tokens'] == 12 * 8
+
+
+def test_running_multi_user_result_snapshot_is_independent(server):
+    manager = MultiUserStressTestManager()
+    test_id = manager.start_multi_user_test({
+        'model': DEFAULT_MODEL, 'user_count': 4, 'queries_per_user': 200, 'delay_between_queries': 0,
+        'endpoints': [server.url], 'save_history': False
+    })
+    wait_for(lambda: len(manager.active_tests[test_id]['result'].query_results) >= 5)
+    snapshot = manager.get_result_snapshot(test_id)
+    count = len(snapshot.query_results)
+    assert snapshot.query_results is not manager.active_tests[test_id]['result'].query_results
+    wait_for(lambda: manager.get_test_status(test_id)['status'] in ('completed', 'error'))
+    # 工作線程之後附加的結果不影響副本
+    assert len(snapshot.query_results) == count < 800
+    assert manager.get_result_snapshot(test_id) is None
@@ -0,0 +1,82 @@
+"""process_load_engine：並發數分配、分批送回的結果與實際執行"""
+
+import random
+
+import pytest
+
+from mock_ollama_server import MockOllamaConfig, MockServerThread
+from process_load_engine import ProcessLoadEngine, split_concurrency
+from record_store import RecordStore
+from result_log import ResultLog, count_result
+from result_retention import RESPONSE_NONE
+from worker_counters import WorkerCounters
+
+
+def test_split_concurrency():
+    assert split_concurrency(10, 3) == [4, 3, 3]
+    assert split_concurrency(2, 8) == [1, 1]
+    assert sum(split_concurrency(101, 7)) == 101
+
+
+def make_result(rng, index):
+    success = rng.random() < 0.9
+    result = {'success': success, 'response': 'ok' if success else '', 'response_time': rng.uniform(0.1, 2),
+              'endpoint': rng.choice(['http://a:11434', 'http://b:11434']), 'task_id': index}
+    if success:
+        result['eval_count'] = rng.randrange(1, 100)
+    else:
+        result['error'] = 'HTTP 500'
+    return result
+
+
+def test_append_batch_matches_appending_each_result():
+    rng = random.Random(5)
+    results = [make_result(rng, i) for i in range(300)]
+
+    single = ResultLog(latency_slo=1.0)
+    for result in results:
+        single.append(dict(result))
+
+    batched = ResultLog(latency_slo=1.0)
+    for start in range(0, len(results), 64):
+        records = RecordStore()
+        counters = WorkerCounters()
+        for result in results[start:start + 64]:
+            count_result(counters, result, 1.0)
+            records.append(result)
+        batched.append_batch(records, counters.totals(), counters.histograms())
+
+    aggregates = batched.aggregates()
+    expected = single.aggregates()
+    assert aggregates.pop('latency_percentiles') == pytest.approx(expected.pop('latency_percentiles'))
+    assert aggregates == pytest.approx(expected)
+    assert batched.throughput(10) == pytest.approx(single.throughput(10))
+    for endpoint, expected_endpoint in zip(batched.endpoint_statistics(10), single.endpoint_statistics(10)):
+        assert endpoint.pop('endpoint') == expected_endpoint.pop('endpoint')
+        assert endpoint.pop('latency_percentiles') == pytest.approx(expected_endpoint.pop('latency_percentiles'))
+        assert endpoint == pytest.approx(expected_endpoint)
+    assert list(batched.entries()) == list(single.entries())
+    assert batched.cursor == single.cursor == 300
+
+
+def test_process_engine_runs_against_mock_server():
+    config = MockOllamaConfig(parallel=8, prefill_tokens_per_second=1e6, decode_tokens_per_second=5000,
+                              output_tokens=8)
+    with MockServerThread(config) as server:
+        engine = ProcessLoadEngine(4, processes=2, endpoints=[server.url])
+        engine.start('mock:latest', 'hello', False, response_retention=RESPONSE_NONE)
+        log = ResultLog()
+        statistics = engine.run(40, None, log.append_batch, lambda: False)
+
+    assert statistics['processes'] == 2
+    assert statistics['requests'] == 40
+    assert statistics['failed'] == 0
+    records = log.entries()
+    assert sorted(records.column('task_id')) == list(range(40))
+    assert set(records.column('worker_thread')) == {'process-0', 'process-1'}
+    # 回應內容在工作行程中捨棄，只傳回長度、雜湊與Token數
+    assert set(records.column('response')) == {''}
+    assert all(length > 0 for length in records.column('response_length'))
+    assert set(records.column('tokens_count')) == {8}
+    assert all(value is not None for value in records.column('client_queue_time'))
+    assert log.aggregates()['successful_results'] == 40
@@ -0,0 +1,146 @@
+"""record_store：以欄位保存的記錄"""
+
+import pickle
+import random
+from datetime import datetime
+
+import pytest
+
+from record_store import RecordStore
+
+
+def make_record(rng, index):
+    record = {
+        'task_id': index,
+        'success': rng.random() < 0.8,
+        'response_time': rng.random(),
+        'endpoint': rng.choice(['http://a:11434', 'http://b:11434', None]),
+        'timestamp': datetime(2024, 1, 1, 12, 0, index % 60).isoformat()
+    }
+    if rng.random() < 0.3:
+        record['ttft'] = rng.random()
+    if rng.random() < 0.1:
+        # 同一欄位出現不同類型的值時改為逐筆保存
+        record['eval_count'] = rng.choice([5, 5.5, None])
+    if rng.random() < 0.2:
+        record['inter_token_latencies'] = [rng.random(), rng.random()]
+    return record
+
+
+@pytest.mark.parametrize('max_entries', [None, 7, 50])
+def test_extend_store_matches_appending_records(max_entries):
+    rng = random.Random(11)
+    records = [make_record(rng, i) for i in range(500)]
+    expected = RecordStore(max_entries)
+    expected.extend(records)
+
+    store = RecordStore(max_entries)
+    start = 0
+    while start < len(records):
+        count = rng.randrange(0, 40)
+        chunk = RecordStore()
+        chunk.extend(records[start:start + count])
+        store.extend_store(chunk)
+        start += count
+
+    assert list(store) == list(expected)
+    assert len(store) == len(expected)
+    assert store.dropped == expected.dropped
+    for field in expected.fields():
+        assert store.column(field) == expected.column(field)
+
+
+def test_round_trip_keeps_keys_order_types_and_values():
+    records = [
+        {'task_id': 1, 'success': True, 'response_time': 0.25, 'model': 'llama3', 'response': 'hello',
+         'timestamp': '2024-01-01T12:00:00.123456', 'inter_token_latencies': [0.01, 0.02]},
+        # 不同的鍵集合與順序、缺少欄位、None值
+        {'success': False, 'task_id': 2, 'error': 'HTTP 500', 'model': None, 'response_time': None},
+        # 同一欄位的類型改變（int -> float -> str）時改為逐筆保存
+        {'task_id': 3.5, 'success': True, 'timestamp': datetime(2024, 1, 1, 12, 0, 1)},
+        {'task_id': 'four', 'success': True, 'timestamp': '2024-01-01 12:00:02'}
+    ]
+    store = RecordStore.from_records(records)
+    assert len(store) == 4
+    for stored, original in zip(store, records):
+        assert stored == original
+        assert list(stored) == list(original)
+        assert [type(value) for value in stored.values()] == [type(value) for value in original.values()]
+    assert store[-1] == records[-1]
+    assert store[1:3] == records[1:3]
+    with pytest.raises(IndexError):
+        store[4]
+    assert store.column('task_id') == [1, 2, 3.5, 'four']
+    assert store.column('error') == [None, 'HTTP 500', None, None]
+    assert store.column('missing') == [None] * 4
+    assert store.column('task_id', where=[True, False, True, False]) == [1, 3.5]
+
+
+def test_timestamps_are_available_as_seconds():
+    moment = datetime(2024, 1, 1, 12, 0, 0, 500000)
+    store = RecordStore.from_records([{'timestamp': moment}, {'timestamp': None}])
+    assert store.seconds('timestamp') == [moment.timestamp(), None]
+    array_values, none = store.raw_column('timestamp')
+    assert list(array_values) == [round(moment.timestamp() * 1_000_000), none]
+
+
+def test_max_entries_keeps_the_most_recent_records():
+    store = RecordStore(max_entries=3)
+    store.extend({'task_id': i} for i in range(10))
+    assert len(store) == 3
+    assert store.dropped == 7
+    assert store.column('task_id') == [7, 8, 9]
+    assert [record['task_id'] for record in store] == [7, 8, 9]
+
+
+def test_copy_and_tail_are_independent():
+    store = RecordStore(max_entries=5)
+    store.extend({'task_id': i, 'endpoint': f'http://{i % 2}:11434'} for i in range(8))
+    tail = store.tail(2)
+    copy = store.copy()
+    store.append({'task_id': 8, 'endpoint': 'http://new:11434'})
+
+    assert tail.column('task_id') == [6, 7]
+    assert tail.dropped == 6
+    assert copy.column('task_id') == [3, 4, 5, 6, 7]
+    assert copy.dropped == 3
+    # 副本的編號表不受原本記錄新增的字串影響
+    copy.append({'task_id': 99, 'endpoint': 'http://other:11434'})
+    assert store.column('endpoint')[-1] == 'http://new:11434'
+    assert copy.column('endpoint')[-1] == 'http://other:11434'
+
+
+def test_row_factory_builds_objects():
+    class Row:
+        def __init__(self, task_id, success=True):
+            self.task_id = task_id
+            self.success = success
+
+    store = RecordStore(row_factory=Row)
+    store.append(Row(1, False))
+    store.append({'task_id': 2})
+    rows = list(store)
+    assert [(row.task_id, row.success) for row in rows] == [(1, False), (2, True)]
+    assert store[0].task_id == 1
+
+
+def test_interned_strings_fall_back_when_there_are_too_many(monkeypatch):
+    import record_store
+    monkeypatch.setattr(record_store, 'MAX_INTERNED_VALUES', 3)
+    store = RecordStore()
+    prompts = [f"prompt {i}" for i in range(6)] + ['prompt 0']
+    store.extend({'prompt': prompt} for prompt in prompts)
+    assert store.column('prompt') == prompts
+    assert store.raw_column('prompt') is None
+
+
+def test_pickle_round_trip():
+    # 行程引擎以pickle傳送分批的RecordStore
+    rng = random.Random(3)
+    store = RecordStore(max_entries=20)
+    store.extend(make_record(rng, i) for i in range(45))
+    restored = pickle.loads(pickle.dumps(store))
+    assert list(restored) == list(store)
+    assert restored.dropped == store.dropped
+    restored.append(make_record(rng, 45))
+    assert len(restored) == 20
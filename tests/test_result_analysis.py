@@ -0,0 +1,148 @@
+"""result_analysis：NumPy與純Python兩種計算方式回傳相同的結果"""
+
+import random
+import statistics
+from datetime import datetime, timedelta
+
+import pytest
+
+import result_analysis
+from record_store import RecordStore
+from result_analysis import (
+    ResultAnalysis, box_statistics, describe, group_by, histogram, span_seconds, summarize, time_buckets, to_list
+)
+from connection_pool import aggregate_connection_timing
+from server_metrics import aggregate_latency_breakdown, aggregate_server_metrics
+from streaming_metrics import summarize_values
+from throughput_series import ThroughputSeries, build_throughput_series
+
+
+@pytest.fixture(params=['python', 'numpy'])
+def backend(request, monkeypatch):
+    if request.param == 'python':
+        monkeypatch.setattr(result_analysis, 'HAS_NUMPY', False)
+        monkeypatch.setattr(result_analysis, 'np', None)
+    else:
+        pytest.importorskip('numpy')
+        assert result_analysis.HAS_NUMPY
+    return request.param
+
+
+def make_results(count=200, seed=7):
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1, 12, 0, 0)
+    results = []
+    for index in range(count):
+        success = rng.random() < 0.85
+        result = {
+            'user_id': rng.randrange(1, 6),
+            'success': success,
+            'timestamp': (start + timedelta(seconds=index * 0.25)).isoformat(),
+            'response_time': rng.uniform(0.1, 3.0),
+            'tokens_count': rng.randrange(1, 200) if success else 0
+        }
+        if success and rng.random() < 0.5:
+            result['ttft'] = rng.uniform(0.01, 0.5)
+            result['decode_tokens_per_second'] = rng.uniform(10, 80)
+            result['inter_token_latencies'] = [rng.uniform(0.005, 0.05) for _ in range(rng.randrange(0, 5))]
+        if success:
+            result['eval_count'] = result['tokens_count']
+            result['eval_duration'] = rng.randrange(1, 10) * 100_000_000
+            result['network_time'] = rng.uniform(0, 0.05)
+            result['decode_time'] = rng.uniform(0.1, 2.0)
+        if rng.random() < 0.7:
+            result['connection_reused'] = rng.random() < 0.8
+            result['ttfb'] = rng.uniform(0.01, 0.2)
+            if not result['connection_reused']:
+                result['connect_time'] = rng.uniform(0.001, 0.01)
+        results.append(result)
+    return results
+
+
+def test_summaries_match_reference(backend):
+    values = [random.Random(1).uniform(0, 10) for _ in range(501)]
+    assert summarize(values) == pytest.approx(summarize_values(values))
+    described = describe(values)
+    assert described['median'] == pytest.approx(statistics.median(values))
+    assert described['std_dev'] == pytest.approx(statistics.stdev(values))
+    assert summarize([]) == {} and describe([]) == {} and box_statistics([]) == {}
+
+    box = box_statistics(values)
+    assert box['q1'] <= box['median'] <= box['q3']
+    assert min(values) <= box['lowerfence'] <= box['q1']
+    assert box['q3'] <= box['upperfence'] <= max(values)
+
+
+def test_histogram_matches_numpy_semantics(backend):
+    counts, edges = histogram([1.0, 2.0, 2.0, 3.0], bins=2)
+    assert counts == [1, 3]
+    assert edges == pytest.approx([1.0, 2.0, 3.0])
+    counts, edges = histogram([5.0, 5.0], bins=2)
+    assert counts == [0, 2]
+    assert edges == pytest.approx([4.5, 5.0, 5.5])
+
+
+def test_group_by_keeps_first_seen_order(backend):
+    groups = group_by([3, 1, 3, 2], tokens=[10, 20, 30, 40])
+    assert list(groups) == [3, 1, 2]
+    assert groups[3] == {'count': 2, 'tokens': 40}
+
+
+def test_result_analysis_selects_and_aggregates(backend):
+    results = make_results()
+    analysis = ResultAnalysis(RecordStore.from_records(results))
+    success = analysis.mask('success')
+    successful = [r for r in results if r['success']]
+
+    assert analysis.count(success) == len(successful)
+    assert to_list(analysis.values('response_time', where=success)) == pytest.approx(
+        [r['response_time'] for r in successful])
+    assert analysis.total('tokens_count', where=success) == sum(r['tokens_count'] for r in successful)
+    assert list(to_list(analysis.keys('user_id', where=success))) == [r['user_id'] for r in successful]
+
+    streamed = analysis.present('ttft', where=success)
+    assert analysis.count(streamed) == sum(1 for r in results if 'ttft' in r)
+    sampled = analysis.sample(streamed, 10)
+    assert 0 < analysis.count(sampled) <= 10
+    assert all(not selected or streamed_selected for selected, streamed_selected in zip(sampled, streamed))
+    assert analysis.sample(streamed, 10_000) is streamed
+
+    streaming = analysis.streaming_statistics(where=success)
+    itls = [itl for r in results for itl in r.get('inter_token_latencies', [])]
+    assert streaming['inter_token_latency_stats'] == pytest.approx(summarize_values(itls))
+
+    server = analysis.server_metrics(where=success)
+    assert server['total_output_tokens'] == sum(r['eval_count'] for r in successful)
+
+
+def test_time_buckets_match_throughput_series(backend):
+    results = make_results()
+    expected = ThroughputSeries(1)
+    for r in results:
+        start = datetime.fromisoformat(r['timestamp']).timestamp()
+        expected.add(start, start + r['response_time'], r['tokens_count'], r['success'])
+
+    series = build_throughput_series(RecordStore.from_records(results), bucket_seconds=1)
+    assert series.buckets == expected.buckets
+    starts, ends, _, _ = ResultAnalysis(results).request_intervals()
+    assert span_seconds(starts, ends) == pytest.approx(max(ends) - min(starts))
+    assert time_buckets([], [], [], [], 1) == {}
+
+
+def test_aggregates_match_per_record_functions(backend):
+    # 兩種計算方式都與逐筆彙總的函數（純Python的計算方式直接使用）結果相同
+    results = make_results()
+    successful = [r for r in results if r['success']]
+    analysis = ResultAnalysis(RecordStore.from_records(results))
+    success = analysis.mask('success')
+    breakdown = analysis.latency_breakdown(where=success)
+    expected = aggregate_latency_breakdown(successful)
+    assert set(breakdown) == set(expected) == {'network_time', 'decode_time'}
+    for component, summary in expected.items():
+        assert breakdown[component] == pytest.approx(summary)
+    timing = analysis.connection_timing(where=success)
+    expected = aggregate_connection_timing(successful)
+    for field in ('dns_time', 'connect_time', 'ttfb'):
+        assert timing.pop(field, None) == pytest.approx(expected.pop(field, None))
+    assert timing == pytest.approx(expected)
+    assert analysis.server_metrics(where=success) == pytest.approx(aggregate_server_metrics(successful))
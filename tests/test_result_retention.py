@@ -0,0 +1,83 @@
+"""result_retention：已完成測試的移除與溢寫檔案，以及溢寫測試的吞吐量統計"""
+
+import os
+import time
+
+import pytest
+
+import multi_user_stress_test
+from mock_ollama_server import DEFAULT_MODEL, MockOllamaConfig, MockServerThread
+from multi_user_stress_test import MultiUserStressTestManager
+from result_retention import CompletedTestStore, ResultSpill, RetentionPolicy
+from throughput_series import ThroughputSeries
+
+
+def test_store_evicts_least_recently_used_and_calls_on_evict():
+    evicted = []
+    store = CompletedTestStore(RetentionPolicy(max_tests=2, max_bytes=None, ttl_seconds=None),
+                               sizer=lambda value: 1, on_evict=lambda test_id, value: evicted.append((test_id, value)))
+    store['a'] = 1
+    store['b'] = 2
+    store.get('a')
+    store['c'] = 3
+    assert store.keys() == ['a', 'c']
+    assert evicted == [('b', 2)]
+    # 明確取出的測試不算移除
+    store.pop('a')
+    assert evicted == [('b', 2)]
+
+
+def test_evicted_basic_test_removes_its_spill_file(tmp_path):
+    from stress_test_simple import _remove_test_spill
+    from result_log import ResultLog
+
+    spill = ResultSpill(str(tmp_path / 'a.jsonl'))
+    spill.append({'success': True})
+    spill.close()
+    store = CompletedTestStore(RetentionPolicy(max_tests=1, max_bytes=None, ttl_seconds=None),
+                               sizer=lambda value: 1, on_evict=_remove_test_spill)
+    store['a'] = {'result_log': ResultLog(spill=spill)}
+    store['b'] = {'result_log': ResultLog()}
+    assert not os.path.exists(spill.path)
+
+
+def test_coarsen_matches_adding_with_larger_buckets():
+    fine = ThroughputSeries(1)
+    coarse = ThroughputSeries(10)
+    for start, end, tokens in ((0.5, 3.2, 5), (8.0, 12.5, 7), (15.0, 31.0, 2), (40.0, 41.0, 9)):
+        fine.add(start, end, tokens)
+        coarse.add(start, end, tokens)
+    assert fine.coarsen(10).buckets == coarse.buckets
+    assert fine.coarsen(1) is fine
+    assert fine.span_seconds() == 42
+    with pytest.raises(ValueError):
+        coarse.coarsen(15)
+
+
+def test_spilled_multi_user_run_uses_throughput_series(tmp_path, monkeypatch):
+    # 記憶體只保留最近5個查詢，吞吐量序列仍須涵蓋全部查詢
+    monkeypatch.setattr(multi_user_stress_test, 'SPILL_RECENT_RESULTS', 5)
+    config = MockOllamaConfig(parallel=4, prefill_tokens_per_second=1e6, decode_tokens_per_second=2000,
+                              output_tokens=8)
+    with MockServerThread(config) as server:
+        manager = MultiUserStressTestManager(RetentionPolicy(max_tests=1, spill_directory=str(tmp_path)))
+        test_ids = []
+        for _ in range(2):
+            test_id = manager.start_multi_user_test({
+                'model': DEFAULT_MODEL, 'user_count': 4, 'queries_per_user': 5, 'delay_between_queries': 0,
+                'endpoints': [server.url], 'save_history': False, 'spill_results': True
+            })
+            deadline = time.time() + 30
+            while manager.get_test_status(test_id)['status'] not in ('completed', 'error'):
+                assert time.time() < deadline
+                time.sleep(0.05)
+            test_ids.append(test_id)
+
+    result = manager.test_results.get(test_ids[1])
+    assert len(result.query_results) == 5
+    assert result.total_queries == 20
+    assert sum(sample['tokens'] for sample in result.tpm_samples) == 20 * 8
+    assert result.average_tpm == result.throughput_statistics['average_tokens_per_minute']
+    assert result.average_tpm <= result.peak_tpm
+    # 第一個測試被移除，溢寫檔案一併刪除
+    assert os.listdir(tmp_path) == [f"{test_ids[1]}.jsonl"]
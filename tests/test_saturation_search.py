@@ -0,0 +1,112 @@
+"""saturation_search：SLO判斷、拐點偵測與步驟輪詢"""
+
+import time
+
+import pytest
+
+from saturation_search import SaturationSearchManager, evaluate_slo, find_knee
+
+
+def test_find_knee_needs_three_points_with_variation():
+    assert find_knee([(0.1, 10), (0.2, 20)]) is None
+    assert find_knee([(0.1, 10), (0.2, 10), (0.3, 10)]) is None
+    assert find_knee([(0.1, 10), (0.1, 20), (0.1, 30)]) is None
+
+
+def test_find_knee_returns_point_where_gains_flatten():
+    # 吞吐量先隨延遲快速增加，之後幾乎不再增加
+    points = [(0.1, 10), (0.2, 50), (0.3, 90), (1.0, 95), (3.0, 97)]
+    assert find_knee(points) == 2
+
+
+def test_find_knee_indexes_the_original_order():
+    points = [(3.0, 97), (0.3, 90), (0.1, 10), (1.0, 95), (0.2, 50)]
+    assert find_knee(points) == 1
+
+
+def test_find_knee_ignores_linear_growth():
+    # 吞吐量與延遲成正比：沒有增益遞減的點
+    assert find_knee([(1, 1), (2, 2), (3, 3), (4, 4)]) is None
+
+
+def test_evaluate_slo_lists_violations():
+    metrics = {'successful_requests': 10, 'p95_latency': 2.0, 'p99_latency': 3.0, 'error_rate': 5.0}
+    assert evaluate_slo(metrics, {'max_p95_latency': 2.5}) == []
+    assert evaluate_slo(metrics, {'max_p95_latency': 1.0, 'max_p99_latency': 4.0,
+                                  'max_error_rate': 1.0}) == ['max_p95_latency', 'max_error_rate']
+    assert evaluate_slo({**metrics, 'successful_requests': 0}, {}) == ['no_successful_requests']
+
+
+class StubStressTestManager:
+    """只記錄啟動與停止的步驟測試，狀態由status_for決定"""
+
+    def __init__(self, status_for):
+        self.status_for = status_for
+        self.started = []
+        self.stopped = []
+
+    def start_test(self, config):
+        test_id = f"step-{len(self.started) + 1}"
+        self.started.append(config)
+        return test_id
+
+    def stop_test(self, test_id):
+        self.stopped.append(test_id)
+        return True
+
+    def get_test_status(self, test_id, cursor=None):
+        return self.status_for(test_id)
+
+    def get_test_results(self, test_id):
+        return []
+
+
+SEARCH_CONFIG = {
+    'model': 'mock:latest', 'prompt': 'x', 'total_requests': 10,
+    'start': 1, 'max': 4, 'slo': {'max_p95_latency': 1.0}
+}
+
+
+def wait_for_search(manager, search_id, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = manager.get_search_status(search_id)
+        if 'end_time' in status:
+            return status
+        time.sleep(0.05)
+    pytest.fail("search did not finish")
+
+
+def test_search_fails_when_step_status_disappears():
+    manager = SaturationSearchManager(StubStressTestManager(lambda test_id: None))
+    status = wait_for_search(manager, manager.start_search(SEARCH_CONFIG))
+    assert status['status'] == 'error'
+    assert 'no longer available' in status['error']
+
+
+def test_search_fails_when_step_exceeds_timeout():
+    stub = StubStressTestManager(lambda test_id: {'status': 'running'})
+    manager = SaturationSearchManager(stub)
+    status = wait_for_search(manager, manager.start_search({**SEARCH_CONFIG, 'step_timeout_seconds': 0.2}))
+    assert status['status'] == 'error'
+    assert 'did not finish' in status['error']
+    assert stub.stopped == ['step-1']
+
+
+def test_stop_interrupts_a_running_step():
+    stub = StubStressTestManager(lambda test_id: {'status': 'running'})
+    manager = SaturationSearchManager(stub)
+    search_id = manager.start_search(SEARCH_CONFIG)
+    while not stub.started:
+        time.sleep(0.01)
+    manager.stop_search(search_id)
+    status = wait_for_search(manager, search_id)
+    assert status['status'] == 'completed'
+    assert status['steps'] == []
+    assert 'step-1' in stub.stopped
+
+
+def test_invalid_step_timeout_is_rejected():
+    manager = SaturationSearchManager(StubStressTestManager(lambda test_id: None))
+    with pytest.raises(ValueError):
+        manager.start_search({**SEARCH_CONFIG, 'step_timeout_seconds': -1})
@@ -0,0 +1,36 @@
+"""server_metrics：伺服器指標的彙總"""
+
+import pytest
+
+from server_metrics import NS_PER_SECOND, aggregate_server_metrics
+
+
+def test_aggregate_reports_rates_and_times_from_durations():
+    items = [
+        {'prompt_eval_count': 10, 'eval_count': 20, 'prompt_eval_duration': NS_PER_SECOND // 10,
+         'eval_duration': NS_PER_SECOND, 'load_duration': 0, 'total_duration': 2 * NS_PER_SECOND},
+        {'prompt_eval_count': 30, 'eval_count': 20, 'prompt_eval_duration': NS_PER_SECOND // 10,
+         'eval_duration': NS_PER_SECOND, 'load_duration': 0, 'total_duration': 2 * NS_PER_SECOND}
+    ]
+    metrics = aggregate_server_metrics(items)
+    assert metrics['reported_requests'] == 2
+    assert metrics['prefill_tokens_per_second'] == pytest.approx(200.0)
+    assert metrics['eval_tokens_per_second'] == pytest.approx(20.0)
+    # 有回報耗時時，0秒的模型載入仍是有效的數值
+    assert metrics['average_load_time'] == 0.0
+    assert metrics['average_server_time'] == pytest.approx(2.0)
+
+
+def test_aggregate_without_durations_has_no_rates_or_times():
+    # OpenAI相容後端只回報Token數量
+    items = [{'prompt_eval_count': 10, 'eval_count': 20}, {'prompt_eval_count': 5, 'eval_count': 7}]
+    metrics = aggregate_server_metrics(items)
+    assert metrics['total_prompt_tokens'] == 15
+    assert metrics['total_output_tokens'] == 27
+    for key in ('prefill_tokens_per_second', 'eval_tokens_per_second', 'average_load_time',
+                'average_prefill_time', 'average_decode_time', 'average_server_time'):
+        assert metrics[key] is None
+
+
+def test_aggregate_skips_requests_without_eval_count():
+    assert aggregate_server_metrics([{'prompt_eval_count': 10}]) == {}
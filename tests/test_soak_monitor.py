@@ -0,0 +1,75 @@
+"""soak_monitor：快照區間與峰值TPM"""
+
+import time
+
+import pytest
+
+import soak_monitor
+from soak_monitor import SoakMonitor, detect_trends, linear_slope
+
+
+def monitor_with_full_window(tokens_per_request=10, requests=60, interval=60.0):
+    """產生一個剛好涵蓋一個完整區間的監控器（不啟動背景線程）"""
+    monitor = SoakMonitor(interval=interval)
+    monitor.start_time = monitor.window_start = time.time() - interval
+    for _ in range(requests):
+        monitor.record(True, 1.0, tokens_per_request)
+    monitor._take_snapshot()
+    return monitor
+
+
+def test_short_final_window_does_not_inflate_peak():
+    monitor = monitor_with_full_window()
+    # 結束時進行中的請求在極短時間內陸續完成
+    for _ in range(50):
+        monitor.record(True, 1.0, 10)
+    monitor.stop()
+
+    summary = monitor.summary()
+    assert len(summary['snapshots']) == 1
+    assert summary['peak_tokens_per_minute'] == pytest.approx(600, rel=0.01)
+    # 累計數據仍包括最後區間的請求
+    assert summary['total_requests'] == 110
+    assert summary['total_output_tokens'] == 1100
+
+
+def test_long_final_window_is_kept():
+    monitor = monitor_with_full_window()
+    monitor.window_start = time.time() - 40
+    monitor.record(True, 1.0, 10)
+    monitor.stop()
+    assert len(monitor.summary()['snapshots']) == 2
+
+
+def test_only_window_is_kept_even_if_short():
+    monitor = SoakMonitor(interval=60)
+    monitor.record(True, 1.0, 10)
+    monitor.record(False, 0.5)
+    monitor.stop()
+    snapshots = monitor.summary()['snapshots']
+    assert len(snapshots) == 1
+    assert snapshots[0]['error_rate'] == 50.0
+
+
+def test_detect_trends_flags_latency_drift():
+    snapshots = [{'elapsed': hour * 3600, 'p95_latency': 1.0 + 0.5 * hour} for hour in range(4)]
+    trends = detect_trends(snapshots)
+    assert trends['p95_latency']['latency_drift'] is True
+    assert trends['p95_latency']['slope_per_hour'] == pytest.approx(0.5)
+    assert linear_slope([1], [1]) is None
+
+
+def test_process_memory_is_read_outside_the_lock(monkeypatch):
+    monitor = SoakMonitor(interval=60.0)
+    locked = []
+
+    def get_process_rss(name_fragment):
+        # 讀取行程記憶體時，記錄請求的線程仍可取得lock
+        locked.append(monitor.lock.locked())
+        return 512 * 1024 * 1024
+
+    monkeypatch.setattr(soak_monitor, 'get_process_rss', get_process_rss)
+    monitor.record(True, 1.0, 10)
+    monitor._take_snapshot()
+    assert locked == [False]
+    assert monitor.snapshots[0]['server_rss_mb'] == 512
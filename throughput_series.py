@@ -0,0 +1,202 @@
+"""
+吞吐量時間序列
+以固定長度的時間桶（1秒/10秒/60秒）一次走訪所有完成的查詢，
+產生滑動窗口的tokens/秒、TPM、每秒請求數與進行中請求數；也可在測試進行中逐筆加入
+"""
+
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from result_analysis import ResultAnalysis, span_seconds, time_buckets
+
+# 依測試長度自動選擇時間桶：不超過10分鐘用1秒，不超過3小時用10秒，更長用60秒
+BUCKET_CHOICES = ((600, 1), (3 * 3600, 10))
+LONG_RUN_BUCKET_SECONDS = 60
+
+# 滑動窗口長度（秒）；TPM為窗口內的Token數換算成每分鐘
+DEFAULT_WINDOW_SECONDS = 60
+
+
+def choose_bucket_seconds(span_seconds: float) -> int:
+    """依測試長度選擇時間桶大小，讓序列點數維持在數百到數千之間"""
+    for max_span, bucket_seconds in BUCKET_CHOICES:
+        if span_seconds <= max_span:
+            return bucket_seconds
+    return LONG_RUN_BUCKET_SECONDS
+
+
+class ThroughputSeries:
+    """以絕對時間對齊的時間桶累計完成數、Token數與開始/結束數"""
+
+    def __init__(self, bucket_seconds: float = 1, window_seconds: float = DEFAULT_WINDOW_SECONDS):
+        self.bucket_seconds = bucket_seconds
+        self.window_seconds = max(window_seconds, bucket_seconds)
+        # 桶編號 -> [完成數, 成功數, Token數, 開始數, 結束數]
+        self.buckets: Dict[int, List[int]] = {}
+
+    def _bucket(self, timestamp: float) -> List[int]:
+        index = int(timestamp // self.bucket_seconds)
+        bucket = self.buckets.get(index)
+        if bucket is None:
+            bucket = self.buckets[index] = [0, 0, 0, 0, 0]
+        return bucket
+
+    def add(self, start: float, end: float, tokens: int = 0, success: bool = True):
+        """
+        加入一個完成的查詢
+
+        Args:
+            start: 開始時間（epoch秒）
+            end: 完成時間（epoch秒）
+            tokens: 輸出Token數（失敗時不計）
+            success: 是否成功
+        """
+        finished = self._bucket(end)
+        finished[0] += 1
+        if success:
+            finished[1] += 1
+            finished[2] += tokens
+        finished[4] += 1
+        self._bucket(start)[3] += 1
+
+    def merge(self, other: 'ThroughputSeries', index_offset: int = 0) -> 'ThroughputSeries':
+        """
+        把另一個時間桶大小相同的序列合併進來，回傳自己
+
+        Args:
+            index_offset: 加到對方桶編號上的位移（用於修正不同機器間的時鐘差）
+        """
+        if other.bucket_seconds != self.bucket_seconds:
+            raise ValueError("Cannot merge throughput series with different bucket sizes")
+        for index, counts in list(other.buckets.items()):
+            bucket = self.buckets.setdefault(index + index_offset, [0, 0, 0, 0, 0])
+            for position, value in enumerate(counts):
+                bucket[position] += value
+        return self
+
+    def coarsen(self, bucket_seconds: float) -> 'ThroughputSeries':
+        """
+        以較大的時間桶重新彙總（新桶大小須為目前的整數倍，例如1秒改為10秒），回傳新的序列
+
+        在測試中逐筆加入的序列固定使用小時間桶，結束後依測試長度改用 choose_bucket_seconds() 的大小，
+        與 build_throughput_series() 的結果相同
+        """
+        if bucket_seconds == self.bucket_seconds:
+            return self
+        if bucket_seconds < self.bucket_seconds or bucket_seconds % self.bucket_seconds:
+            raise ValueError("bucket_seconds must be a multiple of the current bucket size")
+        factor = int(bucket_seconds // self.bucket_seconds)
+        series = ThroughputSeries(bucket_seconds, self.window_seconds)
+        for index, counts in list(self.buckets.items()):
+            bucket = series.buckets.setdefault(index // factor, [0, 0, 0, 0, 0])
+            for position, value in enumerate(counts):
+                bucket[position] += value
+        return series
+
+    def span_seconds(self) -> float:
+        """第一個到最後一個有資料的桶涵蓋的秒數"""
+        buckets = list(self.buckets)
+        if not buckets:
+            return 0.0
+        return (max(buckets) - min(buckets) + 1) * self.bucket_seconds
+
+    def to_dict(self) -> Dict:
+        """可JSON序列化的表示（桶編號轉為字串）"""
+        return {
+            'bucket_seconds': self.bucket_seconds,
+            'window_seconds': self.window_seconds,
+            'buckets': {str(index): list(counts) for index, counts in sorted(dict(self.buckets).items())}
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'ThroughputSeries':
+        """由 to_dict() 的結果還原"""
+        series = cls(data['bucket_seconds'], data.get('window_seconds', DEFAULT_WINDOW_SECONDS))
+        series.buckets = {int(index): list(counts) for index, counts in data.get('buckets', {}).items()}
+        return series
+
+    def series(self) -> List[Dict]:
+        """
+        產生每個時間桶的序列（一次走訪）
+
+        Returns:
+            每個桶一筆：桶結束時間、該桶的完成數與Token數、滑動窗口的tokens/秒、TPM、每秒成功請求數，
+            以及桶結束時仍在進行中的請求數
+        """
+        # 先複製：測試進行中其他線程可能仍在加入
+        buckets = dict(self.buckets)
+        if not buckets:
+            return []
+
+        first, last = min(buckets), max(buckets)
+        window_buckets = max(1, int(round(self.window_seconds / self.bucket_seconds)))
+        empty = [0, 0, 0, 0, 0]
+
+        samples = []
+        window_tokens = 0
+        window_successful = 0
+        in_flight = 0
+        for index in range(first, last + 1):
+            queries, successful, tokens, started, ended = buckets.get(index, empty)
+            window_tokens += tokens
+            window_successful += successful
+            if index - window_buckets >= first:
+                # 移出滑出窗口的桶
+                _, old_successful, old_tokens, _, _ = buckets.get(index - window_buckets, empty)
+                window_tokens -= old_tokens
+                window_successful -= old_successful
+            in_flight += started - ended
+
+            # 窗口尚未填滿時以實際涵蓋的時間換算，避免測試開始時低估
+            covered = min(window_buckets, index - first + 1) * self.bucket_seconds
+            tokens_per_second = window_tokens / covered
+            samples.append({
+                'timestamp': datetime.fromtimestamp((index + 1) * self.bucket_seconds),
+                'queries_count': queries,
+                'successful': successful,
+                'tokens': tokens,
+                'tokens_per_second': tokens_per_second,
+                'tokens_per_minute': tokens_per_second * 60,
+                'requests_per_second': window_successful / covered,
+                'in_flight': in_flight
+            })
+        return samples
+
+    def summary(self, samples: Optional[List[Dict]] = None) -> Dict:
+        """整體吞吐量：平均值以第一個到最後一個有資料的桶之間的時間計算，峰值取滑動窗口的最大值"""
+        samples = self.series() if samples is None else samples
+        if not samples:
+            return {}
+        span = len(samples) * self.bucket_seconds
+        total_tokens = sum(s['tokens'] for s in samples)
+        total_successful = sum(s['successful'] for s in samples)
+        return {
+            'bucket_seconds': self.bucket_seconds,
+            'window_seconds': self.window_seconds,
+            'total_tokens': total_tokens,
+            'average_tokens_per_minute': total_tokens / span * 60,
+            'peak_tokens_per_minute': max(s['tokens_per_minute'] for s in samples),
+            'average_requests_per_second': total_successful / span,
+            'peak_requests_per_second': max(s['requests_per_second'] for s in samples),
+            'peak_in_flight': max(s['in_flight'] for s in samples)
+        }
+
+
+def build_throughput_series(query_results: Iterable, bucket_seconds: Optional[float] = None,
+                            window_seconds: float = DEFAULT_WINDOW_SECONDS) -> ThroughputSeries:
+    """
+    由查詢結果建立吞吐量序列
+
+    Args:
+        query_results: 具有 timestamp（開始時間）、response_time、tokens_count 與 success 的結果；
+            RecordStore直接讀取這四個欄位（時間桶以ResultAnalysis向量化計算）
+        bucket_seconds: 時間桶大小；None時依測試長度自動選擇
+        window_seconds: 滑動窗口長度
+    """
+    starts, ends, tokens, success = ResultAnalysis(query_results).request_intervals()
+    if bucket_seconds is None:
+        bucket_seconds = choose_bucket_seconds(span_seconds(starts, ends))
+
+    series = ThroughputSeries(bucket_seconds, window_seconds)
+    series.buckets = time_buckets(starts, ends, tokens, success, bucket_seconds)
+    return series
@@ -0,0 +1,92 @@
+"""
+分片計數器
+每個工作線程只更新自己的分片（計數器與延遲直方圖），不需要取得鎖；讀取時再加總所有分片
+"""
+
+import threading
+from typing import Dict, List
+
+from latency_histogram import LatencyHistogram
+
+
+class WorkerCounters:
+    """以線程為單位分片的計數器"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards: List[Dict[str, float]] = []
+        self._histogram_shards: List[Dict[str, LatencyHistogram]] = []
+        self._register_lock = threading.Lock()  # 只在線程第一次記錄時使用
+
+    def _shard(self) -> Dict[str, float]:
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = {}
+            self._local.shard = shard
+            with self._register_lock:
+                self._shards.append(shard)
+        return shard
+
+    def _histogram_shard(self) -> Dict[str, LatencyHistogram]:
+        shard = getattr(self._local, 'histograms', None)
+        if shard is None:
+            shard = {}
+            self._local.histograms = shard
+            with self._register_lock:
+                self._histogram_shards.append(shard)
+        return shard
+
+    def record(self, name: str, value: float):
+        """把樣本記錄到目前線程的直方圖分片"""
+        shard = self._histogram_shard()
+        histogram = shard.get(name)
+        if histogram is None:
+            histogram = shard[name] = LatencyHistogram()
+        histogram.record(value)
+
+    def histogram(self, name: str) -> LatencyHistogram:
+        """合併所有線程分片的直方圖（回傳新的物件）"""
+        with self._register_lock:
+            shards = list(self._histogram_shards)
+        merged = LatencyHistogram()
+        for shard in shards:
+            histogram = shard.get(name)
+            if histogram is not None:
+                merged.merge(histogram)
+        return merged
+
+    def histograms(self) -> Dict[str, LatencyHistogram]:
+        """所有直方圖（名稱 -> 合併後的新物件）"""
+        with self._register_lock:
+            shards = list(self._histogram_shards)
+        names = {name for shard in shards for name in list(shard)}
+        return {name: self.histogram(name) for name in names}
+
+    def merge(self, totals: Dict[str, float], histograms: Dict[str, LatencyHistogram]):
+        """把在其他地方（例如工作行程）累計的計數與直方圖加到目前線程的分片"""
+        for name, value in totals.items():
+            self.add(name, value)
+        shard = self._histogram_shard()
+        for name, histogram in histograms.items():
+            if name not in shard:
+                shard[name] = LatencyHistogram()
+            shard[name].merge(histogram)
+
+    def add(self, name: str, value: float = 1):
+        """在目前線程的分片上累加"""
+        shard = self._shard()
+        shard[name] = shard.get(name, 0) + value
+
+    def totals(self) -> Dict[str, float]:
+        """加總所有分片（讀取時工作線程可能仍在更新，結果為近似的即時值）"""
+        with self._register_lock:
+            shards = list(self._shards)
+        totals: Dict[str, float] = {}
+        for shard in shards:
+            for name, value in list(shard.items()):
+                totals[name] = totals.get(name, 0) + value
+        return totals
+
+    def get(self, name: str, default: float = 0) -> float:
+        """單一計數器的加總"""
+        return self.totals().get(name, default)